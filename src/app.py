@@ -1,17 +1,41 @@
 # app.py
 import os
 import json
-import shutil
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import gzip
+from flask import Flask, request, jsonify, render_template, send_from_directory, send_file, Response, g
 from werkzeug.utils import secure_filename
 import ppt_processor
 import llm_handler 
+import deck_store
+import metrics
+import tracing
+import processing_log
+import xml_validation
+import image_variants
+import memory_budget
+import vision_cache
+import edit_sessions
+import part_store
+import single_flight
+import storage_gc
+import cpu_pool
+import progress
+import deadlines
 import re 
 from pathlib import Path 
 import time
-import csv
+import uuid
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+try:
+    import brotli  # Optional: preferred over gzip when the client accepts it
+except ImportError:
+    brotli = None
+
 app = Flask(__name__)
 
 # --- MODIFIED: Configuration ---
@@ -21,8 +45,36 @@ TSBENCH_PRESENTATIONS_DIR = SCRIPT_DIR / "TSBench" / "benchmark_ppts"
 EXTRACTED_XML_FOLDER = SCRIPT_DIR / 'extracted_xml_original'
 MODIFIED_PPTX_FOLDER = SCRIPT_DIR / 'modified_ppts'
 GENERATED_IMAGES_FOLDER = SCRIPT_DIR / 'generated_images'
-PROCESSING_LOG_CSV = SCRIPT_DIR / 'processing_log.csv'
+REQUEST_ARTIFACTS_FOLDER = SCRIPT_DIR / 'request_artifacts'
+REQUEST_WORKSPACES_FOLDER = SCRIPT_DIR / 'request_workspaces'
 
+# --- /api/process response shaping ---
+# Returned unless the client asks for specific fields with ?fields=a,b,c
+DEFAULT_RESPONSE_FIELDS = [
+    "message", "llm_engine_used", "modified_pptx_download_url", "reason_for_no_modification",
+    "edited_slides_comparison_data", "timing_stats", "xml_files", "modified_xml_files", "modified_xml_diff",
+    "repaired_xml_files", "rejected_xml_files", "artifacts", "trace_id", "trace_url", "session",
+]
+# Large fields, only returned when requested explicitly (also available under "artifacts")
+OPTIONAL_RESPONSE_FIELDS = ["json_data", "llm_response", "modified_xml_data"]
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain", "text/css", "application/javascript"}
+COMPRESSION_MIN_BYTES = 1024
+IMAGE_CACHE_MAX_AGE_SECONDS = 365 * 24 * 3600
+UI_RASTER_PROFILE = "preview"  # see ppt_processor.RASTER_PROFILES
+# "fast" draws previews from the slide XML (ppt_processor.render_slide_previews), skipping LibreOffice
+PREVIEW_RENDERERS = ("libreoffice", "fast")
+# /api/process_stream traces the edit in the thread that runs it, not in the request context
+UNTRACED_API_PREFIXES = ('/api/traces/', '/api/artifacts/', '/api/decks/', '/api/process_stream')
+PPTX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+# /api/process_batch: prompts per request and LLM calls in flight per batch
+BATCH_MAX_PROMPTS = 20
+BATCH_MAX_CONCURRENCY = 4
+# /api/process_stream: a keepalive comment is sent after this long without an event
+STREAM_KEEPALIVE_S = 15
+# Responses of requests whose deadline ended (see deadlines.py); 499 is nginx's "client closed request"
+CANCELLED_REQUEST_STATUS = {"timeout": 504, "cancelled": 499}
+# Identical edits in flight at the same time share one execution (see single_flight.py)
+EDIT_FLIGHTS = single_flight.SingleFlight("edit")
 
 ALLOWED_EXTENSIONS = {'pptx'}
 
@@ -30,34 +82,112 @@ ALLOWED_EXTENSIONS = {'pptx'}
 app.config['EXTRACTED_XML_FOLDER'] = str(EXTRACTED_XML_FOLDER)
 app.config['MODIFIED_PPTX_FOLDER'] = str(MODIFIED_PPTX_FOLDER)
 app.config['GENERATED_IMAGES_FOLDER'] = str(GENERATED_IMAGES_FOLDER)
+app.config['REQUEST_ARTIFACTS_FOLDER'] = str(REQUEST_ARTIFACTS_FOLDER)
+app.config['REQUEST_WORKSPACES_FOLDER'] = str(REQUEST_WORKSPACES_FOLDER)
 app.config['TSBENCH_PRESENTATIONS_DIR'] = str(TSBENCH_PRESENTATIONS_DIR)
 
 # --- MODIFIED: Create only necessary directories ---
-for folder in [EXTRACTED_XML_FOLDER, MODIFIED_PPTX_FOLDER, GENERATED_IMAGES_FOLDER]:
+for folder in [EXTRACTED_XML_FOLDER, MODIFIED_PPTX_FOLDER, GENERATED_IMAGES_FOLDER, REQUEST_ARTIFACTS_FOLDER, REQUEST_WORKSPACES_FOLDER]:
     folder.mkdir(parents=True, exist_ok=True)
 
+# --- Disk quota (see storage_gc.py): the server's own folders, by app.config key ---
+for area_name, folder_key, policy in [
+    ("request_artifacts", 'REQUEST_ARTIFACTS_FOLDER', "lru"),
+    ("request_workspaces", 'REQUEST_WORKSPACES_FOLDER', "workspace"),
+    ("generated_images", 'GENERATED_IMAGES_FOLDER', "lru"),
+    ("extracted_xml_original", 'EXTRACTED_XML_FOLDER', "lru"),
+    ("modified_ppts", 'MODIFIED_PPTX_FOLDER', "lru"),
+]:
+    storage_gc.register_area(area_name, lambda folder_key=folder_key: app.config[folder_key], policy=policy)
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def log_processing_details(log_data):
-    """Appends a record to the processing log CSV file."""
-    file_exists = os.path.isfile(PROCESSING_LOG_CSV)
-    with open(PROCESSING_LOG_CSV, 'a', newline='') as csvfile:
-        fieldnames = [
-            'Timestamp', 'OriginalFilename', 'LLMEngineUsed', 
-            'TotalProcessingTimeSeconds', 'JSONExtractionTimeSeconds', 
-            'XMLExtractionTimeSeconds', 'LLMInferenceTimeSeconds', 
-            'PPTXModificationTimeSeconds', 'ImageConversionTimeSeconds',
-            'TotalSlidesInOriginal', 'NumberOfSlidesEditedByLLM', 
-            'ModifiedXMLFilesList'
-        ]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
-        if not file_exists:
-            writer.writeheader()
-        
-        writer.writerow(log_data)
+def _read_text_file(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return ""
+
+@app.before_request
+def start_storage_collector():
+    storage_gc.COLLECTOR.ensure_running()
+    cpu_pool.POOL.ensure_running()
+
+@app.before_request
+def start_request_trace():
+    """Every API call gets a trace; its id is returned to the client as trace_id."""
+    if request.path.startswith('/api/') and not request.path.startswith(UNTRACED_API_PREFIXES):
+        g.trace = tracing.begin_trace(f"{request.method} {request.path}", remote_addr=request.remote_addr)
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        tracing.end_trace(trace, error=error)
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses JSON/text responses with brotli (if installed) or gzip, as accepted by the
+    client. File responses are passed through untouched so Range requests keep working.
+    """
+    if (response.direct_passthrough or not 200 <= response.status_code < 300
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding, compressed = compress_body(response.get_data(), request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def compress_body(data, accept_encodings):
+    """(encoding, compressed data) for a response body, or (None, data) when it is small or nothing fits."""
+    if len(data) < COMPRESSION_MIN_BYTES:
+        return None, data
+    if brotli is not None and accept_encodings['br']:
+        return 'br', brotli.compress(data, quality=5)
+    if accept_encodings['gzip']:
+        return 'gzip', gzip.compress(data, compresslevel=6)
+    return None, data
+
+def parse_response_fields(fields_arg):
+    """Validates ?fields=. Returns (field list, error message)."""
+    if not fields_arg:
+        return DEFAULT_RESPONSE_FIELDS, None
+    fields = [field.strip() for field in fields_arg.split(',') if field.strip()]
+    if fields == ["all"]:
+        return DEFAULT_RESPONSE_FIELDS + OPTIONAL_RESPONSE_FIELDS, None
+    unknown = [field for field in fields if field not in DEFAULT_RESPONSE_FIELDS + OPTIONAL_RESPONSE_FIELDS]
+    if unknown:
+        return None, f"Unknown response field(s): {', '.join(unknown)}. Available: {', '.join(DEFAULT_RESPONSE_FIELDS + OPTIONAL_RESPONSE_FIELDS)}, or 'all'."
+    return fields, None
+
+def write_request_artifacts(request_id, json_data, llm_text_response, applied_xml_map, xml_diffs):
+    """
+    Stores the large outputs of a request on disk and returns their URLs. They are
+    served by get_request_artifact, which supports Range requests.
+    """
+    artifact_dir = Path(app.config['REQUEST_ARTIFACTS_FOLDER']) / request_id
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    base_url = f"/api/artifacts/{request_id}"
+    with open(artifact_dir / "deck.json", 'w', encoding='utf-8') as f:
+        json.dump(json_data, f)
+    (artifact_dir / "llm_response.txt").write_text(llm_text_response or "", encoding='utf-8')
+    artifacts = {"deck_json": f"{base_url}/deck.json", "llm_response": f"{base_url}/llm_response.txt", "modified_xml": {}}
+    for part_name, xml_content in applied_xml_map.items():
+        part_path = artifact_dir / "xml" / part_name
+        part_path.parent.mkdir(parents=True, exist_ok=True)
+        part_path.write_text(xml_content, encoding='utf-8')
+        artifacts["modified_xml"][part_name] = f"{base_url}/xml/{part_name}"
+    if xml_diffs:
+        (artifact_dir / "changes.diff").write_text("".join(xml_diffs.values()), encoding='utf-8')
+        artifacts["xml_diff"] = f"{base_url}/changes.diff"
+    return artifacts
 
 
 @app.route('/')
@@ -74,162 +204,1051 @@ def view_slide_image(image_path):
     return send_from_directory(app.config['GENERATED_IMAGES_FOLDER'], image_path, as_attachment=False)
 
 
+@app.route('/images/<image_hash>/<variant>.<image_format>')
+def serve_image_variant(image_hash, variant, image_format):
+    """
+    Serves a content-addressed slide image variant (thumbnail/preview/full, webp/png).
+    The URL names the content, so it is cached as immutable and If-None-Match gets a 304.
+    """
+    if not image_variants.is_valid_request(image_hash, variant, image_format):
+        return jsonify({"error": "Unknown image variant."}), 404
+    etag = f"{image_hash[:32]}-{variant}-{image_format}"
+    if request.if_none_match.contains(etag):
+        metrics.IMAGE_VARIANT_REQUESTS.inc(variant=variant, result="not_modified")
+        response = Response(status=304)
+    else:
+        variant_file = image_variants.get_variant(image_hash, variant, image_format)
+        if variant_file is None:
+            return jsonify({"error": "Image not found."}), 404
+        variant_path, mimetype = variant_file
+        response = send_file(variant_path, mimetype=mimetype, etag=etag, conditional=True)
+    response.set_etag(etag)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_CACHE_MAX_AGE_SECONDS
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/metrics')
+def metrics_route():
+    """Exposes pipeline metrics in Prometheus text format."""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/traces/<trace_id>')
+def get_trace_route(trace_id):
+    """Returns the recorded spans of a recent request."""
+    spans = tracing.get_trace(trace_id)
+    if spans is None:
+        return jsonify({"error": f"Trace '{trace_id}' not found."}), 404
+    return jsonify({"trace_id": trace_id, "spans": spans}), 200
+
+
+@app.route('/api/artifacts/<request_id>/<path:artifact_path>')
+def get_request_artifact(request_id, artifact_path):
+    """Serves a stored request artifact (see write_request_artifacts). Supports Range requests."""
+    if not re.fullmatch(r'[0-9a-f]{32}', request_id):
+        return jsonify({"error": "Invalid request id."}), 404
+    return send_from_directory(os.path.join(app.config['REQUEST_ARTIFACTS_FOLDER'], request_id), artifact_path,
+                               as_attachment=False, conditional=True)
+
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session_route():
+    """
+    Starts an edit session on a benchmark deck (form field 'file', as for /api/process).
+    Later /api/process calls with its session_id edit the session's current version.
+    """
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({"error": "No file part in request. The key should be 'file'."}), 400
+    if not allowed_file(file.filename):
+        return jsonify({"error": "File type not allowed"}), 400
+    filename_secure = secure_filename(file.filename)
+    deck_path = os.path.join(app.config['TSBENCH_PRESENTATIONS_DIR'], filename_secure)
+    if not os.path.exists(deck_path):
+        return jsonify({"error": f"File '{filename_secure}' not found in benchmark directory."}), 404
+    with tracing.span("session_create", filename=filename_secure) as create_span:
+        session = edit_sessions.SESSION_MANAGER.create(deck_path, filename_secure)
+        create_span.set_attribute("session_id", session.session_id)
+    metrics.REQUESTS.inc(route="session_create", outcome="created")
+    return jsonify(session.to_dict()), 201
+
+
+@app.route('/api/sessions/<session_id>', methods=['GET', 'DELETE'])
+def session_route(session_id):
+    """Returns an edit session's versions and turn history, or ends the session."""
+    if request.method == 'DELETE':
+        if not edit_sessions.SESSION_MANAGER.delete(session_id):
+            return jsonify({"error": f"Edit session '{session_id}' not found or expired."}), 404
+        return jsonify({"session_id": session_id, "deleted": True}), 200
+    session = edit_sessions.SESSION_MANAGER.get(session_id)
+    if session is None:
+        return jsonify({"error": f"Edit session '{session_id}' not found or expired."}), 404
+    return jsonify(session.to_dict()), 200
+
+
+@app.route('/api/sessions/<session_id>/versions/<int:version>/download')
+def download_session_version(session_id, version):
+    """Downloads one deck version of an edit session."""
+    session = edit_sessions.SESSION_MANAGER.get(session_id)
+    if session is None:
+        return jsonify({"error": f"Edit session '{session_id}' not found or expired."}), 404
+    if version > session.version:
+        return jsonify({"error": f"Version {version} of session '{session_id}' is not available."}), 404
+    return deck_version_response(session.version_ids[version], f"{Path(session.source_filename).stem}_v{version}.pptx")
+
+
+def deck_version_response(version_id, download_name):
+    """
+    Streams a deck version assembled from the part store (see part_store.py). The
+    version id names the content, so the response is cached as immutable.
+    """
+    if request.if_none_match.contains(version_id):
+        response = Response(status=304)
+    else:
+        response = Response(part_store.iter_pptx_bytes(version_id), mimetype=PPTX_MIMETYPE, direct_passthrough=True)
+        response.content_length = part_store.assembled_size(version_id)
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.set_etag(version_id)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_CACHE_MAX_AGE_SECONDS
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/api/decks/<version_id>/download')
+def download_deck_version(version_id):
+    """Downloads a deck version by id; ?name= sets the file name."""
+    if not part_store.has_version(version_id):
+        return jsonify({"error": f"Deck version '{version_id}' not found."}), 404
+    download_name = secure_filename(request.args.get('name', '')) or f"{version_id[:16]}.pptx"
+    return deck_version_response(version_id, download_name)
+
+
+@app.route('/api/decks/<old_version_id>/diff/<new_version_id>')
+def diff_deck_versions(old_version_id, new_version_id):
+    """
+    Parts added, removed and changed between two deck versions, with unified diffs of
+    the changed XML parts. Only the changed parts are read.
+    """
+    for version_id in (old_version_id, new_version_id):
+        if not part_store.has_version(version_id):
+            return jsonify({"error": f"Deck version '{version_id}' not found."}), 404
+    changes = part_store.diff_versions(old_version_id, new_version_id)
+    changes["xml_diff"] = {
+        part_name: ppt_processor.unified_xml_diff(
+            part_store.read_part(old_version_id, part_name).decode('utf-8', errors='replace'),
+            part_store.read_part(new_version_id, part_name).decode('utf-8', errors='replace'), part_name)
+        for part_name in changes["changed"] if part_name.endswith(('.xml', '.rels'))
+    }
+    return jsonify(changes), 200
+
+
+class DeckContext:
+    """
+    A deck prepared for editing: its JSON summary, extracted XML parts and renders
+    of the original slides. One context serves every prompt of a batch, so the
+    deck is extracted once and each original slide is rendered at most once.
+    Files it writes outside a session go to its own workspace (see storage_gc.py),
+    so concurrent requests on the same deck never share a path; cleanup()
+    removes the workspace once the response no longer needs it.
+    """
+
+    def __init__(self, filepath, filename, session=None):
+        self.filepath = filepath
+        self.filename = filename
+        self.session = session
+        self.workspace = None
+        self.prepared_deck = None
+        self.json_data = None
+        # File holding json_data, when there is one; prompt building reads it instead of receiving the data
+        self.json_path = None
+        self.xml_dir = None
+        self.xml_full_paths = []
+        self.xml_relative_paths = []
+        self.json_extraction_time_s = 0
+        self.xml_extraction_time_s = 0
+        self._base_version_id = None
+        # renderer -> {slide number: image path} of the original deck
+        self._original_images = {}
+        self._lock = threading.RLock()
+        self._async_lock = asyncio.Lock()
+
+    def scratch_dir(self, name):
+        """A directory in this context's workspace, which is created on first use."""
+        with self._lock:
+            if self.workspace is None:
+                self.workspace = storage_gc.create_workspace(app.config['REQUEST_WORKSPACES_FOLDER'])
+        return str(self.workspace / name)
+
+    def cleanup(self):
+        # Slide renders are copied into the image store when their URLs are created, see image_variants.py
+        with self._lock:
+            workspace, self.workspace = self.workspace, None
+        if workspace:
+            storage_gc.remove_workspace(workspace)
+
+    @property
+    def total_slides(self):
+        return len(self.json_data.get("slides", []))
+
+    @property
+    def base_version_id(self):
+        """Part store version of the original deck (see part_store.py)."""
+        with self._lock:
+            if self._base_version_id is None:
+                self._base_version_id = self.session.version_id if self.session else part_store.ingest_pptx(self.filepath)
+            return self._base_version_id
+
+    def _original_image_plan(self, renderer, slide_numbers):
+        """
+        (images by slide, slides to render, output folder, reusable image paths) for
+        original_images; reusable paths are prepared renders that make rendering unnecessary.
+        """
+        images = self._original_images.setdefault(renderer, {})
+        # Slides rendered in an earlier turn of a session are not rendered again
+        session_cached_images = self.session.cached_slide_images(renderer, slide_numbers) if self.session else {}
+        images.update(session_cached_images)
+        slides_to_render = set(slide_numbers) - set(images)
+        prepared_image_paths = deck_store.get_slide_image_paths(self.prepared_deck) if self.prepared_deck else []
+        tracing.set_attributes(prepared_images_hit=bool(prepared_image_paths),
+                               session_images_hit=len(session_cached_images))
+        if self.session:
+            original_img_dir = self.session.image_dir()
+        else:
+            original_img_dir = self.scratch_dir("original_images")
+        # The fast renderer is used on both sides so the comparison shows the edit, not renderer differences;
+        # prepared renders are served through the content-addressed image store, so no copy is needed
+        reusable_image_paths = prepared_image_paths if slides_to_render and renderer != "fast" and prepared_image_paths else None
+        return images, slides_to_render, original_img_dir, reusable_image_paths
+
+    def _add_original_images(self, renderer, images, original_image_paths, slide_numbers):
+        if self.session:
+            self.session.store_slide_images(renderer, original_image_paths)
+        for image_path in original_image_paths:
+            images[ppt_processor.slide_number_from_image_path(image_path)] = image_path
+        return {slide: images[slide] for slide in slide_numbers if slide in images}
+
+    def original_images(self, renderer, slide_numbers):
+        """Renders of the original deck for the given slides, by slide number. Renders only what no earlier call did."""
+        with self._lock:
+            images, slides_to_render, original_img_dir, original_image_paths = self._original_image_plan(renderer, slide_numbers)
+            # Only the edited slides are shown, so only those are rasterized, at preview DPI
+            if original_image_paths is None:
+                original_image_paths = render_slides(renderer, self.filepath, original_img_dir, slides_to_render) if slides_to_render else []
+            return self._add_original_images(renderer, images, original_image_paths, slide_numbers)
+
+    async def original_images_async(self, renderer, slide_numbers):
+        """original_images for the async server (asgi.py); renders on the event loop."""
+        async with self._async_lock:
+            images, slides_to_render, original_img_dir, original_image_paths = await asyncio.to_thread(
+                self._original_image_plan, renderer, slide_numbers)
+            if original_image_paths is None:
+                original_image_paths = await render_slides_async(renderer, self.filepath, original_img_dir, slides_to_render) if slides_to_render else []
+            return await asyncio.to_thread(self._add_original_images, renderer, images, original_image_paths, slide_numbers)
+
+
+def render_slides(renderer, pptx_filepath, output_folder, slide_numbers, on_image=None):
+    """
+    Preview renders of the given slides with the chosen renderer (see PREVIEW_RENDERERS).
+    on_image(slide_number, image_path) is called as each render is written.
+    """
+    if renderer == "fast":
+        return ppt_processor.render_slide_previews(pptx_filepath, output_folder, slides=slide_numbers, on_image=on_image)
+    return ppt_processor.export_slides_to_images(pptx_filepath, output_folder, profile=UI_RASTER_PROFILE,
+                                                 slides=slide_numbers, on_image=on_image)
+
+
+def emit_slide_image(side, slide_number, image_path):
+    """A slide_image progress event (see progress.py) with the render's image store URLs."""
+    if progress.active():
+        variants = image_variants.image_variant_urls(image_path)
+        progress.emit("slide_image", side=side, slide_number=slide_number,
+                      image_url=variants["preview"], image_variants=variants)
+
+
+async def render_slides_async(renderer, pptx_filepath, output_folder, slide_numbers):
+    """render_slides with LibreOffice and poppler run as asyncio subprocesses; the fast renderer runs in a thread."""
+    if renderer == "fast":
+        return await asyncio.to_thread(ppt_processor.render_slide_previews, pptx_filepath, output_folder, slides=slide_numbers)
+    return await ppt_processor.export_slides_to_images_async(pptx_filepath, output_folder, profile=UI_RASTER_PROFILE, slides=slide_numbers)
+
+
+def prepare_deck_context(original_filepath, original_filename_secure, session=None):
+    """Loads the JSON summary and XML parts of a deck from its session, its prepared artifacts, or by extracting them."""
+    ctx = DeckContext(original_filepath, original_filename_secure, session)
+    try:
+        # --- Prepared artifacts (see deck_store.py) skip extraction and original rendering ---
+        # A session already holds the extracted state of its current version
+        ctx.prepared_deck = None if session else deck_store.get_prepared_deck(original_filepath)
+
+        time_json_start = time.time()
+        with metrics.track_stage("json_extraction"), tracing.span("json_extraction", cache_hit=bool(ctx.prepared_deck or session)):
+            if session:
+                ctx.json_data = session.json_data
+            elif ctx.prepared_deck:
+                ctx.json_path = deck_store.get_deck_json_path(ctx.prepared_deck)
+                ctx.json_data = deck_store.load_deck_json(ctx.prepared_deck)
+            else:
+                # Extracted in a CPU stage worker (see cpu_pool.py), which hands the JSON over as a file
+                ctx.json_path = cpu_pool.POOL.run("json_extraction", ppt_processor.extract_deck_json_to_file,
+                                                  original_filepath, ctx.scratch_dir("deck.json"))
+                with open(ctx.json_path, 'r', encoding='utf-8') as f:
+                    ctx.json_data = json.load(f)
+        ctx.json_extraction_time_s = round(time.time() - time_json_start, 3)
+
+        time_xml_extract_start = time.time()
+        with metrics.track_stage("xml_extraction"), tracing.span("xml_extraction", cache_hit=bool(ctx.prepared_deck or session)) as xml_span:
+            if session:
+                ctx.xml_dir = str(session.xml_dir)
+                ctx.xml_full_paths = session.xml_full_paths()
+            elif ctx.prepared_deck:
+                ctx.xml_dir = deck_store.get_xml_dir(ctx.prepared_deck)
+                ctx.xml_full_paths = deck_store.list_xml_paths(ctx.prepared_deck)
+            else:
+                ctx.xml_dir = ctx.scratch_dir("xml")
+                ctx.xml_full_paths = cpu_pool.POOL.run("xml_extraction", ppt_processor.extract_xml_from_pptx,
+                                                       original_filepath, ctx.xml_dir)
+            xml_span.set_attribute("part_count", len(ctx.xml_full_paths))
+        ctx.xml_extraction_time_s = round(time.time() - time_xml_extract_start, 3)
+    except Exception:
+        ctx.cleanup()
+        raise
+
+    ctx.xml_relative_paths = [Path(p).relative_to(ctx.xml_dir).as_posix() for p in ctx.xml_full_paths]
+    progress.emit("parsed", total_slides=ctx.total_slides, xml_files=len(ctx.xml_full_paths),
+                  json_extraction_time_s=ctx.json_extraction_time_s, xml_extraction_time_s=ctx.xml_extraction_time_s,
+                  used_prepared_artifacts=bool(ctx.prepared_deck))
+    return ctx
+
+
+def new_edit(prompt_text, selected_model_id):
+    """The outcome of one prompt, filled in by the edit stages below."""
+    return {
+        "prompt": prompt_text,
+        "llm_engine_used": selected_model_id,
+        "llm_result": {},
+        "image_inputs": [],
+        "applied_xml_map": {},
+        "rejected_xml_files": {},
+        "repaired_xml_files": [],
+        "edited_slide_numbers": set(),
+        "modified_version_id": None,
+        "modified_pptx_download_url": None,
+        "modified_image_paths": [],
+        "edited_slides_comparison_data": [],
+        "reason_for_no_modification": None,
+        "vision_input_time_s": 0,
+        "xml_validation_time_s": "N/A",
+        "pptx_modification_time_s": "N/A",
+        "image_conversion_time_s": "N/A",
+    }
+
+
+def prepare_llm_request(ctx, edit, requested_image_slides=None):
+    """Edit stage 1: vision inputs. Returns the keyword arguments of the LLM call."""
+    session = ctx.session
+    # --- Vision input (see vision_cache.py): cached, downscaled images of the selected slides only ---
+    time_vision_start = time.time()
+    if llm_handler.is_vision_model(edit["llm_engine_used"]):
+        image_slide_numbers = vision_cache.select_slides(edit["prompt"], ctx.total_slides, requested_image_slides)
+        edit["image_inputs"] = vision_cache.get_image_inputs(
+            ctx.filepath, image_slide_numbers,
+            source_images=session.cached_slide_images("libreoffice", image_slide_numbers) if session else None)
+    edit["vision_input_time_s"] = round(time.time() - time_vision_start, 3)
+
+    memory_budget.check_rss("llm_inference")
+    return {
+        "user_prompt": edit["prompt"],
+        "ppt_json_data": ctx.json_path or ctx.json_data,
+        "xml_file_paths": ctx.xml_full_paths,
+        "engine_or_model_id": edit["llm_engine_used"],
+        "image_inputs": edit["image_inputs"],
+        "session_history": session.history() if session else None,
+    }
+
+
+def apply_llm_result(ctx, edit, llm_result, output_suffix=""):
+    """
+    Edit stage 2: parses and validates the LLM's parts and repacks them into a new
+    deck version. Returns the folder for renders of the edited slides, or None
+    when there is nothing to render.
+    """
+    session = ctx.session
+    edit["llm_result"] = llm_result
+    actual_model_used = edit["llm_engine_used"] = llm_result.get("model_used", edit["llm_engine_used"])
+    with tracing.span("parse_llm_response", response_chars=len(llm_result.get("text_response") or "")) as parse_span:
+        parsed_modified_xml_map = llm_handler.parse_llm_response_for_xml_changes(llm_result.get("text_response", ""))
+        parse_span.set_attribute("modified_files", len(parsed_modified_xml_map))
+    for part_name, xml_text in parsed_modified_xml_map.items():
+        progress.emit("file_parsed", name=part_name, chars=len(xml_text), known_part=part_name in ctx.xml_relative_paths)
+
+    if not parsed_modified_xml_map:
+        # --- MODIFIED: Capture the specific reason for no modification ---
+        edit["reason_for_no_modification"] = "LLM did not return any parsable 'MODIFIED_XML_FILE' blocks."
+        llm_text_response = llm_result.get("text_response", "").strip()
+        if "no changes needed" in llm_text_response.lower() or len(llm_text_response) < 30:
+            edit["reason_for_no_modification"] = f"LLM explicitly stated no changes were needed. Full Response: '{llm_text_response}'"
+        return None
+
+    xml_updates_for_new_pptx_relative_keys = {
+        llm_filename_key: new_xml_content
+        for llm_filename_key, new_xml_content in parsed_modified_xml_map.items()
+        if llm_filename_key in ctx.xml_relative_paths
+    }
+
+    # --- Validate (and if needed repair) the modified parts before repacking, see xml_validation.py ---
+    time_validation_start = time.time()
+    with metrics.track_stage("xml_validation"), tracing.span("xml_validation", parts=len(xml_updates_for_new_pptx_relative_keys)):
+        xml_updates_for_new_pptx_relative_keys, edit["rejected_xml_files"], edit["repaired_xml_files"] = xml_validation.validate_and_repair(
+            xml_updates_for_new_pptx_relative_keys, ctx.xml_dir,
+            repair_func=lambda part_name, xml_text, issues: llm_handler.repair_xml_part(
+                part_name, xml_text, issues, ctx.xml_dir, edit["prompt"], actual_model_used)
+        )
+    edit["xml_validation_time_s"] = round(time.time() - time_validation_start, 3)
+    progress.emit("validated", applied=list(xml_updates_for_new_pptx_relative_keys),
+                  rejected=list(edit["rejected_xml_files"]), repaired=edit["repaired_xml_files"])
+
+    edit["applied_xml_map"] = xml_updates_for_new_pptx_relative_keys
+    edited_slide_numbers = edit["edited_slide_numbers"]
+    for llm_filename_key in xml_updates_for_new_pptx_relative_keys:
+        match = re.search(r'ppt/slides/slide(\d+)\.xml', llm_filename_key)
+        if match:
+            edited_slide_numbers.add(int(match.group(1)))
+
+    if edit["rejected_xml_files"] and not xml_updates_for_new_pptx_relative_keys:
+        edit["reason_for_no_modification"] = "All modified XML files failed validation: " + "; ".join(
+            f"{name}: {issues[0]}" for name, issues in edit["rejected_xml_files"].items())
+    if not xml_updates_for_new_pptx_relative_keys:
+        return None
+
+    modified_pptx_filename_secure = f"modified_{ctx.filename}"
+    memory_budget.check_rss("repack")
+    time_pptx_modify_start = time.time()
+    # The modified deck is a part store version (see part_store.py): only the changed parts are written
+    modified_version_id = edit["modified_version_id"] = part_store.derive_version(
+        ctx.base_version_id, xml_updates_for_new_pptx_relative_keys)
+    edit["pptx_modification_time_s"] = round(time.time() - time_pptx_modify_start, 3)
+    if not modified_version_id:
+        return None
+
+    if session:
+        edit["modified_pptx_download_url"] = session.download_url(session.version + 1)
+        modified_img_dir = session.image_dir(session.version + 1)
+    else:
+        edit["modified_pptx_download_url"] = part_store.download_url(modified_version_id, modified_pptx_filename_secure)
+        modified_img_dir = ctx.scratch_dir(f"modified_images{output_suffix}")
+    progress.emit("repacked", modified_pptx_download_url=edit["modified_pptx_download_url"],
+                  pptx_modification_time_s=edit["pptx_modification_time_s"])
+    return modified_img_dir
+
+
+def compare_edit_renders(edit, original_images_by_slide, modified_image_paths):
+    """Edit stage 3 (after rendering): before/after image URLs of each edited slide."""
+    edit["modified_image_paths"] = modified_image_paths
+    modified_images_by_slide = {ppt_processor.slide_number_from_image_path(p): p for p in modified_image_paths}
+
+    for slide_num in sorted(edit["edited_slide_numbers"]):
+        original_img_path = original_images_by_slide.get(slide_num)
+        modified_img_path = modified_images_by_slide.get(slide_num)
+
+        if original_img_path and modified_img_path:
+            # Content-hashed URLs (see image_variants.py) stay valid and cacheable even when
+            # a later request re-renders the same deck into the same folder
+            original_variants = image_variants.image_variant_urls(original_img_path)
+            modified_variants = image_variants.image_variant_urls(modified_img_path)
+            edit["edited_slides_comparison_data"].append({
+                "slide_number": slide_num,
+                "original_image_url": original_variants["preview"],
+                "modified_image_url": modified_variants["preview"],
+                "original_image_variants": original_variants,
+                "modified_image_variants": modified_variants,
+            })
+
+
+def run_edit(ctx, prompt_text, selected_model_id, preview_renderer, requested_image_slides=None, output_suffix=""):
+    """
+    One prompt against a prepared deck: LLM call, validation, repack into a new
+    deck version and renders of the edited slides. Returns the outcome as a dict;
+    output_suffix keeps the modified renders of batch variants apart.
+    asgi.py runs the same stages with the LLM call and renders awaited.
+    """
+    edit = new_edit(prompt_text, selected_model_id)
+    llm_request = prepare_llm_request(ctx, edit, requested_image_slides)
+    llm_result = llm_handler.get_llm_response(**llm_request)
+    modified_img_dir = apply_llm_result(ctx, edit, llm_result, output_suffix)
+    if modified_img_dir is None:
+        return edit
+
+    memory_budget.check_rss("image_conversion")
+    time_img_conv_start = time.time()
+    # Renderers need a file; assembled decks are cached by the part store
+    modified_pptx_filepath = part_store.materialize(edit["modified_version_id"])
+    progress.emit("rendering", slides=sorted(edit["edited_slide_numbers"]), renderer=preview_renderer)
+    original_images_by_slide = ctx.original_images(preview_renderer, edit["edited_slide_numbers"])
+    for slide_number, image_path in sorted(original_images_by_slide.items()):
+        emit_slide_image("original", slide_number, image_path)
+    modified_image_paths = render_slides(
+        preview_renderer, modified_pptx_filepath, modified_img_dir, edit["edited_slide_numbers"],
+        on_image=(lambda slide_number, image_path: emit_slide_image("modified", slide_number, image_path))
+        if progress.active() else None)
+    edit["image_conversion_time_s"] = round(time.time() - time_img_conv_start, 3)
+    compare_edit_renders(edit, original_images_by_slide, modified_image_paths)
+    return edit
+
+
+def edit_timing_stats(ctx, edit, overall_start_time, preview_renderer, memory_tracker):
+    return {
+        "total_processing_time_s": round(time.time() - overall_start_time, 3),
+        "json_extraction_time_s": ctx.json_extraction_time_s,
+        "xml_extraction_time_s": ctx.xml_extraction_time_s,
+        "vision_input_time_s": edit["vision_input_time_s"],
+        "slides_with_images": [img_data["slide_number"] for img_data in edit["image_inputs"]],
+        "llm_inference_time_s": edit["llm_result"].get("inference_time_seconds"),
+        "xml_validation_time_s": edit["xml_validation_time_s"],
+        "pptx_modification_time_s": edit["pptx_modification_time_s"],
+        "image_conversion_time_s": edit["image_conversion_time_s"],
+        "preview_renderer": preview_renderer,
+        "number_of_slides_edited_by_llm": len(edit["edited_slide_numbers"]),
+        "total_slides_in_original": ctx.total_slides,
+        "used_prepared_artifacts": bool(ctx.prepared_deck),
+        **memory_tracker.stats(),
+    }
+
+
+def edit_xml_diffs(ctx, edit):
+    """Unified diffs of the applied parts against the deck's XML (read before a session moves on)."""
+    return {
+        part_name: ppt_processor.unified_xml_diff(
+            _read_text_file(os.path.join(ctx.xml_dir, part_name)), xml_content, part_name)
+        for part_name, xml_content in edit["applied_xml_map"].items()
+    }
+
+
+def edit_fingerprint(original_filepath, prompt_text, selected_model_id, preview_renderer, requested_image_slides):
+    """Key of an edit for single-flight coalescing: the deck's bytes, the prompt and the options that shape the result."""
+    key = [deck_store.compute_deck_hash(original_filepath), prompt_text, selected_model_id, preview_renderer, requested_image_slides]
+    return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def process_edit(original_filepath, original_filename_secure, session, prompt_text, selected_model_id,
+                 preview_renderer, requested_image_slides, overall_start_time):
+    """
+    Prepares a deck and runs one edit within the memory budget.
+    Returns (ctx, edit, timing_stats, xml_diffs); per-request files are removed before returning.
+    """
+    memory_reservation, memory_tracker, ctx = 0, None, None
+    try:
+        # --- Memory budget (see memory_budget.py): wait for room, then track peak RSS ---
+        with tracing.span("memory_admission") as admission_span:
+            memory_reservation = memory_budget.REQUEST_MEMORY_BUDGET.acquire(
+                memory_budget.estimate_request_bytes(original_filepath))
+            admission_span.set_attribute("reserved_mb", round(memory_reservation / memory_budget.MB, 1))
+        memory_tracker = memory_budget.PeakTracker().start()
+
+        ctx = prepare_deck_context(original_filepath, original_filename_secure, session)
+        tracing.set_attributes(prepared_deck_hit=bool(ctx.prepared_deck))
+        edit = run_edit(ctx, prompt_text, selected_model_id, preview_renderer, requested_image_slides)
+        timing_stats = edit_timing_stats(ctx, edit, overall_start_time, preview_renderer, memory_tracker)
+        # Diffs against the pre-turn XML are needed before a session moves to the new version
+        xml_diffs = edit_xml_diffs(ctx, edit)
+        return ctx, edit, timing_stats, xml_diffs
+    finally:
+        if ctx:
+            ctx.cleanup()
+        if memory_tracker:
+            memory_tracker.stop()
+        if memory_reservation:
+            memory_budget.REQUEST_MEMORY_BUDGET.release(memory_reservation)
+
+
+def log_edit(ctx, edit, timing_stats, route):
+    outcome = "modified" if edit["modified_pptx_download_url"] else "not_modified"
+    processing_log.log_request({
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "trace_id": tracing.current_trace_id(),
+        "original_filename": ctx.filename,
+        "llm_engine": edit["llm_engine_used"],
+        "outcome": outcome,
+        "deck_bytes": os.path.getsize(ctx.filepath),
+        "total_slides": timing_stats["total_slides_in_original"],
+        "slides_edited": timing_stats["number_of_slides_edited_by_llm"],
+        "modified_xml_files": ", ".join(edit["applied_xml_map"].keys()) if edit["applied_xml_map"] else None,
+        "used_prepared_artifacts": timing_stats["used_prepared_artifacts"],
+        "total_s": timing_stats["total_processing_time_s"],
+        "json_extraction_s": timing_stats["json_extraction_time_s"],
+        "xml_extraction_s": timing_stats["xml_extraction_time_s"],
+        "llm_inference_s": timing_stats["llm_inference_time_s"],
+        "xml_validation_s": timing_stats["xml_validation_time_s"],
+        "pptx_modification_s": timing_stats["pptx_modification_time_s"],
+        "image_conversion_s": timing_stats["image_conversion_time_s"],
+        "peak_rss_mb": timing_stats["peak_rss_mb"],
+        "session_id": ctx.session.session_id if ctx.session else None,
+        "session_version": ctx.session.version if ctx.session else None,
+    })
+    metrics.REQUESTS.inc(route=route, outcome=outcome)
+
+
+def build_edit_payload(ctx, edit, timing_stats, xml_diffs, response_fields, request_id, trace_id):
+    """Response fields of one edit; request_id names its artifacts (see write_request_artifacts)."""
+    llm_result = edit["llm_result"]
+    artifacts = write_request_artifacts(request_id, ctx.json_data, llm_result.get("text_response"), edit["applied_xml_map"], xml_diffs)
+    payload_builders = {
+        "message": lambda: "File processed successfully.",
+        "llm_engine_used": lambda: edit["llm_engine_used"],
+        "llm_response": lambda: llm_result.get("text_response"),
+        "modified_pptx_download_url": lambda: edit["modified_pptx_download_url"],
+        "reason_for_no_modification": lambda: edit["reason_for_no_modification"],
+        "edited_slides_comparison_data": lambda: edit["edited_slides_comparison_data"],
+        "timing_stats": lambda: timing_stats,
+        "json_data": lambda: ctx.json_data,
+        "xml_files": lambda: [Path(f).name for f in ctx.xml_full_paths],
+        "modified_xml_files": lambda: list(edit["applied_xml_map"]),
+        "modified_xml_diff": lambda: xml_diffs,
+        "modified_xml_data": lambda: edit["applied_xml_map"],
+        "repaired_xml_files": lambda: edit["repaired_xml_files"],
+        "rejected_xml_files": lambda: edit["rejected_xml_files"],
+        "artifacts": lambda: artifacts,
+        "trace_id": lambda: trace_id,
+        "trace_url": lambda: f"/api/traces/{trace_id}",
+        "session": lambda: ctx.session.to_dict() if ctx.session else None,
+    }
+    return {field: payload_builders[field]() for field in response_fields}
+
+
+def parse_edit_options(form):
+    """Model, preview renderer and image_slides of an edit request. Returns (options, error)."""
+    preview_renderer = form.get('preview_renderer', 'libreoffice')
+    if preview_renderer not in PREVIEW_RENDERERS:
+        return None, f"Unknown preview_renderer '{preview_renderer}'. Available: {', '.join(PREVIEW_RENDERERS)}"
+    # Slides whose images go to vision models: "2,4-5", "all" or "none"; defaults to the slides the prompt names
+    requested_image_slides = form.get('image_slides')
+    if requested_image_slides is not None:
+        try:
+            vision_cache.parse_slide_list(requested_image_slides, 0)
+        except ValueError:
+            return None, f"Invalid image_slides '{requested_image_slides}'. Use e.g. '2,4-5', 'all' or 'none'."
+    return (form.get('llm_engine', 'gemini-1.5-flash-latest'), preview_renderer, requested_image_slides), None
+
+
+def resolve_benchmark_file(file):
+    """Path of an uploaded deck in the benchmark directory. Returns (filename, filepath, (error message, status))."""
+    if not file or file.filename == '':
+        return None, None, ("No selected file", 400)
+    if not allowed_file(file.filename):
+        return None, None, ("File type not allowed", 400)
+    original_filename_secure = secure_filename(file.filename)
+    # --- MODIFIED: Construct path to existing benchmark file instead of uploading ---
+    original_filepath = os.path.join(app.config['TSBENCH_PRESENTATIONS_DIR'], original_filename_secure)
+    if not os.path.exists(original_filepath):
+        return None, None, (f"File '{original_filename_secure}' not found in benchmark directory.", 404)
+    return original_filename_secure, original_filepath, None
+
+
+def parse_process_request(req):
+    """
+    Inputs of an /api/process request (a werkzeug request, which asgi.py builds too).
+    Returns (inputs, (error message, status)). A session turn's deck path is read
+    once the session is locked.
+    """
+    response_fields, fields_error = parse_response_fields(req.args.get('fields'))
+    if fields_error:
+        return None, (fields_error, 400)
+    session_id = req.form.get('session_id')
+    session = None
+    if session_id:
+        session = edit_sessions.SESSION_MANAGER.get(session_id)
+        if session is None:
+            return None, (f"Edit session '{session_id}' not found or expired.", 404)
+    elif 'file' not in req.files:
+        return None, ("No file part in request. The key should be 'file'.", 400)
+
+    edit_options, options_error = parse_edit_options(req.form)
+    if options_error:
+        return None, (options_error, 400)
+    selected_model_id, preview_renderer, requested_image_slides = edit_options
+    inputs = {
+        "response_fields": response_fields,
+        "session": session,
+        "filename": session.source_filename if session else None,
+        "filepath": None,
+        "prompt": req.form.get('prompt', ''),
+        "model": selected_model_id,
+        "renderer": preview_renderer,
+        "image_slides": requested_image_slides,
+    }
+    if not session:
+        file = req.files.get('file')
+        if file.filename == '':
+            return None, ("No selected file", 400)
+        if not allowed_file(file.filename):
+            metrics.REQUESTS.inc(route="process", outcome="rejected")
+            return None, ("File type not allowed", 400)
+        inputs["filename"], inputs["filepath"], file_error = resolve_benchmark_file(file)
+        if file_error:
+            return None, file_error
+    return inputs, None
+
+
+def parse_batch_request(req):
+    """Inputs of an /api/process_batch request. Returns (inputs, (error message, status))."""
+    response_fields, fields_error = parse_response_fields(req.args.get('fields'))
+    if fields_error:
+        return None, (fields_error, 400)
+    if 'file' not in req.files:
+        return None, ("No file part in request. The key should be 'file'.", 400)
+    prompts = req.form.getlist('prompt')
+    if req.form.get('prompts'):
+        try:
+            prompts = json.loads(req.form['prompts'])
+        except json.JSONDecodeError:
+            prompts = None
+        if not isinstance(prompts, list) or not all(isinstance(prompt, str) for prompt in prompts):
+            return None, ("'prompts' must be a JSON list of strings.", 400)
+    if not prompts:
+        return None, ("No prompts given. Use repeated 'prompt' fields or a JSON list in 'prompts'.", 400)
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return None, (f"At most {BATCH_MAX_PROMPTS} prompts per batch.", 400)
+    edit_options, options_error = parse_edit_options(req.form)
+    if options_error:
+        return None, (options_error, 400)
+    selected_model_id, preview_renderer, requested_image_slides = edit_options
+    try:
+        max_concurrency = int(req.form.get('max_concurrency', BATCH_MAX_CONCURRENCY))
+    except ValueError:
+        return None, ("'max_concurrency' must be an integer.", 400)
+
+    original_filename_secure, original_filepath, file_error = resolve_benchmark_file(req.files.get('file'))
+    if file_error:
+        metrics.REQUESTS.inc(route="process_batch", outcome="rejected")
+        return None, file_error
+    return {
+        "response_fields": response_fields,
+        "prompts": prompts,
+        "filename": original_filename_secure,
+        "filepath": original_filepath,
+        "model": selected_model_id,
+        "renderer": preview_renderer,
+        "image_slides": requested_image_slides,
+        "max_concurrency": max(1, min(max_concurrency, BATCH_MAX_CONCURRENCY, len(prompts))),
+    }, None
+
+
+def set_edit_trace_attributes(inputs, original_filepath):
+    session = inputs["session"]
+    tracing.set_attributes(filename=inputs["filename"], model=inputs["model"],
+                           prompt_chars=len(inputs["prompt"]), deck_bytes=os.path.getsize(original_filepath),
+                           session_id=session.session_id if session else None,
+                           session_version=session.version if session else None)
+
+
+def record_session_turn(session, edit, preview_renderer):
+    modified = bool(edit["modified_pptx_download_url"])
+    with tracing.span("session_update", session_id=session.session_id):
+        session.record_turn(
+            edit["prompt"], edit["llm_engine_used"], edit["applied_xml_map"],
+            new_version_id=edit["modified_version_id"] if modified else None,
+            modified_images={preview_renderer: edit["modified_image_paths"]} if modified else None)
+
+
+def finish_edit(ctx, edit, timing_stats, xml_diffs, coalesced, overall_start_time, route, response_fields, request_id, trace_id):
+    """Logs a finished edit and returns its response payload. Coalesced edits report their own wall time."""
+    tracing.set_attributes(coalesced=coalesced)
+    timing_stats = {**timing_stats, "coalesced": coalesced}
+    if coalesced:
+        timing_stats["total_processing_time_s"] = round(time.time() - overall_start_time, 3)
+    log_edit(ctx, edit, timing_stats, route=route)
+    with tracing.span("response_build", fields=len(response_fields)):
+        return build_edit_payload(ctx, edit, timing_stats, xml_diffs, response_fields, request_id, trace_id)
+
+
+def request_cancelled(e, route, original_filename_secure, selected_model_id, overall_start_time):
+    """Logs a request whose deadline ended (deadlines.RequestCancelled e). Returns (payload, status, headers)."""
+    app.logger.warning(f"Request on '{original_filename_secure}' stopped: {e}")
+    metrics.REQUESTS.inc(route=route, outcome=e.reason)
+    metrics.REQUEST_CANCELLATIONS.inc(route=route, reason=e.reason, stage=e.stage)
+    tracing.set_attributes(cancelled=e.reason, cancelled_stage=e.stage)
+    processing_log.log_request({
+        "trace_id": tracing.current_trace_id(),
+        "original_filename": original_filename_secure,
+        "llm_engine": selected_model_id,
+        "outcome": e.reason,
+        "stopped_stage": e.stage,
+        "total_s": round(time.time() - overall_start_time, 3),
+    })
+    return {"error": str(e), "trace_id": tracing.current_trace_id()}, CANCELLED_REQUEST_STATUS[e.reason], {}
+
+
+def edit_failure(e, route, original_filename_secure, selected_model_id, overall_start_time):
+    """Logs an edit request that raised e. Returns (payload, status, headers)."""
+    if isinstance(e, deadlines.RequestCancelled):
+        return request_cancelled(e, route, original_filename_secure, selected_model_id, overall_start_time)
+    if isinstance(e, memory_budget.MemoryBudgetExceeded):
+        app.logger.warning(f"Memory budget refused '{original_filename_secure}': {e}")
+        metrics.REQUESTS.inc(route=route, outcome="memory_rejected")
+        processing_log.log_request({
+            "trace_id": tracing.current_trace_id(),
+            "original_filename": original_filename_secure,
+            "llm_engine": selected_model_id,
+            "outcome": "memory_rejected",
+            "total_s": round(time.time() - overall_start_time, 3),
+            "peak_rss_mb": round(memory_budget.current_rss_bytes() / memory_budget.MB, 1),
+        })
+        return {"error": str(e), "trace_id": tracing.current_trace_id()}, 503, {"Retry-After": str(e.retry_after)}
+    app.logger.error(f"Error processing file '{original_filename_secure}': {e}", exc_info=e)
+    metrics.REQUESTS.inc(route=route, outcome="error")
+    processing_log.log_request({
+        "trace_id": tracing.current_trace_id(),
+        "original_filename": original_filename_secure,
+        "llm_engine": selected_model_id,
+        "outcome": "error",
+        "total_s": round(time.time() - overall_start_time, 3),
+    })
+    return {"error": f"An error occurred during processing: {str(e)}", "trace_id": tracing.current_trace_id()}, 500, {}
+
+
+def batch_failure(e, inputs, overall_start_time):
+    """
+    Logs a batch that failed as a whole: its deck could not be admitted or prepared,
+    or its deadline ended. Returns (payload, status, headers).
+    """
+    original_filename_secure = inputs["filename"]
+    if isinstance(e, deadlines.RequestCancelled):
+        return request_cancelled(e, "process_batch", original_filename_secure, inputs["model"], overall_start_time)
+    if isinstance(e, memory_budget.MemoryBudgetExceeded):
+        app.logger.warning(f"Memory budget refused batch on '{original_filename_secure}': {e}")
+        metrics.REQUESTS.inc(route="process_batch", outcome="memory_rejected")
+        return {"error": str(e), "trace_id": tracing.current_trace_id()}, 503, {"Retry-After": str(e.retry_after)}
+    app.logger.error(f"Error preparing batch on '{original_filename_secure}': {e}", exc_info=e)
+    metrics.REQUESTS.inc(route="process_batch", outcome="error")
+    return {"error": f"An error occurred during processing: {str(e)}", "trace_id": tracing.current_trace_id()}, 500, {}
+
+
+def batch_variant_failure(e, index, inputs, trace_id, overall_start_time):
+    """Logs a batch variant that raised e. Returns its payload."""
+    outcome = "memory_rejected" if isinstance(e, memory_budget.MemoryBudgetExceeded) else "error"
+    app.logger.error(f"Batch variant {index} on '{inputs['filename']}' failed: {e}", exc_info=e if outcome == "error" else None)
+    metrics.REQUESTS.inc(route="process_batch", outcome=outcome)
+    processing_log.log_request({
+        "trace_id": trace_id,
+        "original_filename": inputs["filename"],
+        "llm_engine": inputs["model"],
+        "outcome": outcome,
+        "total_s": round(time.time() - overall_start_time, 3),
+    })
+    return {"error": f"An error occurred during processing: {str(e)}"}
+
+
+def batch_response(ctx, variants, inputs, trace_id, overall_start_time, memory_tracker):
+    batch_timing_stats = {
+        "total_processing_time_s": round(time.time() - overall_start_time, 3),
+        "json_extraction_time_s": ctx.json_extraction_time_s,
+        "xml_extraction_time_s": ctx.xml_extraction_time_s,
+        "variants": len(variants),
+        "variants_modified": sum(1 for variant in variants if variant.get("modified_pptx_download_url")),
+        "variants_failed": sum(1 for variant in variants if "error" in variant),
+        "max_concurrency": inputs["max_concurrency"],
+        "used_prepared_artifacts": bool(ctx.prepared_deck),
+        **memory_tracker.stats(),
+    }
+    return {
+        "variants": variants,
+        "timing_stats": batch_timing_stats,
+        "trace_id": trace_id,
+        "trace_url": f"/api/traces/{trace_id}",
+    }
+
+
+def run_process_request(inputs, overall_start_time):
+    """Runs a parsed /api/process request (see parse_process_request). Returns (payload, status, headers)."""
+    session = inputs["session"]
+    session_locked = False
+    try:
+        if session:
+            # --- Edit session turn (see edit_sessions.py): one turn at a time per session ---
+            session_locked = session.lock.acquire(timeout=deadlines.bounded(edit_sessions.SESSION_LOCK_TIMEOUT_S))
+            if not session_locked:
+                return {"error": f"Edit session '{session.session_id}' is busy with another turn."}, 409, {}
+        original_filepath = session.current_path if session else inputs["filepath"]
+        set_edit_trace_attributes(inputs, original_filepath)
+        run_this_edit = lambda: process_edit(
+            original_filepath, inputs["filename"], session, inputs["prompt"], inputs["model"],
+            inputs["renderer"], inputs["image_slides"], overall_start_time)
+
+        if session:
+            ctx, edit, timing_stats, xml_diffs = run_this_edit()
+            coalesced = False
+            record_session_turn(session, edit, inputs["renderer"])
+        else:
+            # --- Single-flight (see single_flight.py): concurrent identical requests share one LLM call and render ---
+            fingerprint = edit_fingerprint(original_filepath, inputs["prompt"], inputs["model"],
+                                           inputs["renderer"], inputs["image_slides"])
+            (ctx, edit, timing_stats, xml_diffs), coalesced = EDIT_FLIGHTS.do(fingerprint, run_this_edit)
+
+        request_id = tracing.current_trace_id() or uuid.uuid4().hex
+        response_payload = finish_edit(ctx, edit, timing_stats, xml_diffs, coalesced, overall_start_time,
+                                       "process", inputs["response_fields"], request_id, request_id)
+        return response_payload, 200, {}
+    except Exception as e:
+        return edit_failure(e, "process", inputs["filename"], inputs["model"], overall_start_time)
+    finally:
+        if session_locked:
+            session.lock.release()
+
+
 @app.route('/api/process', methods=['POST'])
 def process_ppt_route():
     """
     Handles the file upload and processing request from the benchmark runner.
     Provides a more detailed reason when no PPTX file is generated.
+    ?fields=a,b,c selects response fields (see DEFAULT_RESPONSE_FIELDS / OPTIONAL_RESPONSE_FIELDS).
+    With a session_id form field (see /api/sessions) the request is a turn on that
+    session's current deck version instead of on an uploaded file.
+    The edit stops when the X-Request-Timeout deadline passes or the client
+    disconnects (see deadlines.py), answered with 504 or 499.
     """
     overall_start_time = time.time()
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part in request. The key should be 'file'."}), 400
-    
-    file = request.files['file']
-    prompt_text = request.form.get('prompt', '')
-    selected_model_id = request.form.get('llm_engine', 'gemini-1.5-flash-latest')
+    deadline = deadlines.from_headers(request.headers)
+    inputs, input_error = parse_process_request(request)
+    if input_error:
+        return jsonify({"error": input_error[0]}), input_error[1]
+    with deadline.attach(), deadlines.watch_socket(request.environ.get('werkzeug.socket')):
+        payload, status, headers = run_process_request(inputs, overall_start_time)
+    return jsonify(payload), status, headers
+
 
-    if file.filename == '': return jsonify({"error": "No selected file"}), 400
+@app.route('/api/process_stream', methods=['POST'])
+def process_stream_route():
+    """
+    /api/process with progress: the same form fields and ?fields=, answered with a
+    text/event-stream of progress events (see progress.py) while the edit runs in a
+    background thread. The last event is "result", with the /api/process response
+    payload, or "error". Invalid requests get the same JSON errors as /api/process.
+    A stream that joins an identical edit already in flight (see single_flight.py)
+    only receives the result. Closing the stream stops the edit (see deadlines.py).
+    """
+    overall_start_time = time.time()
+    deadline = deadlines.from_headers(request.headers)
+    inputs, input_error = parse_process_request(request)
+    if input_error:
+        return jsonify({"error": input_error[0]}), input_error[1]
+    stream = progress.EventStream()
+    remote_addr = request.remote_addr
+    client_socket = request.environ.get('werkzeug.socket')
+
+    def run_streamed_edit():
+        trace = tracing.begin_trace("POST /api/process_stream", remote_addr=remote_addr)
+        error = None
+        try:
+            with deadline.attach(), deadlines.watch_socket(client_socket), stream.attach():
+                progress.emit("started", trace_id=trace.trace_id, trace_url=f"/api/traces/{trace.trace_id}")
+                payload, status, _ = run_process_request(inputs, overall_start_time)
+                if status != 200:
+                    error = payload.get("error")
+                progress.emit("result" if status == 200 else "error", status=status, **payload)
+        finally:
+            tracing.end_trace(trace, error=error)
+            stream.finish()
+
+    threading.Thread(target=run_streamed_edit, name="process-stream", daemon=True).start()
+
+    def event_source():
+        try:
+            for event, data in stream.events(STREAM_KEEPALIVE_S):
+                yield progress.format_event(event, data)
+        finally:
+            # The client went away or the edit finished; an edit still running is stopped
+            stream.close()
+            deadline.cancel()
+
+    return Response(event_source(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/api/process_batch', methods=['POST'])
+def process_batch_route():
+    """
+    Runs several prompts against one deck. The deck is extracted once and the
+    prompts run concurrently (up to BATCH_MAX_CONCURRENCY); each variant is
+    repacked into its own deck version with only its edited slides rendered.
+    Form fields as for /api/process, with the prompts as repeated 'prompt' fields
+    or a JSON list in 'prompts', and an optional 'max_concurrency'.
+    ?fields= selects the fields of each variant. X-Request-Timeout applies to the whole batch.
+    """
+    overall_start_time = time.time()
+    deadline = deadlines.from_headers(request.headers)
+    inputs, input_error = parse_batch_request(request)
+    if input_error:
+        return jsonify({"error": input_error[0]}), input_error[1]
+    with deadline.attach(), deadlines.watch_socket(request.environ.get('werkzeug.socket')):
+        payload, status, headers = run_batch_request(inputs, overall_start_time)
+    return jsonify(payload), status, headers
+
+
+def run_batch_request(inputs, overall_start_time):
+    """Runs a parsed /api/process_batch request (see parse_batch_request). Returns (payload, status, headers)."""
+    original_filepath, prompts, max_concurrency = inputs["filepath"], inputs["prompts"], inputs["max_concurrency"]
 
-    original_filename_secure = "N/A"
+    memory_reservation, memory_tracker = 0, None
     try:
-        if file and allowed_file(file.filename):
-            original_filename_secure = secure_filename(file.filename)
-            
-            # --- MODIFIED: Construct path to existing benchmark file instead of uploading ---
-            original_filepath = os.path.join(app.config['TSBENCH_PRESENTATIONS_DIR'], original_filename_secure)
-
-            if not os.path.exists(original_filepath):
-                return jsonify({"error": f"File '{original_filename_secure}' not found in benchmark directory."}), 404
-            
-            # --- Timing & Processing Steps ---
-            time_json_start = time.time()
-            json_data = ppt_processor.pptx_to_json(original_filepath)
-            time_json_end = time.time()
-
-            time_xml_extract_start = time.time()
-            original_xml_output_dir = os.path.join(app.config['EXTRACTED_XML_FOLDER'], original_filename_secure + "_xml")
-            if os.path.exists(original_xml_output_dir): shutil.rmtree(original_xml_output_dir)
-            extracted_original_xml_full_paths = ppt_processor.extract_xml_from_pptx(original_filepath, original_xml_output_dir)
-            time_xml_extract_end = time.time()
-            
-            xml_paths_for_llm_prompt_relative = [
-                Path(p).relative_to(original_xml_output_dir).as_posix() for p in extracted_original_xml_full_paths
-            ]
-            
-            llm_result = llm_handler.get_llm_response(
-                user_prompt=prompt_text,
-                ppt_json_data=json_data,
-                xml_file_paths=extracted_original_xml_full_paths,
-                engine_or_model_id=selected_model_id
-            )
-            actual_model_used = llm_result.get("model_used", selected_model_id)
-            parsed_modified_xml_map = llm_handler.parse_llm_response_for_xml_changes(llm_result.get("text_response", ""))
-            
-            modified_pptx_download_url = None
-            edited_slides_comparison_data = []
-            number_of_slides_edited = 0
-            reason_for_no_modification = None
-            time_pptx_modify_start = time_pptx_modify_end = 0
-            time_img_conv_start = time_img_conv_end = 0
-
-            if parsed_modified_xml_map:
-                xml_updates_for_new_pptx_relative_keys = {}
-                edited_slide_numbers = set()
-
-                for llm_filename_key, new_xml_content in parsed_modified_xml_map.items():
-                    if llm_filename_key in xml_paths_for_llm_prompt_relative:
-                        xml_updates_for_new_pptx_relative_keys[llm_filename_key] = new_xml_content
-                        match = re.search(r'ppt/slides/slide(\d+)\.xml', llm_filename_key)
-                        if match:
-                            edited_slide_numbers.add(int(match.group(1)))
-                
-                number_of_slides_edited = len(edited_slide_numbers)
-
-                if xml_updates_for_new_pptx_relative_keys:
-                    modified_pptx_filename_secure = f"modified_{original_filename_secure}"
-                    modified_pptx_filepath = os.path.join(app.config['MODIFIED_PPTX_FOLDER'], modified_pptx_filename_secure)
-                    
-                    time_pptx_modify_start = time.time()
-                    creation_success = ppt_processor.create_modified_pptx(original_filepath, xml_updates_for_new_pptx_relative_keys, modified_pptx_filepath)
-                    time_pptx_modify_end = time.time()
-
-                    if creation_success:
-                        modified_pptx_download_url = f"/download_modified/{modified_pptx_filename_secure}"
-
-                        time_img_conv_start = time.time()
-                        original_img_dir = os.path.join(app.config['GENERATED_IMAGES_FOLDER'], f"{original_filename_secure}_orig")
-                        modified_img_dir = os.path.join(app.config['GENERATED_IMAGES_FOLDER'], f"{modified_pptx_filename_secure}_mod")
-                        
-                        original_image_paths = ppt_processor.export_slides_to_images(original_filepath, original_img_dir)
-                        modified_image_paths = ppt_processor.export_slides_to_images(modified_pptx_filepath, modified_img_dir)
-                        time_img_conv_end = time.time()
-                        
-                        abs_generated_images_folder = os.path.abspath(app.config['GENERATED_IMAGES_FOLDER'])
-
-                        for slide_num in sorted(list(edited_slide_numbers)):
-                            original_img_path = original_image_paths[slide_num - 1] if len(original_image_paths) >= slide_num else None
-                            modified_img_path = modified_image_paths[slide_num - 1] if len(modified_image_paths) >= slide_num else None
-
-                            if original_img_path and modified_img_path:
-                                edited_slides_comparison_data.append({
-                                    "slide_number": slide_num,
-                                    "original_image_url": f"/view_slide_image/{Path(original_img_path).relative_to(abs_generated_images_folder).as_posix()}",
-                                    "modified_image_url": f"/view_slide_image/{Path(modified_img_path).relative_to(abs_generated_images_folder).as_posix()}"
-                                })
-            else:
-                # --- MODIFIED: Capture the specific reason for no modification ---
-                reason_for_no_modification = "LLM did not return any parsable 'MODIFIED_XML_FILE' blocks."
-                llm_text_response = llm_result.get("text_response", "").strip()
-                if "no changes needed" in llm_text_response.lower() or len(llm_text_response) < 30:
-                    reason_for_no_modification = f"LLM explicitly stated no changes were needed. Full Response: '{llm_text_response}'"
-            
-            total_processing_time = time.time() - overall_start_time
-            timing_stats = {
-                "total_processing_time_s": round(total_processing_time, 3),
-                "json_extraction_time_s": round(time_json_end - time_json_start, 3),
-                "xml_extraction_time_s": round(time_xml_extract_end - time_xml_extract_start, 3),
-                "llm_inference_time_s": llm_result.get("inference_time_seconds"),
-                "pptx_modification_time_s": round(time_pptx_modify_end - time_pptx_modify_start, 3) if time_pptx_modify_start else "N/A",
-                "image_conversion_time_s": round(time_img_conv_end - time_img_conv_start, 3) if time_img_conv_start else "N/A",
-                "number_of_slides_edited_by_llm": number_of_slides_edited,
-                "total_slides_in_original": len(json_data.get("slides", []))
-            }
-            
-            log_data = {
-                'Timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'OriginalFilename': original_filename_secure,
-                'LLMEngineUsed': actual_model_used,
-                'TotalProcessingTimeSeconds': timing_stats["total_processing_time_s"],
-                'JSONExtractionTimeSeconds': timing_stats["json_extraction_time_s"],
-                'XMLExtractionTimeSeconds': timing_stats["xml_extraction_time_s"],
-                'LLMInferenceTimeSeconds': timing_stats["llm_inference_time_s"],
-                'PPTXModificationTimeSeconds': timing_stats["pptx_modification_time_s"],
-                'ImageConversionTimeSeconds': timing_stats["image_conversion_time_s"],
-                'TotalSlidesInOriginal': timing_stats["total_slides_in_original"],
-                'NumberOfSlidesEditedByLLM': number_of_slides_edited,
-                'ModifiedXMLFilesList': ", ".join(parsed_modified_xml_map.keys()) if parsed_modified_xml_map else "None"
-            }
-            log_processing_details(log_data)
-
-            response_payload = {
-                "message": "File processed successfully.",
-                "llm_engine_used": actual_model_used,
-                "llm_response": llm_result.get("text_response"),
-                "modified_pptx_download_url": modified_pptx_download_url,
-                "reason_for_no_modification": reason_for_no_modification,
-                "edited_slides_comparison_data": edited_slides_comparison_data,
-                "timing_stats": timing_stats,
-                "json_data": json_data,
-                "xml_files": [Path(f).name for f in extracted_original_xml_full_paths],
-                "modified_xml_data": parsed_modified_xml_map
-            }
-            return jsonify(response_payload), 200
-        else:
-            return jsonify({"error": "File type not allowed"}), 400
+        # --- Memory budget (see memory_budget.py): room for the variants that run at once ---
+        with tracing.span("memory_admission") as admission_span:
+            memory_reservation = memory_budget.REQUEST_MEMORY_BUDGET.acquire(
+                memory_budget.estimate_request_bytes(original_filepath) * max_concurrency)
+            admission_span.set_attribute("reserved_mb", round(memory_reservation / memory_budget.MB, 1))
+        memory_tracker = memory_budget.PeakTracker().start()
 
+        ctx = prepare_deck_context(original_filepath, inputs["filename"])
+        tracing.set_attributes(filename=inputs["filename"], model=inputs["model"], prompts=len(prompts),
+                               max_concurrency=max_concurrency, deck_bytes=os.path.getsize(original_filepath),
+                               prepared_deck_hit=bool(ctx.prepared_deck))
     except Exception as e:
-        app.logger.error(f"Error processing file '{original_filename_secure}': {e}", exc_info=True)
-        return jsonify({"error": f"An error occurred during processing: {str(e)}"}), 500
+        if memory_tracker:
+            memory_tracker.stop()
+        if memory_reservation:
+            memory_budget.REQUEST_MEMORY_BUDGET.release(memory_reservation)
+        return batch_failure(e, inputs, overall_start_time)
+
+    trace_id = tracing.current_trace_id() or uuid.uuid4().hex
+
+    def run_variant(index, prompt_text):
+        with tracing.span("batch_variant", index=index):
+            try:
+                def edit_variant():
+                    edit = run_edit(ctx, prompt_text, inputs["model"], inputs["renderer"], inputs["image_slides"],
+                                    output_suffix=f"_v{index}")
+                    timing_stats = edit_timing_stats(ctx, edit, overall_start_time, inputs["renderer"], memory_tracker)
+                    return ctx, edit, timing_stats, edit_xml_diffs(ctx, edit)
+
+                # Duplicate prompts, within the batch or in concurrent requests, share one execution
+                fingerprint = edit_fingerprint(original_filepath, prompt_text, inputs["model"],
+                                               inputs["renderer"], inputs["image_slides"])
+                (variant_ctx, edit, timing_stats, xml_diffs), coalesced = EDIT_FLIGHTS.do(fingerprint, edit_variant)
+                payload = finish_edit(variant_ctx, edit, timing_stats, xml_diffs, coalesced, overall_start_time,
+                                      "process_batch", inputs["response_fields"], uuid.uuid4().hex, trace_id)
+            except deadlines.RequestCancelled:
+                # The deadline is the batch's: reported once, for the whole batch
+                raise
+            except Exception as e:
+                payload = batch_variant_failure(e, index, inputs, trace_id, overall_start_time)
+            return {"index": index, "prompt": prompt_text, **payload}
+
+    try:
+        with tracing.span("batch_fanout", variants=len(prompts), max_concurrency=max_concurrency):
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                futures = [executor.submit(tracing.wrap_context(run_variant), index, prompt_text)
+                           for index, prompt_text in enumerate(prompts)]
+                variants = [future.result() for future in futures]
+        return batch_response(ctx, variants, inputs, trace_id, overall_start_time, memory_tracker), 200, {}
+    except deadlines.RequestCancelled as e:
+        return batch_failure(e, inputs, overall_start_time)
+    finally:
+        ctx.cleanup()
+        memory_tracker.stop()
+        memory_budget.REQUEST_MEMORY_BUDGET.release(memory_reservation)
+
 
 if __name__ == '__main__':
     # Note: The benchmark runner expects the host to be 127.0.0.1 and port 5001
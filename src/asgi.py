@@ -0,0 +1,518 @@
+# --- asgi.py ---
+"""
+Async (ASGI) serving mode for the processing API.
+
+`python app.py` runs Flask's threaded server, where every in-flight edit holds a
+thread for its whole lifetime, mostly waiting on the LLM provider or on soffice.
+This module serves the same routes from one event loop instead:
+
+    - POST /api/process and POST /api/process_batch run natively: the LLM call
+      goes through the providers' async clients (llm_handler.get_llm_response_async),
+      soffice and pdftoppm run as asyncio subprocesses
+      (ppt_processor.export_slides_to_images_async), and the CPU-bound stages
+      (extraction, vision inputs, parse/validate/repack) run in worker threads,
+      which hand extraction, prompt building, parsing and repacking on to the
+      CPU stage process pool (see cpu_pool.py).
+      Each stage has its own concurrency limit (STAGE_CONCURRENCY), so hundreds
+      of edits can wait on their LLM calls while extraction and rendering stay
+      bounded. Waiting edits and wait times are exported as
+      pptpilot_async_stage_waiting / pptpilot_async_stage_wait_seconds.
+      A native request runs as its own task under a deadline (X-Request-Timeout,
+      see deadlines.py): when it passes, or the client disconnects
+      (http.disconnect), the task is cancelled, which cancels the provider call
+      and kills soffice/pdftoppm, and the outcome is logged as timeout/cancelled.
+    - every other route is forwarded to the Flask app in a worker thread.
+
+Request parsing, validation, logging and response payloads are app.py's own
+helpers, so both modes return the same responses.
+
+Usage (needs uvicorn or hypercorn, neither is required by the threaded mode):
+    python asgi.py [--host 127.0.0.1] [--port 5001] [--server uvicorn|hypercorn]
+    uvicorn asgi:application --port 5001
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.wrappers import Request
+import app
+import cpu_pool
+import deadlines
+import llm_handler
+import memory_budget
+import metrics
+import part_store
+import single_flight
+import storage_gc
+import tracing
+import edit_sessions
+
+try:
+    import uvicorn  # Optional: ASGI server for `python asgi.py`
+except ImportError:
+    uvicorn = None
+
+try:
+    import hypercorn.asyncio  # Optional: alternative ASGI server
+    import hypercorn.config
+except ImportError:
+    hypercorn = None
+
+# --- Configuration ---
+# Edits allowed in each stage at once; the rest wait for a slot
+STAGE_CONCURRENCY = {
+    "prepare": os.cpu_count() or 4,  # JSON/XML extraction and vision inputs (threads)
+    "llm": 256,                      # provider calls awaited on the event loop
+    "apply": os.cpu_count() or 4,    # parse, validate and repack (threads)
+    "render": 4,                     # soffice + pdftoppm subprocesses
+}
+# Threads for the CPU stages, forwarded Flask routes and short file operations
+THREAD_POOL_WORKERS = 64
+# Request bodies (uploaded decks) above this size are spooled to disk
+REQUEST_BODY_SPOOL_BYTES = 8 * 1024 * 1024
+SESSION_LOCK_POLL_S = 0.05
+
+EDIT_FLIGHTS = single_flight.AsyncSingleFlight("edit")
+_stage_slots = {stage: asyncio.Semaphore(limit) for stage, limit in STAGE_CONCURRENCY.items()}
+
+
+@asynccontextmanager
+async def stage_slot(stage):
+    """Holds one of the stage's STAGE_CONCURRENCY slots."""
+    wait_start = time.perf_counter()
+    metrics.ASYNC_STAGE_WAITING.inc(stage=stage)
+    try:
+        await _stage_slots[stage].acquire()
+    finally:
+        metrics.ASYNC_STAGE_WAITING.dec(stage=stage)
+        metrics.ASYNC_STAGE_WAIT_SECONDS.observe(time.perf_counter() - wait_start, stage=stage)
+    try:
+        yield
+    finally:
+        _stage_slots[stage].release()
+
+
+async def in_stage_thread(stage, func, *args):
+    """Runs a blocking stage function in a worker thread, within the stage's concurrency limit."""
+    async with stage_slot(stage):
+        return await asyncio.to_thread(func, *args)
+
+
+# --- Edit pipeline (async forms of app.run_edit / app.process_edit) ---
+
+async def run_edit_async(ctx, prompt_text, selected_model_id, preview_renderer, requested_image_slides=None, output_suffix=""):
+    """app.run_edit with the LLM call and the renders awaited on the event loop."""
+    edit = app.new_edit(prompt_text, selected_model_id)
+    llm_request = await in_stage_thread("prepare", app.prepare_llm_request, ctx, edit, requested_image_slides)
+    async with stage_slot("llm"):
+        llm_result = await llm_handler.get_llm_response_async(**llm_request)
+    modified_img_dir = await in_stage_thread("apply", app.apply_llm_result, ctx, edit, llm_result, output_suffix)
+    if modified_img_dir is None:
+        return edit
+
+    memory_budget.check_rss("image_conversion")
+    time_img_conv_start = time.time()
+    async with stage_slot("render"):
+        modified_pptx_filepath = await asyncio.to_thread(part_store.materialize, edit["modified_version_id"])
+        original_images_by_slide = await ctx.original_images_async(preview_renderer, edit["edited_slide_numbers"])
+        modified_image_paths = await app.render_slides_async(
+            preview_renderer, modified_pptx_filepath, modified_img_dir, edit["edited_slide_numbers"])
+    edit["image_conversion_time_s"] = round(time.time() - time_img_conv_start, 3)
+    await asyncio.to_thread(app.compare_edit_renders, edit, original_images_by_slide, modified_image_paths)
+    return edit
+
+
+async def admit(original_filepath, concurrency=1):
+    """Memory admission for concurrency edits of a deck. Returns the reserved bytes."""
+    with tracing.span("memory_admission") as admission_span:
+        estimate = await asyncio.to_thread(memory_budget.estimate_request_bytes, original_filepath)
+        memory_reservation = await memory_budget.REQUEST_MEMORY_BUDGET.acquire_async(estimate * concurrency)
+        admission_span.set_attribute("reserved_mb", round(memory_reservation / memory_budget.MB, 1))
+    return memory_reservation
+
+
+async def process_edit_async(original_filepath, original_filename_secure, session, prompt_text, selected_model_id,
+                             preview_renderer, requested_image_slides, overall_start_time):
+    """Async form of app.process_edit. Returns (ctx, edit, timing_stats, xml_diffs)."""
+    memory_reservation, memory_tracker, ctx = 0, None, None
+    try:
+        memory_reservation = await admit(original_filepath)
+        memory_tracker = memory_budget.PeakTracker().start()
+
+        ctx = await in_stage_thread("prepare", app.prepare_deck_context, original_filepath, original_filename_secure, session)
+        tracing.set_attributes(prepared_deck_hit=bool(ctx.prepared_deck))
+        edit = await run_edit_async(ctx, prompt_text, selected_model_id, preview_renderer, requested_image_slides)
+        timing_stats = app.edit_timing_stats(ctx, edit, overall_start_time, preview_renderer, memory_tracker)
+        xml_diffs = await asyncio.to_thread(app.edit_xml_diffs, ctx, edit)
+        return ctx, edit, timing_stats, xml_diffs
+    finally:
+        if ctx:
+            await asyncio.to_thread(ctx.cleanup)
+        if memory_tracker:
+            memory_tracker.stop()
+        if memory_reservation:
+            memory_budget.REQUEST_MEMORY_BUDGET.release(memory_reservation)
+
+
+async def acquire_session_lock(session):
+    """session.lock within SESSION_LOCK_TIMEOUT_S, polled so no thread blocks on it. Returns True when held."""
+    deadline = time.monotonic() + deadlines.bounded(edit_sessions.SESSION_LOCK_TIMEOUT_S)
+    while not session.lock.acquire(blocking=False):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(SESSION_LOCK_POLL_S)
+    return True
+
+
+def request_ended():
+    """
+    True when the current task was cancelled because its request's deadline ended
+    (see _run_with_deadline); the cancellation is then absorbed so the route can
+    still log the outcome. False for any other cancellation (e.g. shutdown).
+    """
+    if not deadlines.ended():
+        return False
+    asyncio.current_task().uncancel()
+    return True
+
+
+# --- Native routes: (payload, status, headers) from a werkzeug request ---
+
+async def process_route(request):
+    """POST /api/process, see app.process_ppt_route."""
+    overall_start_time = time.time()
+    inputs, input_error = await asyncio.to_thread(app.parse_process_request, request)
+    if input_error:
+        return {"error": input_error[0]}, input_error[1], {}
+    session = inputs["session"]
+
+    session_locked = False
+    try:
+        if session:
+            session_locked = await acquire_session_lock(session)
+            if not session_locked:
+                return {"error": f"Edit session '{session.session_id}' is busy with another turn."}, 409, {}
+        original_filepath = session.current_path if session else inputs["filepath"]
+        app.set_edit_trace_attributes(inputs, original_filepath)
+        run_this_edit = lambda: process_edit_async(
+            original_filepath, inputs["filename"], session, inputs["prompt"], inputs["model"],
+            inputs["renderer"], inputs["image_slides"], overall_start_time)
+
+        if session:
+            ctx, edit, timing_stats, xml_diffs = await run_this_edit()
+            coalesced = False
+            await asyncio.to_thread(app.record_session_turn, session, edit, inputs["renderer"])
+        else:
+            fingerprint = await asyncio.to_thread(app.edit_fingerprint, original_filepath, inputs["prompt"], inputs["model"],
+                                                  inputs["renderer"], inputs["image_slides"])
+            (ctx, edit, timing_stats, xml_diffs), coalesced = await EDIT_FLIGHTS.do(fingerprint, run_this_edit)
+
+        request_id = tracing.current_trace_id() or uuid.uuid4().hex
+        response_payload = await asyncio.to_thread(
+            app.finish_edit, ctx, edit, timing_stats, xml_diffs, coalesced, overall_start_time,
+            "process", inputs["response_fields"], request_id, request_id)
+        return response_payload, 200, {}
+    except asyncio.CancelledError:
+        if not request_ended():
+            raise
+        return await asyncio.to_thread(app.edit_failure, deadlines.current().error(), "process", inputs["filename"],
+                                       inputs["model"], overall_start_time)
+    except Exception as e:
+        return await asyncio.to_thread(app.edit_failure, e, "process", inputs["filename"], inputs["model"], overall_start_time)
+    finally:
+        if session_locked:
+            session.lock.release()
+
+
+async def process_batch_route(request):
+    """POST /api/process_batch, see app.process_batch_route."""
+    overall_start_time = time.time()
+    inputs, input_error = await asyncio.to_thread(app.parse_batch_request, request)
+    if input_error:
+        return {"error": input_error[0]}, input_error[1], {}
+    original_filepath, prompts, max_concurrency = inputs["filepath"], inputs["prompts"], inputs["max_concurrency"]
+
+    memory_reservation, memory_tracker = 0, None
+    try:
+        memory_reservation = await admit(original_filepath, max_concurrency)
+        memory_tracker = memory_budget.PeakTracker().start()
+        ctx = await in_stage_thread("prepare", app.prepare_deck_context, original_filepath, inputs["filename"])
+        tracing.set_attributes(filename=inputs["filename"], model=inputs["model"], prompts=len(prompts),
+                               max_concurrency=max_concurrency, deck_bytes=os.path.getsize(original_filepath),
+                               prepared_deck_hit=bool(ctx.prepared_deck))
+    except (Exception, asyncio.CancelledError) as e:
+        if memory_tracker:
+            memory_tracker.stop()
+        if memory_reservation:
+            memory_budget.REQUEST_MEMORY_BUDGET.release(memory_reservation)
+        if isinstance(e, asyncio.CancelledError):
+            if not request_ended():
+                raise
+            e = deadlines.current().error()
+        return await asyncio.to_thread(app.batch_failure, e, inputs, overall_start_time)
+
+    trace_id = tracing.current_trace_id() or uuid.uuid4().hex
+    variant_slots = asyncio.Semaphore(max_concurrency)
+
+    async def run_variant(index, prompt_text):
+        async with variant_slots:
+            with tracing.span("batch_variant", index=index):
+                try:
+                    async def edit_variant():
+                        edit = await run_edit_async(ctx, prompt_text, inputs["model"], inputs["renderer"],
+                                                    inputs["image_slides"], output_suffix=f"_v{index}")
+                        timing_stats = app.edit_timing_stats(ctx, edit, overall_start_time, inputs["renderer"], memory_tracker)
+                        return ctx, edit, timing_stats, await asyncio.to_thread(app.edit_xml_diffs, ctx, edit)
+
+                    fingerprint = await asyncio.to_thread(app.edit_fingerprint, original_filepath, prompt_text, inputs["model"],
+                                                          inputs["renderer"], inputs["image_slides"])
+                    (variant_ctx, edit, timing_stats, xml_diffs), coalesced = await EDIT_FLIGHTS.do(fingerprint, edit_variant)
+                    payload = await asyncio.to_thread(
+                        app.finish_edit, variant_ctx, edit, timing_stats, xml_diffs, coalesced, overall_start_time,
+                        "process_batch", inputs["response_fields"], uuid.uuid4().hex, trace_id)
+                except deadlines.RequestCancelled:
+                    raise
+                except Exception as e:
+                    payload = await asyncio.to_thread(app.batch_variant_failure, e, index, inputs, trace_id, overall_start_time)
+                return {"index": index, "prompt": prompt_text, **payload}
+
+    try:
+        with tracing.span("batch_fanout", variants=len(prompts), max_concurrency=max_concurrency):
+            variants = await asyncio.gather(*(run_variant(index, prompt_text) for index, prompt_text in enumerate(prompts)))
+        return app.batch_response(ctx, variants, inputs, trace_id, overall_start_time, memory_tracker), 200, {}
+    except asyncio.CancelledError:
+        if not request_ended():
+            raise
+        return await asyncio.to_thread(app.batch_failure, deadlines.current().error(), inputs, overall_start_time)
+    except deadlines.RequestCancelled as e:
+        return await asyncio.to_thread(app.batch_failure, e, inputs, overall_start_time)
+    finally:
+        await asyncio.to_thread(ctx.cleanup)
+        memory_tracker.stop()
+        memory_budget.REQUEST_MEMORY_BUDGET.release(memory_reservation)
+
+
+NATIVE_ROUTES = {
+    ("POST", "/api/process"): process_route,
+    ("POST", "/api/process_batch"): process_batch_route,
+}
+
+
+# --- ASGI plumbing ---
+
+async def _read_body(receive):
+    """The request body as a file, or None when the client disconnected first."""
+    body = tempfile.SpooledTemporaryFile(max_size=REQUEST_BODY_SPOOL_BYTES)
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            body.close()
+            return None
+        body.write(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    body.seek(0)
+    return body
+
+
+def _wsgi_environ(scope, body):
+    """A WSGI environ for an ASGI HTTP scope, so werkzeug parses forms and files as it does for Flask."""
+    server = scope.get("server") or ("127.0.0.1", 80)
+    client = scope.get("client") or ("", 0)
+    body.seek(0, os.SEEK_END)
+    content_length = body.tell()
+    body.seek(0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(content_length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name, value = raw_name.decode("latin-1").lower(), raw_value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name != "content-length":
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _start_response(send, status, headers):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in headers],
+    })
+
+
+async def _watch_disconnect(receive, end_request):
+    """Calls end_request("cancelled") when the client disconnects; cancelled once the response is sent."""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            end_request("cancelled")
+            return
+
+
+async def _run_with_deadline(handler, request, receive):
+    """
+    Runs handler(request) as a task under the request's deadline (see deadlines.py).
+    The task is cancelled when the deadline passes or the client disconnects.
+    Returns (deadline, handler result).
+    """
+    start_time = time.time()
+    deadline = deadlines.from_headers(request.headers)
+    with deadline.attach():
+        # The task copies the current context, so every stage of the request sees the deadline
+        task = asyncio.ensure_future(handler(request))
+
+    def end_request(reason):
+        if deadline.cancel(reason):
+            task.cancel()
+
+    timer = asyncio.get_running_loop().call_later(deadline.remaining(), end_request, "timeout")
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, end_request))
+    try:
+        return deadline, await task
+    except asyncio.CancelledError:
+        if not task.cancelled() or deadline.reason is None or asyncio.current_task().cancelling():
+            raise
+        # Ended before the route could handle it (e.g. while the request was parsed)
+        route = request.path.rsplit("/", 1)[-1]
+        return deadline, await asyncio.to_thread(app.request_cancelled, deadline.error(), route, None, None, start_time)
+    finally:
+        timer.cancel()
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+
+
+async def _serve_native(handler, request, receive, send):
+    """Runs a native route in its own trace and sends its JSON response (compressed like Flask's, see app.compress_response)."""
+    storage_gc.COLLECTOR.ensure_running()
+    trace = tracing.begin_trace(f"{request.method} {request.path}", remote_addr=request.remote_addr)
+    error = None
+    deadline = None
+    try:
+        deadline, (payload, status, headers) = await _run_with_deadline(handler, request, receive)
+    except Exception as e:
+        error = e
+        app.app.logger.error(f"Unhandled error in {request.path}: {e}", exc_info=e)
+        payload, status, headers = {"error": f"An error occurred during processing: {str(e)}"}, 500, {}
+    finally:
+        tracing.end_trace(trace, error=error)
+    if deadline is not None and deadline.reason == "cancelled":
+        return  # nobody is left to read the response
+
+    body = (app.app.json.dumps(payload) + "\n").encode("utf-8")
+    headers = {**headers, "Content-Type": "application/json", "Vary": "Accept-Encoding"}
+    if 200 <= status < 300:
+        encoding, body = app.compress_body(body, request.accept_encodings)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+    headers["Content-Length"] = len(body)
+    await _start_response(send, status, headers.items())
+    await send({"type": "http.response.body", "body": body})
+
+
+def _call_flask(environ):
+    """Calls the Flask app. Returns (status code, headers, body iterable)."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"], started["headers"] = int(status.split(" ", 1)[0]), headers
+        return lambda data: None
+
+    body = app.app(environ, start_response)
+    return started["status"], started["headers"], body
+
+
+async def _serve_flask(environ, send):
+    """Forwards a request to the Flask app; the response body is iterated in worker threads (files are streamed)."""
+    status, headers, body = await asyncio.to_thread(_call_flask, environ)
+    try:
+        await _start_response(send, status, headers)
+        chunks = iter(body)
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(body, "close"):
+            await asyncio.to_thread(body.close)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=THREAD_POOL_WORKERS, thread_name_prefix="asgi-worker"))
+            storage_gc.COLLECTOR.ensure_running()
+            cpu_pool.POOL.ensure_running()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """The ASGI application."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    body = await _read_body(receive)
+    if body is None:
+        return
+    try:
+        environ = _wsgi_environ(scope, body)
+        handler = NATIVE_ROUTES.get((scope["method"], scope["path"]))
+        if handler is None:
+            await _serve_flask(environ, send)
+        else:
+            await _serve_native(handler, Request(environ), receive, send)
+    finally:
+        body.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the processing API from an asyncio event loop.")
+    # The benchmark runner expects 127.0.0.1:5001, like app.py
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--server", choices=["uvicorn", "hypercorn"], help="default: the first one installed")
+    args = parser.parse_args()
+
+    server = args.server or ("uvicorn" if uvicorn is not None else "hypercorn" if hypercorn is not None else None)
+    if server == "uvicorn" and uvicorn is not None:
+        uvicorn.run(application, host=args.host, port=args.port, lifespan="on")
+    elif server == "hypercorn" and hypercorn is not None:
+        config = hypercorn.config.Config()
+        config.bind = [f"{args.host}:{args.port}"]
+        asyncio.run(hypercorn.asyncio.serve(application, config))
+    else:
+        sys.exit("asgi.py needs an ASGI server: pip install uvicorn (or hypercorn). "
+                 "Without one, use the threaded server: python app.py")
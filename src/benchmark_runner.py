@@ -8,6 +8,7 @@ from pathlib import Path
 from tqdm import tqdm
 import shutil
 import ppt_processor
+import deck_store
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
@@ -17,6 +18,9 @@ import logging
 # --- Configuration ---
 SCRIPT_DIR = Path(__file__).parent.resolve()
 PPT_PROCESSOR_URL = "http://127.0.0.1:5001/api/process"
+PPT_PROCESSOR_BATCH_URL = "http://127.0.0.1:5001/api/process_batch"
+# Only the fields the runner reads; the server then skips the large JSON/XML payloads
+PPT_PROCESSOR_FIELDS = "modified_xml_files,modified_pptx_download_url,reason_for_no_modification"
 TSBENCH_DIR = SCRIPT_DIR / "tsbench"
 TSBENCH_FILE = TSBENCH_DIR / "expanded_instruction_379.json"
 TSBENCH_PRESENTATIONS_DIR = TSBENCH_DIR / "benchmark_ppts"
@@ -28,6 +32,10 @@ LLM_ENGINE = "gemini-2.5-flash-preview-05-20"
 #LLM_ENGINE = "o1-2025-06-04"
 #LLM_ENGINE = "o4-mini"
 MAX_CONCURRENT_REQUESTS = 4
+# Send all prompts of a base deck as one /api/process_batch request (the server prepares the deck once)
+BATCH_MODE = False
+MAX_PROMPTS_PER_BATCH = 20  # app.BATCH_MAX_PROMPTS
+# Also sent as X-Request-Timeout, so the server stops an edit the runner has given up on
 REQUEST_TIMEOUT_SECONDS = 300
 
 # --- NEW: Centralized Run Directory ---
@@ -35,25 +43,28 @@ RUN_TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 RUN_OUTPUT_DIR = SCRIPT_DIR / "benchmark_runs" / f"run_{RUN_TIMESTAMP}"
 RESULTS_CSV = RUN_OUTPUT_DIR / "benchmark_results.csv"
 
-def process_single_prompt(prompt_id, prompt_text):
-    """
-    Processes a single prompt: sends request, saves artifacts, and provides
-    more detailed error reporting based on the server's response.
-    """
+def link_or_copy(source_path, target_path):
+    """Hard-links a file that is never modified (falls back to a copy across filesystems)."""
+    try:
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy(source_path, target_path)
+
+def clean_prompt_text(prompt_text):
     # --- ADDED: Regex to remove the placeholder from the instruction ---
-    prompt_text = re.sub(r'\s*\{slide_num\}\s*', '', prompt_text).strip()
+    return re.sub(r'\s*\{slide_num\}\s*', '', prompt_text).strip()
 
+def before_ppt_path_for(prompt_id):
     base_id = prompt_id.split('-')[0]
-    before_ppt_filename = f"slide_{base_id}.pptx"
-    before_ppt_path = TSBENCH_PRESENTATIONS_DIR / before_ppt_filename
+    return TSBENCH_PRESENTATIONS_DIR / f"slide_{base_id}.pptx"
 
-    # This is the dedicated directory for all outputs of this single prompt run
-    prompt_run_dir = RUN_OUTPUT_DIR / prompt_id
-    prompt_run_dir.mkdir(parents=True, exist_ok=True)
-
-    result_entry = {
+def new_result_entry(prompt_id, prompt_text):
+    return {
         "id": prompt_id,
         "instruction": prompt_text,
+        "llm_engine": LLM_ENGINE,
         "success": False,
         "error_message": "",
         "processing_time_s": None,
@@ -64,63 +75,93 @@ def process_single_prompt(prompt_id, prompt_text):
         "modified_xml_files": []
     }
 
+def prepare_prompt_run_dir(prompt_id, before_ppt_path, result_entry):
+    """Creates the output directory of one prompt and links the 'before' deck into it."""
+    # This is the dedicated directory for all outputs of this single prompt run
+    prompt_run_dir = RUN_OUTPUT_DIR / prompt_id
+    prompt_run_dir.mkdir(parents=True, exist_ok=True)
+    # Link the 'before' presentation into our run directory; the benchmark decks are never modified
+    link_or_copy(before_ppt_path, prompt_run_dir / "before.pptx")
+    result_entry["before_ppt_path"] = str((prompt_run_dir / "before.pptx").relative_to(RUN_OUTPUT_DIR))
+    return prompt_run_dir
+
+def save_prompt_outputs(response_data, before_ppt_path, prompt_run_dir, result_entry):
+    """Downloads the modified deck of one prompt (or variant) and renders its before/after images."""
+    result_entry["modified_xml_files"] = response_data.get("modified_xml_files", [])
+    
+    modified_url = response_data.get("modified_pptx_download_url")
+    if modified_url:
+        modified_response = requests.get(f"http://127.0.0.1:5001{modified_url}", timeout=REQUEST_TIMEOUT_SECONDS)
+        if modified_response.ok:
+            output_path = prompt_run_dir / "after.pptx"
+            with open(output_path, 'wb') as f_out:
+                f_out.write(modified_response.content)
+            
+            result_entry["success"] = True
+            result_entry["output_pptx_path"] = str(output_path.relative_to(RUN_OUTPUT_DIR))
+
+            # --- Image Generation in the new consolidated structure ---
+            before_img_dir = prompt_run_dir / "before_images"
+            after_img_dir = prompt_run_dir / "after_images"
+            
+            # Reuse the warmed-up renders of the static 'before' deck when available
+            prepared_deck = deck_store.get_prepared_deck(before_ppt_path, require_images=True)
+            if prepared_deck:
+                before_img_dir.mkdir(parents=True, exist_ok=True)
+                for prepared_image_path in deck_store.get_slide_image_paths(prepared_deck):
+                    link_or_copy(prepared_image_path, before_img_dir / Path(prepared_image_path).name)
+            else:
+                ppt_processor.export_slides_to_images(str(prompt_run_dir / "before.pptx"), str(before_img_dir))
+            ppt_processor.export_slides_to_images(str(output_path), str(after_img_dir))
+
+            result_entry["before_images_path"] = str(before_img_dir.relative_to(RUN_OUTPUT_DIR))
+            result_entry["after_images_path"] = str(after_img_dir.relative_to(RUN_OUTPUT_DIR))
+            
+        else:
+            # --- MODIFIED: Use the new, more detailed reason from the server ---
+            reason = response_data.get("reason_for_no_modification", "The server returned a response, but downloading the modified PPTX failed.")
+            result_entry["error_message"] = f"PPTX download failed. Reason: {reason}"
+    else:
+        # --- MODIFIED: Use the new, more detailed reason from the server ---
+        reason = response_data.get("reason_for_no_modification", "No modified PPTX URL returned and no reason provided by the server.")
+        result_entry["error_message"] = f"Server did not generate a PPTX. Reason: {reason}"
+
+def server_error_message(response):
+    try:
+        return response.json().get("error", "Unknown server error.")
+    except json.JSONDecodeError:
+        return f"Unknown server error. Status: {response.status_code}, Response: {response.text}"
+
+def process_single_prompt(prompt_id, prompt_text):
+    """
+    Processes a single prompt: sends request, saves artifacts, and provides
+    more detailed error reporting based on the server's response.
+    """
+    prompt_text = clean_prompt_text(prompt_text)
+    before_ppt_path = before_ppt_path_for(prompt_id)
+    result_entry = new_result_entry(prompt_id, prompt_text)
+
     if not before_ppt_path.exists():
         result_entry["error_message"] = f"Skipping: Cannot find 'before' PPTX at {before_ppt_path}"
         return result_entry
 
-    # Copy the 'before' presentation into our run directory for pristine keeping
-    shutil.copy(before_ppt_path, prompt_run_dir / "before.pptx")
-    result_entry["before_ppt_path"] = str((prompt_run_dir / "before.pptx").relative_to(RUN_OUTPUT_DIR))
-
+    prompt_run_dir = prepare_prompt_run_dir(prompt_id, before_ppt_path, result_entry)
 
     try:
         start_time = time.time()
         with open(before_ppt_path, 'rb') as ppt_file:
             files = {'file': (before_ppt_path.name, ppt_file, 'application/vnd.openxmlformats-officedocument.presentationml.presentation')}
             payload = {'prompt': prompt_text, 'llm_engine': LLM_ENGINE}
-            response = requests.post(PPT_PROCESSOR_URL, files=files, data=payload, timeout=REQUEST_TIMEOUT_SECONDS)
+            response = requests.post(PPT_PROCESSOR_URL, params={'fields': PPT_PROCESSOR_FIELDS},
+                                     files=files, data=payload, timeout=REQUEST_TIMEOUT_SECONDS,
+                                     headers={'X-Request-Timeout': str(REQUEST_TIMEOUT_SECONDS)})
         
         result_entry["processing_time_s"] = round(time.time() - start_time, 3)
 
         if response.ok:
-            response_data = response.json()
-            result_entry["modified_xml_files"] = list(response_data.get("modified_xml_data", {}).keys())
-            
-            modified_url = response_data.get("modified_pptx_download_url")
-            if modified_url:
-                modified_response = requests.get(f"http://127.0.0.1:5001{modified_url}", timeout=REQUEST_TIMEOUT_SECONDS)
-                if modified_response.ok:
-                    output_path = prompt_run_dir / "after.pptx"
-                    with open(output_path, 'wb') as f_out:
-                        f_out.write(modified_response.content)
-                    
-                    result_entry["success"] = True
-                    result_entry["output_pptx_path"] = str(output_path.relative_to(RUN_OUTPUT_DIR))
-
-                    # --- Image Generation in the new consolidated structure ---
-                    before_img_dir = prompt_run_dir / "before_images"
-                    after_img_dir = prompt_run_dir / "after_images"
-                    
-                    # Generate images for both presentations
-                    ppt_processor.export_slides_to_images(str(prompt_run_dir / "before.pptx"), str(before_img_dir))
-                    ppt_processor.export_slides_to_images(str(output_path), str(after_img_dir))
-
-                    result_entry["before_images_path"] = str(before_img_dir.relative_to(RUN_OUTPUT_DIR))
-                    result_entry["after_images_path"] = str(after_img_dir.relative_to(RUN_OUTPUT_DIR))
-                    
-                else:
-                    # --- MODIFIED: Use the new, more detailed reason from the server ---
-                    reason = response_data.get("reason_for_no_modification", "The server returned a response, but downloading the modified PPTX failed.")
-                    result_entry["error_message"] = f"PPTX download failed. Reason: {reason}"
-            else:
-                # --- MODIFIED: Use the new, more detailed reason from the server ---
-                reason = response_data.get("reason_for_no_modification", "No modified PPTX URL returned and no reason provided by the server.")
-                result_entry["error_message"] = f"Server did not generate a PPTX. Reason: {reason}"
+            save_prompt_outputs(response.json(), before_ppt_path, prompt_run_dir, result_entry)
         else:
-             try:
-                result_entry["error_message"] = response.json().get("error", "Unknown server error.")
-             except json.JSONDecodeError:
-                result_entry["error_message"] = f"Unknown server error. Status: {response.status_code}, Response: {response.text}"
+            result_entry["error_message"] = server_error_message(response)
 
     except requests.exceptions.RequestException as e:
         result_entry["error_message"] = f"Request failed: {str(e)}"
@@ -129,6 +170,59 @@ def process_single_prompt(prompt_id, prompt_text):
     
     return result_entry
 
+def process_prompt_batch(prompt_items):
+    """
+    Processes all prompts of one base deck with a single /api/process_batch call,
+    so the server prepares the deck once. Returns one result entry per prompt;
+    processing_time_s is the time of the whole batch.
+    """
+    prompt_items = [(prompt_id, clean_prompt_text(prompt_text)) for prompt_id, prompt_text in prompt_items]
+    before_ppt_path = before_ppt_path_for(prompt_items[0][0])
+    result_entries = [new_result_entry(prompt_id, prompt_text) for prompt_id, prompt_text in prompt_items]
+
+    if not before_ppt_path.exists():
+        for result_entry in result_entries:
+            result_entry["error_message"] = f"Skipping: Cannot find 'before' PPTX at {before_ppt_path}"
+        return result_entries
+
+    prompt_run_dirs = [prepare_prompt_run_dir(prompt_id, before_ppt_path, result_entry)
+                       for (prompt_id, _), result_entry in zip(prompt_items, result_entries)]
+
+    try:
+        start_time = time.time()
+        with open(before_ppt_path, 'rb') as ppt_file:
+            files = {'file': (before_ppt_path.name, ppt_file, 'application/vnd.openxmlformats-officedocument.presentationml.presentation')}
+            payload = {'prompts': json.dumps([prompt_text for _, prompt_text in prompt_items]), 'llm_engine': LLM_ENGINE}
+            response = requests.post(PPT_PROCESSOR_BATCH_URL, params={'fields': PPT_PROCESSOR_FIELDS},
+                                     files=files, data=payload, timeout=REQUEST_TIMEOUT_SECONDS * len(prompt_items),
+                                     headers={'X-Request-Timeout': str(REQUEST_TIMEOUT_SECONDS * len(prompt_items))})
+        batch_time = round(time.time() - start_time, 3)
+    except requests.exceptions.RequestException as e:
+        for result_entry in result_entries:
+            result_entry["error_message"] = f"Request failed: {str(e)}"
+        return result_entries
+
+    if not response.ok:
+        error_message = server_error_message(response)
+        for result_entry in result_entries:
+            result_entry["error_message"] = error_message
+        return result_entries
+
+    variants = {variant["index"]: variant for variant in response.json().get("variants", [])}
+    for index, (result_entry, prompt_run_dir) in enumerate(zip(result_entries, prompt_run_dirs)):
+        result_entry["processing_time_s"] = batch_time
+        variant = variants.get(index, {"error": "Missing from the batch response."})
+        if "error" in variant:
+            result_entry["error_message"] = variant["error"]
+            continue
+        try:
+            save_prompt_outputs(variant, before_ppt_path, prompt_run_dir, result_entry)
+        except requests.exceptions.RequestException as e:
+            result_entry["error_message"] = f"Request failed: {str(e)}"
+        except Exception as e:
+            result_entry["error_message"] = f"Unexpected error in benchmark runner: {str(e)}"
+    return result_entries
+
 def run_benchmark():
     """
     Reads the TSBench dataset, sends each entry concurrently to the PPTPilot server,
@@ -151,7 +245,7 @@ def run_benchmark():
 
     # --- MODIFIED: Create CSV and write header at the start ---
     fieldnames = [
-        "id", "instruction", "success", "error_message", "processing_time_s",
+        "id", "instruction", "llm_engine", "success", "error_message", "processing_time_s",
         "before_ppt_path", "output_pptx_path", "before_images_path", "after_images_path",
         "modified_xml_files"
     ]
@@ -169,29 +263,42 @@ def run_benchmark():
 
 
     with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
-        # Create a dictionary mapping futures to their prompt_id
-        future_to_prompt_id = {executor.submit(process_single_prompt, prompt_id, prompt_text): prompt_id for prompt_id, prompt_text in benchmark_items}
+        # Map each future to the prompt ids it covers (all prompts of a base deck in batch mode)
+        if BATCH_MODE:
+            prompt_groups = {}
+            for prompt_id, prompt_text in benchmark_items:
+                prompt_groups.setdefault(prompt_id.split('-')[0], []).append((prompt_id, prompt_text))
+            batches = [group[start:start + MAX_PROMPTS_PER_BATCH]
+                       for group in prompt_groups.values() for start in range(0, len(group), MAX_PROMPTS_PER_BATCH)]
+            print(f"Batch mode: {len(batches)} batch request(s) for {len(prompt_groups)} base deck(s)")
+            future_to_prompt_ids = {executor.submit(process_prompt_batch, batch): [prompt_id for prompt_id, _ in batch] for batch in batches}
+        else:
+            future_to_prompt_ids = {executor.submit(process_single_prompt, prompt_id, prompt_text): [prompt_id] for prompt_id, prompt_text in benchmark_items}
         
         # Process futures as they complete, with a progress bar
-        for future in tqdm(as_completed(future_to_prompt_id), total=len(benchmark_items), desc="Processing Prompts"):
-            prompt_id = future_to_prompt_id[future]
-            try:
-                result = future.result()
-            except Exception as exc:
-                print(f'\nPrompt {prompt_id} generated an exception during execution: {exc}')
-                result = {"id": prompt_id, "instruction": benchmark_data[prompt_id], "success": False, "error_message": str(exc)}
-            
-            # Ensure all fields are present for the CSV writer
-            for key in fieldnames:
-                if key not in result:
-                    result[key] = ""
-            
-            results.append(result)
+        with tqdm(total=len(benchmark_items), desc="Processing Prompts") as progress:
+            for future in as_completed(future_to_prompt_ids):
+                prompt_ids = future_to_prompt_ids[future]
+                try:
+                    future_results = future.result() if BATCH_MODE else [future.result()]
+                except Exception as exc:
+                    print(f'\nPrompt(s) {", ".join(prompt_ids)} generated an exception during execution: {exc}')
+                    future_results = [{"id": prompt_id, "instruction": benchmark_data[prompt_id], "llm_engine": LLM_ENGINE, "success": False, "error_message": str(exc)}
+                                      for prompt_id in prompt_ids]
+                
+                for result in future_results:
+                    # Ensure all fields are present for the CSV writer
+                    for key in fieldnames:
+                        if key not in result:
+                            result[key] = ""
+                    
+                    results.append(result)
 
-            # --- ADDED: Append the result to the CSV immediately ---
-            with open(RESULTS_CSV, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writerow(result)
+                    # --- ADDED: Append the result to the CSV immediately ---
+                    with open(RESULTS_CSV, 'a', newline='', encoding='utf-8') as f:
+                        writer = csv.DictWriter(f, fieldnames=fieldnames)
+                        writer.writerow(result)
+                progress.update(len(prompt_ids))
 
 
     if not results:
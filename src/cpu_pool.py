@@ -0,0 +1,274 @@
+# --- cpu_pool.py ---
+"""
+Warm process pool for the CPU-bound stages of an edit.
+
+JSON and XML extraction, prompt assembly, parsing the LLM response and repacking
+are pure Python over hundreds of KB of text. On the server's request threads
+they hold the GIL, so under concurrent load they run one at a time and every
+request waits for everyone else's string work. POOL.run() sends such a stage
+to one of CPU_POOL_WORKERS worker processes instead; the calling thread waits
+with the GIL released.
+
+Workers are started from a fork server that has PRELOAD_MODULES imported, so a
+new worker starts warm and the multithreaded server itself never forks. Module
+settings the stages read (WORKER_SETTINGS, e.g. part_store.PART_STORE_DIR) are
+copied from the server when the pool starts. As with any multiprocessing pool,
+each worker imports the launching script as __mp_main__, so a script that can
+reach the pool (directly or through app, part_store, llm_handler, ...) must keep
+its own work under an `if __name__ == "__main__":` guard; otherwise every worker
+re-runs it and the pool breaks.
+
+Payloads: stages take and return paths where they can (the deck, extracted
+parts, deck.json). Text arguments and results of SHARED_MEMORY_MIN_BYTES or
+more (slide XML, prompts, LLM responses), directly or as values of a dict or
+list argument, cross the process boundary in shared memory blocks instead of
+being pickled through the pool's pipes. The server unlinks every block once it
+has the result.
+
+Measured per stage: time a job waited for a free worker
+(pptpilot_cpu_pool_queue_wait_seconds) and jobs run in the pool or inline
+(pptpilot_cpu_pool_tasks_total). Counters a stage increments in a worker, and
+spans it opens while the request is traced, come back with its result: the
+counters are added to the server's metrics and the spans are added under the
+stage's span, which also carries queue_wait_ms. The worker's RSS comes back
+too, so memory_budget's RSS ceiling and peak count the pool's memory.
+
+A request whose deadline ends (see deadlines.py) stops waiting for its job; a
+job already running finishes in its worker and the result is dropped.
+
+Set PPTPILOT_CPU_POOL=0 to run every stage inline on the calling thread.
+"""
+import os
+import time
+import importlib
+import contextlib
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+import tracing
+import deadlines
+import memory_budget
+
+# --- Configuration ---
+CPU_POOL_ENABLED = os.environ.get("PPTPILOT_CPU_POOL", "1") != "0"
+CPU_POOL_WORKERS = int(os.environ.get("PPTPILOT_CPU_WORKERS", 0)) or os.cpu_count() or 2
+# Text of at least this many bytes goes through shared memory instead of the pool's pipes
+SHARED_MEMORY_MIN_BYTES = 64 * 1024
+# Jobs over less text than this run inline: the round trip to a worker costs more than the work
+MIN_OFFLOAD_CHARS = 16 * 1024
+# Imported by the fork server once, so workers start without paying for them (every stage
+# function lives in one of these; the launching script is not preloaded, see the module docstring)
+PRELOAD_MODULES = ["ppt_processor", "llm_handler", "part_store"]
+# Module settings the stages read, copied into each worker when the pool starts
+WORKER_SETTINGS = {
+    "ppt_processor": ["JSON_EXTRACTOR"],
+    "part_store": ["PART_STORE_DIR", "DEFLATE_LEVEL"],
+}
+
+
+class _SharedText:
+    """A str moved into a shared memory block (UTF-8)."""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+def _share(text, blocks=None):
+    """
+    Copies text into a new shared memory block. The server passes blocks and keeps
+    the block open until the job is done; a worker hands its blocks over to the
+    server, which unlinks them after reading.
+    """
+    data = text.encode("utf-8")
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    block.buf[:len(data)] = data
+    metrics.CPU_POOL_SHARED_BYTES.inc(len(data), direction="result" if blocks is None else "argument")
+    if blocks is not None:
+        blocks.append(block)
+    else:
+        block.close()
+        resource_tracker.unregister(block._name, "shared_memory")
+    return _SharedText(block.name, len(data))
+
+
+def _read_shared(handle, unlink):
+    block = shared_memory.SharedMemory(name=handle.name)
+    try:
+        return bytes(block.buf[:handle.size]).decode("utf-8")
+    finally:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+def _pack(value, blocks=None):
+    """value with large str (itself, or items of a dict, list or tuple) replaced by _SharedText."""
+    if isinstance(value, str):
+        return _share(value, blocks) if len(value) >= SHARED_MEMORY_MIN_BYTES else value
+    if isinstance(value, dict):
+        return {key: _pack(item, blocks) if isinstance(item, str) else item for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_pack(item, blocks) if isinstance(item, str) else item for item in value)
+    return value
+
+
+def _unpack(value, unlink):
+    if isinstance(value, _SharedText):
+        return _read_shared(value, unlink)
+    if isinstance(value, dict):
+        return {key: _read_shared(item, unlink) if isinstance(item, _SharedText) else item for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_read_shared(item, unlink) if isinstance(item, _SharedText) else item for item in value)
+    return value
+
+
+def _release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _discard_result(future):
+    """Done callback of a job whose caller stopped waiting: unlinks the result's shared memory blocks."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()[1]
+    items = result.values() if isinstance(result, dict) else result if isinstance(result, (list, tuple)) else [result]
+    for item in items:
+        if isinstance(item, _SharedText):
+            block = shared_memory.SharedMemory(name=item.name)
+            block.close()
+            block.unlink()
+
+
+def _wait_for_job(future, stage):
+    """
+    future.result(), given up with deadlines.RequestCancelled when the request's
+    deadline ends. A job already running in a worker still finishes there; its
+    result is dropped.
+    """
+    if deadlines.current() is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=deadlines.MONITOR_POLL_S)
+        except TimeoutError:
+            if deadlines.ended():
+                if not future.cancel():
+                    future.add_done_callback(_discard_result)
+                deadlines.check(stage)
+
+
+# --- Worker side ---
+
+def _init_worker(settings):
+    for module_name, values in settings.items():
+        module = importlib.import_module(module_name)
+        for name, value in values.items():
+            setattr(module, name, value)
+
+
+def _run_job(func, args, kwargs, traced=False):
+    """
+    Runs one stage in a worker. Returns (start time, packed result, counters it
+    incremented, dicts of the spans it opened when traced, (pid, RSS) of the worker).
+    """
+    started_at = time.time()
+    counters_before = metrics.counter_values()
+    with (tracing.capture_spans() if traced else contextlib.nullcontext([])) as spans:
+        result = _pack(func(*[_unpack(arg, unlink=False) for arg in args],
+                            **{key: _unpack(arg, unlink=False) for key, arg in kwargs.items()}))
+    counters_after = metrics.counter_values()
+    increments = {
+        name: {labels: value - counters_before.get(name, {}).get(labels, 0)
+               for labels, value in values.items() if value != counters_before.get(name, {}).get(labels, 0)}
+        for name, values in counters_after.items()
+    }
+    return (started_at, result, {name: values for name, values in increments.items() if values}, spans,
+            (os.getpid(), memory_budget.current_rss_bytes()))
+
+
+def _ping():
+    return os.getpid()
+
+
+# --- Server side ---
+
+class CpuPool:
+    """The server's pool of stage workers, started on first use (or by ensure_running)."""
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                mp_context = multiprocessing.get_context(start_method)
+                if start_method == "forkserver":
+                    mp_context.set_forkserver_preload(PRELOAD_MODULES)
+                settings = {
+                    module_name: {name: getattr(importlib.import_module(module_name), name) for name in names}
+                    for module_name, names in WORKER_SETTINGS.items()
+                }
+                self._executor = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS, mp_context=mp_context,
+                                                     initializer=_init_worker, initargs=(settings,))
+                print(f"Started CPU stage pool ({CPU_POOL_WORKERS} workers, {start_method})")
+            return self._executor
+
+    def ensure_running(self):
+        """Starts every worker now instead of on the first jobs."""
+        if not CPU_POOL_ENABLED or self._executor is not None:
+            return
+        executor = self._get_executor()
+        for _ in range(CPU_POOL_WORKERS):
+            executor.submit(_ping)
+
+    def run(self, stage, func, *args, offload=True, **kwargs):
+        """
+        func(*args, **kwargs) in a worker process; func must be a module-level
+        function. Runs inline when the pool is disabled or offload is False.
+        Raises deadlines.RequestCancelled when the request's deadline has ended
+        before the job starts or while it waits for the job.
+        """
+        deadlines.check(stage)
+        if not CPU_POOL_ENABLED or not offload:
+            metrics.CPU_POOL_TASKS.inc(stage=stage, mode="inline")
+            return func(*args, **kwargs)
+
+        blocks = []
+        try:
+            packed_args = [_pack(arg, blocks) for arg in args]
+            packed_kwargs = {key: _pack(arg, blocks) for key, arg in kwargs.items()}
+            submitted_at = time.time()
+            executor = self._get_executor()
+            try:
+                started_at, result, counter_increments, spans, (worker_pid, worker_rss) = _wait_for_job(
+                    executor.submit(_run_job, func, packed_args, packed_kwargs,
+                                    tracing.current_trace_id() is not None), stage)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); the next job starts a new pool
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                        memory_budget.forget_workers()
+                raise
+        finally:
+            _release(blocks)
+
+        queue_wait_s = max(started_at - submitted_at, 0.0)
+        metrics.CPU_POOL_QUEUE_WAIT_SECONDS.observe(queue_wait_s, stage=stage)
+        metrics.CPU_POOL_TASKS.inc(stage=stage, mode="pool")
+        metrics.add_counter_values(counter_increments)
+        memory_budget.set_worker_rss(worker_pid, worker_rss)
+        tracing.add_spans(spans)
+        tracing.set_attributes(queue_wait_ms=round(queue_wait_s * 1000, 1))
+        return _unpack(result, unlink=True)
+
+
+POOL = CpuPool()
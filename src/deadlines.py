@@ -0,0 +1,258 @@
+# --- deadlines.py ---
+"""
+Request deadlines and cancellation.
+
+An edit is only worth finishing while its client is waiting for it. The
+benchmark runner gives up after its REQUEST_TIMEOUT_SECONDS and a browser tab
+can close at any time; without a deadline the server would still pay for the
+LLM call and two LibreOffice conversions (each up to SOFFICE_TIMEOUT_S per
+attempt) that nobody will see.
+
+Every edit request runs under a Deadline: the client's X-Request-Timeout header
+(seconds), or DEFAULT_REQUEST_TIMEOUT_S, capped at MAX_REQUEST_TIMEOUT_S. It
+ends when its time is up (reason "timeout") or when cancel() is called because
+the client went away (reason "cancelled"). The stages consult it:
+
+    - check(stage) raises RequestCancelled once the deadline has ended; it is
+      called before each CPU pool job, LLM call and subprocess;
+    - bounded(timeout_s) caps a provider or subprocess timeout by the time left;
+    - on_cancel(callback) runs callback when the deadline ends while it is
+      registered: ppt_processor kills soffice and pdftoppm, llm_handler closes
+      the OpenAI client of the call in flight.
+
+Like progress.py, the deadline is found through a context variable, so threads
+started with tracing.wrap_context or asyncio.to_thread share it; outside a
+request every function here does nothing.
+
+Disconnects: asgi.py reads http.disconnect from the ASGI receive channel and
+cancels the request's task. Flask's threaded server has no such event, so
+watch_socket() has the monitor thread poll the connection's socket for EOF;
+/api/process_stream cancels when its event stream is closed.
+"""
+import time
+import select
+import socket
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# --- Configuration ---
+# Used when the client sends no X-Request-Timeout; the benchmark runner sends its own timeout
+DEFAULT_REQUEST_TIMEOUT_S = 600
+MAX_REQUEST_TIMEOUT_S = 3600
+TIMEOUT_HEADER = "X-Request-Timeout"
+# How often the monitor thread looks for expired deadlines and closed connections
+MONITOR_POLL_S = 0.25
+
+_current_deadline = contextvars.ContextVar("pptpilot_deadline", default=None)
+
+
+class RequestCancelled(Exception):
+    """The request's deadline ended: reason is "timeout" or "cancelled" (client gone); stage is where it stopped."""
+
+    def __init__(self, reason, stage, timeout_s):
+        self.reason = reason
+        self.stage = stage
+        self.timeout_s = timeout_s
+        if reason == "timeout":
+            message = f"Request deadline of {timeout_s:g}s exceeded during {stage}"
+        else:
+            message = f"Request cancelled by the client during {stage}"
+        super().__init__(message)
+
+
+class Deadline:
+    """The deadline of one request."""
+
+    def __init__(self, timeout_s):
+        self.timeout_s = timeout_s
+        self.expires_at = time.monotonic() + timeout_s
+        self.reason = None  # "timeout" or "cancelled" once ended
+        self.stage = "admission"  # the last stage that checked the deadline
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def attach(self):
+        """Makes this the current deadline of the calling context."""
+        token = _current_deadline.set(self)
+        try:
+            yield self
+        finally:
+            _current_deadline.reset(token)
+            _MONITOR.discard(self)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def ended(self):
+        if self.reason is None and time.monotonic() >= self.expires_at:
+            self.cancel("timeout")
+        return self.reason is not None
+
+    def cancel(self, reason="cancelled"):
+        """Ends the deadline and runs its on_cancel callbacks. Returns False when it had already ended."""
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Warning: Cancellation callback failed: {e}")
+        return True
+
+    def error(self):
+        """RequestCancelled for this deadline (once it has ended)."""
+        return RequestCancelled(self.reason, self.stage, self.timeout_s)
+
+    def check(self, stage):
+        self.stage = stage
+        if self.ended():
+            raise self.error()
+
+    @contextmanager
+    def on_cancel(self, callback):
+        """Runs callback if the deadline ends (or has ended) while the block runs."""
+        with self._lock:
+            already_ended = self.reason is not None
+            if not already_ended:
+                self._callbacks.append(callback)
+        if already_ended:
+            callback()
+        else:
+            # Expiry is noticed by the monitor thread, so the callback also runs on timeout
+            _MONITOR.add(self)
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+
+def from_headers(headers):
+    """The Deadline of a request, from its X-Request-Timeout header."""
+    timeout_s = DEFAULT_REQUEST_TIMEOUT_S
+    try:
+        requested = float(headers.get(TIMEOUT_HEADER, ""))
+        if requested > 0:
+            timeout_s = min(requested, MAX_REQUEST_TIMEOUT_S)
+    except ValueError:
+        pass
+    return Deadline(timeout_s)
+
+
+def current():
+    return _current_deadline.get()
+
+
+def check(stage):
+    """Raises RequestCancelled when the current deadline has ended."""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def ended():
+    deadline = _current_deadline.get()
+    return deadline is not None and deadline.ended()
+
+
+def bounded(timeout_s):
+    """timeout_s, or less when the current deadline ends sooner."""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return timeout_s
+    return max(min(timeout_s, deadline.remaining()), 0.01)
+
+
+@contextmanager
+def on_cancel(callback):
+    """Deadline.on_cancel for the current deadline; does nothing outside a request."""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        yield
+        return
+    with deadline.on_cancel(callback):
+        yield
+
+
+def sleep(seconds):
+    """time.sleep, cut short by the end of the current deadline."""
+    time.sleep(bounded(seconds))
+
+
+def wait(event):
+    """Waits for a threading.Event until the current deadline ends. Returns event.is_set()."""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return event.wait()
+    while not event.wait(MONITOR_POLL_S):
+        if deadline.ended():
+            return event.is_set()
+    return True
+
+
+@contextmanager
+def watch_socket(sock):
+    """Cancels the current deadline if the client closes sock while the block runs (None: not watched)."""
+    deadline = _current_deadline.get()
+    if deadline is None or sock is None:
+        yield
+        return
+    _MONITOR.add(deadline, sock)
+    try:
+        yield
+    finally:
+        _MONITOR.discard(deadline)
+
+
+def _peer_closed(sock):
+    """True when the other end of a connection has closed it (a read would return EOF)."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except ConnectionError:
+        return True
+    except (OSError, ValueError):
+        # A descriptor closed meanwhile, or a socket that cannot be peeked (TLS): left running
+        return False
+
+
+class _Monitor:
+    """One thread that ends expired deadlines (running their callbacks) and cancels those whose client disconnected."""
+
+    def __init__(self):
+        self._watched = {}  # Deadline -> socket or None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, deadline, sock=None):
+        with self._lock:
+            if sock is not None or deadline not in self._watched:
+                self._watched[deadline] = sock
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deadline-monitor", daemon=True)
+                self._thread.start()
+
+    def discard(self, deadline):
+        with self._lock:
+            self._watched.pop(deadline, None)
+
+    def _run(self):
+        while True:
+            time.sleep(MONITOR_POLL_S)
+            with self._lock:
+                watched = list(self._watched.items())
+            for deadline, sock in watched:
+                if not deadline.ended() and sock is not None and _peer_closed(sock):
+                    print(f"Client disconnected; cancelling its request (stage: {deadline.stage})")
+                    deadline.cancel("cancelled")
+                if deadline.ended():
+                    self.discard(deadline)
+
+
+_MONITOR = _Monitor()
@@ -0,0 +1,310 @@
+# --- deck_store.py ---
+"""
+Prepared artifact store for static benchmark decks.
+
+Every deck is keyed by the SHA-256 of its bytes and prepared once into
+PREPARED_DECKS_DIR/<deck_hash>/:
+    manifest.json   - bookkeeping (source name, slide count, timings)
+    deck.json       - output of ppt_processor.extract_deck_json
+    parts.json      - index of every package part (name, sizes, crc)
+    xml/            - extracted .xml/.rels parts, same layout as extract_xml_from_pptx
+    images/         - rendered slide PNGs
+    thumbnails/     - downsized slide PNGs
+
+Run this module directly to warm up the whole corpus:
+    python deck_store.py [--corpus-dir DIR] [--workers N] [--force] [--no-images]
+"""
+import os
+import json
+import shutil
+import hashlib
+import zipfile
+import argparse
+import threading
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from tqdm import tqdm
+from PIL import Image
+import ppt_processor
+
+# --- Configuration ---
+SCRIPT_DIR = Path(__file__).parent.resolve()
+PREPARED_DECKS_DIR = SCRIPT_DIR / "prepared_decks"
+DEFAULT_CORPUS_DIR = SCRIPT_DIR / "tsbench" / "benchmark_ppts"
+STORE_FORMAT_VERSION = 1
+THUMBNAIL_MAX_SIZE = (320, 320)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_hash_cache = {}
+_hash_cache_lock = threading.Lock()
+
+
+def compute_deck_hash(pptx_filepath):
+    """
+    Returns the SHA-256 hex digest of a deck. Results are memoized per
+    (path, size, mtime) so repeated requests for the same file do not re-read it.
+    """
+    abs_path = os.path.abspath(pptx_filepath)
+    stat = os.stat(abs_path)
+    cache_key = (abs_path, stat.st_size, stat.st_mtime_ns)
+    with _hash_cache_lock:
+        cached = _hash_cache.get(cache_key)
+    if cached:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(abs_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    deck_hash = digest.hexdigest()
+
+    with _hash_cache_lock:
+        _hash_cache[cache_key] = deck_hash
+    return deck_hash
+
+
+def _deck_dir(deck_hash):
+    return PREPARED_DECKS_DIR / deck_hash
+
+
+def _build_part_index(pptx_filepath):
+    """Lists every member of the package with its sizes and CRC."""
+    with zipfile.ZipFile(pptx_filepath, 'r') as pptx_zip:
+        return [
+            {
+                "name": info.filename,
+                "size": info.file_size,
+                "compress_size": info.compress_size,
+                "crc": info.CRC,
+                "is_xml": info.filename.endswith(('.xml', '.rels')),
+            }
+            for info in pptx_zip.infolist() if not info.is_dir()
+        ]
+
+
+def _write_thumbnails(image_paths, thumbnails_dir):
+    """Writes a downsized copy of every slide image, preserving file names."""
+    Path(thumbnails_dir).mkdir(parents=True, exist_ok=True)
+    thumbnail_paths = []
+    for image_path in image_paths:
+        target_path = Path(thumbnails_dir) / Path(image_path).name
+        with Image.open(image_path) as img:
+            img.thumbnail(THUMBNAIL_MAX_SIZE)
+            img.save(target_path, format='PNG', optimize=True)
+        thumbnail_paths.append(str(target_path))
+    return thumbnail_paths
+
+
+def get_prepared_deck(pptx_filepath, require_images=False):
+    """
+    Returns the manifest of a prepared deck (with absolute 'dir' added),
+    or None if the deck has not been prepared yet.
+    """
+    try:
+        deck_hash = compute_deck_hash(pptx_filepath)
+    except OSError:
+        return None
+    deck_dir = _deck_dir(deck_hash)
+    manifest_path = deck_dir / "manifest.json"
+    if not manifest_path.exists():
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Warning: Could not read prepared manifest {manifest_path}: {e}")
+        return None
+    if manifest.get("format_version") != STORE_FORMAT_VERSION:
+        return None
+    if require_images and not manifest.get("images"):
+        return None
+    manifest["dir"] = str(deck_dir)
+    return manifest
+
+
+def prepare_deck(pptx_filepath, render_images=True, force=False):
+    """
+    Prepares all static artifacts of a deck. Safe to call concurrently: work is
+    done in a private staging directory that is atomically renamed into place.
+    Returns the manifest dict.
+    """
+    existing = None if force else get_prepared_deck(pptx_filepath, require_images=render_images)
+    if existing:
+        existing["cached"] = True
+        return existing
+
+    deck_hash = compute_deck_hash(pptx_filepath)
+    deck_dir = _deck_dir(deck_hash)
+    staging_dir = PREPARED_DECKS_DIR / f".{deck_hash}.staging-{os.getpid()}-{time.time_ns()}"
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    timings = {}
+
+    try:
+        start = time.time()
+        json_data = ppt_processor.extract_deck_json(pptx_filepath)
+        with open(staging_dir / "deck.json", 'w', encoding='utf-8') as f:
+            json.dump(json_data, f)
+        timings["json_extraction_time_s"] = round(time.time() - start, 3)
+
+        start = time.time()
+        xml_dir = staging_dir / "xml"
+        ppt_processor.extract_xml_from_pptx(pptx_filepath, str(xml_dir))
+        part_index = _build_part_index(pptx_filepath)
+        with open(staging_dir / "parts.json", 'w', encoding='utf-8') as f:
+            json.dump(part_index, f)
+        timings["xml_extraction_time_s"] = round(time.time() - start, 3)
+
+        image_names = []
+        if render_images:
+            start = time.time()
+            image_paths = ppt_processor.export_slides_to_images(pptx_filepath, str(staging_dir / "images"))
+            timings["image_conversion_time_s"] = round(time.time() - start, 3)
+            if image_paths:
+                start = time.time()
+                _write_thumbnails(image_paths, staging_dir / "thumbnails")
+                timings["thumbnail_time_s"] = round(time.time() - start, 3)
+                image_names = [Path(p).name for p in image_paths]
+
+        manifest = {
+            "format_version": STORE_FORMAT_VERSION,
+            "deck_hash": deck_hash,
+            "source_filename": os.path.basename(pptx_filepath),
+            "prepared_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "slide_count": len(json_data.get("slides", [])),
+            "images": image_names,
+            "timings": timings,
+        }
+        with open(staging_dir / "manifest.json", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+        retired_dir = None
+        if deck_dir.exists():
+            # Moved aside and deleted after the swap, so a server reading the deck never
+            # sees it half-deleted (between the two renames it is briefly not prepared)
+            retired_dir = PREPARED_DECKS_DIR / f".{deck_hash}.retired-{os.getpid()}-{time.time_ns()}"
+            try:
+                os.replace(deck_dir, retired_dir)
+            except OSError:
+                retired_dir = None
+        try:
+            os.replace(staging_dir, deck_dir)
+        except OSError:
+            # Another worker finished the same deck first; keep its copy.
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        if retired_dir is not None:
+            shutil.rmtree(retired_dir, ignore_errors=True)
+        manifest["dir"] = str(deck_dir)
+        manifest["cached"] = False
+        return manifest
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+
+def get_deck_json_path(prepared):
+    """Path of the stored pptx_to_json output of a prepared deck."""
+    return str(Path(prepared["dir"]) / "deck.json")
+
+
+def load_deck_json(prepared):
+    """Returns the stored pptx_to_json output of a prepared deck."""
+    with open(get_deck_json_path(prepared), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_part_index(prepared):
+    """Returns the stored part index of a prepared deck."""
+    with open(Path(prepared["dir"]) / "parts.json", 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def get_xml_dir(prepared):
+    """Directory holding the extracted XML parts. Treat it as read-only."""
+    return str(Path(prepared["dir"]) / "xml")
+
+
+def list_xml_paths(prepared):
+    """Full paths of the extracted XML parts, in package order."""
+    xml_dir = Path(get_xml_dir(prepared))
+    return [
+        str(xml_dir / part["name"]) for part in load_part_index(prepared)
+        if part["is_xml"] and (xml_dir / part["name"]).exists()
+    ]
+
+
+def read_prepared_xml(prepared, xml_filename):
+    """Returns the content of one stored XML part, or None if absent."""
+    xml_path = Path(get_xml_dir(prepared)) / xml_filename.replace("\\", "/")
+    if not xml_path.is_file():
+        return None
+    return xml_path.read_text(encoding='utf-8')
+
+
+def get_slide_image_paths(prepared, thumbnails=False):
+    """Full paths of the rendered slide images (or thumbnails), sorted by slide."""
+    sub_dir = "thumbnails" if thumbnails else "images"
+    base_dir = Path(prepared["dir"]) / sub_dir
+    return [str(base_dir / name) for name in prepared.get("images", []) if (base_dir / name).exists()]
+
+
+def _prepare_deck_worker(pptx_filepath, render_images, force):
+    start = time.time()
+    manifest = prepare_deck(pptx_filepath, render_images=render_images, force=force)
+    manifest.pop("dir", None)
+    return manifest, round(time.time() - start, 3)
+
+
+def warm_up_corpus(corpus_dir=DEFAULT_CORPUS_DIR, workers=None, render_images=True, force=False):
+    """Prepares every deck in the corpus using one process per core."""
+    corpus_dir = Path(corpus_dir)
+    if not corpus_dir.exists():
+        print(f"Error: Corpus directory not found at {corpus_dir}")
+        return []
+
+    deck_paths = sorted(str(p) for p in corpus_dir.glob("*.pptx"))
+    if not deck_paths:
+        print(f"No .pptx files found in {corpus_dir}")
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    PREPARED_DECKS_DIR.mkdir(parents=True, exist_ok=True)
+    print(f"Preparing {len(deck_paths)} decks from {corpus_dir} into {PREPARED_DECKS_DIR} with {workers} workers...")
+
+    results = []
+    failures = 0
+    overall_start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        future_to_path = {
+            executor.submit(_prepare_deck_worker, path, render_images, force): path for path in deck_paths
+        }
+        for future in tqdm(as_completed(future_to_path), total=len(deck_paths), desc="Preparing Decks"):
+            path = future_to_path[future]
+            try:
+                manifest, elapsed = future.result()
+            except Exception as exc:
+                failures += 1
+                tqdm.write(f"[failed] {Path(path).name}: {exc}")
+                continue
+            status = "cached" if manifest.get("cached") else "prepared"
+            timing_text = ", ".join(f"{k}={v}" for k, v in manifest.get("timings", {}).items())
+            tqdm.write(f"[{status}] {Path(path).name} ({manifest['deck_hash'][:12]}) "
+                       f"{manifest['slide_count']} slides, {len(manifest['images'])} images in {elapsed:.3f}s ({timing_text})")
+            results.append(manifest)
+
+    print("\n--- Warm-up Summary ---")
+    print(f"Decks prepared: {len(results)} / {len(deck_paths)} (failures: {failures})")
+    print(f"Total time: {time.time() - overall_start:.2f}s")
+    print("-----------------------")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare the benchmark corpus once so requests can skip preprocessing.")
+    parser.add_argument("--corpus-dir", default=str(DEFAULT_CORPUS_DIR), help="Directory containing the benchmark .pptx decks.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: all cores).")
+    parser.add_argument("--force", action="store_true", help="Re-prepare decks even if they are already in the store.")
+    parser.add_argument("--no-images", action="store_true", help="Skip slide rendering and thumbnails.")
+    args = parser.parse_args()
+    warm_up_corpus(args.corpus_dir, workers=args.workers, render_images=not args.no_images, force=args.force)
@@ -0,0 +1,319 @@
+# --- edit_sessions.py ---
+"""
+Server-side edit sessions: a deck refined over several prompts keeps its state
+between requests instead of being re-parsed, re-extracted and re-rendered each turn.
+
+Deck versions are part store manifests (see part_store.py), so a turn that
+changes one slide stores one part; turn N reads version N-1 and writes version N.
+A session's files live in SESSIONS_DIR/<session id>/:
+    xml/                    - extracted XML of the current version
+    images/v<N>/            - slide renders of version N (only slides that were needed)
+
+and in memory: the version ids, the deck JSON of the current version, which slide
+images are valid for it, and the turn history that is passed to the LLM as context.
+
+After a turn only the changed parts are written into xml/, only the edited
+slides are re-extracted into the deck JSON, and only the edited slides are
+re-rendered. An edit to a shared part (layout, master, theme, presentation.xml)
+re-extracts the whole deck and invalidates every cached slide image.
+
+Idle sessions are evicted after SESSION_TTL_S; least recently used sessions are
+evicted when there are more than MAX_SESSIONS or when their combined disk or
+memory use is over budget. Sessions are process-local and are lost on restart.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import ppt_processor
+import slide_extractor
+import deck_store
+import part_store
+import metrics
+
+# --- Configuration ---
+SCRIPT_DIR = Path(__file__).parent.resolve()
+SESSIONS_DIR = SCRIPT_DIR / "edit_sessions"
+SESSION_TTL_S = 60 * 60
+MAX_SESSIONS = 32
+SESSION_DISK_BUDGET_BYTES = int(float(os.environ.get("PPTPILOT_SESSION_DISK_MB", 2048)) * 1024 * 1024)
+SESSION_MEMORY_BUDGET_BYTES = int(float(os.environ.get("PPTPILOT_SESSION_MEMORY_MB", 256)) * 1024 * 1024)
+# Earlier turns included in the LLM prompt
+HISTORY_TURNS_IN_PROMPT = 10
+# How long a request waits for another turn on the same session to finish
+SESSION_LOCK_TIMEOUT_S = 5
+
+
+def _dir_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class EditSession:
+    """State of one deck being edited over several turns. Turns must hold `lock`."""
+
+    def __init__(self, session_id, source_filename, session_dir):
+        self.session_id = session_id
+        self.source_filename = source_filename
+        self.dir = Path(session_dir)
+        self.xml_dir = self.dir / "xml"
+        self.created_at = self.last_used = time.time()
+        self.lock = threading.Lock()
+        self.version_ids = []
+        self.json_data = None
+        self.xml_part_names = []
+        # renderer ("libreoffice"/"fast") -> {slide number: image path} valid for the current version
+        self.slide_images = {}
+        self.turns = []
+        self.disk_bytes = 0
+        self.memory_bytes = 0
+
+    @property
+    def version(self):
+        return len(self.version_ids) - 1
+
+    @property
+    def version_id(self):
+        return self.version_ids[-1]
+
+    def deck_path(self, version=None):
+        """Assembled .pptx of a version (current by default), for tools that need a file."""
+        return part_store.materialize(self.version_ids[self.version if version is None else version])
+
+    @property
+    def current_path(self):
+        return self.deck_path()
+
+    def image_dir(self, version=None):
+        return str(self.dir / "images" / f"v{self.version if version is None else version}")
+
+    def xml_full_paths(self):
+        return [str(self.xml_dir / part_name) for part_name in self.xml_part_names]
+
+    def history(self, max_turns=HISTORY_TURNS_IN_PROMPT):
+        """Earlier turns in the form llm_handler.get_llm_response takes as session_history."""
+        return [
+            {"turn": turn["turn"], "prompt": turn["prompt"], "modified_parts": turn["modified_parts"]}
+            for turn in self.turns[-max_turns:]
+        ]
+
+    def cached_slide_images(self, renderer, slide_numbers):
+        """Images of the current version that are already rendered, by slide number."""
+        images = self.slide_images.get(renderer, {})
+        return {slide: images[slide] for slide in slide_numbers if slide in images and os.path.exists(images[slide])}
+
+    def store_slide_images(self, renderer, image_paths):
+        """Records renders of the current version so later turns can reuse them."""
+        images = self.slide_images.setdefault(renderer, {})
+        for image_path in image_paths:
+            images[ppt_processor.slide_number_from_image_path(image_path)] = image_path
+
+    def download_url(self, version=None):
+        return f"/api/sessions/{self.session_id}/versions/{self.version if version is None else version}/download"
+
+    def load(self, pptx_filepath):
+        """Initializes version 0 from a deck, reusing its prepared artifacts when available."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.version_ids = [part_store.ingest_pptx(pptx_filepath)]
+        prepared = deck_store.get_prepared_deck(pptx_filepath)
+        if prepared:
+            shutil.copytree(deck_store.get_xml_dir(prepared), self.xml_dir)
+            self.xml_part_names = [
+                Path(path).relative_to(deck_store.get_xml_dir(prepared)).as_posix()
+                for path in deck_store.list_xml_paths(prepared)
+            ]
+            self.json_data = deck_store.load_deck_json(prepared)
+            # Renderer-specific: prepared images come from LibreOffice
+            self.store_slide_images("libreoffice", deck_store.get_slide_image_paths(prepared))
+        else:
+            self.xml_part_names = [
+                Path(path).relative_to(self.xml_dir).as_posix()
+                for path in ppt_processor.extract_xml_from_pptx(pptx_filepath, self.xml_dir)
+            ]
+            self.json_data = ppt_processor.extract_deck_json(pptx_filepath)
+        self._update_sizes()
+
+    def record_turn(self, prompt, model, applied_xml_map, new_version_id=None, modified_images=None):
+        """
+        Records a finished turn. When the turn produced new_version_id (a part store
+        version derived from the current one) it becomes the current version: changed
+        parts are written into xml/, edited slides are re-extracted, and
+        modified_images ({renderer: [paths]}) become the cached renders of the edited slides.
+        """
+        edited_slides = {ppt_processor.slide_number_from_xml_path(part_name) for part_name in applied_xml_map}
+        shared_parts_changed = None in edited_slides
+        edited_slides.discard(None)
+
+        if new_version_id:
+            self.version_ids.append(new_version_id)
+            for part_name, xml_content in applied_xml_map.items():
+                (self.xml_dir / part_name).write_text(xml_content, encoding="utf-8")
+            if shared_parts_changed:
+                self.json_data = ppt_processor.extract_deck_json(self.current_path)
+                self.slide_images = {}
+            else:
+                for slide_json in slide_extractor.extract_slides_json(self.current_path, edited_slides):
+                    self.json_data["slides"][slide_json["slide_number"] - 1] = slide_json
+                for images in self.slide_images.values():
+                    for slide in edited_slides:
+                        images.pop(slide, None)
+            for renderer, image_paths in (modified_images or {}).items():
+                self.store_slide_images(renderer, image_paths)
+
+        self.turns.append({
+            "turn": len(self.turns) + 1,
+            "version": self.version,
+            "prompt": prompt,
+            "model": model,
+            "modified_parts": list(applied_xml_map) if new_version_id else [],
+            "slides_edited": sorted(edited_slides) if new_version_id else [],
+            "timestamp": time.time(),
+        })
+        self._update_sizes()
+
+    def _update_sizes(self):
+        self.disk_bytes = _dir_bytes(self.dir)
+        self.memory_bytes = len(json.dumps(self.json_data)) if self.json_data else 0
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "source_filename": self.source_filename,
+            "version": self.version,
+            "download_url": self.download_url(),
+            "versions": [
+                {"version": version, "version_id": version_id, "download_url": self.download_url(version)}
+                for version, version_id in enumerate(self.version_ids)
+            ],
+            "total_slides": len(self.json_data.get("slides", [])) if self.json_data else 0,
+            "turns": self.turns,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+            "disk_bytes": self.disk_bytes,
+            "memory_bytes": self.memory_bytes,
+        }
+
+
+class SessionManager:
+    """Process-local registry of edit sessions with TTL and LRU eviction."""
+
+    def __init__(self):
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._orphans_removed = False
+
+    def create(self, pptx_filepath, source_filename):
+        """Starts a session on a copy of the deck. Raises on extraction errors."""
+        self._remove_orphaned_dirs()
+        session_id = uuid.uuid4().hex
+        session = EditSession(session_id, source_filename, Path(SESSIONS_DIR) / session_id)
+        try:
+            session.load(pptx_filepath)
+        except Exception:
+            shutil.rmtree(session.dir, ignore_errors=True)
+            raise
+        with self._lock:
+            self._sessions[session_id] = session
+        self.evict(keep=session_id)
+        return session
+
+    def get(self, session_id):
+        """Returns a live session and marks it as recently used, or None."""
+        self.evict()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.time()
+                self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id, reason="deleted"):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        shutil.rmtree(session.dir, ignore_errors=True)
+        metrics.EDIT_SESSION_EVICTIONS.inc(reason=reason)
+        self._update_metrics()
+        return True
+
+    def live_version_ids(self):
+        """Part store versions of live sessions, which garbage collection must keep."""
+        with self._lock:
+            return {version_id for session in self._sessions.values() for version_id in session.version_ids}
+
+    def evict(self, keep=None):
+        """
+        Removes idle sessions, then least recently used ones while over MAX_SESSIONS
+        or the disk/memory budgets. Sessions in the middle of a turn are skipped.
+        """
+        now = time.time()
+        with self._lock:
+            sessions = list(self._sessions.values())  # least recently used first
+        evictions = []
+        for session in sessions:
+            if session.session_id != keep and now - session.last_used > SESSION_TTL_S:
+                evictions.append((session, "ttl"))
+        expired_ids = {session.session_id for session, _ in evictions}
+        remaining = [session for session in sessions if session.session_id not in expired_ids]
+        disk_bytes = sum(session.disk_bytes for session in remaining)
+        memory_bytes = sum(session.memory_bytes for session in remaining)
+        session_count = len(remaining)
+        # The most recently used session is never evicted for size, so one large deck still works
+        for session in remaining[:-1]:
+            if session.session_id == keep:
+                continue
+            if session_count > MAX_SESSIONS:
+                reason = "max_sessions"
+            elif disk_bytes > SESSION_DISK_BUDGET_BYTES:
+                reason = "disk_budget"
+            elif memory_bytes > SESSION_MEMORY_BUDGET_BYTES:
+                reason = "memory_budget"
+            else:
+                break
+            evictions.append((session, reason))
+            session_count -= 1
+            disk_bytes -= session.disk_bytes
+            memory_bytes -= session.memory_bytes
+        for session, reason in evictions:
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                print(f"Evicting edit session {session.session_id} ({reason})")
+                self.delete(session.session_id, reason=reason)
+            finally:
+                session.lock.release()
+        self._update_metrics()
+
+    def _remove_orphaned_dirs(self):
+        """Session directories left by an earlier process cannot be resumed."""
+        if self._orphans_removed:
+            return
+        self._orphans_removed = True
+        if not Path(SESSIONS_DIR).is_dir():
+            return
+        with self._lock:
+            live = set(self._sessions)
+        for entry in Path(SESSIONS_DIR).iterdir():
+            if entry.is_dir() and entry.name not in live:
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def _update_metrics(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        metrics.EDIT_SESSIONS_ACTIVE.set(len(sessions))
+        metrics.EDIT_SESSION_BYTES.set(sum(session.disk_bytes for session in sessions), kind="disk")
+        metrics.EDIT_SESSION_BYTES.set(sum(session.memory_bytes for session in sessions), kind="memory")
+
+
+SESSION_MANAGER = SessionManager()
@@ -3,17 +3,44 @@ import pandas as pd
 from pathlib import Path
 import llm_handler # Correctly importing the local module
 import ppt_processor
+import visual_metrics
+import deck_store
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import base64
 import shutil
 import json
+import hashlib
+import os
+import threading
+import argparse
+import html
+from PIL import Image
 
 # --- Configuration ---
 SCRIPT_DIR = Path(__file__).parent.resolve()
 BENCHMARK_RUNS_DIR = SCRIPT_DIR / "benchmark_runs"
 JUDGE_MODEL = "gemini-2.5-flash-preview-05-20"
 MAX_CONCURRENT_CALLS = 10
+# Judge results are cached across runs, keyed by everything the judge sees
+JUDGE_CACHE_DIR = BENCHMARK_RUNS_DIR / "judge_cache"
+# Longest image side sent to the judge; larger renders are downscaled before upload
+JUDGE_MAX_IMAGE_SIDE = 1024
+# Lightweight report: downsized thumbnails next to the report, paginated client-side
+REPORT_ASSETS_DIRNAME = "report_assets"
+REPORT_THUMBNAIL_SIZE = (480, 480)
+REPORT_THUMBNAIL_FORMAT = "WEBP"
+REPORT_PAGE_SIZE = 25
+REPORT_WORKERS = os.cpu_count() or 4
+
+SCORE_KEYS = ("instruction_following", "text_quality", "image_quality", "layout_quality", "color_quality")
+# Given without an API call when neither the render nor the XML changed: the edit did not
+# happen, but nothing got worse either, so the quality dimensions are left out ("unchanged")
+# and do not count in the averages
+NO_CHANGE_SCORES = {"instruction_following": 0}
+
+_judge_cache_stats = {"cached": 0, "fresh": 0, "auto_scored": 0}
+_judge_cache_stats_lock = threading.Lock()
 
 def find_latest_run_dir():
     """Finds the most recent benchmark run directory."""
@@ -27,71 +54,217 @@ def find_latest_run_dir():
     latest_run_dir = max(run_dirs, key=lambda d: d.stat().st_mtime)
     return latest_run_dir
 
-def judge_single_item(row_tuple, run_dir):
+def compute_judge_cache_key(model_id, instruction, before_img_path, after_img_path, before_xml_dict, after_xml_dict):
+    """Hashes the judge model, instruction, both images and the XML diff into a cache key."""
+    digest = hashlib.sha256()
+    for part in (model_id, instruction):
+        digest.update(part.encode('utf-8'))
+        digest.update(b"\0")
+    for img_path in (before_img_path, after_img_path):
+        with open(img_path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    xml_diff = json.dumps({"before": before_xml_dict, "after": after_xml_dict}, sort_keys=True)
+    digest.update(xml_diff.encode('utf-8'))
+    return digest.hexdigest()
+
+def load_cached_judgment(cache_key):
+    """Returns a previously stored judge result, or None."""
+    cache_path = JUDGE_CACHE_DIR / f"{cache_key}.json"
+    if not cache_path.exists():
+        return None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Warning: Ignoring unreadable judge cache entry {cache_path}: {e}")
+        return None
+
+def store_cached_judgment(cache_key, judge_result):
+    """Atomically stores a successful judge result."""
+    JUDGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cache_path = JUDGE_CACHE_DIR / f"{cache_key}.json"
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(judge_result, f)
+    os.replace(tmp_path, cache_path)
+
+def _record_judge_cache_stat(kind):
+    with _judge_cache_stats_lock:
+        _judge_cache_stats[kind] += 1
+
+def _parse_modified_files(row):
+    """The 'modified_xml_files' column is a string representation of a list."""
+    try:
+        return json.loads(row.get('modified_xml_files', '[]').replace("'", '"'))
+    except json.JSONDecodeError:
+        return []
+
+def plan_item_judging(row_tuple, run_dir):
     """
-    Finds pre-generated images and calls the LLM judge.
+    Maps an item's modified XML files to slide numbers and returns one judge task
+    per edited slide. Returns (index, tasks, None) or (index, [], error_result).
+    When only non-slide parts (layouts, masters, theme) changed, every slide is judged.
     """
     index, row = row_tuple
 
     if not row.get('success', False) or not isinstance(row.get('before_images_path'), str) or not isinstance(row.get('after_images_path'), str):
-        return index, {"status": "Skipped - Run not successful or image paths missing"}
+        return index, [], {"status": "Skipped - Run not successful or image paths missing"}
 
-    try:
-        before_img_dir = run_dir / row['before_images_path']
-        after_img_dir = run_dir / row['after_images_path']
+    before_images = ppt_processor.map_slide_images(run_dir / row['before_images_path'])
+    if not before_images:
+        return index, [], {"error": f"Before images not found in {run_dir / row['before_images_path']}", "status": "Error"}
+    after_images = ppt_processor.map_slide_images(run_dir / row['after_images_path'])
+    if not after_images:
+        return index, [], {"error": f"After images not found in {run_dir / row['after_images_path']}", "status": "Error"}
 
-        before_img_candidates = list(before_img_dir.glob("*.png"))
-        if not before_img_candidates:
-            return index, {"error": f"Before image not found in {before_img_dir}", "status": "Error"}
-        
-        after_img_candidates = list(after_img_dir.glob("*.png"))
-        if not after_img_candidates:
-            return index, {"error": f"After image not found in {after_img_dir}", "status": "Error"}
+    # ---> ADD XML EXTRACTION LOGIC <---
+    before_ppt_path = run_dir / row['before_ppt_path']
+    after_ppt_path = run_dir / row['output_pptx_path']
+    modified_files_list = _parse_modified_files(row)
 
-        before_img_path = before_img_candidates[0]
-        generated_img_path = after_img_candidates[0]
-        
-        # ---> ADD XML EXTRACTION LOGIC <---
-        before_ppt_path = run_dir / row['before_ppt_path']
-        after_ppt_path = run_dir / row['output_pptx_path']
-        
-        # The 'modified_xml_files' column is a string representation of a list
-        # Use json.loads to safely parse it back into a Python list
-        try:
-            modified_files_list = json.loads(row.get('modified_xml_files', '[]').replace("'", '"'))
-        except json.JSONDecodeError:
-            modified_files_list = []
+    before_xml_content = {}
+    after_xml_content = {}
+    if modified_files_list:
+        prepared_before_deck = deck_store.get_prepared_deck(before_ppt_path)
+        for xml_file in modified_files_list:
+            if prepared_before_deck:
+                before_xml = deck_store.read_prepared_xml(prepared_before_deck, xml_file)
+            else:
+                before_xml = ppt_processor.extract_specific_xml_from_pptx(str(before_ppt_path), xml_file)
+            after_xml = ppt_processor.extract_specific_xml_from_pptx(str(after_ppt_path), xml_file)
+            if before_xml and after_xml:
+                before_xml_content[xml_file] = before_xml
+                after_xml_content[xml_file] = after_xml
 
-        before_xml_content = {}
-        after_xml_content = {}
+    slide_xml_files = {}
+    for xml_file in modified_files_list:
+        slide_number = ppt_processor.slide_number_from_xml_path(xml_file)
+        if slide_number is not None:
+            slide_xml_files[slide_number] = xml_file
+    shared_xml_files = [f for f in before_xml_content if f not in slide_xml_files.values()]
+
+    slide_numbers = sorted(slide_xml_files) or sorted(before_images)
+    tasks = []
+    missing = []
+    for slide_number in slide_numbers:
+        if slide_number not in before_images or slide_number not in after_images:
+            missing.append(slide_number)
+            continue
+        # Each slide sees its own XML diff plus any shared parts that changed
+        xml_files_for_slide = shared_xml_files + [f for f in [slide_xml_files.get(slide_number)] if f in before_xml_content]
+        tasks.append({
+            "index": index,
+            "slide_number": slide_number,
+            "instruction": row['instruction'],
+            "before_img_path": before_images[slide_number],
+            "after_img_path": after_images[slide_number],
+            "before_xml_dict": {f: before_xml_content[f] for f in xml_files_for_slide},
+            "after_xml_dict": {f: after_xml_content[f] for f in xml_files_for_slide},
+        })
+
+    if not tasks:
+        return index, [], {"error": f"No rendered images for edited slides {missing}", "status": "Error"}
+    if missing:
+        print(f"Warning: {row['id']}: no rendered images for edited slides {missing}; judging {len(tasks)} slide(s).")
+    return index, tasks, None
+
+def judge_single_slide(task):
+    """
+    Judges one edited slide: local pre-filter, then the judge cache, then the LLM judge.
+    """
+    try:
+        # ---> CHEAP LOCAL PRE-FILTER <---
+        visual_diff = visual_metrics.compute_visual_metrics(task["before_img_path"], task["after_img_path"])
+        local_metrics = {
+            "pixel_diff_ratio": visual_diff["pixel_diff_ratio"],
+            "mean_abs_diff": visual_diff["mean_abs_diff"],
+            "ssim": visual_diff["ssim"],
+            "changed_regions": visual_diff["changed_regions"],
+        }
+        # An edit can be correct without showing (speaker notes, alt text, hidden shapes), so the
+        # judge is only skipped when the XML it would see did not change either
+        if visual_diff["no_visual_change"] and task["before_xml_dict"] == task["after_xml_dict"]:
+            _record_judge_cache_stat("auto_scored")
+            return {**NO_CHANGE_SCORES, **local_metrics, "status": "Success",
+                    "auto_scored": True, "cache_hit": False}
+
+        cache_key = compute_judge_cache_key(
+            f"{JUDGE_MODEL}@{JUDGE_MAX_IMAGE_SIDE}px", task["instruction"],
+            task["before_img_path"], task["after_img_path"],
+            task["before_xml_dict"], task["after_xml_dict"]
+        )
+        cached_result = load_cached_judgment(cache_key)
+        if cached_result is not None:
+            _record_judge_cache_stat("cached")
+            cached_result.update(local_metrics)
+            cached_result['status'] = 'Success'
+            cached_result['auto_scored'] = False
+            cached_result['cache_hit'] = True
+            return cached_result
 
-        if modified_files_list:
-            # print(f"\\nExtracting XML diffs for {row['id']}...")
-            for xml_file in modified_files_list:
-                before_xml = ppt_processor.extract_specific_xml_from_pptx(str(before_ppt_path), xml_file)
-                after_xml = ppt_processor.extract_specific_xml_from_pptx(str(after_ppt_path), xml_file)
-                if before_xml and after_xml:
-                    before_xml_content[xml_file] = before_xml
-                    after_xml_content[xml_file] = after_xml
-        
         # ---> UPDATE THE JUDGE CALL <---
         judge_result = llm_handler.call_llm_judge(
-            instruction=row['instruction'],
-            before_img_path=str(before_img_path),
-            after_img_path=str(generated_img_path),
-            before_xml_dict=before_xml_content, # <-- Pass before XML
-            after_xml_dict=after_xml_content,   # <-- Pass after XML
-            model_id=JUDGE_MODEL
+            instruction=task["instruction"],
+            before_img_path=str(task["before_img_path"]),
+            after_img_path=str(task["after_img_path"]),
+            before_xml_dict=task["before_xml_dict"], # <-- Pass before XML
+            after_xml_dict=task["after_xml_dict"],   # <-- Pass after XML
+            model_id=JUDGE_MODEL,
+            visual_diff=visual_diff,
+            max_image_side=JUDGE_MAX_IMAGE_SIDE
         )
+        _record_judge_cache_stat("fresh")
 
         if 'error' in judge_result:
-            return index, {"status": "Error", "error": judge_result.pop("error")}
-        else:
-            judge_result['status'] = 'Success'
-        return index, judge_result
+            return {"status": "Error", "error": judge_result.pop("error"), **local_metrics}
+        store_cached_judgment(cache_key, judge_result)
+        judge_result.update(local_metrics)
+        judge_result['status'] = 'Success'
+        judge_result['auto_scored'] = False
+        judge_result['cache_hit'] = False
+        return judge_result
 
     except Exception as e:
-        return index, {"error": f"An unexpected error occurred in judging framework: {e}", "status": "Error"}
+        return {"error": f"An unexpected error occurred in judging framework: {e}", "status": "Error"}
+
+def aggregate_slide_judgments(slide_results):
+    """
+    Combines per-slide judgments ({slide_number: result}) into one item-level result:
+    scores are averaged over successfully judged slides, local metrics keep the worst case.
+    """
+    succeeded = {n: r for n, r in slide_results.items() if r.get("status") == "Success"}
+    failed = {n: r for n, r in slide_results.items() if r.get("status") != "Success"}
+
+    aggregated = {
+        "slides_judged": len(succeeded),
+        "slide_numbers": json.dumps(sorted(slide_results)),
+        "per_slide": json.dumps({
+            str(n): {k: v for k, v in r.items() if k in SCORE_KEYS or k in ("status", "error", "ssim")}
+            for n, r in sorted(slide_results.items())
+        }),
+    }
+    for score_key in SCORE_KEYS:
+        values = [r[score_key] for r in succeeded.values() if isinstance(r.get(score_key), (int, float))]
+        if values:
+            aggregated[score_key] = round(sum(values) / len(values), 3)
+
+    metric_results = [r for r in slide_results.values() if "ssim" in r]
+    if metric_results:
+        aggregated["pixel_diff_ratio"] = max(r["pixel_diff_ratio"] for r in metric_results)
+        aggregated["mean_abs_diff"] = max(r["mean_abs_diff"] for r in metric_results)
+        aggregated["ssim"] = min(r["ssim"] for r in metric_results)
+        aggregated["changed_regions"] = json.dumps({str(n): r["changed_regions"] for n, r in sorted(slide_results.items()) if "changed_regions" in r})
+
+    if succeeded:
+        aggregated["status"] = "Success"
+        aggregated["auto_scored"] = all(r.get("auto_scored") for r in succeeded.values())
+        llm_judged = [r for r in succeeded.values() if not r.get("auto_scored")]
+        aggregated["cache_hit"] = bool(llm_judged) and all(r.get("cache_hit") for r in llm_judged)
+    else:
+        aggregated["status"] = "Error"
+    if failed:
+        aggregated["error"] = "; ".join(f"slide {n}: {r.get('error', r.get('status'))}" for n, r in sorted(failed.items()))
+    return aggregated
 
 def image_to_base64(image_path):
     """Converts an image file to a base64 string for embedding in HTML."""
@@ -144,11 +317,15 @@ def generate_html_report(df, html_output_path, run_dir):
             if row.get('judge_status') == 'Success':
                 scores_html += "<div class='scores'>"
                 # --- FIX: Changed keys to snake_case to match JSON from LLM Judge ---
-                scores_html += f"<span>Instr: {row.get('judge_instruction_following', '?')}</span>"
-                scores_html += f"<span>Text: {row.get('judge_text_quality', '?')}</span>"
-                scores_html += f"<span>Image: {row.get('judge_image_quality', '?')}</span>"
-                scores_html += f"<span>Layout: {row.get('judge_layout_quality', '?')}</span>"
-                scores_html += f"<span>Color: {row.get('judge_color_quality', '?')}</span>"
+                missing = 'unchanged' if str(row.get('judge_auto_scored', '')) == 'True' else '?'
+                def shown(key):
+                    value = row.get(key, '')
+                    return missing if value == '' or pd.isna(value) else value
+                scores_html += f"<span>Instr: {shown('judge_instruction_following')}</span>"
+                scores_html += f"<span>Text: {shown('judge_text_quality')}</span>"
+                scores_html += f"<span>Image: {shown('judge_image_quality')}</span>"
+                scores_html += f"<span>Layout: {shown('judge_layout_quality')}</span>"
+                scores_html += f"<span>Color: {shown('judge_color_quality')}</span>"
                 scores_html += "</div>"
             elif row.get('judge_status') in ['Error', 'Skipped', 'Framework Error']:
                 error_msg = row.get('judge_error', 'Evaluation Skipped')
@@ -193,9 +370,261 @@ def generate_html_report(df, html_output_path, run_dir):
         f.write(final_html)
     print(f"\nGenerated HTML report: {html_output_path}")
 
-def evaluate_latest_run():
+def _report_thumbnail(image_path, assets_dir):
+    """
+    Writes (or reuses) a downsized copy of an image under assets_dir and returns its path.
+    Thumbnails are named by source path, size and mtime so unchanged images are not redone.
+    """
+    image_path = Path(image_path)
+    stat = image_path.stat()
+    name_key = f"{image_path.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{REPORT_THUMBNAIL_SIZE}"
+    thumb_path = assets_dir / f"{hashlib.sha1(name_key.encode('utf-8')).hexdigest()}.{REPORT_THUMBNAIL_FORMAT.lower()}"
+    if not thumb_path.exists():
+        with Image.open(image_path) as img:
+            img = img.convert('RGB')
+            img.thumbnail(REPORT_THUMBNAIL_SIZE)
+            tmp_path = thumb_path.with_suffix(f".{threading.get_ident()}.tmp")
+            img.save(tmp_path, format=REPORT_THUMBNAIL_FORMAT, quality=80)
+            os.replace(tmp_path, thumb_path)
+    return thumb_path
+
+def _build_report_row(row, run_dir, assets_dir):
+    """Collects the display data of one result row, creating slide thumbnails as needed."""
+    def score(key):
+        value = row.get(f'judge_{key}', '')
+        try:
+            return None if value == '' or pd.isna(value) else float(value)
+        except (TypeError, ValueError):
+            return None
+
+    entry = {
+        "id": str(row['id']),
+        "instruction": str(row['instruction']),
+        "success": bool(row['success']) and str(row['success']) != 'False',
+        "model": str(row.get('llm_engine', '') or 'unknown'),
+        "error_message": str(row.get('error_message', '') or ''),
+        "judge_status": str(row.get('judge_status', '') or ''),
+        "judge_error": str(row.get('judge_error', '') or ''),
+        "scores": {key: score(key) for key in SCORE_KEYS},
+        "auto_scored": str(row.get('judge_auto_scored', '')) == 'True',
+        "ssim": score('ssim'),
+        "slides": [],
+    }
+    if not entry["success"]:
+        return entry
+
+    before_images = ppt_processor.map_slide_images(run_dir / str(row.get('before_images_path', '')))
+    after_images = ppt_processor.map_slide_images(run_dir / str(row.get('after_images_path', '')))
+    try:
+        slide_numbers = json.loads(row.get('judge_slide_numbers') or '[]')
+    except (TypeError, json.JSONDecodeError):
+        slide_numbers = []
+    if not slide_numbers:
+        slide_numbers = sorted(n for n in (ppt_processor.slide_number_from_xml_path(f) for f in _parse_modified_files(row)) if n)
+    if not slide_numbers:
+        slide_numbers = sorted(after_images)[:1]
+
+    for slide_number in slide_numbers:
+        slide = {"slide_number": slide_number}
+        for side, images in (("before", before_images), ("after", after_images)):
+            image_path = images.get(slide_number)
+            if image_path:
+                slide[f"{side}_full"] = Path(os.path.relpath(image_path, run_dir)).as_posix()
+                slide[f"{side}_thumb"] = Path(os.path.relpath(_report_thumbnail(image_path, assets_dir), run_dir)).as_posix()
+        entry["slides"].append(slide)
+    return entry
+
+def generate_lite_html_report(df, html_output_path, run_dir):
+    """
+    Generates a small, paginated HTML report. Slide images are referenced as cached
+    thumbnails in report_assets/ next to the report; full renders load only on click.
+    """
+    assets_dir = Path(html_output_path).parent / REPORT_ASSETS_DIRNAME
+    assets_dir.mkdir(parents=True, exist_ok=True)
+
+    rows = list(df.iterrows())
+    entries = [None] * len(rows)
+    with ThreadPoolExecutor(max_workers=REPORT_WORKERS) as executor:
+        future_to_position = {
+            executor.submit(_build_report_row, row, run_dir, assets_dir): position
+            for position, (_, row) in enumerate(rows)
+        }
+        for future in tqdm(as_completed(future_to_position), total=len(rows), desc="Building Report"):
+            position = future_to_position[future]
+            try:
+                entries[position] = future.result()
+            except Exception as exc:
+                _, row = rows[position]
+                print(f"Warning: Could not build report row for {row['id']}: {exc}")
+                entries[position] = {"id": str(row['id']), "instruction": str(row['instruction']), "success": False,
+                                     "model": "unknown", "error_message": f"Report error: {exc}", "judge_status": "",
+                                     "judge_error": "", "scores": {}, "ssim": None, "slides": []}
+
+    # Keep the embedded JSON from terminating the <script> element early
+    rows_json = json.dumps(entries).replace("</", "<\\/")
+    final_html = LITE_REPORT_TEMPLATE.replace("__RUN_DIR_NAME__", html.escape(run_dir.name)) \
+                                     .replace("__PAGE_SIZE__", str(REPORT_PAGE_SIZE)) \
+                                     .replace("__ROWS_JSON__", rows_json)
+    with open(html_output_path, 'w', encoding='utf-8') as f:
+        f.write(final_html)
+    print(f"\nGenerated HTML report: {html_output_path} (thumbnails in {assets_dir})")
+
+LITE_REPORT_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Benchmark Evaluation Report</title>
+    <style>
+        body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; margin: 2em; background-color: #f8f9fa; color: #212529; }
+        h1 { color: #343a40; border-bottom: 2px solid #dee2e6; padding-bottom: 0.5em; }
+        h2 { color: #495057; margin: 0; font-size: 1.2em; }
+        .run-info, .filters { background: #e9ecef; padding: 1em; border-radius: 8px; margin-bottom: 1em; border: 1px solid #dee2e6; }
+        .filters label { margin-right: 1em; }
+        .filters input { width: 4em; }
+        .result-card { border: 1px solid #dee2e6; border-radius: 8px; padding: 1em 1.5em; margin-bottom: 1em; background: #ffffff; }
+        .card-header { display: flex; justify-content: space-between; align-items: center; margin-bottom: 0.5em; }
+        .prompt { font-weight: bold; background-color: #f1f3f5; padding: 0.5em 0.75em; border-radius: 4px; margin-bottom: 0.5em; }
+        .slides { display: grid; grid-template-columns: repeat(auto-fill, minmax(640px, 1fr)); gap: 1em; }
+        .slide-pair { display: grid; grid-template-columns: 1fr 1fr; gap: 0.5em; text-align: center; font-size: 0.85em; }
+        .slide-pair img { max-width: 100%; height: auto; border: 1px solid #ced4da; border-radius: 4px; cursor: zoom-in; }
+        .scores { font-size: 0.9em; font-weight: bold; display: flex; gap: 1em; white-space: nowrap; }
+        .success { color: #28a745; font-weight: bold; }
+        .failure { color: #dc3545; font-weight: bold; }
+        .error { font-family: "SF Mono", "Menlo", "Consolas", monospace; color: #dc3545; background: #f8d7da; padding: 0.5em; border-radius: 4px; white-space: pre-wrap; word-wrap: break-word; }
+        .pager { margin: 1em 0; display: flex; gap: 1em; align-items: center; }
+        #overlay { display: none; position: fixed; inset: 0; background: rgba(0,0,0,0.8); align-items: center; justify-content: center; cursor: zoom-out; }
+        #overlay img { max-width: 95vw; max-height: 95vh; background: white; }
+    </style>
+</head>
+<body>
+    <h1>Benchmark Evaluation Report</h1>
+    <div class="run-info"><strong>Run Directory:</strong> __RUN_DIR_NAME__ &mdash; <span id="count"></span></div>
+    <div class="filters">
+        <label>Status <select id="f-status">
+            <option value="">All</option><option value="success">Run succeeded</option>
+            <option value="failure">Run failed</option><option value="judge-error">Judge error</option>
+        </select></label>
+        <label>Model <select id="f-model"><option value="">All</option></select></label>
+        <label>Instruction score <input id="f-min" type="number" min="0" max="5" step="0.5" value="0"> to
+            <input id="f-max" type="number" min="0" max="5" step="0.5" value="5"></label>
+    </div>
+    <div class="pager"><button id="prev">&larr; Prev</button><span id="page"></span><button id="next">Next &rarr;</button></div>
+    <div id="rows"></div>
+    <div class="pager"><button id="prev2">&larr; Prev</button><button id="next2">Next &rarr;</button></div>
+    <div id="overlay"><img alt="Full-size slide"></div>
+    <script id="report-data" type="application/json">__ROWS_JSON__</script>
+    <script>
+        const ROWS = JSON.parse(document.getElementById('report-data').textContent);
+        const PAGE_SIZE = __PAGE_SIZE__;
+        let page = 0;
+
+        const models = [...new Set(ROWS.map(r => r.model))].sort();
+        const modelSelect = document.getElementById('f-model');
+        models.forEach(m => { const o = document.createElement('option'); o.value = m; o.textContent = m; modelSelect.appendChild(o); });
+
+        function el(tag, attrs, text) {
+            const e = document.createElement(tag);
+            Object.entries(attrs || {}).forEach(([k, v]) => e.setAttribute(k, v));
+            if (text !== undefined) e.textContent = text;
+            return e;
+        }
+
+        function filteredRows() {
+            const status = document.getElementById('f-status').value;
+            const model = modelSelect.value;
+            const min = parseFloat(document.getElementById('f-min').value);
+            const max = parseFloat(document.getElementById('f-max').value);
+            return ROWS.filter(r => {
+                if (status === 'success' && !r.success) return false;
+                if (status === 'failure' && r.success) return false;
+                if (status === 'judge-error' && !(r.judge_status && r.judge_status !== 'Success')) return false;
+                if (model && r.model !== model) return false;
+                const score = r.scores.instruction_following;
+                if ((min > 0 || max < 5) && (score === null || score === undefined || score < min || score > max)) return false;
+                return true;
+            });
+        }
+
+        function renderRow(r) {
+            const card = el('div', {class: 'result-card'});
+            const header = el('div', {class: 'card-header'});
+            header.appendChild(el('h2', {}, `Prompt ID: ${r.id} (${r.model})`));
+            if (r.judge_status === 'Success') {
+                const scores = el('div', {class: 'scores'});
+                [['Instr', 'instruction_following'], ['Text', 'text_quality'], ['Image', 'image_quality'],
+                 ['Layout', 'layout_quality'], ['Color', 'color_quality']].forEach(([label, key]) => {
+                    const v = r.scores[key];
+                    const missing = r.auto_scored ? 'unchanged' : '?';
+                    scores.appendChild(el('span', {}, `${label}: ${v === null || v === undefined ? missing : v}`));
+                });
+                if (r.ssim !== null) scores.appendChild(el('span', {}, `SSIM: ${r.ssim}`));
+                header.appendChild(scores);
+            } else if (r.judge_status) {
+                header.appendChild(el('div', {class: 'error'}, `Judge Status: ${r.judge_status}: ${r.judge_error}`));
+            }
+            card.appendChild(header);
+            card.appendChild(el('div', {class: 'prompt'}, `Instruction: ${r.instruction}`));
+            const status = el('p', {});
+            status.appendChild(el('strong', {}, 'Status: '));
+            status.appendChild(el('span', {class: r.success ? 'success' : 'failure'}, r.success ? 'Success' : 'Failure'));
+            card.appendChild(status);
+            if (!r.success && r.error_message) card.appendChild(el('div', {class: 'error'}, `Error Message: ${r.error_message}`));
+
+            const slides = el('div', {class: 'slides'});
+            r.slides.forEach(s => {
+                const pair = el('div', {class: 'slide-pair'});
+                ['before', 'after'].forEach(side => {
+                    const cell = el('div', {});
+                    cell.appendChild(el('div', {}, `${side === 'before' ? 'Before' : 'After'} - Slide ${s.slide_number}`));
+                    if (s[side + '_thumb']) {
+                        const img = el('img', {src: s[side + '_thumb'], loading: 'lazy', alt: `${side} slide ${s.slide_number}`});
+                        img.dataset.full = s[side + '_full'];
+                        cell.appendChild(img);
+                    } else {
+                        cell.appendChild(el('p', {}, 'Image not generated.'));
+                    }
+                    pair.appendChild(cell);
+                });
+                slides.appendChild(pair);
+            });
+            card.appendChild(slides);
+            return card;
+        }
+
+        function render() {
+            const rows = filteredRows();
+            const pages = Math.max(1, Math.ceil(rows.length / PAGE_SIZE));
+            page = Math.min(page, pages - 1);
+            const container = document.getElementById('rows');
+            container.replaceChildren(...rows.slice(page * PAGE_SIZE, (page + 1) * PAGE_SIZE).map(renderRow));
+            document.getElementById('page').textContent = `Page ${page + 1} / ${pages}`;
+            document.getElementById('count').textContent = `${rows.length} of ${ROWS.length} rows shown`;
+        }
+
+        ['f-status', 'f-model', 'f-min', 'f-max'].forEach(id => document.getElementById(id).addEventListener('change', () => { page = 0; render(); }));
+        ['prev', 'prev2'].forEach(id => document.getElementById(id).addEventListener('click', () => { page = Math.max(0, page - 1); render(); window.scrollTo(0, 0); }));
+        ['next', 'next2'].forEach(id => document.getElementById(id).addEventListener('click', () => { page += 1; render(); window.scrollTo(0, 0); }));
+
+        const overlay = document.getElementById('overlay');
+        document.getElementById('rows').addEventListener('click', e => {
+            if (e.target.tagName === 'IMG' && e.target.dataset.full) {
+                overlay.querySelector('img').src = e.target.dataset.full;
+                overlay.style.display = 'flex';
+            }
+        });
+        overlay.addEventListener('click', () => { overlay.style.display = 'none'; overlay.querySelector('img').removeAttribute('src'); });
+        render();
+    </script>
+</body>
+</html>
+"""
+
+def evaluate_latest_run(report_mode="lite"):
     """
     Finds the latest benchmark run, judges results, and saves an evaluated CSV and HTML report.
+    report_mode: "lite" writes a paginated report with thumbnails in report_assets/,
+    "embedded" writes the self-contained report with full-size base64 images.
     """
     latest_run_dir = find_latest_run_dir()
     if not latest_run_dir:
@@ -221,18 +650,35 @@ def evaluate_latest_run():
     print(f"Using {JUDGE_MODEL} as the judge with up to {MAX_CONCURRENT_CALLS} concurrent calls.")
 
     scores = [{} for _ in range(len(df))]
-    
+
+    # Plan every edited slide of every item, then judge them all through one bounded pool
+    all_tasks = []
+    slide_results_by_index = {}
+    for row_tuple in successful_runs.iterrows():
+        try:
+            index, tasks, error_result = plan_item_judging(row_tuple, latest_run_dir)
+        except Exception as exc:
+            index, tasks, error_result = row_tuple[0], [], {"error": str(exc), "status": "Framework Error"}
+        if error_result is not None:
+            scores[index] = error_result
+            continue
+        slide_results_by_index[index] = {}
+        all_tasks.extend(tasks)
+
+    print(f"Judging {len(all_tasks)} edited slides across {len(slide_results_by_index)} items.")
     with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CALLS) as executor:
-        tasks = [(row, latest_run_dir) for row in successful_runs.iterrows()]
-        future_to_index = {executor.submit(judge_single_item, *task): task[0][0] for task in tasks}
-        
-        for future in tqdm(as_completed(future_to_index), total=len(tasks), desc="Judging Slides"):
-            index = future_to_index[future]
+        future_to_task = {executor.submit(judge_single_slide, task): task for task in all_tasks}
+
+        for future in tqdm(as_completed(future_to_task), total=len(all_tasks), desc="Judging Slides"):
+            task = future_to_task[future]
             try:
-                _, data = future.result()
-                scores[index] = data
+                data = future.result()
             except Exception as exc:
-                scores[index] = {"error": str(exc), "status": "Framework Error"}
+                data = {"error": str(exc), "status": "Framework Error"}
+            slide_results_by_index[task["index"]][task["slide_number"]] = data
+
+    for index, slide_results in slide_results_by_index.items():
+        scores[index] = aggregate_slide_judgments(slide_results)
 
     scores_df = pd.DataFrame(scores)
     if not scores_df.empty:
@@ -243,8 +689,17 @@ def evaluate_latest_run():
     
     evaluated_df.to_csv(evaluated_csv_path, index=False)
     print(f"\nEvaluation complete. Full results with scores saved to {evaluated_csv_path}")
+    print(f"Judge cache: {_judge_cache_stats['cached']} cached, {_judge_cache_stats['fresh']} fresh judgments, "
+          f"{_judge_cache_stats['auto_scored']} auto-scored without visual or XML change (cache dir: {JUDGE_CACHE_DIR})")
 
-    generate_html_report(evaluated_df, html_report_path, latest_run_dir)
+    if report_mode == "embedded":
+        generate_html_report(evaluated_df, html_report_path, latest_run_dir)
+    else:
+        generate_lite_html_report(evaluated_df.fillna(''), html_report_path, latest_run_dir)
 
 if __name__ == "__main__":
-    evaluate_latest_run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Judge the latest benchmark run and write an HTML report.")
+    parser.add_argument("--report", choices=["lite", "embedded"], default="lite",
+                        help="'lite': paginated report with thumbnails (default); 'embedded': single self-contained HTML file.")
+    args = parser.parse_args()
+    evaluate_latest_run(report_mode=args.report)
\ No newline at end of file
@@ -0,0 +1,126 @@
+# --- image_variants.py ---
+"""
+Content-addressed slide image store. Rendered slides are registered by the sha256
+of their bytes, and size/format variants are generated on first request and cached
+on disk. Since a URL names the content, responses can be cached forever by the
+browser (see the /images route in app.py).
+
+Layout:
+    image_cache/<hash[:2]>/<hash>/source.png
+    image_cache/<hash[:2]>/<hash>/<variant>.<format>
+"""
+import os
+import re
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from PIL import Image
+import metrics
+
+# --- Configuration ---
+SCRIPT_DIR = Path(__file__).parent.resolve()
+IMAGE_CACHE_DIR = SCRIPT_DIR / "image_cache"
+# Variant name -> bounding box (None keeps the rendered size)
+VARIANT_SIZES = {
+    "thumbnail": (320, 320),
+    "preview": (1280, 1280),
+    "full": None,
+}
+FORMATS = {"webp": ("WEBP", "image/webp"), "png": ("PNG", "image/png")}
+WEBP_QUALITY = 82
+CONTENT_HASH_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+_hash_memo = {}
+_hash_memo_lock = threading.Lock()
+
+
+def content_hash(image_path):
+    """sha256 of a file's bytes, memoized by (path, size, mtime)."""
+    stat = os.stat(image_path)
+    memo_key = (str(Path(image_path).resolve()), stat.st_size, stat.st_mtime_ns)
+    with _hash_memo_lock:
+        cached = _hash_memo.get(memo_key)
+    if cached:
+        return cached
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()
+    with _hash_memo_lock:
+        _hash_memo[memo_key] = value
+    return value
+
+
+def _image_dir(image_hash):
+    return IMAGE_CACHE_DIR / image_hash[:2] / image_hash
+
+
+def register_image(image_path):
+    """Adds a rendered slide to the store and returns its content hash."""
+    image_hash = content_hash(image_path)
+    source_path = _image_dir(image_hash) / "source.png"
+    if not source_path.exists():
+        source_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = source_path.with_suffix(f".{threading.get_ident()}.tmp")
+        # A copy, not a hard link: renderers overwrite slide PNGs in place
+        shutil.copyfile(image_path, tmp_path)
+        os.replace(tmp_path, source_path)
+    else:
+        # Marks the entry as recently used for disk-quota eviction (see storage_gc.py)
+        os.utime(source_path.parent)
+    return image_hash
+
+
+def variant_url(image_hash, variant, image_format):
+    return f"/images/{image_hash}/{variant}.{image_format}"
+
+
+def image_variant_urls(image_path):
+    """Registers an image and returns the URLs of its variants."""
+    image_hash = register_image(image_path)
+    return {
+        "thumbnail": variant_url(image_hash, "thumbnail", "webp"),
+        "preview": variant_url(image_hash, "preview", "webp"),
+        "full": variant_url(image_hash, "full", "png"),
+    }
+
+
+def is_valid_request(image_hash, variant, image_format):
+    return bool(CONTENT_HASH_PATTERN.fullmatch(image_hash)) and variant in VARIANT_SIZES and image_format in FORMATS
+
+
+def get_variant(image_hash, variant, image_format):
+    """
+    Returns (path, mimetype) of a variant, generating it on first use, or None when
+    the image is not in the store.
+    """
+    image_dir = _image_dir(image_hash)
+    source_path = image_dir / "source.png"
+    if not source_path.exists():
+        return None
+    try:
+        os.utime(image_dir)
+    except OSError:
+        pass
+    pil_format, mimetype = FORMATS[image_format]
+    if variant == "full" and image_format == "png":
+        metrics.IMAGE_VARIANT_REQUESTS.inc(variant=variant, result="hit")
+        return source_path, mimetype
+
+    variant_path = image_dir / f"{variant}.{image_format}"
+    if variant_path.exists():
+        metrics.IMAGE_VARIANT_REQUESTS.inc(variant=variant, result="hit")
+        return variant_path, mimetype
+
+    with Image.open(source_path) as img:
+        img = img.convert("RGB")
+        if VARIANT_SIZES[variant]:
+            img.thumbnail(VARIANT_SIZES[variant], Image.LANCZOS)
+        tmp_path = variant_path.with_suffix(f".{threading.get_ident()}.tmp")
+        save_options = {"quality": WEBP_QUALITY, "method": 4} if pil_format == "WEBP" else {"optimize": True}
+        img.save(tmp_path, format=pil_format, **save_options)
+    os.replace(tmp_path, variant_path)
+    metrics.IMAGE_VARIANT_REQUESTS.inc(variant=variant, result="generated")
+    return variant_path, mimetype
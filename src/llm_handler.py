@@ -1,6 +1,8 @@
 # --- llm_handler.py ---
 import json
 import os
+import asyncio
+from contextlib import contextmanager
 import openai
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold # For safety settings
@@ -9,10 +11,23 @@ import time # <--- Added for timing
 from pathlib import Path # Added for Path operations
 import base64 # For image encoding
 from PIL import Image
+import visual_metrics
+import metrics
+import tracing
+import cpu_pool
+import progress
+import deadlines
 
 # --- Configuration & API Key Loading ---
 CREDENTIALS_FILE = "credentials.env" 
 API_KEYS = {}
+# Larger images are sent to Gemini through the File API (streamed from disk) instead of inline bytes
+GEMINI_INLINE_IMAGE_MAX_BYTES = 4 * 1024 * 1024
+# Model id substrings of families that accept image input
+VISION_MODEL_FAMILIES = ("gpt-4o", "gpt-4-turbo", "vision", "gemini-1.5",
+                         "gemini-2.0-flash-preview-image-generation", "gemini-2.5")
+# Provider call timeout (the OpenAI client's default), capped by the request deadline (see deadlines.py)
+LLM_TIMEOUT_S = 600
 
 def load_api_keys():
     """Loads API keys from credentials.env"""
@@ -37,6 +52,11 @@ def load_api_keys():
             API_KEYS = {} 
     return API_KEYS
 
+def _image_data_url(image_path, mime_type):
+    """data: URL of an image file not already base64-encoded by vision_cache (slide renders are small)."""
+    with open(image_path, "rb") as image_file:
+        return f"data:{mime_type};base64,{base64.b64encode(image_file.read()).decode('ascii')}"
+
 def _read_xml_file_content(xml_file_path):
     """Reads the content of a single XML file."""
     try:
@@ -46,12 +66,51 @@ def _read_xml_file_content(xml_file_path):
         print(f"Error reading XML file {xml_file_path}: {e}")
         return f"Error reading file: {Path(xml_file_path).name}"
 
-def _construct_llm_input_prompt(user_prompt, ppt_json_data, xml_file_paths, image_inputs_present=False, num_slides_with_images=0):
+def is_vision_model(model_id):
+    """True when the model accepts slide images alongside the prompt."""
+    return any(family in model_id for family in VISION_MODEL_FAMILIES)
+
+def _image_slide_numbers(image_inputs):
+    """Slide numbers of image inputs, in order; inputs without one are taken as slides 1..n."""
+    return [img_data.get("slide_number", index) for index, img_data in enumerate(image_inputs or [], start=1)]
+
+def _format_session_history(session_history):
+    """Earlier requests of an edit session, one line each, for the prompt."""
+    if not session_history:
+        return ""
+    lines = ["\nEarlier Requests In This Session (oldest first):"]
+    for turn in session_history:
+        changed = ", ".join(turn.get("modified_parts") or []) or "no changes"
+        lines.append(f"- Turn {turn['turn']}: \"{turn['prompt']}\" -> {changed}")
+    return "\n".join(lines)
+
+@metrics.timed_stage("prompt_build")
+@tracing.traced("prompt_build")
+def build_llm_input_prompt(user_prompt, ppt_json_data, xml_file_paths, image_inputs_present=False, image_slide_numbers=(), session_history=None):
+    """_construct_llm_input_prompt, run in a CPU stage worker (see cpu_pool.py) for large decks."""
+    input_bytes = sum(os.path.getsize(path) for path in xml_file_paths if os.path.isfile(path))
+    if isinstance(ppt_json_data, (str, Path)) and os.path.isfile(ppt_json_data):
+        input_bytes += os.path.getsize(ppt_json_data)
+    final_prompt_text = cpu_pool.POOL.run(
+        "prompt_build", _construct_llm_input_prompt, user_prompt, ppt_json_data, list(xml_file_paths),
+        image_inputs_present, list(image_slide_numbers), session_history,
+        offload=input_bytes >= cpu_pool.MIN_OFFLOAD_CHARS)
+    tracing.set_attributes(prompt_chars=len(final_prompt_text))
+    progress.emit("prompt_built", prompt_chars=len(final_prompt_text), xml_files=len(xml_file_paths),
+                  image_count=len(image_slide_numbers) if image_inputs_present else 0)
+    return final_prompt_text
+
+def _construct_llm_input_prompt(user_prompt, ppt_json_data, xml_file_paths, image_inputs_present=False, image_slide_numbers=(), session_history=None):
     """
     Helper function to construct the detailed prompt for the LLM.
+    ppt_json_data: pptx_to_json output, or the path of a JSON file holding it.
     image_inputs_present: Boolean indicating if image data is part of the context for vision models.
-    num_slides_with_images: Integer, number of slides for which images are provided.
+    image_slide_numbers: Slide numbers whose images are provided, in the order they are attached.
+    session_history: Earlier turns of an edit session (see edit_sessions.py), oldest first.
     """
+    if isinstance(ppt_json_data, (str, Path)):
+        with open(ppt_json_data, 'r', encoding='utf-8') as f:
+            ppt_json_data = json.load(f)
     json_summary_for_prompt = json.dumps(ppt_json_data, indent=2)
     if len(json_summary_for_prompt) > 150000: 
         json_summary_for_prompt = (
@@ -80,21 +139,24 @@ def _construct_llm_input_prompt(user_prompt, ppt_json_data, xml_file_paths, imag
             continue
         
         slide_num_from_filename = int(slide_number_match.group(1))
-        slide_xml_content = _read_xml_file_content(slide_xml_path_str)
-        
-        current_slide_xml_part = f"\n\n--- Slide {slide_num_from_filename} ({slide_xml_path_obj.as_posix()}) ---"
-        if image_inputs_present and slide_num_from_filename <= num_slides_with_images:
-            current_slide_xml_part += f"\n(An image for Slide {slide_num_from_filename} is provided as part of the multimodal input.)"
-        
-        if len(slide_xml_content) > 30000:
-            slide_xml_display_content = f"{slide_xml_content[:15000]}...\n...{slide_xml_content[-15000:]} (Truncated)"
-            slide_xml_chars_total += 30000
-        else:
-            slide_xml_display_content = slide_xml_content
-            slide_xml_chars_total += len(slide_xml_content)
-
-        current_slide_xml_part += f"\nXML Content:\n```xml\n{slide_xml_display_content}\n```"
-        per_slide_prompt_parts.append(current_slide_xml_part)
+        with tracing.span("prompt.slide_part", slide_number=slide_num_from_filename) as part_span:
+            slide_xml_content = _read_xml_file_content(slide_xml_path_str)
+            
+            current_slide_xml_part = f"\n\n--- Slide {slide_num_from_filename} ({slide_xml_path_obj.as_posix()}) ---"
+            if image_inputs_present and slide_num_from_filename in image_slide_numbers:
+                current_slide_xml_part += f"\n(An image for Slide {slide_num_from_filename} is provided as part of the multimodal input.)"
+            
+            if len(slide_xml_content) > 30000:
+                slide_xml_display_content = f"{slide_xml_content[:15000]}...\n...{slide_xml_content[-15000:]} (Truncated)"
+                slide_xml_chars_total += 30000
+            else:
+                slide_xml_display_content = slide_xml_content
+                slide_xml_chars_total += len(slide_xml_content)
+
+            current_slide_xml_part += f"\nXML Content:\n```xml\n{slide_xml_display_content}\n```"
+            per_slide_prompt_parts.append(current_slide_xml_part)
+            part_span.set_attribute("xml_chars", len(slide_xml_content))
+            part_span.set_attribute("truncated", len(slide_xml_content) > 30000)
         slides_xml_processed_count += 1
         
         if slide_xml_chars_total > 300000:
@@ -107,14 +169,16 @@ def _construct_llm_input_prompt(user_prompt, ppt_json_data, xml_file_paths, imag
 
     for xml_path_str in other_xml_files:
         xml_path_obj = Path(xml_path_str)
-        content = _read_xml_file_content(xml_path_str)
-        
-        if len(content) > 50000 and other_xml_files_processed_count > 3:
-             current_other_xml_part = f"\n\n--- XML File: {xml_path_obj.as_posix()} (Content truncated due to length) ---\n{content[:1000]}...\n--- End ---\n"
-             total_other_xml_chars += 1000 
-        else:
-            current_other_xml_part = f"\n\n--- XML File: {xml_path_obj.as_posix()} ---\n{content}\n--- End ---\n"
-            total_other_xml_chars += len(content)
+        with tracing.span("prompt.ancillary_part", part=xml_path_obj.name) as part_span:
+            content = _read_xml_file_content(xml_path_str)
+            
+            if len(content) > 50000 and other_xml_files_processed_count > 3:
+                 current_other_xml_part = f"\n\n--- XML File: {xml_path_obj.as_posix()} (Content truncated due to length) ---\n{content[:1000]}...\n--- End ---\n"
+                 total_other_xml_chars += 1000 
+            else:
+                current_other_xml_part = f"\n\n--- XML File: {xml_path_obj.as_posix()} ---\n{content}\n--- End ---\n"
+                total_other_xml_chars += len(content)
+            part_span.set_attribute("xml_chars", len(content))
         
         aggregated_other_xml_content += current_other_xml_part
         other_xml_files_processed_count +=1
@@ -127,18 +191,25 @@ def _construct_llm_input_prompt(user_prompt, ppt_json_data, xml_file_paths, imag
 
     # Part 1: Persona and context setting
     prompt_context_parts = [
-        "You are an expert AI assistant that modifies PowerPoint presentations by editing their underlying XML structure. You may also receive images of each slide to provide visual context.",
+        "You are an expert AI assistant that modifies PowerPoint presentations by editing their underlying XML structure. You may also receive images of selected slides to provide visual context.",
         "You will now be provided with the complete context for a presentation, which includes:",
         "1. A user's natural language modification request.",
         "2. A JSON summary of the presentation's content.",
         "3. The raw XML content for each slide and other presentation components (like themes, layouts, etc.)."
     ]
     if image_inputs_present:
-        prompt_context_parts.append("4. An image of each slide, which will be provided as multimodal input for visual context.")
+        prompt_context_parts.append(
+            f"4. Images of slide(s) {', '.join(str(n) for n in image_slide_numbers)}, provided as multimodal input "
+            "in that order for visual context. Other slides are described by their XML only.")
+
+    if session_history:
+        prompt_context_parts.append(
+            "5. The earlier requests of this editing session. The JSON and XML below already include their changes.")
 
     # Part 2: The actual data payload
     prompt_data_parts = [
         "\n\n--- PRESENTATION CONTEXT & DATA ---",
+        _format_session_history(session_history),
         f"\nUser's Request:\n{user_prompt}",
         f"\n\nJSON Summary:\n{json_summary_for_prompt}",
         "".join(per_slide_prompt_parts),
@@ -169,172 +240,338 @@ def _construct_llm_input_prompt(user_prompt, ppt_json_data, xml_file_paths, imag
     final_prompt_parts = prompt_context_parts + prompt_data_parts + prompt_instruction_parts
     final_prompt_text = "\n".join(final_prompt_parts)
 
+    tracing.set_attributes(prompt_chars=len(final_prompt_text), json_chars=len(json_summary_for_prompt),
+                           slide_xml_chars=slide_xml_chars_total, other_xml_chars=total_other_xml_chars)
     print(f"Constructed prompt. Approx. JSON length: {len(json_summary_for_prompt)}, Approx. Slide XMLs length: {slide_xml_chars_total}, Approx. Other XMLs length: {total_other_xml_chars}")
     if (slide_xml_chars_total + total_other_xml_chars) > 400000: 
         print("WARNING: The total XML content is very large and may exceed LLM token limits or be very costly.")
     return final_prompt_text
 
-def call_openai_api(user_prompt, ppt_json_data, xml_file_paths, model_id="gpt-3.5-turbo", image_inputs=None):
+@contextmanager
+def _provider_call(response_data, provider, model_id, text_prompt_content, image_count):
+    """Times, meters and traces one provider call; sets inference_time_seconds. Yields the span."""
+    metrics.LLM_PROMPT_CHARS.inc(len(text_prompt_content), model=model_id)
+    progress.emit("llm_started", provider=provider, model=model_id, prompt_chars=len(text_prompt_content))
+    llm_start_time = time.time()
+    with metrics.track_stage("llm_inference", model=model_id, count_errors=False), \
+         tracing.span("llm.provider_call", provider=provider, model=model_id,
+                      prompt_chars=len(text_prompt_content), image_count=image_count) as call_span:
+        yield call_span
+    response_data["inference_time_seconds"] = round(time.time() - llm_start_time, 3)
+    progress.emit("llm_finished", model=model_id, inference_time_s=response_data["inference_time_seconds"])
+
+def _openai_request(user_prompt, ppt_json_data, xml_file_paths, model_id, image_inputs, session_history):
+    """Builds the chat message content. Returns (text prompt, payload content, image count)."""
+    message_content_parts = []
+    text_prompt_content = build_llm_input_prompt(
+        user_prompt, ppt_json_data, xml_file_paths, 
+        bool(image_inputs), image_slide_numbers=_image_slide_numbers(image_inputs),
+        session_history=session_history
+    )
+    message_content_parts.append({"type": "text", "text": text_prompt_content})
+
+    if image_inputs and is_vision_model(model_id):
+        print(f"--- Preparing {len(image_inputs)} image(s) for OpenAI API ({model_id}) ---")
+        for img_data in image_inputs: 
+            try:
+                if "base64" in img_data:
+                    data_url = f"data:{img_data['mime_type']};base64,{img_data['base64']}"
+                else:
+                    data_url = _image_data_url(img_data["path"], img_data["mime_type"])
+                metrics.LLM_IMAGE_BYTES.inc(os.path.getsize(img_data["path"]), model=model_id)
+                message_content_parts.append({
+                    "type": "image_url",
+                    "image_url": {"url": data_url, "detail": "low"} 
+                })
+            except Exception as e_img:
+                print(f"Error processing image {img_data['path']} for OpenAI: {e_img}")
+                message_content_parts.append({"type": "text", "text": f"[Error processing image: {Path(img_data['path']).name}]"})
+    elif image_inputs:
+        print(f"Warning: Images provided but model {model_id} may not be vision-capable for OpenAI. Sending text only.")
+    
+    payload_content = message_content_parts if (image_inputs and is_vision_model(model_id)) else text_prompt_content
+    print(f"--- Calling OpenAI API ({model_id}) (multimodal: {payload_content is message_content_parts}) ---")
+    return text_prompt_content, payload_content, len(message_content_parts) - 1
+
+def _openai_stream(client, payload_content, model_id):
+    """A streamed chat completion; each piece of text is emitted as an llm_token progress event. Returns the text."""
+    text_parts = []
+    for chunk in client.chat.completions.create(messages=[{"role": "user", "content": payload_content}],
+                                                model=model_id, stream=True):
+        deadlines.check("llm_inference")
+        text = chunk.choices[0].delta.content if chunk.choices else None
+        if text:
+            text_parts.append(text)
+            progress.emit("llm_token", text=text)
+    return "".join(text_parts)
+
+def _openai_response(response_data, text_response, model_id, call_span):
+    response_data["text_response"] = text_response
+    call_span.set_attribute("response_chars", len(response_data["text_response"] or ""))
+    metrics.LLM_RESPONSE_CHARS.inc(len(response_data["text_response"] or ""), model=model_id)
+    print(f"--- OpenAI API Call Successful (took {response_data['inference_time_seconds']:.3f}s) ---")
+
+def _openai_error(response_data, e):
+    """Maps an OpenAI client exception to the error text of the response and its metric cause."""
+    if isinstance(e, openai.APIConnectionError):
+        response_data["text_response"] = f"OpenAI API Connection Error: {e}"
+        metrics.record_error("llm_inference", "connection")
+    elif isinstance(e, openai.RateLimitError):
+        response_data["text_response"] = f"OpenAI API Rate Limit Error: {e}"
+        metrics.record_error("llm_inference", "rate_limit")
+    elif isinstance(e, openai.AuthenticationError):
+        response_data["text_response"] = f"OpenAI API Authentication Error: {e} (Check your API key)"
+        metrics.record_error("llm_inference", "authentication")
+    elif isinstance(e, openai.BadRequestError):
+        response_data["text_response"] = f"OpenAI API BadRequestError: {e}. The prompt or image data might be too long or invalid."
+        metrics.record_error("llm_inference", "bad_request")
+    elif isinstance(e, openai.APIError):
+        response_data["text_response"] = f"OpenAI API Error: {e}"
+        metrics.record_error("llm_inference", "api_error")
+    else:
+        response_data["text_response"] = f"An unexpected error occurred with OpenAI API: {e}"
+        metrics.record_error("llm_inference", "unexpected")
+
+def call_openai_api(user_prompt, ppt_json_data, xml_file_paths, model_id="gpt-3.5-turbo", image_inputs=None, session_history=None):
     keys = load_api_keys()
     api_key = keys.get("openai_api_key")
     response_data = {"text_response": "", "model_used": model_id, "inference_time_seconds": None}
 
     if not api_key:
         response_data["text_response"] = f"Error: OpenAI API key not found in {CREDENTIALS_FILE}"
+        metrics.record_error("llm_inference", "missing_api_key")
         return response_data
 
     try:
-        client = openai.OpenAI(api_key=api_key)
-        
-        message_content_parts = []
-        num_slides_with_images = len(image_inputs) if image_inputs else 0
-
-        text_prompt_content = _construct_llm_input_prompt(
-            user_prompt, ppt_json_data, xml_file_paths, 
-            bool(image_inputs), num_slides_with_images=num_slides_with_images
-        )
-        message_content_parts.append({"type": "text", "text": text_prompt_content})
-
-        if image_inputs and model_id in ["gpt-4o", "gpt-4-turbo", "gpt-4-vision-preview"]:
-            print(f"--- Preparing {len(image_inputs)} image(s) for OpenAI API ({model_id}) ---")
-            for img_data in image_inputs: 
-                try:
-                    with open(img_data["path"], "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                    data_url = f"data:{img_data['mime_type']};base64,{encoded_string}"
-                    message_content_parts.append({
-                        "type": "image_url",
-                        "image_url": {"url": data_url, "detail": "low"} 
-                    })
-                except Exception as e_img:
-                    print(f"Error processing image {img_data['path']} for OpenAI: {e_img}")
-                    message_content_parts.append({"type": "text", "text": f"[Error processing image: {Path(img_data['path']).name}]"})
-        elif image_inputs:
-            print(f"Warning: Images provided but model {model_id} may not be vision-capable for OpenAI. Sending text only.")
-        
-        payload_content = message_content_parts if (image_inputs and model_id in ["gpt-4o", "gpt-4-turbo", "gpt-4-vision-preview"]) else text_prompt_content
-
-        print(f"--- Calling OpenAI API ({model_id}) (multimodal: {bool(image_inputs and model_id in ['gpt-4o', 'gpt-4-turbo'])}) ---")
-        llm_start_time = time.time()
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": payload_content}],
-            model=model_id,
-        )
-        llm_end_time = time.time()
-        response_data["inference_time_seconds"] = round(llm_end_time - llm_start_time, 3)
-        
-        response_data["text_response"] = chat_completion.choices[0].message.content
-        print(f"--- OpenAI API Call Successful (took {response_data['inference_time_seconds']:.3f}s) ---")
-    except openai.APIConnectionError as e:
-        response_data["text_response"] = f"OpenAI API Connection Error: {e}"
-    except openai.RateLimitError as e:
-        response_data["text_response"] = f"OpenAI API Rate Limit Error: {e}"
-    except openai.AuthenticationError as e:
-        response_data["text_response"] = f"OpenAI API Authentication Error: {e} (Check your API key)"
-    except openai.BadRequestError as e: 
-         response_data["text_response"] = f"OpenAI API BadRequestError: {e}. The prompt or image data might be too long or invalid."
-    except openai.APIError as e: 
-        response_data["text_response"] = f"OpenAI API Error: {e}"
+        client = openai.OpenAI(api_key=api_key, timeout=deadlines.bounded(LLM_TIMEOUT_S))
+        text_prompt_content, payload_content, image_count = _openai_request(
+            user_prompt, ppt_json_data, xml_file_paths, model_id, image_inputs, session_history)
+        # Closing the client aborts the request in flight when the client of this edit goes away
+        with _provider_call(response_data, "openai", model_id, text_prompt_content, image_count) as call_span, \
+             deadlines.on_cancel(client.close):
+            if progress.active():
+                text_response = _openai_stream(client, payload_content, model_id)
+            else:
+                chat_completion = client.chat.completions.create(
+                    messages=[{"role": "user", "content": payload_content}],
+                    model=model_id,
+                )
+                text_response = chat_completion.choices[0].message.content
+        _openai_response(response_data, text_response, model_id, call_span)
+    except deadlines.RequestCancelled:
+        raise
     except Exception as e: 
-        response_data["text_response"] = f"An unexpected error occurred with OpenAI API: {e}"
+        # A failure caused by the request's deadline ending is reported as such, not as a provider error
+        deadlines.check("llm_inference")
+        _openai_error(response_data, e)
     return response_data
 
 
-def call_gemini_api(user_prompt, ppt_json_data, xml_file_paths, model_id="gemini-1.5-flash-latest", image_inputs=None):
+def _gemini_model(model_id, api_key):
+    genai.configure(api_key=api_key)
+    safety_settings = [
+        {"category": HarmCategory.HARM_CATEGORY_HARASSMENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
+        {"category": HarmCategory.HARM_CATEGORY_HATE_SPEECH, "threshold": HarmBlockThreshold.BLOCK_NONE},
+        {"category": HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, "threshold": HarmBlockThreshold.BLOCK_NONE},
+        {"category": HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
+    ]
+    return genai.GenerativeModel(model_id, safety_settings=safety_settings)
+
+def _gemini_request(user_prompt, ppt_json_data, xml_file_paths, model_id, image_inputs, session_history):
+    """Builds the prompt parts (text, then images). Returns (text prompt, prompt parts)."""
+    prompt_parts_for_api = []
+    text_prompt_content = build_llm_input_prompt(
+        user_prompt, ppt_json_data, xml_file_paths, 
+        bool(image_inputs), image_slide_numbers=_image_slide_numbers(image_inputs),
+        session_history=session_history
+    )
+    prompt_parts_for_api.append(text_prompt_content)
+
+    if image_inputs:
+        num_images_processed = 0
+        for img_data in image_inputs:
+            try:
+                if "path" in img_data and os.path.exists(img_data["path"]):
+                    image_size = os.path.getsize(img_data["path"])
+                    if image_size > GEMINI_INLINE_IMAGE_MAX_BYTES:
+                        prompt_parts_for_api.append(genai.upload_file(path=img_data["path"], mime_type=img_data["mime_type"]))
+                    else:
+                        with open(img_data["path"], "rb") as f:
+                            prompt_parts_for_api.append({"mime_type": img_data["mime_type"], "data": f.read()})
+                    metrics.LLM_IMAGE_BYTES.inc(image_size, model=model_id)
+                    num_images_processed += 1
+                elif "data" in img_data:
+                     prompt_parts_for_api.append({"mime_type": img_data["mime_type"], "data": img_data["data"]})
+                     metrics.LLM_IMAGE_BYTES.inc(len(img_data["data"]), model=model_id)
+                     num_images_processed += 1
+                else:
+                    print(f"Warning: Invalid image input format for Gemini: {img_data}")
+            except Exception as e_img:
+                print(f"Error processing image for Gemini ({img_data.get('path', 'bytes_data')}): {e_img}")
+                prompt_parts_for_api.append(f"\n[Error processing image: {Path(img_data.get('path', 'N/A')).name}]")
+        print(f"--- Calling Gemini API ({model_id}) with {num_images_processed} image(s) ---")
+    else:
+         print(f"--- Calling Gemini API ({model_id}) (text only) ---")
+    return text_prompt_content, prompt_parts_for_api
+
+def _gemini_stream(model, prompt_parts_for_api):
+    """A streamed Gemini response; each chunk's text is emitted as an llm_token progress event."""
+    response = model.generate_content(prompt_parts_for_api, stream=True,
+                                      request_options={"timeout": deadlines.bounded(LLM_TIMEOUT_S)})
+    for chunk in response:
+        deadlines.check("llm_inference")
+        try:
+            text = chunk.text
+        except ValueError:  # a chunk without text parts (e.g. the final one of a blocked response)
+            continue
+        if text:
+            progress.emit("llm_token", text=text)
+    return response
+
+def _gemini_response(response_data, response, model_id, call_span):
+    print(f"--- Gemini API Call Successful (took {response_data['inference_time_seconds']:.3f}s) ---")
+
+    if hasattr(response, 'text') and response.text:
+        response_data["text_response"] = response.text
+    elif response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+         response_data["text_response"] = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, "text"))
+    else:
+        if response.prompt_feedback and response.prompt_feedback.block_reason:
+            reason_msg = f"Gemini API call blocked. Reason: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}"
+            response_data["text_response"] = reason_msg
+            metrics.record_error("llm_inference", "blocked")
+        else: 
+            response_data["text_response"] = "Gemini API: No text content found in response, and not explicitly blocked."
+            metrics.record_error("llm_inference", "empty_response")
+    metrics.LLM_RESPONSE_CHARS.inc(len(response_data["text_response"]), model=model_id)
+    call_span.set_attribute("response_chars", len(response_data["text_response"]))
+
+def call_gemini_api(user_prompt, ppt_json_data, xml_file_paths, model_id="gemini-1.5-flash-latest", image_inputs=None, session_history=None):
     keys = load_api_keys()
     api_key = keys.get("gemini_api_key")
     response_data = {"text_response": "", "model_used": model_id, "inference_time_seconds": None}
 
     if not api_key:
         response_data["text_response"] = f"Error: Gemini API key not found in {CREDENTIALS_FILE}"
+        metrics.record_error("llm_inference", "missing_api_key")
         return response_data
 
     try:
-        genai.configure(api_key=api_key)
-        safety_settings = [
-            {"category": HarmCategory.HARM_CATEGORY_HARASSMENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-            {"category": HarmCategory.HARM_CATEGORY_HATE_SPEECH, "threshold": HarmBlockThreshold.BLOCK_NONE},
-            {"category": HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-            {"category": HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-        ]
-        model = genai.GenerativeModel(model_id, safety_settings=safety_settings)
-        
-        prompt_parts_for_api = []
-        num_slides_with_images = len(image_inputs) if image_inputs else 0
-
-        text_prompt_content = _construct_llm_input_prompt(
-            user_prompt, ppt_json_data, xml_file_paths, 
-            bool(image_inputs), num_slides_with_images=num_slides_with_images
-        )
-        prompt_parts_for_api.append(text_prompt_content)
-
-        if image_inputs:
-            num_images_processed = 0
-            for img_data in image_inputs:
-                try:
-                    if "path" in img_data and os.path.exists(img_data["path"]):
-                        with open(img_data["path"], "rb") as f:
-                            img_bytes = f.read()
-                        prompt_parts_for_api.append({"mime_type": img_data["mime_type"], "data": img_bytes})
-                        num_images_processed += 1
-                    elif "data" in img_data:
-                         prompt_parts_for_api.append({"mime_type": img_data["mime_type"], "data": img_data["data"]})
-                         num_images_processed += 1
-                    else:
-                        print(f"Warning: Invalid image input format for Gemini: {img_data}")
-                except Exception as e_img:
-                    print(f"Error processing image for Gemini ({img_data.get('path', 'bytes_data')}): {e_img}")
-                    prompt_parts_for_api.append(f"\n[Error processing image: {Path(img_data.get('path', 'N/A')).name}]")
-            print(f"--- Calling Gemini API ({model_id}) with {num_images_processed} image(s) ---")
-        else:
-             print(f"--- Calling Gemini API ({model_id}) (text only) ---")
-
-        llm_start_time = time.time()
-        response = model.generate_content(prompt_parts_for_api)
-        llm_end_time = time.time()
-        response_data["inference_time_seconds"] = round(llm_end_time - llm_start_time, 3)
-        
-        print(f"--- Gemini API Call Successful (took {response_data['inference_time_seconds']:.3f}s) ---")
-
-        if hasattr(response, 'text') and response.text:
-            response_data["text_response"] = response.text
-        elif response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-             response_data["text_response"] = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, "text"))
-        else:
-            if response.prompt_feedback and response.prompt_feedback.block_reason:
-                reason_msg = f"Gemini API call blocked. Reason: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}"
-                response_data["text_response"] = reason_msg
-            else: 
-                response_data["text_response"] = "Gemini API: No text content found in response, and not explicitly blocked."
+        model = _gemini_model(model_id, api_key)
+        text_prompt_content, prompt_parts_for_api = _gemini_request(
+            user_prompt, ppt_json_data, xml_file_paths, model_id, image_inputs, session_history)
+        # Gemini's client cannot abort a call from another thread; its timeout ends with the request's deadline
+        with _provider_call(response_data, "gemini", model_id, text_prompt_content, len(prompt_parts_for_api) - 1) as call_span:
+            if progress.active():
+                response = _gemini_stream(model, prompt_parts_for_api)
+            else:
+                response = model.generate_content(prompt_parts_for_api,
+                                                  request_options={"timeout": deadlines.bounded(LLM_TIMEOUT_S)})
+        _gemini_response(response_data, response, model_id, call_span)
+    except deadlines.RequestCancelled:
+        raise
     except Exception as e: 
+        deadlines.check("llm_inference")
         response_data["text_response"] = f"An error occurred with Gemini API: {e}"
+        metrics.record_error("llm_inference", type(e).__name__)
     return response_data
 
-def get_llm_response(user_prompt, ppt_json_data, xml_file_paths, engine_or_model_id="gemini-1.5-flash-latest", image_inputs=None):
-    print(f"--- LLM Handler (get_llm_response) Called for: {engine_or_model_id} ---")
-    
-    is_vision_model_family = "gpt-4o" in engine_or_model_id or \
-                             "gpt-4-turbo" in engine_or_model_id or \
-                             "vision" in engine_or_model_id or \
-                             "gemini-1.5" in engine_or_model_id or \
-                             "gemini-2.0-flash-preview-image-generation" in engine_or_model_id or \
-                             "gemini-2.5" in engine_or_model_id
+def _resolve_llm_call(engine_or_model_id, image_inputs):
+    """(provider, model id, image inputs to send) for get_llm_response and its async form."""
+    is_vision_model_family = is_vision_model(engine_or_model_id)
 
     actual_image_inputs_to_send = image_inputs if is_vision_model_family else None
     if image_inputs and not is_vision_model_family:
         print(f"Warning: Images provided, but selected model '{engine_or_model_id}' is not recognized as vision-capable. Images will not be sent.")
 
-
     if engine_or_model_id.startswith("gemini"):
-        return call_gemini_api(user_prompt, ppt_json_data, xml_file_paths, model_id=engine_or_model_id, image_inputs=actual_image_inputs_to_send)
+        return "gemini", engine_or_model_id, actual_image_inputs_to_send
     elif engine_or_model_id.startswith("gpt"):
-        return call_openai_api(user_prompt, ppt_json_data, xml_file_paths, model_id=engine_or_model_id, image_inputs=actual_image_inputs_to_send)
-    else:
-        print(f"Warning: engine_or_model_id '{engine_or_model_id}' not recognized. Defaulting to gemini-1.5-flash-latest.")
-        return call_gemini_api(user_prompt, ppt_json_data, xml_file_paths, model_id="gemini-1.5-flash-latest", image_inputs=actual_image_inputs_to_send)
+        return "openai", engine_or_model_id, actual_image_inputs_to_send
+    print(f"Warning: engine_or_model_id '{engine_or_model_id}' not recognized. Defaulting to gemini-1.5-flash-latest.")
+    return "gemini", "gemini-1.5-flash-latest", actual_image_inputs_to_send
+
+def get_llm_response(user_prompt, ppt_json_data, xml_file_paths, engine_or_model_id="gemini-1.5-flash-latest", image_inputs=None, session_history=None):
+    print(f"--- LLM Handler (get_llm_response) Called for: {engine_or_model_id} ---")
+    deadlines.check("llm_inference")
+    provider, model_id, actual_image_inputs_to_send = _resolve_llm_call(engine_or_model_id, image_inputs)
+    call_api = call_openai_api if provider == "openai" else call_gemini_api
+    return call_api(user_prompt, ppt_json_data, xml_file_paths, model_id=model_id, image_inputs=actual_image_inputs_to_send, session_history=session_history)
+
+
+# --- Async provider calls (asgi.py) ---
+# Same prompts, metrics and response dict as the calls above; the provider request
+# is awaited on the event loop, while prompt building (file reads, JSON summaries,
+# image encoding) runs in a worker thread so it does not block other requests.
+
+async def call_openai_api_async(user_prompt, ppt_json_data, xml_file_paths, model_id="gpt-3.5-turbo", image_inputs=None, session_history=None):
+    keys = load_api_keys()
+    api_key = keys.get("openai_api_key")
+    response_data = {"text_response": "", "model_used": model_id, "inference_time_seconds": None}
+
+    if not api_key:
+        response_data["text_response"] = f"Error: OpenAI API key not found in {CREDENTIALS_FILE}"
+        metrics.record_error("llm_inference", "missing_api_key")
+        return response_data
+
+    try:
+        client = openai.AsyncOpenAI(api_key=api_key, timeout=deadlines.bounded(LLM_TIMEOUT_S))
+        text_prompt_content, payload_content, image_count = await asyncio.to_thread(
+            _openai_request, user_prompt, ppt_json_data, xml_file_paths, model_id, image_inputs, session_history)
+        with _provider_call(response_data, "openai", model_id, text_prompt_content, image_count) as call_span:
+            chat_completion = await client.chat.completions.create(
+                messages=[{"role": "user", "content": payload_content}],
+                model=model_id,
+            )
+        _openai_response(response_data, chat_completion.choices[0].message.content, model_id, call_span)
+    except deadlines.RequestCancelled:
+        raise
+    except Exception as e:
+        deadlines.check("llm_inference")
+        _openai_error(response_data, e)
+    return response_data
+
+async def call_gemini_api_async(user_prompt, ppt_json_data, xml_file_paths, model_id="gemini-1.5-flash-latest", image_inputs=None, session_history=None):
+    keys = load_api_keys()
+    api_key = keys.get("gemini_api_key")
+    response_data = {"text_response": "", "model_used": model_id, "inference_time_seconds": None}
+
+    if not api_key:
+        response_data["text_response"] = f"Error: Gemini API key not found in {CREDENTIALS_FILE}"
+        metrics.record_error("llm_inference", "missing_api_key")
+        return response_data
+
+    try:
+        model = _gemini_model(model_id, api_key)
+        text_prompt_content, prompt_parts_for_api = await asyncio.to_thread(
+            _gemini_request, user_prompt, ppt_json_data, xml_file_paths, model_id, image_inputs, session_history)
+        with _provider_call(response_data, "gemini", model_id, text_prompt_content, len(prompt_parts_for_api) - 1) as call_span:
+            response = await model.generate_content_async(
+                prompt_parts_for_api, request_options={"timeout": deadlines.bounded(LLM_TIMEOUT_S)})
+        _gemini_response(response_data, response, model_id, call_span)
+    except deadlines.RequestCancelled:
+        raise
+    except Exception as e:
+        deadlines.check("llm_inference")
+        response_data["text_response"] = f"An error occurred with Gemini API: {e}"
+        metrics.record_error("llm_inference", type(e).__name__)
+    return response_data
+
+async def get_llm_response_async(user_prompt, ppt_json_data, xml_file_paths, engine_or_model_id="gemini-1.5-flash-latest", image_inputs=None, session_history=None):
+    """Async form of get_llm_response."""
+    print(f"--- LLM Handler (get_llm_response_async) Called for: {engine_or_model_id} ---")
+    deadlines.check("llm_inference")
+    provider, model_id, actual_image_inputs_to_send = _resolve_llm_call(engine_or_model_id, image_inputs)
+    call_api = call_openai_api_async if provider == "openai" else call_gemini_api_async
+    return await call_api(user_prompt, ppt_json_data, xml_file_paths, model_id=model_id, image_inputs=actual_image_inputs_to_send, session_history=session_history)
 
 
 def parse_llm_response_for_xml_changes(llm_text_response):
+    """{part name: new XML} of the MODIFIED_XML_FILE blocks of a response; long responses are parsed in a CPU stage worker."""
+    return cpu_pool.POOL.run("parse_llm_response", _parse_xml_change_blocks, llm_text_response,
+                             offload=len(llm_text_response) >= cpu_pool.MIN_OFFLOAD_CHARS)
+
+def _parse_xml_change_blocks(llm_text_response):
     modified_files = {}
     pattern = re.compile(
         r"MODIFIED_XML_FILE:\s*(?P<filename>[a-zA-Z0-9./\-_]+?\.xml)\s*```xml\n(?P<xml_content>.+?)\n```", 
@@ -352,11 +589,106 @@ def parse_llm_response_for_xml_changes(llm_text_response):
         print("No 'MODIFIED_XML_FILE:' blocks found in LLM response.")
     return modified_files
 
+def get_llm_text_completion(prompt_text, engine_or_model_id="gemini-1.5-flash-latest", stage="xml_repair"):
+    """
+    Sends a plain text prompt (no deck context, no images) to the given model. Used for
+    small follow-up calls such as XML repair. Returns the same dict as get_llm_response.
+    """
+    keys = load_api_keys()
+    provider = "openai" if engine_or_model_id.startswith("gpt") else "gemini"
+    response_data = {"text_response": "", "model_used": engine_or_model_id, "inference_time_seconds": None}
+    api_key = keys.get(f"{provider}_api_key")
+    if not api_key:
+        response_data["text_response"] = f"Error: {provider} API key not found in {CREDENTIALS_FILE}"
+        metrics.record_error(stage, "missing_api_key")
+        return response_data
+
+    deadlines.check(stage)
+    metrics.LLM_PROMPT_CHARS.inc(len(prompt_text), model=engine_or_model_id)
+    llm_start_time = time.time()
+    try:
+        with metrics.track_stage(stage, model=engine_or_model_id, count_errors=False), \
+             tracing.span("llm.provider_call", provider=provider, model=engine_or_model_id,
+                          prompt_chars=len(prompt_text), image_count=0) as call_span:
+            if provider == "openai":
+                client = openai.OpenAI(api_key=api_key, timeout=deadlines.bounded(LLM_TIMEOUT_S))
+                with deadlines.on_cancel(client.close):
+                    chat_completion = client.chat.completions.create(
+                        messages=[{"role": "user", "content": prompt_text}],
+                        model=engine_or_model_id,
+                    )
+                response_data["text_response"] = chat_completion.choices[0].message.content or ""
+            else:
+                genai.configure(api_key=api_key)
+                response = genai.GenerativeModel(engine_or_model_id).generate_content(
+                    prompt_text, request_options={"timeout": deadlines.bounded(LLM_TIMEOUT_S)})
+                if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+                    response_data["text_response"] = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, "text"))
+            call_span.set_attribute("response_chars", len(response_data["text_response"]))
+        metrics.LLM_RESPONSE_CHARS.inc(len(response_data["text_response"]), model=engine_or_model_id)
+    except Exception as e:
+        deadlines.check(stage)
+        response_data["text_response"] = f"An error occurred with {provider} API: {e}"
+        metrics.record_error(stage, type(e).__name__)
+    response_data["inference_time_seconds"] = round(time.time() - llm_start_time, 3)
+    return response_data
+
+def repair_xml_part(part_name, broken_xml, issues, original_xml_dir, user_prompt, engine_or_model_id):
+    """
+    Targeted retry for one modified part that failed validation (see xml_validation.py).
+    Sends only that part, its original version and the validation issues.
+    Returns the repaired XML text, or None.
+    """
+    original_xml_path = Path(original_xml_dir) / part_name
+    original_xml = _read_xml_file_content(original_xml_path) if original_xml_path.is_file() else "(not available)"
+    issue_lines = "\n".join(f"- {issue}" for issue in issues)
+    prompt_text = "\n".join([
+        "You previously edited a PowerPoint XML part for the user request below, but the result failed validation.",
+        f"User request: {user_prompt}",
+        "",
+        f"Validation issues in {part_name}:",
+        issue_lines,
+        "",
+        f"ORIGINAL {part_name} (valid, before your edit):",
+        "```xml", original_xml, "```",
+        "",
+        f"YOUR EDITED {part_name} (invalid):",
+        "```xml", broken_xml, "```",
+        "",
+        "Fix ONLY the listed issues while keeping the intended edit. Keep every namespace declaration of the original root element "
+        "and only use relationship ids that exist in the original part. Respond with the complete corrected file in exactly this format "
+        "and nothing else:",
+        f"MODIFIED_XML_FILE: {part_name}",
+        "```xml",
+        "...full corrected XML...",
+        "```",
+    ])
+    print(f"--- Requesting targeted XML repair for {part_name} ({len(issues)} issue(s)) ---")
+    result = get_llm_text_completion(prompt_text, engine_or_model_id, stage="xml_repair")
+    repaired_files = parse_llm_response_for_xml_changes(result.get("text_response") or "")
+    return repaired_files.get(part_name)
+
+def _format_visual_diff_for_judge(visual_diff):
+    """Turns local pixel metrics (see visual_metrics.py) into a short prompt section."""
+    width, height = visual_diff.get("image_size", ["?", "?"])
+    regions = visual_diff.get("changed_regions") or []
+    region_text = "; ".join(f"x={r[0]}-{r[2]}, y={r[1]}-{r[3]}" for r in regions) or "none"
+    return (
+        "\n\nLOCAL PIXEL COMPARISON (computed before judging, for orientation only):\n"
+        f"- Changed pixels: {visual_diff.get('pixel_diff_ratio', 0) * 100:.2f}% of a {width}x{height} render\n"
+        f"- Structural similarity (SSIM): {visual_diff.get('ssim', 'N/A')}\n"
+        f"- Changed regions (pixel boxes): {region_text}\n"
+    )
+
 def call_llm_judge(instruction: str, before_img_path: str, after_img_path: str,
                    before_xml_dict: dict, after_xml_dict: dict,
-                   model_id: str = "gemini-2.5-flash-preview-05-20"):
+                   model_id: str = "gemini-2.5-flash-preview-05-20",
+                   visual_diff: dict = None, max_image_side: int = None):
     """
     Calls Gemini to act as a judge, comparing slide images and their underlying XML.
+    visual_diff: Optional local metrics from visual_metrics.compute_visual_metrics; the
+    changed regions are described in the prompt and a crop of the edited area is attached.
+    max_image_side: If set, images are downscaled so their longest side fits before upload.
     """
     keys = load_api_keys()
     api_key = keys.get("gemini_api_key")
@@ -448,6 +780,9 @@ Return *only* the JSON object and nothing else.
     try:
         before_image = Image.open(before_img_path)
         after_image = Image.open(after_img_path)
+        if max_image_side:
+            before_image.thumbnail((max_image_side, max_image_side))
+            after_image.thumbnail((max_image_side, max_image_side))
         
         generation_config = {
           "temperature": 0.2,
@@ -466,10 +801,26 @@ Return *only* the JSON object and nothing else.
             safety_settings=safety_settings
         )
         
+        visual_diff_parts = []
+        if visual_diff:
+            visual_diff_parts.append(_format_visual_diff_for_judge(visual_diff))
+            region = visual_metrics.union_region(visual_diff.get("changed_regions"))
+            if region:
+                x0, y0, x1, y1 = region
+                # Regions are in full-resolution pixels, not those of the thumbnail sent to the judge
+                full_width, full_height = visual_diff["image_size"]
+                region_area = (x1 - x0) * (y1 - y0)
+                if region_area < 0.6 * full_width * full_height:
+                    scale_x = after_image.width / full_width
+                    scale_y = after_image.height / full_height
+                    crop_box = (int(x0 * scale_x), int(y0 * scale_y), int(x1 * scale_x), int(y1 * scale_y))
+                    visual_diff_parts += ["\n\nEDITED slide, changed region close-up:", after_image.crop(crop_box)]
+
         prompt_parts = [
             "INSTRUCTION: ", instruction, "\\n\\n",
             "ORIGINAL slide:", before_image, "\\n\\n",
             "EDITED slide:", after_image,
+            *visual_diff_parts,
             xml_diff_prompt_part, # <-- ADD THE XML DIFFS TO THE PROMPT
             "\\n\\n",
             judge_prompt,
@@ -0,0 +1,112 @@
+# --- load_test.py ---
+"""
+Load test for /api/process: sends concurrent edit requests to one or more
+running servers and reports throughput and latency percentiles, to compare the
+threaded server (python app.py) with the async one (python asgi.py).
+
+Each request gets a distinct prompt ("{i}" in --prompt is replaced by the request
+number), so duplicate-request coalescing (see single_flight.py) does not hide
+the load. The deck must exist in the server's benchmark directory.
+
+Usage:
+    python app.py                    # threaded, port 5001
+    python asgi.py --port 5002       # async
+    python load_test.py --deck slide_1.pptx --requests 200 --concurrency 100 \
+        --url threaded=http://127.0.0.1:5001 --url async=http://127.0.0.1:5002
+"""
+import time
+import argparse
+import statistics
+from pathlib import Path
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# --- Configuration ---
+SCRIPT_DIR = Path(__file__).parent.resolve()
+DEFAULT_DECK_DIR = SCRIPT_DIR / "TSBench" / "benchmark_ppts"
+DEFAULT_PROMPT = "Make the title of slide 1 bold. (load test request {i})"
+# Only the fields needed to tell success from failure; large payloads would dominate the timings
+RESPONSE_FIELDS = "modified_pptx_download_url,reason_for_no_modification"
+REQUEST_TIMEOUT_SECONDS = 600
+PPTX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+
+
+def send_request(base_url, deck_path, prompt_text, llm_engine, preview_renderer):
+    """One /api/process call. Returns (status or error name, latency in seconds)."""
+    start_time = time.perf_counter()
+    try:
+        with open(deck_path, 'rb') as deck_file:
+            response = requests.post(
+                f"{base_url}/api/process", params={'fields': RESPONSE_FIELDS},
+                files={'file': (deck_path.name, deck_file, PPTX_MIMETYPE)},
+                data={'prompt': prompt_text, 'llm_engine': llm_engine, 'preview_renderer': preview_renderer},
+                headers={'X-Request-Timeout': str(REQUEST_TIMEOUT_SECONDS)}, timeout=REQUEST_TIMEOUT_SECONDS)
+        outcome = response.status_code
+    except requests.exceptions.RequestException as e:
+        outcome = type(e).__name__
+    return outcome, time.perf_counter() - start_time
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def run_load(name, base_url, deck_path, args):
+    """Sends args.requests requests with args.concurrency in flight. Returns the summary row."""
+    print(f"--- {name}: {args.requests} requests, {args.concurrency} concurrent, {base_url} ---")
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda i: send_request(base_url, deck_path, args.prompt.format(i=i), args.llm_engine, args.preview_renderer),
+            range(args.requests)))
+    wall_time = time.perf_counter() - start_time
+
+    outcomes = Counter(outcome for outcome, _ in results)
+    latencies = sorted(latency for outcome, latency in results if outcome == 200)
+    return {
+        "server": name,
+        "ok": outcomes.get(200, 0),
+        "failed": ", ".join(f"{outcome}x{count}" for outcome, count in outcomes.items() if outcome != 200) or "-",
+        "wall_s": round(wall_time, 2),
+        "req_per_s": round(len(latencies) / wall_time, 2) if wall_time else 0,
+        "p50_s": round(percentile(latencies, 0.50), 2),
+        "p95_s": round(percentile(latencies, 0.95), 2),
+        "p99_s": round(percentile(latencies, 0.99), 2),
+        "mean_s": round(statistics.fmean(latencies), 2) if latencies else float("nan"),
+    }
+
+
+def print_table(rows):
+    columns = list(rows[0])
+    widths = {column: max(len(column), *(len(str(row[column])) for row in rows)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(widths[column]) for column in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare /api/process throughput and latency across servers.")
+    parser.add_argument("--url", action="append", metavar="[NAME=]URL",
+                        help="server base URL, repeatable (default: http://127.0.0.1:5001)")
+    parser.add_argument("--deck", required=True, help="deck file name in the server's benchmark directory, or a path")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--llm-engine", default="gemini-1.5-flash-latest")
+    parser.add_argument("--preview-renderer", default="libreoffice", choices=["libreoffice", "fast"])
+    args = parser.parse_args()
+
+    deck_path = Path(args.deck)
+    if not deck_path.exists():
+        deck_path = DEFAULT_DECK_DIR / args.deck
+    if not deck_path.exists():
+        parser.error(f"Deck '{args.deck}' not found")
+
+    rows = []
+    for index, url_arg in enumerate(args.url or ["http://127.0.0.1:5001"]):
+        name, _, base_url = url_arg.partition("=") if "=" in url_arg else (f"server{index + 1}", "", url_arg)
+        rows.append(run_load(name, base_url.rstrip("/"), deck_path, args))
+    print_table(rows)
@@ -0,0 +1,239 @@
+# --- memory_budget.py ---
+"""
+Memory-bounded request processing. Embedded video makes some decks hundreds of
+megabytes, but the pipeline streams media (zip members are copied in chunks,
+large media is left out of python-pptx), so what a request holds in memory is driven
+by its XML: the parsed parts, the prompt built from them and the LLM reply.
+
+Three mechanisms keep the server inside its memory:
+    - admission: each request reserves an estimate of its working set (from the
+      zip central directory, without reading members) against MEMORY_BUDGET_BYTES
+      and waits, then fails with 503, when concurrent requests would exceed it
+    - a hard ceiling: check_rss() raises MemoryBudgetExceeded at stage boundaries
+      when the server's RSS is above RSS_LIMIT_BYTES
+    - reporting: PeakTracker samples the server's RSS while a request runs, so
+      peak memory ends up in the request's timing stats
+
+The server's RSS (total_rss_bytes) is this process plus its CPU stage workers
+(see cpu_pool.py), where extraction, prompt building, parsing and repacking
+hold most of the XML working set. Each worker reports its RSS with every job
+result, so a worker's share is as of the end of its last job. RSS is not per
+request: with concurrent requests a tracker's peak includes the others' memory.
+"""
+import os
+import time
+import asyncio
+import zipfile
+import threading
+import resource
+from contextlib import contextmanager
+import metrics
+
+MB = 1024 * 1024
+
+
+def _physical_memory_bytes():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 4096 * MB
+
+
+def _env_mb(name, default_bytes):
+    value = os.environ.get(name)
+    return int(float(value) * MB) if value else int(default_bytes)
+
+
+# --- Configuration ---
+PHYSICAL_MEMORY_BYTES = _physical_memory_bytes()
+# Sum of admitted request estimates
+MEMORY_BUDGET_BYTES = _env_mb("PPTPILOT_MEMORY_BUDGET_MB", PHYSICAL_MEMORY_BYTES * 0.5)
+# RSS of the server and its CPU stage workers above which requests are aborted at the next stage boundary
+RSS_LIMIT_BYTES = _env_mb("PPTPILOT_RSS_LIMIT_MB", PHYSICAL_MEMORY_BYTES * 0.8)
+# Fixed per-request overhead: LLM client, rendered images, response building
+REQUEST_BASE_BYTES = 96 * MB
+# Bytes of memory per byte of uncompressed XML (lxml trees, prompt text, LLM reply, diffs)
+XML_MEMORY_FACTOR = 6
+ADMISSION_TIMEOUT_S = 30
+ASYNC_ADMISSION_POLL_S = 0.05
+RETRY_AFTER_S = 10
+PEAK_SAMPLE_INTERVAL_S = 0.05
+
+
+_worker_rss = {}  # pid -> RSS of a CPU stage worker at the end of its last job
+_worker_rss_lock = threading.Lock()
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a request cannot be admitted or the process is over its RSS limit."""
+
+    def __init__(self, message, retry_after=RETRY_AFTER_S):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def current_rss_bytes():
+    """Resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if os.uname().sysname == "Darwin" else max_rss * 1024
+
+
+def set_worker_rss(pid, rss_bytes):
+    """Records the RSS a CPU stage worker reported with a job result."""
+    with _worker_rss_lock:
+        _worker_rss[pid] = rss_bytes
+
+
+def forget_workers():
+    """Drops worker RSS readings (the pool was replaced)."""
+    with _worker_rss_lock:
+        _worker_rss.clear()
+
+
+def total_rss_bytes():
+    """RSS of this process plus that of its CPU stage workers."""
+    with _worker_rss_lock:
+        workers_bytes = sum(_worker_rss.values())
+    return current_rss_bytes() + workers_bytes
+
+
+def estimate_request_bytes(pptx_filepath):
+    """Working-set estimate for processing a deck, from its zip central directory."""
+    with zipfile.ZipFile(pptx_filepath) as pptx_zip:
+        xml_bytes = sum(info.file_size for info in pptx_zip.infolist() if info.filename.endswith((".xml", ".rels")))
+    return REQUEST_BASE_BYTES + xml_bytes * XML_MEMORY_FACTOR
+
+
+def check_rss(stage=""):
+    """Raises MemoryBudgetExceeded when the server's RSS (workers included) is above RSS_LIMIT_BYTES."""
+    rss = total_rss_bytes()
+    if rss > RSS_LIMIT_BYTES:
+        metrics.MEMORY_ADMISSIONS.inc(result="aborted")
+        raise MemoryBudgetExceeded(
+            f"Server memory is over its limit ({rss // MB} MB RSS > {RSS_LIMIT_BYTES // MB} MB)"
+            + (f" before {stage}" if stage else "") + "; try again shortly.")
+
+
+class MemoryBudget:
+    """Byte-counting semaphore over request working-set estimates."""
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.reserved_bytes = 0
+        self._condition = threading.Condition()
+
+    def _rejected(self, nbytes):
+        metrics.MEMORY_ADMISSIONS.inc(result="rejected")
+        return MemoryBudgetExceeded(
+            f"Not enough memory budget to process this deck now (needs ~{nbytes // MB} MB, "
+            f"{(self.limit_bytes - self.reserved_bytes) // MB} of {self.limit_bytes // MB} MB free).")
+
+    def _reserve_locked(self, nbytes):
+        """Takes nbytes if they fit. The caller holds the condition."""
+        if self.reserved_bytes + nbytes > self.limit_bytes:
+            return False
+        self.reserved_bytes += nbytes
+        metrics.MEMORY_RESERVED_BYTES.set(self.reserved_bytes)
+        return True
+
+    def acquire(self, nbytes, timeout=ADMISSION_TIMEOUT_S):
+        """
+        Reserves nbytes, waiting up to timeout for other requests to release
+        theirs. A request larger than the whole budget is clamped to it, so it
+        runs alone instead of never. Returns the bytes actually reserved.
+        """
+        nbytes = min(nbytes, self.limit_bytes)
+        deadline = time.monotonic() + timeout
+        waited = False
+        with self._condition:
+            while not self._reserve_locked(nbytes):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._rejected(nbytes)
+                waited = True
+                self._condition.wait(remaining)
+        metrics.MEMORY_ADMISSIONS.inc(result="waited" if waited else "admitted")
+        return nbytes
+
+    async def acquire_async(self, nbytes, timeout=ADMISSION_TIMEOUT_S):
+        """acquire() for the event loop (asgi.py): polls while it waits instead of blocking a thread."""
+        nbytes = min(nbytes, self.limit_bytes)
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._condition:
+                if self._reserve_locked(nbytes):
+                    break
+                if time.monotonic() >= deadline:
+                    raise self._rejected(nbytes)
+            waited = True
+            await asyncio.sleep(ASYNC_ADMISSION_POLL_S)
+        metrics.MEMORY_ADMISSIONS.inc(result="waited" if waited else "admitted")
+        return nbytes
+
+    def release(self, nbytes):
+        with self._condition:
+            self.reserved_bytes = max(0, self.reserved_bytes - nbytes)
+            metrics.MEMORY_RESERVED_BYTES.set(self.reserved_bytes)
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes, timeout=ADMISSION_TIMEOUT_S):
+        reserved = self.acquire(nbytes, timeout)
+        try:
+            yield reserved
+        finally:
+            self.release(reserved)
+
+
+class PeakTracker:
+    """Records the highest server RSS (workers included) seen between start() and stop()."""
+
+    _active = set()
+    _lock = threading.Lock()
+    _sampler = None
+
+    def __init__(self):
+        self.start_bytes = None
+        self.peak_bytes = 0
+
+    @classmethod
+    def _sample_forever(cls):
+        while True:
+            time.sleep(PEAK_SAMPLE_INTERVAL_S)
+            with cls._lock:
+                trackers = list(cls._active)
+            if trackers:
+                rss = total_rss_bytes()
+                for tracker in trackers:
+                    tracker.peak_bytes = max(tracker.peak_bytes, rss)
+
+    def start(self):
+        self.start_bytes = self.peak_bytes = total_rss_bytes()
+        with PeakTracker._lock:
+            PeakTracker._active.add(self)
+            if PeakTracker._sampler is None:
+                PeakTracker._sampler = threading.Thread(target=PeakTracker._sample_forever, name="rss-sampler", daemon=True)
+                PeakTracker._sampler.start()
+        return self
+
+    def stop(self):
+        self.peak_bytes = max(self.peak_bytes, total_rss_bytes())
+        with PeakTracker._lock:
+            PeakTracker._active.discard(self)
+        return self.peak_bytes
+
+    def stats(self):
+        """Peak and growth in MB, for timing stats."""
+        peak = max(self.peak_bytes, total_rss_bytes())
+        return {
+            "peak_rss_mb": round(peak / MB, 1),
+            "rss_growth_mb": round((peak - (self.start_bytes or peak)) / MB, 1),
+        }
+
+
+REQUEST_MEMORY_BUDGET = MemoryBudget(MEMORY_BUDGET_BYTES)
@@ -0,0 +1,331 @@
+# --- metrics.py ---
+"""
+In-process pipeline metrics rendered in the Prometheus text exposition format.
+Served by app.py at /metrics.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        missing = set(self.label_names) - set(labels)
+        if missing:
+            raise ValueError(f"Metric {self.name} is missing labels: {sorted(missing)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]})
+                           for k, v in self._values.items())
+        for label_values, state in items:
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, state["buckets"]):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, label_values, [("le", _format_value(upper_bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {state['count']}")
+            plain_labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{plain_labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{plain_labels} {state['count']}")
+        return lines
+
+
+REGISTRY = []
+
+# --- Pipeline metrics ---
+STAGE_DURATION = Histogram(
+    "pptpilot_stage_duration_seconds",
+    "Latency of each pipeline stage.",
+    ["stage", "model"],
+)
+STAGE_IN_FLIGHT = Gauge(
+    "pptpilot_stage_in_flight",
+    "Number of pipeline stages currently executing.",
+    ["stage"],
+)
+STAGE_ERRORS = Counter(
+    "pptpilot_stage_errors_total",
+    "Pipeline stage failures by cause.",
+    ["stage", "cause"],
+)
+LLM_PROMPT_CHARS = Counter(
+    "pptpilot_llm_prompt_chars_total",
+    "Characters of text prompt sent to LLM providers.",
+    ["model"],
+)
+LLM_RESPONSE_CHARS = Counter(
+    "pptpilot_llm_response_chars_total",
+    "Characters of text received from LLM providers.",
+    ["model"],
+)
+LLM_IMAGE_BYTES = Counter(
+    "pptpilot_llm_image_bytes_total",
+    "Bytes of image data attached to LLM requests.",
+    ["model"],
+)
+XML_PARTS_VALIDATED = Counter(
+    "pptpilot_xml_parts_validated_total",
+    "LLM-modified XML parts by validation result (valid, repaired, rejected).",
+    ["result"],
+)
+IMAGE_VARIANT_REQUESTS = Counter(
+    "pptpilot_image_variant_requests_total",
+    "Slide image variant requests by result (hit, generated, not_modified).",
+    ["variant", "result"],
+)
+VISION_CACHE_REQUESTS = Counter(
+    "pptpilot_vision_cache_requests_total",
+    "Slide images requested for vision models by cache result (hit, miss).",
+    ["result"],
+)
+PART_STORE_PARTS = Counter(
+    "pptpilot_part_store_parts_total",
+    "Package parts written to the part store, by result (stored, deduplicated).",
+    ["result"],
+)
+PART_STORE_BYTES = Counter(
+    "pptpilot_part_store_bytes_total",
+    "Compressed bytes of parts written to the part store, by result (stored, deduplicated).",
+    ["result"],
+)
+SINGLE_FLIGHT_CALLS = Counter(
+    "pptpilot_single_flight_calls_total",
+    "Calls through a single-flight group by role (leader ran the work, follower shared its result).",
+    ["flight", "role"],
+)
+SINGLE_FLIGHT_IN_FLIGHT = Gauge(
+    "pptpilot_single_flight_in_flight",
+    "Distinct keys currently being worked on per single-flight group.",
+    ["flight"],
+)
+STORAGE_BYTES = Gauge(
+    "pptpilot_storage_bytes",
+    "Disk used by each artifact area, as of the last collection (see storage_gc.py).",
+    ["area"],
+)
+STORAGE_EVICTED_BYTES = Counter(
+    "pptpilot_storage_evicted_bytes_total",
+    "Bytes removed by the storage collector, by area and reason (ttl, quota, orphaned).",
+    ["area", "reason"],
+)
+STORAGE_EVICTED_ENTRIES = Counter(
+    "pptpilot_storage_evicted_entries_total",
+    "Entries removed by the storage collector, by area and reason (ttl, quota, orphaned).",
+    ["area", "reason"],
+)
+ASYNC_STAGE_WAITING = Gauge(
+    "pptpilot_async_stage_waiting",
+    "Edits waiting for a concurrency slot of an async server stage (see asgi.py).",
+    ["stage"],
+)
+ASYNC_STAGE_WAIT_SECONDS = Histogram(
+    "pptpilot_async_stage_wait_seconds",
+    "Time edits waited for a concurrency slot of an async server stage.",
+    ["stage"],
+)
+CPU_POOL_QUEUE_WAIT_SECONDS = Histogram(
+    "pptpilot_cpu_pool_queue_wait_seconds",
+    "Time CPU stage jobs waited for a free worker process (see cpu_pool.py).",
+    ["stage"],
+)
+CPU_POOL_TASKS = Counter(
+    "pptpilot_cpu_pool_tasks_total",
+    "CPU stage jobs by stage and where they ran (pool, inline).",
+    ["stage", "mode"],
+)
+CPU_POOL_SHARED_BYTES = Counter(
+    "pptpilot_cpu_pool_shared_bytes_total",
+    "Text passed to and from CPU stage workers in shared memory (argument, result).",
+    ["direction"],
+)
+REQUEST_CANCELLATIONS = Counter(
+    "pptpilot_request_cancellations_total",
+    "Requests ended before finishing, by reason (timeout, cancelled) and the stage they stopped in.",
+    ["route", "reason", "stage"],
+)
+EDIT_SESSIONS_ACTIVE = Gauge(
+    "pptpilot_edit_sessions_active",
+    "Edit sessions currently held by the server.",
+)
+EDIT_SESSION_BYTES = Gauge(
+    "pptpilot_edit_session_bytes",
+    "Disk and memory used by edit sessions.",
+    ["kind"],
+)
+EDIT_SESSION_EVICTIONS = Counter(
+    "pptpilot_edit_session_evictions_total",
+    "Removed edit sessions by reason (ttl, max_sessions, disk_budget, memory_budget, deleted).",
+    ["reason"],
+)
+MEMORY_RESERVED_BYTES = Gauge(
+    "pptpilot_memory_reserved_bytes",
+    "Working-set estimate reserved by requests currently being processed.",
+)
+MEMORY_ADMISSIONS = Counter(
+    "pptpilot_memory_admissions_total",
+    "Memory budget decisions (admitted, waited, rejected, aborted).",
+    ["result"],
+)
+REQUESTS = Counter(
+    "pptpilot_requests_total",
+    "Processed API requests by route and outcome.",
+    ["route", "outcome"],
+)
+
+
+@contextmanager
+def track_stage(stage, model="", count_errors=True):
+    """
+    Times a pipeline stage: observes its latency, tracks it as in flight and counts
+    uncaught exceptions as errors (cause = exception class name). Pass
+    count_errors=False when the caller records a more specific cause itself.
+    """
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if count_errors:
+            STAGE_ERRORS.inc(stage=stage, cause=type(e).__name__)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start_time, stage=stage, model=model)
+        STAGE_IN_FLIGHT.dec(stage=stage)
+
+
+def timed_stage(stage):
+    """Decorator form of track_stage for functions that make up a whole stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_error(stage, cause):
+    """Counts a handled failure of a stage (for stages that report errors instead of raising)."""
+    STAGE_ERRORS.inc(stage=stage, cause=cause)
+
+
+def counter_values():
+    """{counter name: {label values: value}} of every counter."""
+    values = {}
+    for metric in REGISTRY:
+        if isinstance(metric, Counter):
+            with metric._lock:
+                values[metric.name] = dict(metric._values)
+    return values
+
+
+def add_counter_values(increments):
+    """Adds counts recorded in another process (in counter_values form, see cpu_pool.py)."""
+    counters = {metric.name: metric for metric in REGISTRY if isinstance(metric, Counter)}
+    for name, values in increments.items():
+        metric = counters.get(name)
+        if metric is None:
+            continue
+        with metric._lock:
+            for label_values, amount in values.items():
+                metric._values[label_values] = metric._values.get(label_values, 0) + amount
+
+
+def render_prometheus():
+    """Returns all registered metrics in Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,603 @@
+# --- part_store.py ---
+"""
+Deduplicating, content-addressed store for deck versions.
+
+Each package part (zip member) is stored once, as its compressed bytes, under
+the SHA-256 of those bytes. A deck version is a manifest listing its members and
+the part each one points to, so a version that changes one slide adds one small
+object and one manifest instead of a full copy of the deck and its media:
+
+    PART_STORE_DIR/objects/<aa>/<sha256>      - compressed member data
+    PART_STORE_DIR/manifests/<version id>.json - members of a version, in zip order
+    PART_STORE_DIR/sources/<deck sha256>       - version id of an ingested .pptx
+    PART_STORE_DIR/materialized/<version id>.pptx - assembled decks for rendering (bounded cache)
+
+The version id is the SHA-256 of the manifest, so equal decks share an id.
+A .pptx is assembled by raw-copying the stored compressed bytes behind freshly
+written zip headers: nothing is decompressed or recompressed, and the output size
+is known before the first byte, so downloads stream straight from the store.
+Diffing two versions compares manifest entries, which is O(changed parts).
+
+Identical content compressed differently by two tools is stored twice; parts
+copied from one version to the next (the common case) are always shared.
+
+    python part_store.py check [decks] [--corpus-dir DIR]   # round-trip and timing check
+    python part_store.py stats
+    python part_store.py gc [--max-age-days N] [--max-mb N]
+"""
+import os
+import io
+import json
+import time
+import zlib
+import re
+import struct
+import hashlib
+import zipfile
+import argparse
+import threading
+import tempfile
+from pathlib import Path
+from collections import Counter
+import deck_store
+import metrics
+import tracing
+import cpu_pool
+
+# --- Configuration ---
+SCRIPT_DIR = Path(__file__).parent.resolve()
+PART_STORE_DIR = SCRIPT_DIR / "part_store"
+DEFAULT_CORPUS_DIR = SCRIPT_DIR / "tsbench" / "benchmark_ppts"
+COPY_CHUNK_BYTES = 1024 * 1024
+# Assembled decks kept for rendering; least recently used ones are removed above this
+MATERIALIZED_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# Manifests not used for this long are removed by collect_garbage (with parts only they used)
+MANIFEST_MAX_AGE_S = 7 * 24 * 3600
+# Objects written (or reused) this recently are kept even when unreferenced: their manifest may not exist yet
+OBJECT_GC_GRACE_S = 60 * 60
+MANIFEST_FORMAT_VERSION = 1
+DEFLATE_LEVEL = 6  # zlib level zipfile uses for ZIP_DEFLATED
+
+_ZIP64_LIMIT = zipfile.ZIP64_LIMIT  # sizes/offsets from here on go into zip64 extra fields
+_ZIP64_MARKER = 0xFFFFFFFF
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+_ZIP64_END_RECORD = struct.Struct("<IQHHIIQQQQ")
+_ZIP64_END_LOCATOR = struct.Struct("<IIQI")
+_UTF8_FLAG = 0x800
+
+_materialize_lock = threading.Lock()
+
+
+class PartStoreError(Exception):
+    """Raised when a version or one of its parts is missing from the store."""
+
+
+def _object_path(part_hash):
+    return Path(PART_STORE_DIR) / "objects" / part_hash[:2] / part_hash
+
+
+def _manifest_path(version_id):
+    return Path(PART_STORE_DIR) / "manifests" / f"{version_id}.json"
+
+
+def _write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _store_object_stream(chunks):
+    """Stores compressed member bytes from an iterable of chunks. Returns (hash, size)."""
+    digest = hashlib.sha256()
+    objects_dir = Path(PART_STORE_DIR) / "objects"
+    objects_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=objects_dir, prefix=".incoming-")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        part_hash = digest.hexdigest()
+        object_path = _object_path(part_hash)
+        if object_path.exists():
+            os.remove(tmp_path)
+            os.utime(object_path)
+            metrics.PART_STORE_PARTS.inc(result="deduplicated")
+            metrics.PART_STORE_BYTES.inc(size, result="deduplicated")
+        else:
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, object_path)
+            metrics.PART_STORE_PARTS.inc(result="stored")
+            metrics.PART_STORE_BYTES.inc(size, result="stored")
+        return part_hash, size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _iter_raw_member(pptx_file, info):
+    """Yields the compressed bytes of a zip member straight from the archive file."""
+    pptx_file.seek(info.header_offset)
+    local_header = pptx_file.read(_LOCAL_HEADER.size)
+    name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+    pptx_file.seek(info.header_offset + _LOCAL_HEADER.size + name_length + extra_length)
+    remaining = info.compress_size
+    while remaining:
+        chunk = pptx_file.read(min(COPY_CHUNK_BYTES, remaining))
+        if not chunk:
+            raise PartStoreError(f"Truncated member {info.filename}")
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _entry_for(info, part_hash):
+    return {
+        "name": info.filename,
+        "part": part_hash,
+        "compress_type": info.compress_type,
+        "crc": info.CRC,
+        "file_size": info.file_size,
+        "compress_size": info.compress_size,
+        "date_time": list(info.date_time),
+        "external_attr": info.external_attr,
+    }
+
+
+def _save_manifest(entries):
+    """Writes a manifest (if new) and returns its version id."""
+    body = json.dumps({"format_version": MANIFEST_FORMAT_VERSION, "entries": entries},
+                      sort_keys=True, separators=(",", ":")).encode("utf-8")
+    version_id = hashlib.sha256(body).hexdigest()
+    manifest_path = _manifest_path(version_id)
+    if manifest_path.exists():
+        os.utime(manifest_path)
+    else:
+        _write_atomic(manifest_path, body)
+    return version_id
+
+
+def load_manifest(version_id):
+    """Member entries of a version, in zip order. Raises PartStoreError if unknown."""
+    manifest_path = _manifest_path(version_id)
+    try:
+        with open(manifest_path, "rb") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PartStoreError(f"Unknown deck version '{version_id}'") from e
+    os.utime(manifest_path)
+    return manifest["entries"]
+
+
+def has_version(version_id):
+    return bool(re.fullmatch(r"[0-9a-f]{64}", version_id)) and _manifest_path(version_id).exists()
+
+
+@metrics.timed_stage("part_ingest")
+@tracing.traced("part_ingest")
+def ingest_pptx(pptx_filepath):
+    """
+    Adds a deck to the store and returns its version id. Memoized per deck hash,
+    so ingesting an unchanged benchmark deck again only hashes it.
+    """
+    deck_hash = deck_store.compute_deck_hash(pptx_filepath)
+    source_path = Path(PART_STORE_DIR) / "sources" / deck_hash
+    if source_path.exists():
+        version_id = source_path.read_text(encoding="ascii").strip()
+        if has_version(version_id):
+            tracing.set_attributes(cache_hit=True)
+            return version_id
+    entries = []
+    with zipfile.ZipFile(pptx_filepath) as pptx_zip, open(pptx_filepath, "rb") as pptx_file:
+        for info in pptx_zip.infolist():
+            if info.flag_bits & 0x1:
+                raise PartStoreError(f"Encrypted member {info.filename} in {pptx_filepath}")
+            part_hash, _ = _store_object_stream(_iter_raw_member(pptx_file, info))
+            entries.append(_entry_for(info, part_hash))
+    version_id = _save_manifest(entries)
+    _write_atomic(source_path, version_id.encode("ascii"))
+    tracing.set_attributes(cache_hit=False, members=len(entries))
+    return version_id
+
+
+@metrics.timed_stage("repack")
+@tracing.traced("repack")
+def derive_version(base_version_id, modified_parts):
+    """
+    New version of a deck with some parts replaced ({member name: str or bytes}).
+    Only the replaced parts are compressed and written; every other member keeps
+    pointing at the base version's parts. Returns the new version id, or None on
+    failure (like ppt_processor.create_modified_pptx). Compression runs in a CPU
+    stage worker (see cpu_pool.py).
+    """
+    version_id = cpu_pool.POOL.run("repack", _derive_version, base_version_id, modified_parts)
+    tracing.set_attributes(modified_parts=len(modified_parts))
+    return version_id
+
+
+def _derive_version(base_version_id, modified_parts):
+    try:
+        entries = load_manifest(base_version_id)
+        names = {entry["name"].replace("\\", "/"): index for index, entry in enumerate(entries)}
+        for part_name, content in modified_parts.items():
+            if part_name not in names:
+                raise PartStoreError(f"Part {part_name} is not in version {base_version_id}")
+            data = content.encode("utf-8") if isinstance(content, str) else content
+            compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15)
+            compressed = compressor.compress(data) + compressor.flush()
+            part_hash, _ = _store_object_stream([compressed])
+            entry = dict(entries[names[part_name]])
+            entry.update(part=part_hash, compress_type=zipfile.ZIP_DEFLATED, crc=zlib.crc32(data),
+                         file_size=len(data), compress_size=len(compressed))
+            entries[names[part_name]] = entry
+        return _save_manifest(entries)
+    except Exception as e:
+        print(f"Error deriving deck version from {base_version_id}: {e}")
+        metrics.record_error("repack", type(e).__name__)
+        return None
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _zip32(value):
+    return _ZIP64_MARKER if value >= _ZIP64_LIMIT else value
+
+
+def _zip_layout(entries):
+    """
+    Zip headers for raw-copying the entries' parts: a list of (local header bytes,
+    object path, compressed size) and the central directory + end record bytes.
+    """
+    members, central_headers, offset = [], [], 0
+    for entry in entries:
+        name = entry["name"].encode("utf-8")
+        flags = 0 if entry["name"].isascii() else _UTF8_FLAG
+        dos_time, dos_date = _dos_date_time(entry["date_time"])
+        file_size, compress_size = entry["file_size"], entry["compress_size"]
+        sizes_zip64 = file_size >= _ZIP64_LIMIT or compress_size >= _ZIP64_LIMIT
+        version_needed = 45 if sizes_zip64 or offset >= _ZIP64_LIMIT else 20
+
+        local_extra = struct.pack("<HHQQ", 1, 16, file_size, compress_size) if sizes_zip64 else b""
+        local_header = _LOCAL_HEADER.pack(
+            0x04034B50, version_needed, flags, entry["compress_type"], dos_time, dos_date, entry["crc"],
+            _ZIP64_MARKER if sizes_zip64 else compress_size, _ZIP64_MARKER if sizes_zip64 else file_size,
+            len(name), len(local_extra)) + name + local_extra
+        members.append((local_header, _object_path(entry["part"]), compress_size))
+
+        central_values = [value for value in (file_size, compress_size, offset) if value >= _ZIP64_LIMIT]
+        central_extra = struct.pack(f"<HH{len(central_values)}Q", 1, 8 * len(central_values), *central_values) if central_values else b""
+        central_headers.append(_CENTRAL_HEADER.pack(
+            0x02014B50, version_needed, version_needed, flags, entry["compress_type"], dos_time, dos_date, entry["crc"],
+            _zip32(compress_size), _zip32(file_size), len(name), len(central_extra), 0, 0, 0,
+            entry.get("external_attr", 0), _zip32(offset)) + name + central_extra)
+        offset += len(local_header) + compress_size
+
+    central_directory = b"".join(central_headers)
+    count = len(entries)
+    tail = io.BytesIO()
+    tail.write(central_directory)
+    if count >= 0xFFFF or offset >= _ZIP64_LIMIT or len(central_directory) >= _ZIP64_LIMIT:
+        zip64_end_offset = offset + len(central_directory)
+        tail.write(_ZIP64_END_RECORD.pack(0x06064B50, _ZIP64_END_RECORD.size - 12, 45, 45, 0, 0,
+                                          count, count, len(central_directory), offset))
+        tail.write(_ZIP64_END_LOCATOR.pack(0x07064B50, 0, zip64_end_offset, 1))
+    tail.write(_END_RECORD.pack(0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                _zip32(len(central_directory)), _zip32(offset), 0))
+    return members, tail.getvalue()
+
+
+def assembled_size(version_id):
+    """Byte size of the assembled .pptx of a version, without assembling it."""
+    members, tail = _zip_layout(load_manifest(version_id))
+    return sum(len(header) + size for header, _, size in members) + len(tail)
+
+
+def iter_pptx_bytes(version_id):
+    """Yields the assembled .pptx of a version in chunks (raw copy, no recompression)."""
+    members, tail = _zip_layout(load_manifest(version_id))
+    for local_header, object_path, compress_size in members:
+        yield local_header
+        try:
+            with open(object_path, "rb") as part_file:
+                for chunk in iter(lambda: part_file.read(COPY_CHUNK_BYTES), b""):
+                    yield chunk
+        except FileNotFoundError as e:
+            raise PartStoreError(f"Part {object_path.name} of version {version_id} is missing") from e
+    yield tail
+
+
+@metrics.timed_stage("assemble")
+@tracing.traced("assemble")
+def write_pptx(version_id, output_path):
+    """Assembles a version into output_path (written atomically)."""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in iter_pptx_bytes(version_id):
+                f.write(chunk)
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+    tracing.set_attributes(output_bytes=os.path.getsize(output_path))
+    return str(output_path)
+
+
+def materialize(version_id):
+    """
+    Path of an assembled .pptx of a version, for tools that need a file
+    (LibreOffice, python-pptx). Assembled decks are cached up to
+    MATERIALIZED_CACHE_MAX_BYTES; treat the file as read-only.
+    """
+    materialized_path = Path(PART_STORE_DIR) / "materialized" / f"{version_id}.pptx"
+    if materialized_path.exists():
+        os.utime(materialized_path)
+        return str(materialized_path)
+    write_pptx(version_id, materialized_path)
+    _trim_materialized(keep=materialized_path)
+    return str(materialized_path)
+
+
+def _trim_materialized(keep):
+    with _materialize_lock:
+        files = []
+        for path in (Path(PART_STORE_DIR) / "materialized").glob("*.pptx"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= MATERIALIZED_CACHE_MAX_BYTES:
+                break
+            if path != keep:
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+def read_part(version_id, part_name):
+    """Decompressed content of one member of a version, or None if it has no such member."""
+    for entry in load_manifest(version_id):
+        if entry["name"] == part_name:
+            with open(_object_path(entry["part"]), "rb") as part_file:
+                data = part_file.read()
+            if entry["compress_type"] == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(data, -15)
+            elif entry["compress_type"] != zipfile.ZIP_STORED:
+                raise PartStoreError(f"Unsupported compression {entry['compress_type']} for {part_name}")
+            return data
+    return None
+
+
+def diff_versions(old_version_id, new_version_id):
+    """Member names added, removed and changed between two versions, from their manifests alone."""
+    old_parts = {entry["name"]: (entry["crc"], entry["file_size"], entry["part"]) for entry in load_manifest(old_version_id)}
+    new_parts = {entry["name"]: (entry["crc"], entry["file_size"], entry["part"]) for entry in load_manifest(new_version_id)}
+    return {
+        "added": sorted(set(new_parts) - set(old_parts)),
+        "removed": sorted(set(old_parts) - set(new_parts)),
+        # Same CRC and size with a different object is the same content compressed differently
+        "changed": sorted(name for name in set(old_parts) & set(new_parts)
+                          if old_parts[name] != new_parts[name] and old_parts[name][:2] != new_parts[name][:2]),
+    }
+
+
+def download_url(version_id, filename=None):
+    return f"/api/decks/{version_id}/download" + (f"?name={filename}" if filename else "")
+
+
+def store_stats():
+    """Object, manifest and materialized counts and bytes, plus what full copies would take."""
+    def _files(sub_dir, pattern="*"):
+        base = Path(PART_STORE_DIR) / sub_dir
+        return [path for path in base.rglob(pattern) if path.is_file() and not path.name.startswith(".")] if base.is_dir() else []
+    objects, manifests, materialized = _files("objects"), _files("manifests", "*.json"), _files("materialized", "*.pptx")
+    full_copy_bytes = 0
+    for manifest_path in manifests:
+        try:
+            full_copy_bytes += assembled_size(manifest_path.stem)
+        except (PartStoreError, OSError):
+            pass
+    return {
+        "objects": len(objects),
+        "object_bytes": sum(path.stat().st_size for path in objects),
+        "versions": len(manifests),
+        "manifest_bytes": sum(path.stat().st_size for path in manifests),
+        "materialized": len(materialized),
+        "materialized_bytes": sum(path.stat().st_size for path in materialized),
+        "full_copies_bytes": full_copy_bytes,
+    }
+
+
+def _remove_unreferenced(live_parts, now):
+    """
+    Removes source entries and assembled decks of missing versions, and objects
+    outside live_parts (past OBJECT_GC_GRACE_S). Returns (objects, bytes) removed.
+    """
+    removed_objects, removed_bytes = 0, 0
+    sources_dir = Path(PART_STORE_DIR) / "sources"
+    for source_path in (sources_dir.iterdir() if sources_dir.is_dir() else []):
+        if not _manifest_path(source_path.read_text(encoding="ascii").strip()).exists():
+            source_path.unlink(missing_ok=True)
+    objects_dir = Path(PART_STORE_DIR) / "objects"
+    for object_path in (objects_dir.rglob("*") if objects_dir.is_dir() else []):
+        if (object_path.is_file() and not object_path.name.startswith(".") and object_path.name not in live_parts
+                and now - object_path.stat().st_mtime > OBJECT_GC_GRACE_S):
+            removed_bytes += object_path.stat().st_size
+            object_path.unlink(missing_ok=True)
+            removed_objects += 1
+    materialized_dir = Path(PART_STORE_DIR) / "materialized"
+    for materialized_path in (materialized_dir.glob("*.pptx") if materialized_dir.is_dir() else []):
+        if not _manifest_path(materialized_path.stem).exists():
+            materialized_path.unlink(missing_ok=True)
+    return removed_objects, removed_bytes
+
+
+def collect_garbage(max_manifest_age_s=MANIFEST_MAX_AGE_S, keep_versions=()):
+    """
+    Removes manifests unused for max_manifest_age_s (except keep_versions), source
+    entries pointing at them, and objects no remaining manifest references.
+    Returns counts of what was removed.
+    """
+    now = time.time()
+    removed = {"versions": 0, "objects": 0, "bytes": 0}
+    keep_versions = set(keep_versions)
+    live_parts = set()
+    manifests_dir = Path(PART_STORE_DIR) / "manifests"
+    for manifest_path in (manifests_dir.glob("*.json") if manifests_dir.is_dir() else []):
+        if manifest_path.stem not in keep_versions and now - manifest_path.stat().st_mtime > max_manifest_age_s:
+            manifest_path.unlink(missing_ok=True)
+            removed["versions"] += 1
+            continue
+        live_parts.update(entry["part"] for entry in json.loads(manifest_path.read_bytes())["entries"])
+    removed["objects"], removed["bytes"] = _remove_unreferenced(live_parts, now)
+    return removed
+
+
+def trim_to_size(max_bytes, keep_versions=(), min_age_s=0):
+    """
+    Removes least recently used manifests (except keep_versions and those used in
+    the last min_age_s), and the objects only they referenced, until the store
+    takes at most max_bytes. Returns counts of what was removed; bytes include
+    the removed manifests and their assembled decks.
+    """
+    now = time.time()
+    keep_versions = set(keep_versions)
+    removed = {"versions": 0, "objects": 0, "bytes": 0}
+    store_dir = Path(PART_STORE_DIR)
+    if not store_dir.is_dir():
+        return removed
+    store_bytes = sum(path.stat().st_size for path in store_dir.rglob("*") if path.is_file())
+    manifests = []  # (last used, path, parts)
+    for manifest_path in (store_dir / "manifests").glob("*.json"):
+        manifests.append((manifest_path.stat().st_mtime, manifest_path,
+                          {entry["part"] for entry in json.loads(manifest_path.read_bytes())["entries"]}))
+    part_refs = Counter(part for _, _, parts in manifests for part in parts)
+    objects = {path.name: path.stat() for path in (store_dir / "objects").rglob("*")
+               if path.is_file() and not path.name.startswith(".")}
+    # Objects no manifest references already go in the sweep below
+    store_bytes -= sum(stat.st_size for name, stat in objects.items()
+                       if not part_refs[name] and now - stat.st_mtime > OBJECT_GC_GRACE_S)
+    for last_used, manifest_path, parts in sorted(manifests, key=lambda manifest: manifest[0]):
+        if store_bytes <= max_bytes:
+            break
+        if manifest_path.stem in keep_versions or now - last_used <= min_age_s:
+            continue
+        materialized_path = store_dir / "materialized" / f"{manifest_path.stem}.pptx"
+        version_bytes = manifest_path.stat().st_size + (materialized_path.stat().st_size if materialized_path.exists() else 0)
+        store_bytes -= version_bytes
+        removed["bytes"] += version_bytes
+        for part in parts:
+            part_refs[part] -= 1
+            stat = objects.get(part)
+            if not part_refs[part] and stat is not None and now - stat.st_mtime > OBJECT_GC_GRACE_S:
+                store_bytes -= stat.st_size
+        manifest_path.unlink(missing_ok=True)
+        removed["versions"] += 1
+    removed["objects"], object_bytes = _remove_unreferenced({part for part, refs in part_refs.items() if refs}, now)
+    removed["bytes"] += object_bytes
+    return removed
+
+
+def _members_equal(expected_path, actual_path):
+    """First member whose name, order or content differs between two decks, or None."""
+    with zipfile.ZipFile(expected_path) as expected_zip, zipfile.ZipFile(actual_path) as actual_zip:
+        expected_names = [info.filename for info in expected_zip.infolist()]
+        actual_names = [info.filename for info in actual_zip.infolist()]
+        if expected_names != actual_names:
+            return "member list"
+        if actual_zip.testzip() is not None:
+            return f"corrupt member {actual_zip.testzip()}"
+        for name in expected_names:
+            if expected_zip.read(name) != actual_zip.read(name):
+                return name
+    return None
+
+
+def check_decks(pptx_paths):
+    """
+    For each deck: ingest, assemble and compare with the original; then replace the
+    first slide and compare with ppt_processor.create_modified_pptx. Prints timings
+    and the bytes each approach writes. Returns the number of mismatching decks.
+    """
+    import ppt_processor
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="part_store_check_") as tmp_dir:
+        for pptx_path in pptx_paths:
+            name = Path(pptx_path).name
+            start = time.perf_counter()
+            base_version = ingest_pptx(pptx_path)
+            ingest_s = time.perf_counter() - start
+
+            assembled_path = write_pptx(base_version, Path(tmp_dir) / f"assembled_{name}")
+            mismatch = _members_equal(pptx_path, assembled_path)
+
+            slide_part = "ppt/slides/slide1.xml"
+            slide_xml = read_part(base_version, slide_part)
+            if slide_xml is None:
+                print(f"{name}: no {slide_part}, skipping derive check")
+                failures += bool(mismatch)
+                continue
+            modified = {slide_part: slide_xml.decode("utf-8").replace("</p:sld>", "<!-- part_store check --></p:sld>")}
+
+            objects_before = store_stats()["object_bytes"]
+            start = time.perf_counter()
+            derived_version = derive_version(base_version, modified)
+            derive_s = time.perf_counter() - start
+            derived_bytes = store_stats()["object_bytes"] - objects_before
+
+            repacked_path = str(Path(tmp_dir) / f"repacked_{name}")
+            start = time.perf_counter()
+            ppt_processor.create_modified_pptx(pptx_path, modified, repacked_path)
+            repack_s = time.perf_counter() - start
+
+            derived_path = write_pptx(derived_version, Path(tmp_dir) / f"derived_{name}")
+            mismatch = mismatch or _members_equal(repacked_path, derived_path)
+            diff = diff_versions(base_version, derived_version)
+            if diff != {"added": [], "removed": [], "changed": [slide_part]}:
+                mismatch = mismatch or f"diff {diff}"
+            failures += bool(mismatch)
+            print(f"{name}: {'MISMATCH ' + mismatch if mismatch else 'ok'} | ingest {ingest_s:.3f}s | "
+                  f"derive {derive_s * 1000:.1f}ms, {derived_bytes} B written | "
+                  f"full repack {repack_s * 1000:.1f}ms, {os.path.getsize(repacked_path)} B written")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Content-addressed deck version store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check_parser = subparsers.add_parser("check", help="Round-trip decks through the store and compare with full repacking.")
+    check_parser.add_argument("decks", nargs="*", help=".pptx files to check.")
+    check_parser.add_argument("--corpus-dir", default=None, help="Check every .pptx in this directory.")
+    subparsers.add_parser("stats", help="Print store size and the size full copies would take.")
+    gc_parser = subparsers.add_parser("gc", help="Remove old versions and unreferenced parts.")
+    gc_parser.add_argument("--max-age-days", type=float, default=MANIFEST_MAX_AGE_S / 86400)
+    gc_parser.add_argument("--max-mb", type=float, default=None, help="Then remove least recently used versions down to this size.")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        decks = list(args.decks)
+        if args.corpus_dir or not decks:
+            decks += sorted(str(path) for path in Path(args.corpus_dir or DEFAULT_CORPUS_DIR).glob("*.pptx"))
+        raise SystemExit(1 if check_decks(decks) else 0)
+    elif args.command == "stats":
+        print(json.dumps(store_stats(), indent=2))
+    else:
+        print(json.dumps(collect_garbage(args.max_age_days * 86400), indent=2))
+        if args.max_mb is not None:
+            print(json.dumps(trim_to_size(args.max_mb * 1024 * 1024), indent=2))
@@ -1,14 +1,49 @@
 # --- ppt_processor.py ---
 from pptx import Presentation
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+import io
+import copy
 import json
+import base64
 import zipfile
 import os
 import shutil
+import asyncio
 from pathlib import Path
 import subprocess
 import re
 import time
-from pdf2image import convert_from_path
+import difflib
+from lxml import etree
+from xml.sax.saxutils import escape as xml_escape
+from PIL import Image, ImageDraw, ImageFont
+from pdf2image import pdfinfo_from_path
+import metrics
+import tracing
+import deadlines
+import slide_extractor
+
+# --- Rasterization profiles: DPI and image format per use ---
+RASTER_PROFILES = {
+    "thumbnail": {"dpi": 36, "fmt": "jpeg"},  # ~480px wide for 16:9 slides
+    "preview": {"dpi": 96, "fmt": "png"},     # ~1280px, what the web UI shows
+    "judge": {"dpi": 110, "fmt": "png"},      # slightly above the judge's 1024px downscale
+    "full": {"dpi": 200, "fmt": "png"},       # pdf2image default, used for stored renders
+}
+DEFAULT_RASTER_PROFILE = "full"
+RASTER_PAGES_PER_THREAD = 4
+RASTER_MAX_THREADS = min(4, os.cpu_count() or 1)
+RASTER_STREAM_CHUNK_PAGES = 16
+SOFFICE_TIMEOUT_S = 120
+SOFFICE_ATTEMPTS = 2
+POPPLER_TIMEOUT_S = 120
+# "lxml" streams slide XML (slide_extractor.pptx_to_json_fast); "python-pptx" uses pptx_to_json
+JSON_EXTRACTOR = "lxml"
+# Unmodified package members (often large media) are streamed in chunks of this size
+ZIP_COPY_CHUNK_BYTES = 1024 * 1024
+# Binary members above this size (video, audio, OLE payloads) are left empty when python-pptx
+# is only needed for slide structure (see open_presentation_lite)
+PRESENTATION_LITE_MAX_MEMBER_BYTES = 16 * 1024 * 1024
 
 def extract_text_from_shape(shape):
     """Extracts text from a shape, handling different shape types."""
@@ -25,7 +60,7 @@ def extract_text_from_shape(shape):
 def pptx_to_json(filepath):
     """Converts a .pptx file to a JSON representation."""
     try:
-        prs = Presentation(filepath)
+        prs = open_presentation_lite(filepath)
         presentation_data = {
             "filename": os.path.basename(filepath),
             "slides": []
@@ -57,6 +92,22 @@ def pptx_to_json(filepath):
         print(f"Error converting {filepath} to JSON: {e}")
         raise
 
+def extract_deck_json(filepath):
+    """pptx_to_json output from the configured JSON_EXTRACTOR, falling back to python-pptx."""
+    if JSON_EXTRACTOR == "lxml":
+        try:
+            return slide_extractor.pptx_to_json_fast(filepath)
+        except Exception as e:
+            print(f"Warning: Fast JSON extraction failed for {filepath}, falling back to python-pptx: {e}")
+    return pptx_to_json(filepath)
+
+def extract_deck_json_to_file(filepath, json_path):
+    """extract_deck_json written to json_path; for the server's CPU stage workers (see cpu_pool.py)."""
+    json_data = extract_deck_json(filepath)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(json_data, f)
+    return json_path
+
 def extract_xml_from_pptx(pptx_filepath, output_folder):
     """
     Extracts all constituent XML files from a .pptx file.
@@ -79,6 +130,32 @@ def extract_xml_from_pptx(pptx_filepath, output_folder):
         print(f"Error extracting XML from {pptx_filepath}: {e}")
         raise
 
+def _copy_zip_member(zin, zout, item):
+    """Streams one member into another archive without holding it in memory."""
+    with zin.open(item) as source, \
+         zout.open(copy.copy(item), 'w', force_zip64=item.file_size > zipfile.ZIP64_LIMIT) as target:
+        shutil.copyfileobj(source, target, ZIP_COPY_CHUNK_BYTES)
+
+def open_presentation_lite(pptx_filepath):
+    """
+    Opens a deck with python-pptx without loading its large binary members, which
+    python-pptx would otherwise read into memory in full. They are replaced by empty
+    parts in an in-memory copy of the package; everything else is unchanged.
+    """
+    with zipfile.ZipFile(pptx_filepath, 'r') as zin:
+        large_members = {item.filename for item in zin.infolist()
+                         if item.file_size > PRESENTATION_LITE_MAX_MEMBER_BYTES and not item.filename.endswith(('.xml', '.rels'))}
+        if not large_members:
+            return Presentation(pptx_filepath)
+        package_buffer = io.BytesIO()
+        with zipfile.ZipFile(package_buffer, 'w', zipfile.ZIP_STORED) as zout:
+            for item in zin.infolist():
+                zout.writestr(item.filename, b"" if item.filename in large_members else zin.read(item))
+    package_buffer.seek(0)
+    return Presentation(package_buffer)
+
+@metrics.timed_stage("repack")
+@tracing.traced("repack")
 def create_modified_pptx(original_pptx_path, modified_xml_map, output_pptx_path):
     """
     Creates a new .pptx file by taking an original .pptx, and replacing
@@ -96,13 +173,14 @@ def create_modified_pptx(original_pptx_path, modified_xml_map, output_pptx_path)
                         new_content = modified_xml_map[item_name_normalized]
                         zout.writestr(item, new_content.encode('utf-8'))
                     else:
-                        buffer = zin.read(item.filename)
-                        zout.writestr(item, buffer)
+                        _copy_zip_member(zin, zout, item)
         os.replace(temp_output_pptx_path, output_pptx_path)
+        tracing.set_attributes(modified_parts=len(modified_xml_map), output_bytes=os.path.getsize(output_pptx_path))
         print(f"Modified PPTX successfully created at: {output_pptx_path}")
         return True
     except Exception as e:
         print(f"Error creating modified PPTX at {output_pptx_path}: {e}")
+        metrics.record_error("repack", type(e).__name__)
         if os.path.exists(temp_output_pptx_path):
             os.remove(temp_output_pptx_path)
         return False
@@ -120,6 +198,83 @@ def _find_soffice_command():
                 print(f"Soffice command '{cmd}' not working or timed out: {e}")
     return None
 
+def _soffice_convert_args(soffice_cmd, temp_profile_dir, output_folder, pptx_filepath):
+    return [
+        soffice_cmd,
+        # ** FIX: Isolate LibreOffice instance to prevent parallel conflicts **
+        f"-env:UserInstallation=file://{os.path.abspath(temp_profile_dir)}",
+        '--headless',
+        '--convert-to', 'pdf',
+        '--outdir', output_folder,
+        pptx_filepath
+    ]
+
+def _soffice_attempt_failed(attempt, attempt_span, pptx_filepath, error):
+    """Logs and records a failed conversion attempt (error None: no PDF was written). Returns True to retry."""
+    if error is None:
+        print(f"Attempt {attempt + 1}: PDF not found for {Path(pptx_filepath).name}. Retrying...")
+        outcome = "pdf_missing"
+    elif isinstance(error, subprocess.CalledProcessError):
+        print(f"Attempt {attempt + 1}: Soffice error for {Path(pptx_filepath).name}. STDERR: {(error.stderr or '').strip()}")
+        outcome = "soffice_error"
+    elif isinstance(error, subprocess.TimeoutExpired):
+        print(f"Attempt {attempt + 1}: Soffice timed out converting {Path(pptx_filepath).name}.")
+        outcome = "timeout"
+    else:
+        print(f"Attempt {attempt + 1}: Unexpected error during PDF conversion: {error}")
+        outcome = type(error).__name__
+    attempt_span.set_attribute("outcome", outcome)
+    metrics.record_error("pdf_conversion", outcome)
+    return outcome in ("pdf_missing", "soffice_error", "timeout")
+
+def _soffice_converted(attempt_span, pdf_path, temp_profile_dir):
+    attempt_span.set_attribute("outcome", "converted")
+    attempt_span.set_attribute("pdf_bytes", pdf_path.stat().st_size)
+    shutil.rmtree(temp_profile_dir, ignore_errors=True)
+    return str(pdf_path)
+
+def _soffice_failed(pptx_filepath, temp_profile_dir):
+    shutil.rmtree(temp_profile_dir, ignore_errors=True)
+    print(f"Failed to convert {Path(pptx_filepath).name} to PDF after all attempts.")
+    return None
+
+def _run_subprocesses(commands, timeout, stage):
+    """
+    Runs commands in parallel; raises like subprocess.run(check=True) for the first
+    that fails. The timeout is capped by the request deadline (see deadlines.py) and
+    every process is killed when the deadline ends or the client goes away.
+    """
+    deadlines.check(stage)
+    timeout = deadlines.bounded(timeout)
+    start_time = time.monotonic()
+    processes = []
+
+    def kill_all():
+        for process in processes:
+            process.kill()
+
+    try:
+        for command_args in commands:
+            processes.append(subprocess.Popen(command_args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True))
+        with deadlines.on_cancel(kill_all):
+            stderr_outputs = []
+            for process in processes:
+                try:
+                    stderr_outputs.append(process.communicate(timeout=max(timeout - (time.monotonic() - start_time), 0))[1])
+                except subprocess.TimeoutExpired:
+                    deadlines.check(stage)
+                    raise subprocess.TimeoutExpired(process.args, timeout)
+        deadlines.check(stage)
+        for process, stderr in zip(processes, stderr_outputs):
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, process.args, stderr=stderr)
+    finally:
+        kill_all()
+        for process in processes:
+            process.wait()
+
+@metrics.timed_stage("pdf_conversion")
+@tracing.traced("pdf_conversion")
 def _convert_pptx_to_pdf(pptx_filepath, output_folder, soffice_cmd):
     """Converts a PPTX to a single PDF file using an isolated user profile for stability."""
     # Create a unique, temporary profile directory for this specific conversion process
@@ -128,64 +283,122 @@ def _convert_pptx_to_pdf(pptx_filepath, output_folder, soffice_cmd):
     
     pdf_path = Path(output_folder) / (Path(pptx_filepath).stem + ".pdf")
     
-    for attempt in range(2): # Retry mechanism
-        try:
-            command_args = [
-                soffice_cmd,
-                # ** FIX: Isolate LibreOffice instance to prevent parallel conflicts **
-                f"-env:UserInstallation=file://{os.path.abspath(temp_profile_dir)}",
-                '--headless',
-                '--convert-to', 'pdf',
-                '--outdir', output_folder,
-                pptx_filepath
-            ]
-            subprocess.run(command_args, capture_output=True, text=True, timeout=120, check=True)
-            
-            if pdf_path.exists():
+    for attempt in range(SOFFICE_ATTEMPTS): # Retry mechanism
+        with tracing.span("soffice.attempt", attempt=attempt + 1, command=soffice_cmd) as attempt_span:
+            try:
+                _run_subprocesses([_soffice_convert_args(soffice_cmd, temp_profile_dir, output_folder, pptx_filepath)],
+                                  SOFFICE_TIMEOUT_S, "pdf_conversion")
+                error = None
+            except deadlines.RequestCancelled as e:
+                attempt_span.set_attribute("outcome", e.reason)
                 shutil.rmtree(temp_profile_dir, ignore_errors=True)
-                return str(pdf_path)
-            
-            print(f"Attempt {attempt + 1}: PDF not found for {Path(pptx_filepath).name}. Retrying...")
-            time.sleep(1)
-
-        except subprocess.CalledProcessError as e:
-            print(f"Attempt {attempt + 1}: Soffice error for {Path(pptx_filepath).name}. STDERR: {e.stderr.strip()}")
-            time.sleep(1)
-        except Exception as e:
-            print(f"Attempt {attempt + 1}: Unexpected error during PDF conversion: {e}")
-            break
+                raise
+            except Exception as e:
+                error = e
+            if error is None and pdf_path.exists():
+                return _soffice_converted(attempt_span, pdf_path, temp_profile_dir)
+            if not _soffice_attempt_failed(attempt, attempt_span, pptx_filepath, error):
+                break
+            deadlines.sleep(1)
     
-    shutil.rmtree(temp_profile_dir, ignore_errors=True)
-    print(f"Failed to convert {Path(pptx_filepath).name} to PDF after all attempts.")
-    return None
+    return _soffice_failed(pptx_filepath, temp_profile_dir)
+
+
+def _page_runs(pages):
+    """Groups page numbers into contiguous (first, last) runs: [1, 2, 3, 7] -> [(1, 3), (7, 7)]."""
+    runs = []
+    for page in sorted(set(pages)):
+        if runs and page == runs[-1][1] + 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return [tuple(run) for run in runs]
+
+def _raster_thread_count(page_count):
+    """One pdftoppm process per RASTER_PAGES_PER_THREAD pages, capped at RASTER_MAX_THREADS."""
+    return max(1, min(RASTER_MAX_THREADS, page_count // RASTER_PAGES_PER_THREAD))
+
+def _pdftoppm_args(pdf_filepath, output_folder, raster_profile, first_page, last_page):
+    """
+    pdftoppm command for a run of pages. Returns (command, output root): pdftoppm writes
+    <root>-<page>.<ext>, and a root per run keeps concurrent runs apart.
+    """
+    output_root = f"slide-{first_page:04d}"
+    command_args = [
+        "pdftoppm", "-r", str(raster_profile["dpi"]), "-f", str(first_page), "-l", str(last_page),
+        f"-{raster_profile['fmt']}", pdf_filepath, os.path.join(output_folder, output_root)
+    ]
+    return command_args, output_root
 
+def _pdftoppm_outputs(output_folder, output_root, raster_profile, first_page, last_page):
+    """Image paths pdftoppm wrote for a run of pages."""
+    extension = "jpg" if raster_profile["fmt"] == "jpeg" else raster_profile["fmt"]
+    return [str(path) for path in Path(output_folder).glob(f"{output_root}-*.{extension}")
+            if first_page <= (slide_number_from_image_path(path) or 0) <= last_page]
 
-def _convert_pdf_to_images(pdf_filepath, output_folder):
-    """Converts a PDF file's pages to PNG images."""
-    print(f"Converting PDF {pdf_filepath} to images...")
+def iter_pdf_page_images(pdf_filepath, output_folder, profile=DEFAULT_RASTER_PROFILE, pages=None, thread_count=None):
+    """
+    Rasterizes a PDF with the given profile (see RASTER_PROFILES) and yields
+    (page_number, image_path) as each chunk of pages is written, so callers can use
+    early pages before the rest are done and no page image is held in memory.
+    pages: optional iterable of 1-based page numbers; all pages when None.
+    """
+    raster_profile = RASTER_PROFILES[profile]
     try:
-        images = convert_from_path(
-            pdf_filepath,
-            output_folder=output_folder,
-            fmt='png',
-            output_file='slide-',
-            paths_only=True
-        )
-        print(f"Successfully converted PDF to {len(images)} images.")
-        return sorted(images)
+        if pages is None:
+            page_count = pdfinfo_from_path(pdf_filepath)["Pages"]
+            runs = [(1, page_count)] if page_count else []
+        else:
+            runs = _page_runs(pages)
     except Exception as e:
-        print(f"An error occurred converting PDF to images: {e}")
-        print("Please ensure 'poppler' is installed on your system.")
-        print("On macOS: 'brew install poppler'")
-        print("On Debian/Ubuntu: 'sudo apt-get install poppler-utils'")
-        return []
+        print(f"An error occurred reading PDF info for {pdf_filepath}: {e}")
+        metrics.record_error("rasterization", type(e).__name__)
+        return
 
+    for first_page, last_page in runs:
+        for chunk_first in range(first_page, last_page + 1, RASTER_STREAM_CHUNK_PAGES):
+            chunk_last = min(chunk_first + RASTER_STREAM_CHUNK_PAGES - 1, last_page)
+            chunk_threads = thread_count or _raster_thread_count(chunk_last - chunk_first + 1)
+            # The chunk's pages split evenly over chunk_threads pdftoppm processes
+            pages_per_process = -(-(chunk_last - chunk_first + 1) // chunk_threads)
+            process_runs = [(run_first, min(run_first + pages_per_process - 1, chunk_last))
+                            for run_first in range(chunk_first, chunk_last + 1, pages_per_process)]
+            try:
+                with metrics.track_stage("rasterization"), \
+                     tracing.span("pdftoppm", profile=profile, dpi=raster_profile["dpi"], first_page=chunk_first,
+                                  last_page=chunk_last, thread_count=len(process_runs)) as chunk_span:
+                    commands = [_pdftoppm_args(pdf_filepath, output_folder, raster_profile, run_first, run_last)
+                                for run_first, run_last in process_runs]
+                    _run_subprocesses([command_args for command_args, _ in commands], POPPLER_TIMEOUT_S, "rasterization")
+                    image_paths = [image_path
+                                   for (_, output_root), (run_first, run_last) in zip(commands, process_runs)
+                                   for image_path in _pdftoppm_outputs(output_folder, output_root, raster_profile,
+                                                                       run_first, run_last)]
+                    chunk_span.set_attribute("page_count", len(image_paths))
+            except deadlines.RequestCancelled:
+                raise
+            except Exception as e:
+                print(f"An error occurred converting PDF to images: {e}")
+                print("Please ensure 'poppler' is installed on your system.")
+                print("On macOS: 'brew install poppler'")
+                print("On Debian/Ubuntu: 'sudo apt-get install poppler-utils'")
+                return
+            for image_path in sorted(image_paths, key=lambda p: slide_number_from_image_path(p) or 0):
+                yield slide_number_from_image_path(image_path), image_path
 
+def _convert_pdf_to_images(pdf_filepath, output_folder, profile=DEFAULT_RASTER_PROFILE, pages=None, thread_count=None):
+    """Converts a PDF file's pages to images. Returns their paths in page order."""
+    print(f"Converting PDF {pdf_filepath} to images (profile '{profile}', pages: {'all' if pages is None else sorted(pages)})...")
+    images = [image_path for _, image_path in iter_pdf_page_images(pdf_filepath, output_folder, profile, pages, thread_count)]
+    print(f"Successfully converted PDF to {len(images)} images.")
+    return images
 
-def export_slides_to_images(pptx_filepath, output_folder):
+
+def iter_slide_images(pptx_filepath, output_folder, profile=DEFAULT_RASTER_PROFILE, slides=None, thread_count=None):
     """
-    Robustly converts each slide of a .pptx file to a .png image by first
-    converting to PDF, then splitting the PDF into images.
+    Streaming form of export_slides_to_images: converts the .pptx to PDF, then yields
+    (slide_number, image_path) as pages are rasterized. The intermediate PDF is
+    removed once the generator is exhausted or closed.
     """
     abs_pptx_filepath = os.path.abspath(pptx_filepath)
     abs_output_folder = os.path.abspath(output_folder)
@@ -194,22 +407,205 @@ def export_slides_to_images(pptx_filepath, output_folder):
     soffice_cmd = _find_soffice_command()
     if not soffice_cmd:
         print("Error: LibreOffice command not found. Cannot proceed with image conversion.")
-        return []
+        metrics.record_error("pdf_conversion", "soffice_not_found")
+        return
 
     pdf_path = _convert_pptx_to_pdf(abs_pptx_filepath, abs_output_folder, soffice_cmd)
     
     if not pdf_path:
+        return
+
+    try:
+        yield from iter_pdf_page_images(pdf_path, abs_output_folder, profile, slides, thread_count)
+    finally:
+        try:
+            os.remove(pdf_path)
+            print(f"Cleaned up intermediate PDF: {pdf_path}")
+        except OSError as e:
+            print(f"Warning: Could not remove intermediate PDF {pdf_path}: {e}")
+
+@tracing.traced("render_slides")
+def export_slides_to_images(pptx_filepath, output_folder, profile=DEFAULT_RASTER_PROFILE, slides=None, thread_count=None, on_image=None):
+    """
+    Robustly converts each slide of a .pptx file to an image by first
+    converting to PDF, then splitting the PDF into images.
+    profile selects DPI and format (see RASTER_PROFILES); slides limits rendering to
+    the given 1-based slide numbers. on_image(slide_number, image_path) is called as
+    each image is written. Returns image paths in slide order.
+    """
+    tracing.set_attributes(profile=profile, requested_slides=len(slides) if slides is not None else "all")
+    image_paths = []
+    for slide_number, image_path in iter_slide_images(pptx_filepath, output_folder, profile, slides, thread_count):
+        image_paths.append(image_path)
+        if on_image:
+            on_image(slide_number, image_path)
+    return image_paths
+
+
+# --- Async rendering (asgi.py) ---
+# The same conversion as above with soffice and pdftoppm run as asyncio
+# subprocesses, so a render in progress holds no thread while it waits.
+
+async def _run_subprocess_async(command_args, timeout, stage):
+    """
+    Runs a command on the event loop; raises like subprocess.run(check=True). The process
+    is killed on timeout (capped by the request deadline) or cancellation.
+    """
+    deadlines.check(stage)
+    timeout = deadlines.bounded(timeout)
+    process = await asyncio.create_subprocess_exec(
+        *command_args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        deadlines.check(stage)
+        raise subprocess.TimeoutExpired(command_args, timeout)
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command_args,
+                                            stderr=stderr.decode('utf-8', errors='replace'))
+
+async def _convert_pptx_to_pdf_async(pptx_filepath, output_folder, soffice_cmd):
+    """Async form of _convert_pptx_to_pdf."""
+    with metrics.track_stage("pdf_conversion"), tracing.span("pdf_conversion"):
+        temp_profile_dir = Path(output_folder) / f"lo_profile_{os.getpid()}_{time.time_ns()}"
+        temp_profile_dir.mkdir(parents=True, exist_ok=True)
+        pdf_path = Path(output_folder) / (Path(pptx_filepath).stem + ".pdf")
+
+        for attempt in range(SOFFICE_ATTEMPTS):
+            with tracing.span("soffice.attempt", attempt=attempt + 1, command=soffice_cmd) as attempt_span:
+                try:
+                    await _run_subprocess_async(
+                        _soffice_convert_args(soffice_cmd, temp_profile_dir, output_folder, pptx_filepath),
+                        SOFFICE_TIMEOUT_S, "pdf_conversion")
+                    error = None
+                except (asyncio.CancelledError, deadlines.RequestCancelled):
+                    shutil.rmtree(temp_profile_dir, ignore_errors=True)
+                    raise
+                except Exception as e:
+                    error = e
+                if error is None and pdf_path.exists():
+                    return _soffice_converted(attempt_span, pdf_path, temp_profile_dir)
+                if not _soffice_attempt_failed(attempt, attempt_span, pptx_filepath, error):
+                    break
+                await asyncio.sleep(1)
+
+        return _soffice_failed(pptx_filepath, temp_profile_dir)
+
+async def _convert_pdf_to_images_async(pdf_filepath, output_folder, profile=DEFAULT_RASTER_PROFILE, pages=None):
+    """
+    Async form of _convert_pdf_to_images: one pdftoppm process per RASTER_PAGES_PER_THREAD
+    pages, at most RASTER_MAX_THREADS at a time. Returns image paths in page order.
+    """
+    raster_profile = RASTER_PROFILES[profile]
+    try:
+        if pages is None:
+            page_count = (await asyncio.to_thread(pdfinfo_from_path, pdf_filepath))["Pages"]
+            runs = [(1, page_count)] if page_count else []
+        else:
+            runs = _page_runs(pages)
+    except Exception as e:
+        print(f"An error occurred reading PDF info for {pdf_filepath}: {e}")
+        metrics.record_error("rasterization", type(e).__name__)
         return []
+    chunks = [(chunk_first, min(chunk_first + RASTER_PAGES_PER_THREAD - 1, last_page))
+              for first_page, last_page in runs
+              for chunk_first in range(first_page, last_page + 1, RASTER_PAGES_PER_THREAD)]
+    process_slots = asyncio.Semaphore(RASTER_MAX_THREADS)
+
+    async def rasterize(first_page, last_page):
+        command_args, output_root = _pdftoppm_args(pdf_filepath, output_folder, raster_profile, first_page, last_page)
+        async with process_slots:
+            with metrics.track_stage("rasterization"), \
+                 tracing.span("pdftoppm", profile=profile, dpi=raster_profile["dpi"], first_page=first_page,
+                              last_page=last_page) as chunk_span:
+                await _run_subprocess_async(command_args, POPPLER_TIMEOUT_S, "rasterization")
+                image_paths = _pdftoppm_outputs(output_folder, output_root, raster_profile, first_page, last_page)
+                chunk_span.set_attribute("page_count", len(image_paths))
+        return image_paths
+
+    print(f"Converting PDF {pdf_filepath} to images (profile '{profile}', pages: {'all' if pages is None else sorted(pages)})...")
+    images = []
+    for result in await asyncio.gather(*(rasterize(*chunk) for chunk in chunks), return_exceptions=True):
+        if isinstance(result, (asyncio.CancelledError, deadlines.RequestCancelled)):
+            raise result
+        if isinstance(result, Exception):
+            print(f"An error occurred converting PDF to images: {result}")
+            print("Please ensure 'poppler' is installed on your system.")
+            continue
+        images.extend(result)
+    images.sort(key=lambda p: slide_number_from_image_path(p) or 0)
+    print(f"Successfully converted PDF to {len(images)} images.")
+    return images
+
+async def export_slides_to_images_async(pptx_filepath, output_folder, profile=DEFAULT_RASTER_PROFILE, slides=None):
+    """Async form of export_slides_to_images. Returns image paths in slide order."""
+    with tracing.span("render_slides", profile=profile, requested_slides=len(slides) if slides is not None else "all"):
+        abs_pptx_filepath = os.path.abspath(pptx_filepath)
+        abs_output_folder = os.path.abspath(output_folder)
+        Path(abs_output_folder).mkdir(parents=True, exist_ok=True)
+
+        soffice_cmd = await asyncio.to_thread(_find_soffice_command)
+        if not soffice_cmd:
+            print("Error: LibreOffice command not found. Cannot proceed with image conversion.")
+            metrics.record_error("pdf_conversion", "soffice_not_found")
+            return []
+
+        pdf_path = await _convert_pptx_to_pdf_async(abs_pptx_filepath, abs_output_folder, soffice_cmd)
+        if not pdf_path:
+            return []
+        try:
+            return await _convert_pdf_to_images_async(pdf_path, abs_output_folder, profile, slides)
+        finally:
+            try:
+                os.remove(pdf_path)
+                print(f"Cleaned up intermediate PDF: {pdf_path}")
+            except OSError as e:
+                print(f"Warning: Could not remove intermediate PDF {pdf_path}: {e}")
+
+def slide_number_from_xml_path(xml_path):
+    """Returns N for 'ppt/slides/slideN.xml', or None for any other part."""
+    match = re.search(r'ppt/slides/slide(\d+)\.xml$', str(xml_path).replace("\\", "/"))
+    return int(match.group(1)) if match else None
 
-    image_paths = _convert_pdf_to_images(pdf_path, abs_output_folder)
+def slide_number_from_image_path(image_path):
+    """Returns the 1-based page number pdf2image encodes at the end of a file name (e.g. 'slide-0001-03.png')."""
+    match = re.search(r'-(\d+)\.(?:png|jpe?g|webp|svg)$', Path(image_path).name)
+    return int(match.group(1)) if match else None
 
+def map_slide_images(image_folder):
+    """Maps slide numbers to the rendered slide images in a folder."""
+    image_folder = Path(image_folder)
+    if not image_folder.is_dir():
+        return {}
+    slide_images = {}
+    for image_path in image_folder.iterdir():
+        slide_number = slide_number_from_image_path(image_path)
+        if slide_number is not None:
+            slide_images[slide_number] = image_path
+    return slide_images
+
+def _pretty_xml_lines(xml_text):
+    """One element per line, so diffs of single-line package XML stay readable."""
+    if isinstance(xml_text, str):
+        xml_text = xml_text.encode('utf-8')
     try:
-        os.remove(pdf_path)
-        print(f"Cleaned up intermediate PDF: {pdf_path}")
-    except OSError as e:
-        print(f"Warning: Could not remove intermediate PDF {pdf_path}: {e}")
+        parser = etree.XMLParser(remove_blank_text=True, resolve_entities=False, no_network=True)
+        root = etree.fromstring(xml_text, parser)
+        return etree.tostring(root, pretty_print=True, encoding='unicode').splitlines(keepends=True)
+    except (etree.XMLSyntaxError, ValueError):
+        return xml_text.decode('utf-8', errors='replace').splitlines(keepends=True)
 
-    return image_paths
+def unified_xml_diff(original_xml, modified_xml, part_name, context_lines=2):
+    """Unified diff between two versions of a package part, after pretty-printing both."""
+    return "".join(difflib.unified_diff(
+        _pretty_xml_lines(original_xml or ""), _pretty_xml_lines(modified_xml),
+        fromfile=f"a/{part_name}", tofile=f"b/{part_name}", n=context_lines
+    ))
 
 def extract_specific_xml_from_pptx(pptx_filepath, xml_filename):
     """
@@ -232,4 +628,521 @@ def extract_specific_xml_from_pptx(pptx_filepath, xml_filename):
             return None
     except Exception as e:
         print(f"Error extracting specific XML '{xml_filename}' from {pptx_filepath}: {e}")
-        return None
\ No newline at end of file
+        return None
+
+# --- Fast preview renderer (approximate, no LibreOffice) ---
+# Draws slides straight from their XML: shape geometry, solid fills and outlines,
+# pictures, tables and text runs laid out with real font metrics. Good enough to
+# show what an edit did in well under a second; LibreOffice stays the
+# full-fidelity renderer.
+PREVIEW_WIDTH_PX = 1280
+PREVIEW_FONT_FILES = {
+    (False, False): ("DejaVuSans.ttf", "Arial.ttf", "LiberationSans-Regular.ttf"),
+    (True, False): ("DejaVuSans-Bold.ttf", "Arial Bold.ttf", "LiberationSans-Bold.ttf"),
+    (False, True): ("DejaVuSans-Oblique.ttf", "Arial Italic.ttf", "LiberationSans-Italic.ttf"),
+    (True, True): ("DejaVuSans-BoldOblique.ttf", "Arial Bold Italic.ttf", "LiberationSans-BoldItalic.ttf"),
+}
+PREVIEW_SVG_FONT_FAMILY = "DejaVu Sans, Arial, Helvetica, sans-serif"
+# Office theme, used when the deck's own theme cannot be read
+PREVIEW_DEFAULT_THEME = {
+    "dk1": "000000", "lt1": "FFFFFF", "dk2": "44546A", "lt2": "E7E6E6",
+    "accent1": "4472C4", "accent2": "ED7D31", "accent3": "A5A5A5", "accent4": "FFC000",
+    "accent5": "5B9BD5", "accent6": "70AD47", "hlink": "0563C1", "folHlink": "954F72",
+}
+PREVIEW_THEME_ALIASES = {"tx1": "dk1", "bg1": "lt1", "tx2": "dk2", "bg2": "lt2"}
+PREVIEW_DEFAULT_FONT_PT = {"title": 40, "center_title": 44, "subtitle": 24, "body": 24, "object": 24}
+PREVIEW_FALLBACK_FONT_PT = 18
+PREVIEW_LINE_SPACING = 1.2
+PREVIEW_LINE_PRESETS = {"line", "straightConnector1", "bentConnector3", "curvedConnector3"}
+
+_NS = {
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+}
+_preview_font_cache = {}
+
+
+def _preview_font(size_px, bold=False, italic=False):
+    """A FreeType font for text measurement and drawing, cached per size and style."""
+    key = (max(1, int(round(size_px))), bool(bold), bool(italic))
+    font = _preview_font_cache.get(key)
+    if font is None:
+        for font_file in PREVIEW_FONT_FILES[key[1:]]:
+            try:
+                font = ImageFont.truetype(font_file, key[0])
+                break
+            except OSError:
+                continue
+        if font is None:
+            font = ImageFont.load_default(size=key[0])
+        _preview_font_cache[key] = font
+    return font
+
+
+def _theme_colors(prs):
+    """Color scheme of the deck's theme (dk1, lt1, accent1, ...) as hex strings."""
+    colors = dict(PREVIEW_DEFAULT_THEME)
+    try:
+        theme_part = prs.slide_master.part.part_related_by(RT.THEME)
+        scheme = etree.fromstring(theme_part.blob).find(".//a:clrScheme", _NS)
+        for entry in scheme if scheme is not None else []:
+            if len(entry):
+                value = entry[0].get("val") if etree.QName(entry[0]).localname == "srgbClr" else entry[0].get("lastClr")
+                if value:
+                    colors[etree.QName(entry).localname] = value
+    except Exception as e:
+        print(f"Warning: Could not read theme colors, using defaults: {e}")
+    for alias, name in PREVIEW_THEME_ALIASES.items():
+        colors[alias] = colors[name]
+    return colors
+
+
+def _color_from(parent, theme):
+    """Hex color of the first color element under parent (srgbClr, schemeClr, sysClr)."""
+    if parent is None:
+        return None
+    for child in parent:
+        local_name = etree.QName(child).localname
+        if local_name == "srgbClr":
+            return child.get("val")
+        if local_name == "schemeClr":
+            return theme.get(child.get("val"))
+        if local_name == "sysClr":
+            return child.get("lastClr")
+    return None
+
+
+def _fill_color(sp_pr, style, theme):
+    """Solid (or first gradient stop) fill of a shape, falling back to its style's fillRef."""
+    if sp_pr is not None:
+        if sp_pr.find("a:noFill", _NS) is not None:
+            return None
+        solid = sp_pr.find("a:solidFill", _NS)
+        if solid is not None:
+            return _color_from(solid, theme)
+        gradient_stop = sp_pr.find("a:gradFill/a:gsLst/a:gs", _NS)
+        if gradient_stop is not None:
+            return _color_from(gradient_stop, theme)
+    fill_ref = style.find("a:fillRef", _NS) if style is not None else None
+    if fill_ref is not None and fill_ref.get("idx") not in (None, "0"):
+        return _color_from(fill_ref, theme)
+    return None
+
+
+def _line_style(sp_pr, style, theme):
+    """(color, width in EMU) of a shape outline, or (None, 0)."""
+    line = sp_pr.find("a:ln", _NS) if sp_pr is not None else None
+    width = int(line.get("w", 12700)) if line is not None else 12700
+    if line is not None:
+        if line.find("a:noFill", _NS) is not None:
+            return None, 0
+        solid = line.find("a:solidFill", _NS)
+        if solid is not None:
+            return _color_from(solid, theme), width
+    line_ref = style.find("a:lnRef", _NS) if style is not None else None
+    if line_ref is not None and line_ref.get("idx") not in (None, "0"):
+        return _color_from(line_ref, theme), width
+    return None, 0
+
+
+def _background_color(slide, theme):
+    """Solid background of the slide, its layout or its master; the theme's lt1 otherwise."""
+    for part_element in (slide._element, slide.slide_layout._element, slide.slide_layout.slide_master._element):
+        bg_fill = part_element.find("p:cSld/p:bg/p:bgPr/a:solidFill", _NS)
+        if bg_fill is not None:
+            return _color_from(bg_fill, theme) or "FFFFFF"
+        bg_ref = part_element.find("p:cSld/p:bg/p:bgRef", _NS)
+        if bg_ref is not None:
+            return _color_from(bg_ref, theme) or "FFFFFF"
+    return theme.get("lt1", "FFFFFF")
+
+
+def _placeholder_kind(shape):
+    """'title', 'center_title', 'body', ... for placeholders, None for other shapes."""
+    if not shape.is_placeholder:
+        return None
+    try:
+        return str(shape.placeholder_format.type).split(" ")[0].lower()
+    except Exception:
+        return None
+
+
+def _text_paragraphs(tx_body, theme, default_size_pt, default_align):
+    """
+    Paragraphs of a txBody as {"align", "size_pt", "runs"}, where runs holds
+    {"text", "size_pt", "bold", "italic", "color"} dicts and None for line breaks.
+    """
+    paragraphs = []
+    body_pr = tx_body.find("a:bodyPr", _NS)
+    autofit = body_pr.find("a:normAutofit", _NS) if body_pr is not None else None
+    font_scale = int(autofit.get("fontScale", 100000)) / 100000 if autofit is not None else 1.0
+    for paragraph in tx_body.findall("a:p", _NS):
+        p_pr = paragraph.find("a:pPr", _NS)
+        end_r_pr = paragraph.find("a:endParaRPr", _NS)
+        paragraph_size = int(end_r_pr.get("sz")) / 100 if end_r_pr is not None and end_r_pr.get("sz") else default_size_pt
+        runs = []
+        for child in paragraph:
+            local_name = etree.QName(child).localname
+            if local_name == "br":
+                runs.append(None)
+            elif local_name in ("r", "fld"):
+                r_pr = child.find("a:rPr", _NS)
+                text_element = child.find("a:t", _NS)
+                size_pt = int(r_pr.get("sz")) / 100 if r_pr is not None and r_pr.get("sz") else paragraph_size
+                runs.append({
+                    "text": text_element.text or "" if text_element is not None else "",
+                    "size_pt": size_pt * font_scale,
+                    "bold": r_pr is not None and r_pr.get("b") in ("1", "true"),
+                    "italic": r_pr is not None and r_pr.get("i") in ("1", "true"),
+                    "color": _color_from(r_pr.find("a:solidFill", _NS), theme) if r_pr is not None else None,
+                })
+        paragraphs.append({
+            "align": p_pr.get("algn") if p_pr is not None and p_pr.get("algn") else default_align,
+            "size_pt": paragraph_size * font_scale,
+            "runs": runs,
+        })
+    return paragraphs
+
+
+def _text_block(tx_body, theme, placeholder_kind=None, default_align="l", default_color=None):
+    """Text frame settings plus paragraphs, or None when the body holds no text."""
+    if tx_body is None:
+        return None
+    default_size = PREVIEW_DEFAULT_FONT_PT.get(placeholder_kind, PREVIEW_FALLBACK_FONT_PT)
+    if placeholder_kind in ("center_title", "subtitle"):
+        default_align = "ctr"
+    paragraphs = _text_paragraphs(tx_body, theme, default_size, default_align)
+    if not any(run and run["text"].strip() for paragraph in paragraphs for run in paragraph["runs"]):
+        return None
+    body_pr = tx_body.find("a:bodyPr", _NS)
+    body_attrs = body_pr.attrib if body_pr is not None else {}
+    return {
+        "paragraphs": paragraphs,
+        "color": default_color,
+        "anchor": body_attrs.get("anchor", "ctr" if placeholder_kind in ("title", "center_title") else "t"),
+        "wrap": body_attrs.get("wrap", "square") != "none",
+        "insets": [int(body_attrs.get(name, default)) for name, default in
+                   (("lIns", 91440), ("tIns", 45720), ("rIns", 91440), ("bIns", 45720))],
+    }
+
+
+def _shape_box(shape, transform):
+    """Slide-space EMU box (x0, y0, x1, y1) of a shape under a group transform."""
+    if shape.left is None or shape.width is None:
+        return None
+    scale_x, scale_y, offset_x, offset_y = transform
+    x0 = shape.left * scale_x + offset_x
+    y0 = shape.top * scale_y + offset_y
+    return (x0, y0, x0 + shape.width * scale_x, y0 + shape.height * scale_y)
+
+
+def _group_transform(group_shape, transform):
+    """Maps a group's child coordinate space (chOff/chExt) onto the slide."""
+    xfrm = group_shape._element.find("p:grpSpPr/a:xfrm", _NS)
+    if xfrm is None:
+        return transform
+    off, ext = xfrm.find("a:off", _NS), xfrm.find("a:ext", _NS)
+    child_off, child_ext = xfrm.find("a:chOff", _NS), xfrm.find("a:chExt", _NS)
+    if any(element is None for element in (off, ext, child_off, child_ext)):
+        return transform
+    kx = int(ext.get("cx")) / max(int(child_ext.get("cx")), 1)
+    ky = int(ext.get("cy")) / max(int(child_ext.get("cy")), 1)
+    scale_x, scale_y, offset_x, offset_y = transform
+    return (scale_x * kx, scale_y * ky,
+            offset_x + scale_x * (int(off.get("x")) - int(child_off.get("x")) * kx),
+            offset_y + scale_y * (int(off.get("y")) - int(child_off.get("y")) * ky))
+
+
+def _collect_scene_items(shapes, theme, transform, items):
+    for shape in shapes:
+        element = shape._element
+        local_name = etree.QName(element).localname
+        if local_name == "grpSp":
+            _collect_scene_items(shape.shapes, theme, _group_transform(shape, transform), items)
+            continue
+        box = _shape_box(shape, transform)
+        if box is None:
+            continue
+        sp_pr = element.find("p:spPr", _NS)
+        style = element.find("p:style", _NS)
+        xfrm = sp_pr.find("a:xfrm", _NS) if sp_pr is not None else None
+        item = {
+            "box": box,
+            "rotation": int(xfrm.get("rot", 0)) / 60000 if xfrm is not None else 0,
+            "flip_h": xfrm is not None and xfrm.get("flipH") == "1",
+            "flip_v": xfrm is not None and xfrm.get("flipV") == "1",
+        }
+        geometry = sp_pr.find("a:prstGeom", _NS) if sp_pr is not None else None
+        preset = geometry.get("prst") if geometry is not None else "rect"
+
+        if local_name == "pic":
+            try:
+                item.update(kind="picture", image=shape.image.blob)
+            except Exception:
+                item.update(kind="rect", fill="DDDDDD", line="999999", line_width=12700)
+            items.append(item)
+        elif local_name == "graphicFrame" and shape.has_table:
+            cells = []
+            row_y = box[1]
+            scale_x, scale_y = transform[0], transform[1]
+            for row in shape.table.rows:
+                cell_x = box[0]
+                for column, cell in zip(shape.table.columns, row.cells):
+                    cell_box = (cell_x, row_y, cell_x + column.width * scale_x, row_y + row.height * scale_y)
+                    cells.append({
+                        "box": cell_box,
+                        "fill": _fill_color(cell._tc.find("a:tcPr", _NS), None, theme),
+                        "text": _text_block(cell._tc.find("a:txBody", _NS), theme),
+                    })
+                    cell_x = cell_box[2]
+                row_y += row.height * scale_y
+            item.update(kind="table", cells=cells)
+            items.append(item)
+        elif local_name in ("sp", "cxnSp"):
+            line_color, line_width = _line_style(sp_pr, style, theme)
+            is_line = local_name == "cxnSp" or preset in PREVIEW_LINE_PRESETS
+            kind = "line" if is_line else {"ellipse": "ellipse", "roundRect": "round_rect"}.get(preset, "rect")
+            item.update(
+                kind=kind,
+                fill=None if is_line else _fill_color(sp_pr, style, theme),
+                line=line_color,
+                line_width=line_width,
+                # Styled autoshapes center their text in the style's font color, like PowerPoint
+                text=_text_block(element.find("p:txBody", _NS), theme, _placeholder_kind(shape),
+                                 "ctr" if style is not None else "l",
+                                 _color_from(style.find("a:fontRef", _NS), theme) if style is not None else None),
+            )
+            items.append(item)
+
+
+def build_slide_scene(prs, slide, theme=None):
+    """Everything the preview backends draw for one slide, in slide EMU coordinates."""
+    theme = theme or _theme_colors(prs)
+    items = []
+    _collect_scene_items(slide.shapes, theme, (1, 1, 0, 0), items)
+    return {
+        "width_emu": prs.slide_width,
+        "height_emu": prs.slide_height,
+        "background": _background_color(slide, theme),
+        "default_text_color": theme.get("tx1", "000000"),
+        "items": items,
+    }
+
+
+def _layout_text(text, box_px, px_per_emu, default_color):
+    """
+    Greedy word wrap of a text block inside box_px using font metrics. Returns
+    positioned fragments (x, baseline_y, text, size_px, bold, italic, color).
+    """
+    left_ins, top_ins, right_ins, bottom_ins = (inset * px_per_emu for inset in text["insets"])
+    x0, y0, x1, y1 = box_px[0] + left_ins, box_px[1] + top_ins, box_px[2] - right_ins, box_px[3] - bottom_ins
+    available_width = max(x1 - x0, 1)
+    px_per_pt = 12700 * px_per_emu
+    default_color = text["color"] or default_color
+
+    lines = []  # (align, [(token, size_px, bold, italic, color, width)], line_height)
+    for paragraph in text["paragraphs"]:
+        current, current_width = [], 0.0
+
+        def finish_line():
+            sizes = [fragment[1] for fragment in current] or [paragraph["size_pt"] * px_per_pt]
+            lines.append((paragraph["align"], list(current), max(sizes) * PREVIEW_LINE_SPACING))
+
+        for run in paragraph["runs"]:
+            if run is None:
+                finish_line()
+                current, current_width = [], 0.0
+                continue
+            size_px = run["size_pt"] * px_per_pt
+            font = _preview_font(size_px, run["bold"], run["italic"])
+            for token in re.findall(r"\S+\s*|\s+", run["text"]):
+                if text["wrap"] and current and current_width + font.getlength(token.rstrip()) > available_width:
+                    finish_line()
+                    current, current_width = [], 0.0
+                    token = token.lstrip()
+                token_width = font.getlength(token)
+                current.append((token, size_px, run["bold"], run["italic"], run["color"] or default_color, token_width))
+                current_width += token_width
+        finish_line()
+
+    total_height = sum(line[2] for line in lines)
+    if text["anchor"] == "ctr":
+        cursor_y = y0 + (y1 - y0 - total_height) / 2
+    elif text["anchor"] == "b":
+        cursor_y = y1 - total_height
+    else:
+        cursor_y = y0
+
+    fragments = []
+    for align, line_fragments, line_height in lines:
+        line_width = sum(fragment[5] for fragment in line_fragments)
+        if align == "ctr":
+            cursor_x = x0 + (available_width - line_width) / 2
+        elif align == "r":
+            cursor_x = x1 - line_width
+        else:
+            cursor_x = x0
+        # Baseline at ~80% of the em box, with the extra line spacing split above and below
+        baseline = cursor_y + line_height / PREVIEW_LINE_SPACING * 0.8 + line_height * (1 - 1 / PREVIEW_LINE_SPACING) / 2
+        for token, size_px, bold, italic, color, token_width in line_fragments:
+            if token.strip():
+                fragments.append((cursor_x, baseline, token.rstrip(), size_px, bold, italic, color))
+            cursor_x += token_width
+        cursor_y += line_height
+    return fragments
+
+
+def _scale_box(box, px_per_emu):
+    """EMU box -> normalized pixel box (x0 <= x1, y0 <= y1)."""
+    x0, y0, x1, y1 = (value * px_per_emu for value in box)
+    return (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+
+def _line_endpoints(item, box_px):
+    x0, y0, x1, y1 = box_px
+    return ((x1 if item["flip_h"] else x0, y1 if item["flip_v"] else y0),
+            (x0 if item["flip_h"] else x1, y0 if item["flip_v"] else y1))
+
+
+def _draw_scene_png(scene, width_px):
+    """Rasterizes a scene with PIL. Rotation is ignored in raster previews."""
+    px_per_emu = width_px / scene["width_emu"]
+    height_px = max(1, int(round(scene["height_emu"] * px_per_emu)))
+    canvas = Image.new("RGB", (width_px, height_px), f"#{scene['background']}")
+    draw = ImageDraw.Draw(canvas)
+
+    def draw_text(text_block, box_px):
+        if text_block:
+            for x, baseline, token, size_px, bold, italic, color in _layout_text(text_block, box_px, px_per_emu, scene["default_text_color"]):
+                draw.text((x, baseline), token, font=_preview_font(size_px, bold, italic), fill=f"#{color}", anchor="ls")
+
+    for item in scene["items"]:
+        box_px = _scale_box(item["box"], px_per_emu)
+        line_width = max(1, int(round(item.get("line_width", 0) * px_per_emu))) if item.get("line") else 0
+        fill = f"#{item['fill']}" if item.get("fill") else None
+        outline = f"#{item['line']}" if item.get("line") else None
+        kind = item["kind"]
+        if kind == "picture":
+            size = (max(1, int(box_px[2] - box_px[0])), max(1, int(box_px[3] - box_px[1])))
+            try:
+                with Image.open(io.BytesIO(item["image"])) as picture:
+                    picture = picture.convert("RGBA").resize(size, Image.BILINEAR)
+                canvas.paste(picture, (int(box_px[0]), int(box_px[1])), picture)
+            except Exception:
+                draw.rectangle(box_px, fill="#DDDDDD", outline="#999999")
+        elif kind == "table":
+            for cell in item["cells"]:
+                cell_box = _scale_box(cell["box"], px_per_emu)
+                draw.rectangle(cell_box, fill=f"#{cell['fill']}" if cell["fill"] else None, outline="#9A9A9A")
+                draw_text(cell["text"], cell_box)
+        elif kind == "line":
+            draw.line(_line_endpoints(item, box_px), fill=outline or f"#{scene['default_text_color']}", width=max(line_width, 1))
+        else:
+            if kind == "ellipse":
+                draw.ellipse(box_px, fill=fill, outline=outline, width=line_width)
+            elif kind == "round_rect":
+                radius = min(box_px[2] - box_px[0], box_px[3] - box_px[1]) / 6
+                draw.rounded_rectangle(box_px, radius=radius, fill=fill, outline=outline, width=line_width)
+            elif fill or outline:
+                draw.rectangle(box_px, fill=fill, outline=outline, width=line_width)
+            draw_text(item.get("text"), box_px)
+    return canvas
+
+
+def _scene_to_svg(scene, width_px):
+    """Serializes a scene as an SVG document, positioning text with the same metrics as the PNG backend."""
+    px_per_emu = width_px / scene["width_emu"]
+    height_px = scene["height_emu"] * px_per_emu
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width_px}" height="{height_px:.0f}" viewBox="0 0 {width_px} {height_px:.1f}">',
+        f'<rect width="100%" height="100%" fill="#{scene["background"]}"/>',
+    ]
+
+    def paint(item):
+        fill = f'#{item["fill"]}' if item.get("fill") else "none"
+        stroke = f'#{item["line"]}' if item.get("line") else "none"
+        stroke_width = max(1.0, item.get("line_width", 0) * px_per_emu) if item.get("line") else 0
+        return f'fill="{fill}" stroke="{stroke}" stroke-width="{stroke_width:.2f}"'
+
+    def text_elements(text_block, box_px):
+        elements = []
+        if text_block:
+            for x, baseline, token, size_px, bold, italic, color in _layout_text(text_block, box_px, px_per_emu, scene["default_text_color"]):
+                font_style = (' font-weight="bold"' if bold else "") + (' font-style="italic"' if italic else "")
+                elements.append(
+                    f'<text x="{x:.1f}" y="{baseline:.1f}" font-family="{PREVIEW_SVG_FONT_FAMILY}" font-size="{size_px:.1f}"'
+                    f'{font_style} fill="#{color}" xml:space="preserve">{xml_escape(token)}</text>'
+                )
+        return elements
+
+    for item in scene["items"]:
+        box_px = _scale_box(item["box"], px_per_emu)
+        x0, y0, x1, y1 = box_px
+        width, height = x1 - x0, y1 - y0
+        elements = []
+        kind = item["kind"]
+        if kind == "picture":
+            encoded = base64.b64encode(item["image"]).decode("ascii")
+            mime_type = "image/jpeg" if item["image"][:3] == b"\xff\xd8\xff" else "image/png"
+            elements.append(f'<image x="{x0:.1f}" y="{y0:.1f}" width="{width:.1f}" height="{height:.1f}" '
+                            f'preserveAspectRatio="none" href="data:{mime_type};base64,{encoded}"/>')
+        elif kind == "table":
+            for cell in item["cells"]:
+                cell_box = _scale_box(cell["box"], px_per_emu)
+                cell_fill = f'#{cell["fill"]}' if cell["fill"] else "none"
+                elements.append(f'<rect x="{cell_box[0]:.1f}" y="{cell_box[1]:.1f}" width="{cell_box[2] - cell_box[0]:.1f}" '
+                                f'height="{cell_box[3] - cell_box[1]:.1f}" fill="{cell_fill}" stroke="#9A9A9A" stroke-width="1"/>')
+                elements.extend(text_elements(cell["text"], cell_box))
+        elif kind == "line":
+            (sx, sy), (ex, ey) = _line_endpoints(item, box_px)
+            stroke_width = max(1.0, item.get("line_width", 0) * px_per_emu)
+            elements.append(f'<line x1="{sx:.1f}" y1="{sy:.1f}" x2="{ex:.1f}" y2="{ey:.1f}" '
+                            f'stroke="#{item["line"] or scene["default_text_color"]}" stroke-width="{stroke_width:.2f}"/>')
+        else:
+            if kind == "ellipse":
+                elements.append(f'<ellipse cx="{x0 + width / 2:.1f}" cy="{y0 + height / 2:.1f}" rx="{width / 2:.1f}" ry="{height / 2:.1f}" {paint(item)}/>')
+            elif item.get("fill") or item.get("line"):
+                radius = min(width, height) / 6 if kind == "round_rect" else 0
+                elements.append(f'<rect x="{x0:.1f}" y="{y0:.1f}" width="{width:.1f}" height="{height:.1f}" rx="{radius:.1f}" {paint(item)}/>')
+            elements.extend(text_elements(item.get("text"), box_px))
+        if item["rotation"] and elements:
+            parts.append(f'<g transform="rotate({item["rotation"]:.2f} {x0 + width / 2:.1f} {y0 + height / 2:.1f})">')
+            parts.extend(elements)
+            parts.append('</g>')
+        else:
+            parts.extend(elements)
+    parts.append('</svg>')
+    return "\n".join(parts)
+
+
+@metrics.timed_stage("fast_preview")
+@tracing.traced("fast_preview")
+def render_slide_previews(pptx_filepath, output_folder, slides=None, fmt="png", width_px=PREVIEW_WIDTH_PX, on_image=None):
+    """
+    Renders approximate slide previews straight from the slide XML, without
+    LibreOffice. fmt is "png", "webp" or "svg"; slides limits rendering to the given
+    1-based slide numbers. Files are named slide-preview-NN.<fmt> so they map back
+    with slide_number_from_image_path. on_image(slide_number, path) is called as each
+    preview is written. Returns the paths in slide order.
+    """
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+    prs = open_presentation_lite(pptx_filepath)
+    theme = _theme_colors(prs)
+    wanted = set(slides) if slides is not None else None
+    output_paths = []
+    for slide_number, slide in enumerate(prs.slides, start=1):
+        if wanted is not None and slide_number not in wanted:
+            continue
+        scene = build_slide_scene(prs, slide, theme)
+        output_path = os.path.join(os.path.abspath(output_folder), f"slide-preview-{slide_number:02d}.{fmt}")
+        if fmt == "svg":
+            with open(output_path, "w", encoding="utf-8") as f:
+                f.write(_scene_to_svg(scene, width_px))
+        else:
+            _draw_scene_png(scene, width_px).save(output_path, format="WEBP" if fmt == "webp" else "PNG")
+        output_paths.append(output_path)
+        if on_image:
+            on_image(slide_number, output_path)
+    tracing.set_attributes(slide_count=len(output_paths), fmt=fmt, width_px=width_px)
+    return output_paths
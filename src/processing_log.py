@@ -0,0 +1,416 @@
+# --- processing_log.py ---
+"""
+Append-safe, schema-versioned per-request processing log (SQLite in WAL mode).
+
+Requests are queued by log_request() and written by a background thread, so the
+request path never waits on disk. The legacy processing_log.csv is imported
+automatically the first time the database is created.
+
+Analysis:
+    python processing_log.py report  [--since 2025-06-01] [--until 2025-07-01] [--window day|week|month]
+    python processing_log.py compare --a-since 2025-06-01 --a-until 2025-06-15 --b-since 2025-06-15 --b-until 2025-07-01
+    python processing_log.py compare --a-rev 1a2b3c4 --b-rev 5d6e7f8
+    python processing_log.py import-csv processing_log.csv
+"""
+import os
+import csv
+import time
+import queue
+import atexit
+import sqlite3
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+from collections import Counter
+from pathlib import Path
+import pandas as pd
+
+# --- Configuration ---
+SCRIPT_DIR = Path(__file__).parent.resolve()
+PROCESSING_LOG_DB = SCRIPT_DIR / "processing_log.sqlite3"
+LEGACY_PROCESSING_LOG_CSV = SCRIPT_DIR / "processing_log.csv"
+SCHEMA_VERSION = 5
+WRITER_BATCH_SIZE = 200
+REGRESSION_THRESHOLD = 0.10  # Relative p50/p90 increase flagged by `compare`
+
+# Stage columns reported by the analysis commands
+STAGE_COLUMNS = [
+    "total_s", "json_extraction_s", "xml_extraction_s", "llm_inference_s",
+    "pptx_modification_s", "image_conversion_s", "xml_validation_s",
+]
+
+_MIGRATIONS = {
+    1: [
+        """CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            schema_version INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            timestamp_unix REAL NOT NULL,
+            git_revision TEXT,
+            trace_id TEXT,
+            original_filename TEXT,
+            llm_engine TEXT,
+            outcome TEXT,
+            deck_bytes INTEGER,
+            total_slides INTEGER,
+            slides_edited INTEGER,
+            modified_xml_files TEXT,
+            used_prepared_artifacts INTEGER,
+            total_s REAL,
+            json_extraction_s REAL,
+            xml_extraction_s REAL,
+            llm_inference_s REAL,
+            pptx_modification_s REAL,
+            image_conversion_s REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_requests_timestamp ON requests (timestamp_unix)",
+        "CREATE INDEX IF NOT EXISTS idx_requests_engine ON requests (llm_engine)",
+        "CREATE INDEX IF NOT EXISTS idx_requests_revision ON requests (git_revision)",
+        """CREATE TABLE IF NOT EXISTS csv_imports (
+            source_key TEXT PRIMARY KEY,
+            imported_at TEXT NOT NULL,
+            row_count INTEGER NOT NULL
+        )""",
+    ],
+    2: [
+        "ALTER TABLE requests ADD COLUMN xml_validation_s REAL",
+    ],
+    3: [
+        "ALTER TABLE requests ADD COLUMN peak_rss_mb REAL",
+    ],
+    4: [
+        "ALTER TABLE requests ADD COLUMN session_id TEXT",
+        "ALTER TABLE requests ADD COLUMN session_version INTEGER",
+    ],
+    5: [
+        "ALTER TABLE requests ADD COLUMN stopped_stage TEXT",
+    ],
+}
+
+_RECORD_COLUMNS = [
+    "schema_version", "timestamp", "timestamp_unix", "git_revision", "trace_id", "original_filename",
+    "llm_engine", "outcome", "deck_bytes", "total_slides", "slides_edited", "modified_xml_files",
+    "used_prepared_artifacts", *STAGE_COLUMNS, "peak_rss_mb", "session_id", "session_version",
+    "stopped_stage",
+]
+
+_write_queue = queue.Queue()
+_writer_thread = None
+_writer_lock = threading.Lock()
+_git_revision = None
+
+
+def get_git_revision():
+    """Short git revision of the running code, computed once."""
+    global _git_revision
+    if _git_revision is None:
+        try:
+            _git_revision = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                capture_output=True, text=True, timeout=5, check=True
+            ).stdout.strip() or "unknown"
+        except Exception:
+            _git_revision = "unknown"
+    return _git_revision
+
+
+def connect(db_path=None):
+    """Opens the log database in WAL mode and applies pending migrations."""
+    db_path = Path(db_path or PROCESSING_LOG_DB)
+    is_new = not db_path.exists()
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_meta (version INTEGER NOT NULL)")
+    row = conn.execute("SELECT MAX(version) FROM schema_meta").fetchone()
+    current_version = row[0] or 0
+    for version in sorted(v for v in _MIGRATIONS if v > current_version):
+        for statement in _MIGRATIONS[version]:
+            conn.execute(statement)
+        conn.execute("INSERT INTO schema_meta (version) VALUES (?)", (version,))
+    conn.commit()
+    if is_new and db_path == PROCESSING_LOG_DB and LEGACY_PROCESSING_LOG_CSV.exists():
+        imported = import_legacy_csv(LEGACY_PROCESSING_LOG_CSV, conn)
+        print(f"Imported {imported} rows from legacy {LEGACY_PROCESSING_LOG_CSV.name} into {db_path.name}")
+    return conn
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _normalize_record(record):
+    now = datetime.now()
+    timestamp = record.get("timestamp") or now.strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        timestamp_unix = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        timestamp_unix = now.timestamp()
+    normalized = {
+        "schema_version": SCHEMA_VERSION,
+        "timestamp": timestamp,
+        "timestamp_unix": timestamp_unix,
+        "git_revision": record.get("git_revision") or get_git_revision(),
+        "trace_id": record.get("trace_id"),
+        "original_filename": record.get("original_filename"),
+        "llm_engine": record.get("llm_engine"),
+        "outcome": record.get("outcome"),
+        "deck_bytes": _to_int(record.get("deck_bytes")),
+        "total_slides": _to_int(record.get("total_slides")),
+        "slides_edited": _to_int(record.get("slides_edited")),
+        "modified_xml_files": record.get("modified_xml_files"),
+        "used_prepared_artifacts": _to_int(record.get("used_prepared_artifacts")),
+    }
+    for column in STAGE_COLUMNS:
+        normalized[column] = _to_float(record.get(column))
+    normalized["peak_rss_mb"] = _to_float(record.get("peak_rss_mb"))
+    normalized["session_id"] = record.get("session_id")
+    normalized["session_version"] = _to_int(record.get("session_version"))
+    normalized["stopped_stage"] = record.get("stopped_stage")
+    return tuple(normalized[column] for column in _RECORD_COLUMNS)
+
+
+def _insert_rows(conn, rows):
+    placeholders = ", ".join("?" for _ in _RECORD_COLUMNS)
+    conn.executemany(f"INSERT INTO requests ({', '.join(_RECORD_COLUMNS)}) VALUES ({placeholders})", rows)
+    conn.commit()
+
+
+def _writer_loop():
+    conn = connect()
+    while True:
+        batch = [_write_queue.get()]
+        while len(batch) < WRITER_BATCH_SIZE:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _insert_rows(conn, [item for item in batch if item is not None])
+        except Exception as e:
+            print(f"Warning: Failed to write {len(batch)} processing log rows: {e}")
+        finally:
+            for _ in batch:
+                _write_queue.task_done()
+
+
+def _ensure_writer():
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name="processing-log-writer", daemon=True)
+            _writer_thread.start()
+
+
+def log_request(record):
+    """
+    Queues one request record for writing. Keys: timestamp, trace_id, original_filename,
+    llm_engine, outcome, deck_bytes, total_slides, slides_edited, modified_xml_files,
+    used_prepared_artifacts, the *_s stage timings in STAGE_COLUMNS and, for requests
+    whose deadline ended (outcome timeout or cancelled), stopped_stage.
+    """
+    _ensure_writer()
+    _write_queue.put(_normalize_record(record))
+
+
+def flush(timeout=5.0):
+    """Waits (bounded) until queued records are written. Registered at exit."""
+    if _writer_thread is None:
+        return
+    deadline = time.time() + timeout
+    while _write_queue.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.05)
+
+
+atexit.register(flush)
+
+
+def import_legacy_csv(csv_path, conn=None):
+    """
+    Imports a processing_log.csv written by earlier versions. Rows are matched to
+    whichever historical header has the same number of columns; rows matching none
+    are skipped and reported.
+    """
+    own_conn = conn is None
+    conn = conn or connect()
+    csv_stat = os.stat(csv_path)
+    source_key = f"{Path(csv_path).resolve()}|{csv_stat.st_size}|{csv_stat.st_mtime_ns}"
+    if conn.execute("SELECT 1 FROM csv_imports WHERE source_key = ?", (source_key,)).fetchone():
+        if own_conn:
+            conn.close()
+        return 0
+    legacy_headers = {
+        14: ['Timestamp', 'OriginalFilename', 'LLMEngineUsed', 'TotalProcessingTimeSeconds',
+             'JSONExtractionTimeSeconds', 'XMLExtractionTimeSeconds', 'OriginalPDFConversionTimeSeconds',
+             'LLMInferenceTimeSeconds', 'PPTXModificationTimeSeconds', 'ModifiedPDFConversionTimeSeconds',
+             'TotalSlidesInOriginal', 'NumberOfSlidesEditedByLLM', 'ModifiedXMLFilesList',
+             'AverageTimePerEditedSlideSeconds'],
+        12: ['Timestamp', 'OriginalFilename', 'LLMEngineUsed', 'TotalProcessingTimeSeconds',
+             'JSONExtractionTimeSeconds', 'XMLExtractionTimeSeconds', 'LLMInferenceTimeSeconds',
+             'PPTXModificationTimeSeconds', 'ImageConversionTimeSeconds', 'TotalSlidesInOriginal',
+             'NumberOfSlidesEditedByLLM', 'ModifiedXMLFilesList'],
+        10: ['Timestamp', 'OriginalFilename', 'LLMEngineUsed', 'TotalProcessingTimeSeconds',
+             'JSONExtractionTimeSeconds', 'LLMInferenceTimeSeconds', 'PPTXModificationTimeSeconds',
+             'ImageConversionTimeSeconds', 'TotalSlidesInOriginal', 'NumberOfSlidesEditedByLLM'],
+        7: ['Timestamp', 'OriginalFilename', 'LLMEngineUsed', 'TotalProcessingTimeSeconds',
+            'LLMInferenceTimeSeconds', 'ImageConversionTimeSeconds', 'TotalSlidesInOriginal'],
+    }
+    rows = []
+    skipped = Counter()
+    with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for values in reader:
+            header = legacy_headers.get(len(values))
+            if header is None:
+                skipped[len(values)] += 1
+                continue
+            legacy = dict(zip(header, values))
+            image_time = legacy.get('ImageConversionTimeSeconds')
+            if image_time is None:
+                pdf_times = [_to_float(legacy.get(k)) for k in ('OriginalPDFConversionTimeSeconds', 'ModifiedPDFConversionTimeSeconds')]
+                image_time = sum(t for t in pdf_times if t is not None) if any(t is not None for t in pdf_times) else None
+            rows.append(_normalize_record({
+                "timestamp": legacy.get('Timestamp'),
+                "git_revision": "legacy-csv",
+                "original_filename": legacy.get('OriginalFilename'),
+                "llm_engine": legacy.get('LLMEngineUsed'),
+                "total_slides": legacy.get('TotalSlidesInOriginal'),
+                "slides_edited": legacy.get('NumberOfSlidesEditedByLLM'),
+                "modified_xml_files": legacy.get('ModifiedXMLFilesList'),
+                "total_s": legacy.get('TotalProcessingTimeSeconds'),
+                "json_extraction_s": legacy.get('JSONExtractionTimeSeconds'),
+                "xml_extraction_s": legacy.get('XMLExtractionTimeSeconds'),
+                "llm_inference_s": legacy.get('LLMInferenceTimeSeconds'),
+                "pptx_modification_s": legacy.get('PPTXModificationTimeSeconds'),
+                "image_conversion_s": image_time,
+            }))
+    conn.execute("INSERT INTO csv_imports (source_key, imported_at, row_count) VALUES (?, ?, ?)",
+                 (source_key, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(rows)))
+    _insert_rows(conn, rows)
+    if own_conn:
+        conn.close()
+    if skipped:
+        layouts = ", ".join(f"{count} with {columns} columns" for columns, count in sorted(skipped.items()))
+        print(f"Warning: Skipped {sum(skipped.values())} rows of {csv_path} matching no known header ({layouts})")
+    return len(rows)
+
+
+# --- Analysis ---
+
+def load_requests(since=None, until=None, revision=None):
+    """Loads log rows into a DataFrame, filtered by date range and/or git revision."""
+    conn = connect()
+    query = "SELECT * FROM requests WHERE 1=1"
+    params = []
+    if since:
+        query += " AND timestamp_unix >= ?"
+        params.append(pd.Timestamp(since).timestamp())
+    if until:
+        query += " AND timestamp_unix < ?"
+        params.append(pd.Timestamp(until).timestamp())
+    if revision:
+        query += " AND git_revision LIKE ?"
+        params.append(f"{revision}%")
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    df["deck_size"] = pd.cut(df["total_slides"], bins=[0, 1, 5, 20, float("inf")],
+                             labels=["1 slide", "2-5 slides", "6-20 slides", "21+ slides"])
+    return df
+
+
+def stage_percentiles(df, group_by=None):
+    """Returns count and p50/p90/p99 of every stage column, optionally grouped."""
+    long_df = df.melt(id_vars=[c for c in [group_by] if c], value_vars=STAGE_COLUMNS,
+                      var_name="stage", value_name="seconds").dropna(subset=["seconds"])
+    keys = [c for c in [group_by] if c] + ["stage"]
+    if long_df.empty:
+        return pd.DataFrame(columns=keys + ["count", "p50", "p90", "p99"])
+    grouped = long_df.groupby(keys, observed=True)["seconds"]
+    summary = grouped.agg(count="count",
+                          p50=lambda s: s.quantile(0.50),
+                          p90=lambda s: s.quantile(0.90),
+                          p99=lambda s: s.quantile(0.99))
+    return summary.round(3).reset_index()
+
+
+def report(since=None, until=None, window="week"):
+    df = load_requests(since, until)
+    if df.empty:
+        print("No processing log rows in the selected range.")
+        return
+    period = {"day": "D", "week": "W", "month": "M"}[window]
+    df["window"] = df["timestamp"].dt.to_period(period).astype(str)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(f"=== {len(df)} requests from {df['timestamp'].min()} to {df['timestamp'].max()} ===")
+        print("\n--- Per stage ---")
+        print(stage_percentiles(df).to_string(index=False))
+        print("\n--- Per stage and model ---")
+        print(stage_percentiles(df, "llm_engine").to_string(index=False))
+        print("\n--- Per stage and deck size ---")
+        print(stage_percentiles(df, "deck_size").to_string(index=False))
+        print(f"\n--- Per stage and {window} ---")
+        print(stage_percentiles(df, "window").to_string(index=False))
+
+
+def compare(a_filter, b_filter):
+    """Prints per-stage percentile deltas between two selections and flags regressions."""
+    a_df, b_df = load_requests(**a_filter), load_requests(**b_filter)
+    if a_df.empty or b_df.empty:
+        print(f"Not enough data: baseline has {len(a_df)} rows, candidate has {len(b_df)} rows.")
+        return
+    a_stats = stage_percentiles(a_df).set_index("stage")
+    b_stats = stage_percentiles(b_df).set_index("stage")
+    joined = a_stats.join(b_stats, lsuffix="_a", rsuffix="_b", how="outer")
+    for q in ("p50", "p90", "p99"):
+        joined[f"{q}_change"] = ((joined[f"{q}_b"] - joined[f"{q}_a"]) / joined[f"{q}_a"]).round(3)
+    joined["regression"] = (joined["p50_change"] > REGRESSION_THRESHOLD) | (joined["p90_change"] > REGRESSION_THRESHOLD)
+    columns = ["count_a", "count_b", "p50_a", "p50_b", "p50_change", "p90_a", "p90_b", "p90_change", "p99_a", "p99_b", "regression"]
+    with pd.option_context("display.width", 200):
+        print(f"Baseline (a): {a_filter}  |  Candidate (b): {b_filter}")
+        print(joined[columns].to_string())
+    regressed = joined.index[joined["regression"]].tolist()
+    if regressed:
+        print(f"\nREGRESSIONS (>{REGRESSION_THRESHOLD:.0%} slower p50/p90): {', '.join(regressed)}")
+    else:
+        print("\nNo regressions detected.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze the per-request processing log.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser("report", help="p50/p90/p99 per stage, model, deck size and time window.")
+    report_parser.add_argument("--since")
+    report_parser.add_argument("--until")
+    report_parser.add_argument("--window", choices=["day", "week", "month"], default="week")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two date ranges or git revisions.")
+    for side in ("a", "b"):
+        compare_parser.add_argument(f"--{side}-since")
+        compare_parser.add_argument(f"--{side}-until")
+        compare_parser.add_argument(f"--{side}-rev")
+
+    import_parser = subparsers.add_parser("import-csv", help="Import a legacy processing_log.csv.")
+    import_parser.add_argument("csv_path")
+
+    args = parser.parse_args()
+    if args.command == "report":
+        report(args.since, args.until, args.window)
+    elif args.command == "compare":
+        compare({"since": args.a_since, "until": args.a_until, "revision": args.a_rev},
+                {"since": args.b_since, "until": args.b_until, "revision": args.b_rev})
+    else:
+        print(f"Imported {import_legacy_csv(args.csv_path)} rows into {PROCESSING_LOG_DB}")
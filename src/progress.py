@@ -0,0 +1,84 @@
+# --- progress.py ---
+"""
+Progress events of an edit, streamed to the web UI by /api/process_stream.
+
+The streaming route runs the edit inside EventStream.attach(); pipeline stages
+call emit(event, **data) as they finish something the user can see (the deck
+parsed, the prompt built, LLM output arriving, a part parsed, the deck repacked,
+a slide rendered). Like tracing spans outside a trace, emit() does nothing when
+no stream is attached, so /api/process and the batch route pay nothing for it.
+
+The stream is found through a context variable: threads started with
+tracing.wrap_context (which copies every context variable) emit to the same
+stream. Worker processes of cpu_pool.py do not; their stages emit from the
+server once the job returns.
+
+Events are (name, dict) pairs; the route serializes them as Server-Sent Events
+with format_event.
+"""
+import json
+import queue
+import contextvars
+from contextlib import contextmanager
+
+_current_stream = contextvars.ContextVar("pptpilot_progress_stream", default=None)
+
+
+def active():
+    """True when progress is being streamed (stages can skip work only a stream needs)."""
+    return _current_stream.get() is not None
+
+
+def emit(event, **data):
+    """Sends an event to the current stream, if any."""
+    stream = _current_stream.get()
+    if stream is not None:
+        stream.put(event, data)
+
+
+class EventStream:
+    """Events of one request, from the thread running the edit to the response generator."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self.closed = False
+
+    @contextmanager
+    def attach(self):
+        """Makes this the current stream of the calling context."""
+        token = _current_stream.set(self)
+        try:
+            yield self
+        finally:
+            _current_stream.reset(token)
+
+    def put(self, event, data):
+        if not self.closed:
+            self._queue.put((event, data))
+
+    def finish(self):
+        """Ends events(); called by the producer after its last event."""
+        self._queue.put(None)
+
+    def close(self):
+        """The consumer went away: further events are dropped."""
+        self.closed = True
+
+    def events(self, keepalive_s):
+        """Yields (event, data) until finish(), and (None, None) after keepalive_s without one."""
+        while True:
+            try:
+                item = self._queue.get(timeout=keepalive_s)
+            except queue.Empty:
+                yield None, None
+                continue
+            if item is None:
+                return
+            yield item
+
+
+def format_event(event, data):
+    """One Server-Sent Event; event None is a keepalive comment."""
+    if event is None:
+        return ": keepalive\n\n"
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,125 @@
+# --- single_flight.py ---
+"""
+Single-flight execution: concurrent calls with the same key share one execution.
+
+The first caller for a key (the leader) runs the work; callers that arrive while
+it is running (followers) wait for it and receive the same result, or the same
+exception. Nothing is remembered once the call has finished, so a later call with
+the same key runs the work again.
+
+app.py keys edits by their fingerprint (deck bytes, prompt and options), so
+identical requests from parallel benchmark workers or UI users make one LLM call
+and one set of renders. asgi.py uses AsyncSingleFlight, where followers await the
+leader on the event loop instead of blocking a thread.
+
+The work runs under the leader's request deadline (see deadlines.py). A follower
+stops waiting when its own deadline ends; when the leader's ends first (timeout,
+or its client went away), the followers that are still wanted run the work again.
+"""
+import asyncio
+import threading
+import metrics
+import deadlines
+
+
+class _Call:
+    def __init__(self, done=None):
+        # threading.Event, or an asyncio future for AsyncSingleFlight
+        self.done = done if done is not None else threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """A group of keyed calls; `name` labels its metrics."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Runs func() unless a call with the same key is in flight, in which case
+        its outcome is shared. Returns (result, shared).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+                metrics.SINGLE_FLIGHT_IN_FLIGHT.set(len(self._calls), flight=self.name)
+            else:
+                call.followers += 1
+        metrics.SINGLE_FLIGHT_CALLS.inc(flight=self.name, role="leader" if is_leader else "follower")
+
+        if not is_leader:
+            if not deadlines.wait(call.done):
+                deadlines.check("coalesced_wait")
+            if isinstance(call.error, deadlines.RequestCancelled) and not deadlines.ended():
+                return self.do(key, func)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                metrics.SINGLE_FLIGHT_IN_FLIGHT.set(len(self._calls), flight=self.name)
+            if call.followers:
+                print(f"Single-flight '{self.name}': shared one call with {call.followers} concurrent duplicate(s)")
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines; all callers must run on the same event loop."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    async def do(self, key, func):
+        """Awaits func() unless a call with the same key is in flight. Returns (result, shared)."""
+        call = self._calls.get(key)
+        is_leader = call is None
+        metrics.SINGLE_FLIGHT_CALLS.inc(flight=self.name, role="leader" if is_leader else "follower")
+        if not is_leader:
+            call.followers += 1
+            # Shielded: a follower that is cancelled (client gone) must not cancel the leader's call
+            try:
+                return await asyncio.shield(call.done), True
+            except asyncio.CancelledError:
+                if not call.done.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            except deadlines.RequestCancelled:
+                if deadlines.ended():
+                    raise
+            # The leader's request ended before the work did; this caller still wants the result
+            return await self.do(key, func)
+
+        call = self._calls[key] = _Call(asyncio.get_running_loop().create_future())
+        metrics.SINGLE_FLIGHT_IN_FLIGHT.set(len(self._calls), flight=self.name)
+        try:
+            call.result = await func()
+            call.done.set_result(call.result)
+            return call.result, False
+        except asyncio.CancelledError:
+            call.done.cancel()
+            raise
+        except BaseException as e:
+            call.done.set_exception(e)
+            # Retrieved here so a call without followers does not log "exception never retrieved"
+            call.done.exception()
+            raise
+        finally:
+            del self._calls[key]
+            metrics.SINGLE_FLIGHT_IN_FLIGHT.set(len(self._calls), flight=self.name)
+            if call.followers:
+                print(f"Single-flight '{self.name}': shared one call with {call.followers} concurrent duplicate(s)")
@@ -0,0 +1,462 @@
+# --- slide_extractor.py ---
+"""
+Streaming replacement for ppt_processor.pptx_to_json. Slide parts are iterparsed
+straight from the zip with lxml instead of building the python-pptx object model,
+which makes summaries of large decks (hundreds of slides, big tables) several
+times cheaper. The output is the same JSON schema, value for value:
+
+    {"filename", "slides": [{"slide_number", "shapes": [{"name", "type", "text",
+                             "left", "top", "width", "height"}], "notes"}]}
+
+The python-pptx rules this mirrors (version 0.6.x):
+    - only top-level spTree shapes are listed; groups have no text
+    - "type" is str(MSO_SHAPE_TYPE member), or "None" when python-pptx has none
+    - slide placeholders (p:sp and p:pic) without a position inherit it per
+      attribute from the layout placeholder with the same idx, which in turn
+      inherits from the master placeholder of the mapped type
+    - text frames join paragraphs with "\\n" and line breaks are "\\v"; tables
+      join cells with "\\t" and rows with "\\n"; everything is stripped
+    - notes come from the first "body" placeholder of the notes slide
+
+Check equivalence and speed on a corpus with:
+    python slide_extractor.py --corpus-dir tsbench/benchmark_ppts
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import posixpath
+import zipfile
+from pathlib import Path
+from lxml import etree
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+
+NS_P = "http://schemas.openxmlformats.org/presentationml/2006/main"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+NS_R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_RELS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+RT_OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+RT_SLIDE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/slide"
+RT_SLIDE_LAYOUT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/slideLayout"
+RT_SLIDE_MASTER = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/slideMaster"
+RT_NOTES_SLIDE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/notesSlide"
+
+GRAPHIC_DATA_URI_CHART = "http://schemas.openxmlformats.org/drawingml/2006/chart"
+GRAPHIC_DATA_URI_TABLE = "http://schemas.openxmlformats.org/drawingml/2006/table"
+GRAPHIC_DATA_URI_OLEOBJ = "http://schemas.openxmlformats.org/presentationml/2006/ole"
+
+TAG_SP = f"{{{NS_P}}}sp"
+TAG_PIC = f"{{{NS_P}}}pic"
+TAG_GRAPHIC_FRAME = f"{{{NS_P}}}graphicFrame"
+TAG_GRP_SP = f"{{{NS_P}}}grpSp"
+TAG_CXN_SP = f"{{{NS_P}}}cxnSp"
+TAG_CONTENT_PART = f"{{{NS_P}}}contentPart"
+TAG_SP_TREE = f"{{{NS_P}}}spTree"
+SHAPE_TAGS = (TAG_SP, TAG_GRP_SP, TAG_GRAPHIC_FRAME, TAG_CXN_SP, TAG_PIC, TAG_CONTENT_PART)
+
+TAG_R = f"{{{NS_A}}}r"
+TAG_FLD = f"{{{NS_A}}}fld"
+TAG_BR = f"{{{NS_A}}}br"
+TAG_T = f"{{{NS_A}}}t"
+
+SHAPE_TYPE_NAMES = {
+    name: str(getattr(MSO_SHAPE_TYPE, name)) for name in (
+        "PLACEHOLDER", "FREEFORM", "AUTO_SHAPE", "TEXT_BOX", "PICTURE", "MEDIA", "GROUP",
+        "LINE", "CHART", "TABLE", "EMBEDDED_OLE_OBJECT", "LINKED_OLE_OBJECT",
+    )
+}
+# Layout placeholder type -> master placeholder type it inherits from (python-pptx LayoutPlaceholder)
+LAYOUT_TO_MASTER_PH_TYPE = {
+    "body": "body", "chart": "body", "clipArt": "body", "ctrTitle": "title", "dgm": "body",
+    "dt": "dt", "ftr": "ftr", "media": "body", "obj": "body", "pic": "body",
+    "sldNum": "sldNum", "subTitle": "body", "tbl": "body", "title": "title",
+}
+EMU_PER_PT = 12700.0
+
+_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+
+
+def _rels_name(part_name):
+    directory, filename = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", f"{filename}.rels")
+
+
+def _read_rels(pptx_zip, part_name):
+    """{rId: (reltype, target part name)} of a part; external targets are skipped."""
+    try:
+        data = pptx_zip.read(_rels_name(part_name))
+    except KeyError:
+        return {}
+    base_dir = posixpath.dirname(part_name)
+    rels = {}
+    for rel in etree.fromstring(data, _PARSER).iterchildren(f"{{{NS_PKG_RELS}}}Relationship"):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target", "")
+        target = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(base_dir, target))
+        rels[rel.get("Id")] = (rel.get("Type"), target)
+    return rels
+
+
+def _related_part(rels, reltype):
+    for rel_type, target in rels.values():
+        if rel_type == reltype:
+            return target
+    return None
+
+
+def _nv_props(shape_elm):
+    """The shape's nv*Pr element (always its first child)."""
+    for child in shape_elm:
+        if isinstance(child.tag, str):
+            return child
+    return None
+
+
+def _placeholder(shape_elm):
+    """(type, idx) of a shape's p:ph, or None when it is not a placeholder."""
+    nv_props = _nv_props(shape_elm)
+    ph = nv_props.find(f"{{{NS_P}}}nvPr/{{{NS_P}}}ph") if nv_props is not None else None
+    if ph is None:
+        return None
+    return ph.get("type", "obj"), int(ph.get("idx", 0))
+
+
+def _xfrm(shape_elm):
+    tag = shape_elm.tag
+    if tag == TAG_GRAPHIC_FRAME:
+        return shape_elm.find(f"{{{NS_P}}}xfrm")
+    if tag == TAG_GRP_SP:
+        return shape_elm.find(f"{{{NS_P}}}grpSpPr/{{{NS_A}}}xfrm")
+    return shape_elm.find(f"{{{NS_P}}}spPr/{{{NS_A}}}xfrm")
+
+
+def _geometry(shape_elm):
+    """Directly applied [left, top, width, height] in EMU, None where absent."""
+    xfrm = _xfrm(shape_elm) if shape_elm.tag != TAG_CONTENT_PART else None
+    if xfrm is None:
+        return [None, None, None, None]
+    off, ext = xfrm.find(f"{{{NS_A}}}off"), xfrm.find(f"{{{NS_A}}}ext")
+    return [
+        int(off.get("x")) if off is not None else None,
+        int(off.get("y")) if off is not None else None,
+        int(ext.get("cx")) if ext is not None else None,
+        int(ext.get("cy")) if ext is not None else None,
+    ]
+
+
+def _merge_geometry(geometry, base_geometry):
+    return [value if value is not None else base for value, base in zip(geometry, base_geometry)]
+
+
+def _paragraphs_text(tx_body):
+    if tx_body is None:
+        return ""
+    paragraphs = []
+    for paragraph in tx_body.iterchildren(f"{{{NS_A}}}p"):
+        pieces = []
+        for child in paragraph:
+            tag = child.tag
+            if tag == TAG_R or tag == TAG_FLD:
+                t = child.find(TAG_T)
+                if t is not None and t.text:
+                    pieces.append(t.text)
+            elif tag == TAG_BR:
+                pieces.append("\v")
+        paragraphs.append("".join(pieces))
+    return "\n".join(paragraphs)
+
+
+def _graphic_data(shape_elm):
+    return shape_elm.find(f"{{{NS_A}}}graphic/{{{NS_A}}}graphicData")
+
+
+def _shape_text(shape_elm):
+    tag = shape_elm.tag
+    if tag == TAG_SP:
+        return _paragraphs_text(shape_elm.find(f"{{{NS_P}}}txBody")).strip()
+    if tag == TAG_GRAPHIC_FRAME:
+        graphic_data = _graphic_data(shape_elm)
+        if graphic_data is not None and graphic_data.get("uri") == GRAPHIC_DATA_URI_TABLE:
+            rows = []
+            for row in graphic_data.iterfind(f"{{{NS_A}}}tbl/{{{NS_A}}}tr"):
+                rows.append("".join(_paragraphs_text(cell.find(f"{{{NS_A}}}txBody")) + "\t"
+                                    for cell in row.iterchildren(f"{{{NS_A}}}tc")) + "\n")
+            return "".join(rows).strip()
+    return ""
+
+
+def _shape_type(shape_elm, placeholder):
+    tag = shape_elm.tag
+    if tag == TAG_SP:
+        if placeholder:
+            return SHAPE_TYPE_NAMES["PLACEHOLDER"]
+        sp_pr = shape_elm.find(f"{{{NS_P}}}spPr")
+        if sp_pr is not None and sp_pr.find(f"{{{NS_A}}}custGeom") is not None:
+            return SHAPE_TYPE_NAMES["FREEFORM"]
+        c_nv_sp_pr = shape_elm.find(f"{{{NS_P}}}nvSpPr/{{{NS_P}}}cNvSpPr")
+        is_textbox = c_nv_sp_pr is not None and c_nv_sp_pr.get("txBox") in ("1", "true")
+        if sp_pr is not None and sp_pr.find(f"{{{NS_A}}}prstGeom") is not None and not is_textbox:
+            return SHAPE_TYPE_NAMES["AUTO_SHAPE"]
+        # python-pptx raises NotImplementedError for anything else
+        return SHAPE_TYPE_NAMES["TEXT_BOX"] if is_textbox else "None"
+    if tag == TAG_PIC:
+        if placeholder:
+            return SHAPE_TYPE_NAMES["PLACEHOLDER"]
+        if shape_elm.find(f"{{{NS_P}}}nvPicPr/{{{NS_P}}}nvPr/{{{NS_A}}}videoFile") is not None:
+            return SHAPE_TYPE_NAMES["MEDIA"]
+        return SHAPE_TYPE_NAMES["PICTURE"]
+    if tag == TAG_GRAPHIC_FRAME:
+        graphic_data = _graphic_data(shape_elm)
+        uri = graphic_data.get("uri") if graphic_data is not None else None
+        if uri == GRAPHIC_DATA_URI_CHART:
+            return SHAPE_TYPE_NAMES["CHART"]
+        if uri == GRAPHIC_DATA_URI_TABLE:
+            return SHAPE_TYPE_NAMES["TABLE"]
+        if uri == GRAPHIC_DATA_URI_OLEOBJ:
+            ole_objects = graphic_data.findall(f".//{{{NS_P}}}oleObj")
+            if ole_objects:
+                embedded = ole_objects[-1].find(f"{{{NS_P}}}embed") is not None
+                return SHAPE_TYPE_NAMES["EMBEDDED_OLE_OBJECT" if embedded else "LINKED_OLE_OBJECT"]
+        return "None"
+    if tag == TAG_GRP_SP:
+        return SHAPE_TYPE_NAMES["GROUP"]
+    if tag == TAG_CXN_SP:
+        return SHAPE_TYPE_NAMES["LINE"]
+    return "None"
+
+
+class _PlaceholderIndex:
+    """
+    Layout and master placeholder geometry, parsed once per part. Layout entries
+    already include what they inherit from the master.
+    """
+
+    def __init__(self, pptx_zip):
+        self._zip = pptx_zip
+        self._layouts = {}
+        self._masters = {}
+
+    def _placeholder_shapes(self, part_name):
+        root = etree.fromstring(self._zip.read(part_name), _PARSER)
+        sp_tree = root.find(f"{{{NS_P}}}cSld/{TAG_SP_TREE}")
+        for shape_elm in (sp_tree if sp_tree is not None else ()):
+            if shape_elm.tag in SHAPE_TAGS:
+                placeholder = _placeholder(shape_elm)
+                if placeholder:
+                    yield shape_elm, placeholder
+
+    def _master(self, master_part):
+        if master_part not in self._masters:
+            by_type = {}
+            for shape_elm, (ph_type, _) in self._placeholder_shapes(master_part):
+                by_type.setdefault(ph_type, _geometry(shape_elm))
+            self._masters[master_part] = by_type
+        return self._masters[master_part]
+
+    def layout(self, layout_part):
+        """{idx: [left, top, width, height]} of a layout's placeholders."""
+        if layout_part not in self._layouts:
+            master_part = _related_part(_read_rels(self._zip, layout_part), RT_SLIDE_MASTER)
+            master = self._master(master_part) if master_part else {}
+            by_idx = {}
+            for shape_elm, (ph_type, ph_idx) in self._placeholder_shapes(layout_part):
+                if ph_idx in by_idx:
+                    continue
+                geometry = _geometry(shape_elm)
+                # Only p:sp layout placeholders inherit from the master
+                if shape_elm.tag == TAG_SP and None in geometry:
+                    base = master.get(LAYOUT_TO_MASTER_PH_TYPE.get(ph_type))
+                    if base:
+                        geometry = _merge_geometry(geometry, base)
+                by_idx[ph_idx] = geometry
+            self._layouts[layout_part] = by_idx
+        return self._layouts[layout_part]
+
+
+def _iter_top_level_shapes(stream):
+    """
+    Yields the top-level spTree shapes of a slide part as they finish parsing,
+    clearing finished siblings so memory stays bounded by the largest shape.
+    """
+    for _, element in etree.iterparse(stream, events=("end",), tag=SHAPE_TAGS,
+                                      resolve_entities=False, no_network=True, huge_tree=True):
+        parent = element.getparent()
+        if parent is None or parent.tag != TAG_SP_TREE:
+            continue
+        yield element
+        element.clear()
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def _notes_text(pptx_zip, notes_part):
+    root = etree.fromstring(pptx_zip.read(notes_part), _PARSER)
+    sp_tree = root.find(f"{{{NS_P}}}cSld/{TAG_SP_TREE}")
+    for shape_elm in (sp_tree if sp_tree is not None else ()):
+        if shape_elm.tag in SHAPE_TAGS:
+            placeholder = _placeholder(shape_elm)
+            if placeholder and placeholder[0] == "body":
+                return _paragraphs_text(shape_elm.find(f"{{{NS_P}}}txBody")).strip()
+    return ""
+
+
+def _slide_parts(pptx_zip):
+    """Slide part names in presentation order."""
+    presentation_part = _related_part(_read_rels(pptx_zip, ""), RT_OFFICE_DOCUMENT) or "ppt/presentation.xml"
+    presentation_rels = _read_rels(pptx_zip, presentation_part)
+    root = etree.fromstring(pptx_zip.read(presentation_part), _PARSER)
+    slide_parts = []
+    for slide_id in root.iterfind(f"{{{NS_P}}}sldIdLst/{{{NS_P}}}sldId"):
+        rel = presentation_rels.get(slide_id.get(f"{{{NS_R}}}id"))
+        if rel and rel[0] == RT_SLIDE:
+            slide_parts.append(rel[1])
+    return slide_parts
+
+
+def _pt(emu):
+    return emu / EMU_PER_PT if emu is not None else None
+
+
+def _slide_json(pptx_zip, placeholder_index, slide_number, slide_part):
+    slide_rels = _read_rels(pptx_zip, slide_part)
+    layout_part = _related_part(slide_rels, RT_SLIDE_LAYOUT)
+    shapes = []
+    with pptx_zip.open(slide_part) as stream:
+        for shape_elm in _iter_top_level_shapes(stream):
+            placeholder = _placeholder(shape_elm)
+            geometry = _geometry(shape_elm)
+            if placeholder and shape_elm.tag in (TAG_SP, TAG_PIC) and None in geometry and layout_part:
+                base = placeholder_index.layout(layout_part).get(placeholder[1])
+                if base:
+                    geometry = _merge_geometry(geometry, base)
+            nv_props = _nv_props(shape_elm)
+            c_nv_pr = nv_props.find(f"{{{NS_P}}}cNvPr") if nv_props is not None else None
+            left, top, width, height = geometry
+            shapes.append({
+                "name": c_nv_pr.get("name", "") if c_nv_pr is not None else "",
+                "type": _shape_type(shape_elm, placeholder),
+                "text": _shape_text(shape_elm),
+                "left": _pt(left),
+                "top": _pt(top),
+                "width": _pt(width),
+                "height": _pt(height),
+            })
+    notes_part = _related_part(slide_rels, RT_NOTES_SLIDE)
+    return {
+        "slide_number": slide_number,
+        "shapes": shapes,
+        "notes": _notes_text(pptx_zip, notes_part) if notes_part else "",
+    }
+
+
+def pptx_to_json_fast(filepath):
+    """Converts a .pptx file to the same JSON representation as ppt_processor.pptx_to_json."""
+    presentation_data = {
+        "filename": os.path.basename(filepath),
+        "slides": []
+    }
+    with zipfile.ZipFile(filepath) as pptx_zip:
+        placeholder_index = _PlaceholderIndex(pptx_zip)
+        for slide_number, slide_part in enumerate(_slide_parts(pptx_zip), start=1):
+            presentation_data["slides"].append(_slide_json(pptx_zip, placeholder_index, slide_number, slide_part))
+    return presentation_data
+
+
+def extract_slides_json(filepath, slide_numbers):
+    """
+    JSON entries (as in pptx_to_json_fast) for only the given 1-based slides, so an
+    edit that touched a few slides can refresh a deck summary without re-reading the rest.
+    """
+    with zipfile.ZipFile(filepath) as pptx_zip:
+        placeholder_index = _PlaceholderIndex(pptx_zip)
+        slide_parts = _slide_parts(pptx_zip)
+        return [_slide_json(pptx_zip, placeholder_index, slide_number, slide_parts[slide_number - 1])
+                for slide_number in sorted(slide_numbers) if 1 <= slide_number <= len(slide_parts)]
+
+
+def _first_difference(expected, actual, path="$"):
+    """Path and values of the first difference between two JSON values, or None."""
+    if type(expected) is not type(actual):
+        return f"{path}: {expected!r} != {actual!r}"
+    if isinstance(expected, dict):
+        if list(expected) != list(actual):
+            return f"{path}: keys {list(expected)} != {list(actual)}"
+        for key in expected:
+            difference = _first_difference(expected[key], actual[key], f"{path}.{key}")
+            if difference:
+                return difference
+        return None
+    if isinstance(expected, list):
+        if len(expected) != len(actual):
+            return f"{path}: {len(expected)} items != {len(actual)} items"
+        for index, (expected_item, actual_item) in enumerate(zip(expected, actual)):
+            difference = _first_difference(expected_item, actual_item, f"{path}[{index}]")
+            if difference:
+                return difference
+        return None
+    return None if expected == actual else f"{path}: {expected!r} != {actual!r}"
+
+
+def compare_extractors(pptx_paths, repeat=1):
+    """
+    Runs both extractors on every deck, checks the outputs are identical and times
+    them. Returns a list of {"deck", "equal", "difference", "pptx_s", "fast_s"}.
+    """
+    import ppt_processor  # imported here: ppt_processor uses this module
+
+    results = []
+    for pptx_path in pptx_paths:
+        result = {"deck": str(pptx_path)}
+        try:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                expected = ppt_processor.pptx_to_json(str(pptx_path))
+            result["pptx_s"] = (time.perf_counter() - start) / repeat
+        except Exception as e:
+            result.update(equal=None, difference=f"python-pptx failed: {e}")
+            results.append(result)
+            continue
+        start = time.perf_counter()
+        for _ in range(repeat):
+            actual = pptx_to_json_fast(str(pptx_path))
+        result["fast_s"] = (time.perf_counter() - start) / repeat
+        result["difference"] = _first_difference(expected, actual)
+        result["equal"] = result["difference"] is None
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check pptx_to_json_fast against python-pptx and compare their speed.")
+    parser.add_argument("decks", nargs="*", help="Deck files to check.")
+    parser.add_argument("--corpus-dir", help="Check every .pptx in this directory.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per extractor per deck (timings are averaged).")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    deck_paths = [Path(deck) for deck in args.decks]
+    if args.corpus_dir:
+        deck_paths.extend(sorted(Path(args.corpus_dir).glob("*.pptx")))
+    if not deck_paths:
+        parser.error("no decks given")
+
+    results = compare_extractors(deck_paths, repeat=max(1, args.repeat))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            status = "OK  " if result["equal"] else "SKIP" if result["equal"] is None else "DIFF"
+            timing = f"python-pptx {result['pptx_s'] * 1000:8.1f} ms  lxml {result['fast_s'] * 1000:8.1f} ms" if "fast_s" in result else ""
+            print(f"{status} {Path(result['deck']).name:40} {timing}")
+            if result["difference"]:
+                print(f"     {result['difference']}")
+        compared = [r for r in results if "fast_s" in r]
+        if compared:
+            pptx_total = sum(r["pptx_s"] for r in compared)
+            fast_total = sum(r["fast_s"] for r in compared)
+            print(f"\n{sum(1 for r in compared if r['equal'])}/{len(compared)} decks identical; "
+                  f"python-pptx {pptx_total:.3f}s, lxml {fast_total:.3f}s ({pptx_total / max(fast_total, 1e-9):.1f}x faster)")
+    sys.exit(0 if all(result["equal"] is not False for result in results) else 1)
@@ -0,0 +1,343 @@
+# --- storage_gc.py ---
+"""
+Per-request workspaces and a disk-quota garbage collector for the server's
+artifact folders.
+
+Workspaces: each request extracts and renders into its own directory under the
+workspace root (see create_workspace), which is removed when the request ends.
+Workspaces left behind by a process that died are reclaimed once they are older
+than STALE_WORKSPACE_S.
+
+Areas: every folder the server writes to is registered as an area with a
+policy:
+    "lru"        - entries (unit_depth levels below the root) are removed when
+                   unused for ARTIFACT_TTL_S, and least recently used first while
+                   the total is over DISK_QUOTA_BYTES
+    "workspace"  - per-request workspaces, only reclaimed when orphaned
+    "managed"    - the owning module evicts its own entries: the collector runs
+                   its collector (edit sessions, part store) every pass and, while
+                   the total is still over DISK_QUOTA_BYTES once "lru" entries are
+                   gone, asks areas registered with a trim_fn to shrink (the part
+                   store drops least recently used versions, except those of live
+                   edit sessions); edit sessions keep to their own disk budget
+    "keep"       - counted only (prepared decks are rebuilt explicitly)
+
+An entry's last use is its modification time; stores touch entries they serve
+(see image_variants.py and vision_cache.py). Entries used within
+MIN_EVICTION_AGE_S are never evicted, so URLs in recent responses stay valid.
+
+LibreOffice profile directories (lo_profile_<pid>_<ns>, see
+ppt_processor._convert_pptx_to_pdf) whose process is gone, or that are older than
+ORPHAN_MAX_AGE_S, are removed from every area, as are stale vision_render_*
+directories in the system temp directory.
+
+The collector runs every GC_INTERVAL_S in a background thread of the server.
+Usage:
+    python storage_gc.py status
+    python storage_gc.py collect [--dry-run]
+"""
+import os
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+import metrics
+import image_variants
+import vision_cache
+import deck_store
+import part_store
+import edit_sessions
+
+# --- Configuration ---
+SCRIPT_DIR = Path(__file__).parent.resolve()
+DISK_QUOTA_BYTES = int(float(os.environ.get("PPTPILOT_DISK_QUOTA_MB", 10 * 1024)) * 1024 * 1024)
+ARTIFACT_TTL_S = float(os.environ.get("PPTPILOT_ARTIFACT_TTL_HOURS", 7 * 24)) * 3600
+GC_INTERVAL_S = 5 * 60
+# Entries used more recently are never evicted (responses may still point at them)
+MIN_EVICTION_AGE_S = 15 * 60
+STALE_WORKSPACE_S = 60 * 60
+ORPHAN_MAX_AGE_S = 60 * 60
+LO_PROFILE_PREFIX = "lo_profile_"
+TEMP_RENDER_PREFIXES = ("vision_render_",)
+
+_areas = {}
+_active_workspaces = set()
+_workspaces_lock = threading.Lock()
+
+
+def register_area(name, path_fn, policy="lru", unit_depth=1, trim_fn=None):
+    """
+    Adds a folder to the collector. path_fn returns its current path (folders can be
+    reconfigured). trim_fn(max_bytes), for "managed" areas, shrinks the area to at
+    most max_bytes and returns the (entries, bytes) it removed.
+    """
+    _areas[name] = {"path_fn": path_fn, "policy": policy, "unit_depth": unit_depth, "trim_fn": trim_fn}
+
+
+def _trim_part_store(max_bytes):
+    removed = part_store.trim_to_size(max_bytes, keep_versions=edit_sessions.SESSION_MANAGER.live_version_ids(),
+                                      min_age_s=MIN_EVICTION_AGE_S)
+    return removed["objects"], removed["bytes"]
+
+
+register_area("image_cache", lambda: image_variants.IMAGE_CACHE_DIR, unit_depth=2)
+register_area("vision_cache", lambda: vision_cache.VISION_CACHE_DIR)
+register_area("part_store", lambda: part_store.PART_STORE_DIR, policy="managed", trim_fn=_trim_part_store)
+register_area("edit_sessions", lambda: edit_sessions.SESSIONS_DIR, policy="managed")
+register_area("prepared_decks", lambda: deck_store.PREPARED_DECKS_DIR, policy="keep")
+
+
+def create_workspace(root):
+    """A new, empty per-request directory under root, protected from collection until removed."""
+    path = Path(root) / uuid.uuid4().hex
+    path.mkdir(parents=True)
+    with _workspaces_lock:
+        _active_workspaces.add(str(path))
+    return path
+
+
+def remove_workspace(path):
+    shutil.rmtree(path, ignore_errors=True)
+    with _workspaces_lock:
+        _active_workspaces.discard(str(path))
+
+
+def _scan(path):
+    """Bytes under a file or directory (LibreOffice profiles excluded), and the profile directories inside it."""
+    if os.path.isfile(path):
+        return os.path.getsize(path), []
+    total, lo_profiles = 0, []
+    for root, dirs, files in os.walk(path):
+        for name in [name for name in dirs if name.startswith(LO_PROFILE_PREFIX)]:
+            lo_profiles.append(os.path.join(root, name))
+            dirs.remove(name)
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total, lo_profiles
+
+
+def _units(root, depth):
+    """Entries depth levels below root (dot-files, in-progress writes, are skipped)."""
+    entries = [Path(root)]
+    for _ in range(depth):
+        next_entries = []
+        for entry in entries:
+            if entry.is_dir():
+                next_entries.extend(child for child in entry.iterdir() if not child.name.startswith("."))
+        entries = next_entries
+    return entries
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _is_orphaned_profile(path, now):
+    """A LibreOffice profile whose process is gone (or that is too old to still be in use)."""
+    mtime = _mtime(path)
+    if mtime is None:
+        return False
+    if now - mtime > ORPHAN_MAX_AGE_S:
+        return True
+    try:
+        pid = int(Path(path).name[len(LO_PROFILE_PREFIX):].split("_")[0])
+    except ValueError:
+        return False
+    return pid != os.getpid() and not _process_alive(pid)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def usage():
+    """{area: {"path", "policy", "bytes", "entries"}} of every registered area."""
+    report = {}
+    for name, area in _areas.items():
+        root = Path(area["path_fn"]())
+        units = _units(root, area["unit_depth"]) if root.is_dir() else []
+        report[name] = {
+            "path": str(root),
+            "policy": area["policy"],
+            "bytes": sum(_scan(unit)[0] for unit in units),
+            "entries": len(units),
+        }
+    return report
+
+
+class DiskCollector:
+    """Enforces DISK_QUOTA_BYTES and ARTIFACT_TTL_S over the registered areas."""
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+
+    def ensure_running(self):
+        """Starts the background thread once per process."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="storage-gc", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"Storage collection failed: {e}")
+            time.sleep(GC_INTERVAL_S)
+
+    def collect(self, dry_run=False):
+        """One collection pass. Returns {area: {reason: [entries, bytes]}} of what was (or would be) removed."""
+        with self._collect_lock:
+            return self._collect(dry_run)
+
+    def _collect(self, dry_run):
+        now = time.time()
+        removed = {}
+
+        def record(area_name, entries, nbytes, reason):
+            counts = removed.setdefault(area_name, {}).setdefault(reason, [0, 0])
+            counts[0] += entries
+            counts[1] += nbytes
+            if not dry_run:
+                metrics.STORAGE_EVICTED_ENTRIES.inc(entries, area=area_name, reason=reason)
+                metrics.STORAGE_EVICTED_BYTES.inc(nbytes, area=area_name, reason=reason)
+
+        def evict(area_name, path, nbytes, reason):
+            record(area_name, 1, nbytes, reason)
+            if not dry_run:
+                _remove(path)
+
+        # --- Stores that evict their own entries ---
+        if not dry_run:
+            edit_sessions.SESSION_MANAGER.evict()
+            keep_versions = edit_sessions.SESSION_MANAGER.live_version_ids()
+            part_store_removed = part_store.collect_garbage(max_manifest_age_s=ARTIFACT_TTL_S, keep_versions=keep_versions)
+            if part_store_removed["objects"]:
+                record("part_store", part_store_removed["objects"], part_store_removed["bytes"], "ttl")
+
+        # --- Scan: sizes, last use, orphans and expired entries ---
+        with _workspaces_lock:
+            active_workspaces = set(_active_workspaces)
+        area_bytes = {}
+        candidates = []  # (last used, area, path, bytes) of entries that may be evicted for quota
+        for name, area in _areas.items():
+            root = Path(area["path_fn"]())
+            area_bytes[name] = 0
+            if not root.is_dir():
+                continue
+            for unit in _units(root, area["unit_depth"]):
+                nbytes, lo_profiles = _scan(unit)
+                for profile_dir in lo_profiles:
+                    profile_bytes = _scan(profile_dir)[0]
+                    if _is_orphaned_profile(profile_dir, now):
+                        evict(name, profile_dir, profile_bytes, "orphaned")
+                    else:
+                        nbytes += profile_bytes
+                last_used = _mtime(unit)
+                if last_used is None:
+                    continue
+                age = now - last_used
+                if area["policy"] == "workspace":
+                    if str(unit) not in active_workspaces and age > STALE_WORKSPACE_S:
+                        evict(name, unit, nbytes, "orphaned")
+                        continue
+                elif area["policy"] == "lru":
+                    if age > ARTIFACT_TTL_S:
+                        evict(name, unit, nbytes, "ttl")
+                        continue
+                    if age > MIN_EVICTION_AGE_S:
+                        candidates.append((last_used, name, unit, nbytes))
+                area_bytes[name] += nbytes
+
+        # Renders of processes that died before cleaning up their temp directories
+        temp_dir = Path(tempfile.gettempdir())
+        for prefix in TEMP_RENDER_PREFIXES:
+            for entry in temp_dir.glob(f"{prefix}*"):
+                last_used = _mtime(entry)
+                if last_used is not None and now - last_used > ORPHAN_MAX_AGE_S:
+                    evict("temp", entry, _scan(entry)[0], "orphaned")
+
+        # --- Quota: least recently used entries first ---
+        total_bytes = sum(area_bytes.values())
+        for _, name, unit, nbytes in sorted(candidates, key=lambda candidate: candidate[0]):
+            if total_bytes <= DISK_QUOTA_BYTES:
+                break
+            evict(name, unit, nbytes, "quota")
+            area_bytes[name] -= nbytes
+            total_bytes -= nbytes
+        # Then managed areas, which pick their own entries to drop
+        for name, area in _areas.items():
+            if total_bytes <= DISK_QUOTA_BYTES or dry_run:
+                break
+            if area["trim_fn"] is None:
+                continue
+            entries, nbytes = area["trim_fn"](max(area_bytes[name] - (total_bytes - DISK_QUOTA_BYTES), 0))
+            if entries:
+                record(name, entries, nbytes, "quota")
+            area_bytes[name] -= nbytes
+            total_bytes -= nbytes
+        if total_bytes > DISK_QUOTA_BYTES:
+            print(f"Storage is over its quota ({total_bytes / 1024 / 1024:.0f} MB of "
+                  f"{DISK_QUOTA_BYTES / 1024 / 1024:.0f} MB) after evicting every eligible entry")
+
+        if not dry_run:
+            for name, nbytes in area_bytes.items():
+                metrics.STORAGE_BYTES.set(nbytes, area=name)
+        for area_name, reasons in removed.items():
+            for reason, (entries, nbytes) in reasons.items():
+                print(f"{'Would remove' if dry_run else 'Removed'} {entries} {area_name} entries "
+                      f"({nbytes / 1024 / 1024:.1f} MB, {reason})")
+        return removed
+
+
+COLLECTOR = DiskCollector()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Disk usage and garbage collection of the server's artifact folders.")
+    parser.add_argument("command", choices=["status", "collect"])
+    parser.add_argument("--dry-run", action="store_true", help="collect: report what would be removed")
+    args = parser.parse_args()
+
+    # The server registers its own folders with the imported module, not with __main__
+    import app  # noqa: F401
+    import storage_gc
+
+    if args.command == "status":
+        total = 0
+        for name, info in storage_gc.usage().items():
+            total += info["bytes"]
+            print(f"{name:24} {info['policy']:9} {info['entries']:7} entries {info['bytes'] / 1024 / 1024:10.1f} MB  {info['path']}")
+        print(f"{'total':24} {'':9} {'':15} {total / 1024 / 1024:10.1f} MB  (quota {DISK_QUOTA_BYTES / 1024 / 1024:.0f} MB)")
+    else:
+        storage_gc.COLLECTOR.collect(dry_run=args.dry_run)
@@ -0,0 +1,304 @@
+# --- tracing.py ---
+"""
+Lightweight request tracing. A trace is started per API request (see app.py);
+nested spans record timing plus attributes such as payload sizes and cache hits.
+
+Finished traces are exported according to PPTPILOT_TRACE_EXPORTER:
+    jsonl (default) - one JSON object per span appended to traces/spans-YYYYMMDD.jsonl
+    otlp            - OTLP/HTTP JSON posted to PPTPILOT_OTLP_ENDPOINT (e.g. http://localhost:4318/v1/traces)
+    none            - keep only the in-memory copy served by /api/traces/<trace_id>
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+import requests
+
+# --- Configuration ---
+SCRIPT_DIR = Path(__file__).parent.resolve()
+TRACES_DIR = SCRIPT_DIR / "traces"
+TRACE_EXPORTER = os.environ.get("PPTPILOT_TRACE_EXPORTER", "jsonl").lower()
+OTLP_ENDPOINT = os.environ.get("PPTPILOT_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+SERVICE_NAME = "pptpilot"
+MAX_TRACES_IN_MEMORY = 200
+
+_current_trace = contextvars.ContextVar("pptpilot_trace", default=None)
+_current_span = contextvars.ContextVar("pptpilot_span", default=None)
+
+_recent_traces = OrderedDict()
+_recent_traces_lock = threading.Lock()
+_jsonl_lock = threading.Lock()
+_export_queue = queue.Queue()
+_export_thread = None
+_export_thread_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "status", "error")
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = "ok"
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time": datetime.fromtimestamp(self.start_ns / 1e9).isoformat(timespec="microseconds"),
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    def __init__(self, name, attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self._lock = threading.Lock()
+        self.root = self._new_span(name, None, attributes)
+
+    def _new_span(self, name, parent_id, attributes):
+        new_span = Span(self, name, parent_id, attributes)
+        with self._lock:
+            self.spans.append(new_span)
+        return new_span
+
+    def to_dicts(self):
+        with self._lock:
+            return [s.to_dict() for s in self.spans]
+
+
+class _NoopSpan:
+    """Returned when no trace is active so callers never need to check."""
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def begin_trace(name, **attributes):
+    """Starts a new trace with a root span and makes it current. Returns the trace."""
+    trace = Trace(name, attributes)
+    trace._tokens = (_current_trace.set(trace), _current_span.set(trace.root))
+    return trace
+
+
+def end_trace(trace, error=None):
+    """Closes the root span, restores the previous context and exports the trace."""
+    root = trace.root
+    root.end_ns = time.time_ns()
+    if error is not None:
+        root.status = "error"
+        root.error = str(error)
+    trace_token, span_token = getattr(trace, "_tokens", (None, None))
+    if span_token is not None:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+    _remember(trace)
+    _export(trace)
+
+
+def current_trace_id():
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def span(name, **attributes):
+    """Records a child span of the current span. A no-op outside a trace."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+    parent = _current_span.get()
+    new_span = trace._new_span(name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.status = "error"
+        new_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        new_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+def traced(name):
+    """Decorator recording each call of a function as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_attributes(**attributes):
+    """Adds attributes to the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def wrap_context(func):
+    """Binds func to the current trace context, for work submitted to thread pools."""
+    ctx = contextvars.copy_context()
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return ctx.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def capture_spans():
+    """
+    Records the spans opened in the block in a trace of their own, which is not
+    exported, and yields a list that receives their dicts when the block ends.
+    cpu_pool workers send these back to the server, which adds them with add_spans.
+    """
+    trace = Trace("captured", {})
+    trace_token, span_token = _current_trace.set(trace), _current_span.set(trace.root)
+    captured = []
+    try:
+        yield captured
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        captured.extend(span_dict for span_dict in trace.to_dicts() if span_dict["span_id"] != trace.root.span_id)
+
+
+def add_spans(span_dicts):
+    """Adds spans recorded by capture_spans under the current span. A no-op outside a trace."""
+    trace = _current_trace.get()
+    if trace is None or not span_dicts:
+        return
+    parent = _current_span.get()
+    captured_ids = {span_dict["span_id"] for span_dict in span_dicts}
+    for span_dict in span_dicts:
+        parent_id = span_dict["parent_span_id"] if span_dict["parent_span_id"] in captured_ids else (parent.span_id if parent else None)
+        added = trace._new_span(span_dict["name"], parent_id, span_dict["attributes"])
+        added.span_id = span_dict["span_id"]
+        added.start_ns, added.end_ns = span_dict["start_ns"], span_dict["end_ns"]
+        added.status, added.error = span_dict["status"], span_dict["error"]
+
+
+def get_trace(trace_id):
+    """Returns the spans of a recent trace, searching today's JSONL export as a fallback."""
+    with _recent_traces_lock:
+        trace = _recent_traces.get(trace_id)
+    if trace is not None:
+        return trace.to_dicts()
+    jsonl_path = TRACES_DIR / f"spans-{datetime.now().strftime('%Y%m%d')}.jsonl"
+    if not jsonl_path.exists():
+        return None
+    spans = []
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if trace_id in line:
+                record = json.loads(line)
+                if record.get("trace_id") == trace_id:
+                    spans.append(record)
+    return spans or None
+
+
+def _remember(trace):
+    with _recent_traces_lock:
+        _recent_traces[trace.trace_id] = trace
+        while len(_recent_traces) > MAX_TRACES_IN_MEMORY:
+            _recent_traces.popitem(last=False)
+
+
+def _export(trace):
+    """Hands the trace to the background exporter so the request path never blocks on I/O."""
+    if TRACE_EXPORTER == "none":
+        return
+    global _export_thread
+    with _export_thread_lock:
+        if _export_thread is None or not _export_thread.is_alive():
+            _export_thread = threading.Thread(target=_export_worker, name="trace-exporter", daemon=True)
+            _export_thread.start()
+    _export_queue.put(trace.to_dicts())
+
+
+def _export_worker():
+    while True:
+        span_dicts = _export_queue.get()
+        try:
+            if TRACE_EXPORTER == "otlp":
+                _export_otlp(span_dicts)
+            else:
+                _export_jsonl(span_dicts)
+        except Exception as e:
+            print(f"Warning: Trace export failed: {e}")
+
+
+def _export_jsonl(span_dicts):
+    TRACES_DIR.mkdir(parents=True, exist_ok=True)
+    jsonl_path = TRACES_DIR / f"spans-{datetime.now().strftime('%Y%m%d')}.jsonl"
+    with _jsonl_lock, open(jsonl_path, 'a', encoding='utf-8') as f:
+        for span_dict in span_dicts:
+            f.write(json.dumps(span_dict, default=str) + "\n")
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _export_otlp(span_dicts):
+    otlp_spans = []
+    for span_dict in span_dicts:
+        otlp_span = {
+            "traceId": span_dict["trace_id"],
+            "spanId": span_dict["span_id"],
+            "name": span_dict["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(span_dict["start_ns"]),
+            "endTimeUnixNano": str(span_dict["end_ns"] or span_dict["start_ns"]),
+            "attributes": [_otlp_attribute(k, v) for k, v in span_dict["attributes"].items()],
+            "status": {"code": 2, "message": span_dict["error"] or ""} if span_dict["status"] == "error" else {"code": 1},
+        }
+        if span_dict["parent_span_id"]:
+            otlp_span["parentSpanId"] = span_dict["parent_span_id"]
+        otlp_spans.append(otlp_span)
+    payload = {
+        "resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "pptpilot.tracing"}, "spans": otlp_spans}],
+        }]
+    }
+    requests.post(OTLP_ENDPOINT, json=payload, timeout=5).raise_for_status()
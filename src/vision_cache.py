@@ -0,0 +1,179 @@
+# --- vision_cache.py ---
+"""
+Slide images for vision-capable LLMs, downscaled and base64-encoded once per deck
+and slide. Providers are asked for low-detail images anyway, so sending
+full-resolution renders only costs upload time.
+
+Layout:
+    vision_cache/<deck hash>/<VISION_PROFILE>/slide-NN.jpg   (downscaled JPEG)
+    vision_cache/<deck hash>/<VISION_PROFILE>/slide-NN.b64   (its base64 text)
+
+Images come from the prepared deck renders (see deck_store.py) when available;
+otherwise only the missing slides are rendered.
+"""
+import os
+import re
+import io
+import base64
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from PIL import Image
+import deck_store
+import ppt_processor
+import metrics
+import tracing
+
+# --- Configuration ---
+SCRIPT_DIR = Path(__file__).parent.resolve()
+VISION_CACHE_DIR = SCRIPT_DIR / "vision_cache"
+VISION_IMAGE_MAX_SIDE = 768  # OpenAI "low" detail is 512px; Gemini tiles at 768px
+VISION_JPEG_QUALITY = 80
+VISION_PROFILE = f"{VISION_IMAGE_MAX_SIDE}px-q{VISION_JPEG_QUALITY}"
+VISION_MIME_TYPE = "image/jpeg"
+# Decks this small get every slide attached when the prompt names no slide
+VISION_AUTO_ALL_SLIDES_MAX = 3
+VISION_MAX_IMAGES = 8
+
+SLIDE_REFERENCE_PATTERN = re.compile(
+    r"\bslides?\s*#?\s*(\d+(?:\s*(?:,|and|&|-|to|through)\s*#?\s*\d+)*)", re.IGNORECASE)
+
+_deck_locks = {}
+_deck_locks_guard = threading.Lock()
+
+
+def _deck_lock(deck_hash):
+    with _deck_locks_guard:
+        return _deck_locks.setdefault(deck_hash, threading.Lock())
+
+
+def parse_slide_list(value, total_slides):
+    """
+    Parses an explicit slide selection ("2,4-6", "all", "none"). Returns a sorted
+    list of valid 1-based slide numbers. Raises ValueError on malformed input.
+    """
+    value = (value or "").strip().lower()
+    if value == "all":
+        return list(range(1, total_slides + 1))
+    if value in ("", "none"):
+        return []
+    slides = set()
+    for item in value.split(","):
+        bounds = [int(bound) for bound in item.split("-")]
+        if not 1 <= len(bounds) <= 2:
+            raise ValueError(f"Invalid slide range '{item}'")
+        slides.update(range(bounds[0], bounds[-1] + 1))
+    return sorted(slide for slide in slides if 1 <= slide <= total_slides)
+
+
+def slides_referenced_in_prompt(prompt_text, total_slides):
+    """Slide numbers a prompt mentions ("slide 3", "slides 2 and 4", "slides 2-5")."""
+    slides = set()
+    for match in SLIDE_REFERENCE_PATTERN.finditer(prompt_text or ""):
+        tokens = re.findall(r"\d+|-|to|through", match.group(1), re.IGNORECASE)
+        index = 0
+        while index < len(tokens):
+            start = int(tokens[index])
+            if index + 2 < len(tokens) and not tokens[index + 1].isdigit():
+                slides.update(range(start, int(tokens[index + 2]) + 1))
+                index += 3
+            else:
+                slides.add(start)
+                index += 1
+    return sorted(slide for slide in slides if 1 <= slide <= total_slides)
+
+
+def select_slides(prompt_text, total_slides, requested=None):
+    """
+    Slides whose images should accompany a prompt: the explicit selection if given,
+    else the slides the prompt mentions, else every slide of a small deck.
+    """
+    if requested is not None:
+        slides = parse_slide_list(requested, total_slides)
+    else:
+        slides = slides_referenced_in_prompt(prompt_text, total_slides)
+        if not slides and total_slides <= VISION_AUTO_ALL_SLIDES_MAX:
+            slides = list(range(1, total_slides + 1))
+    return slides[:VISION_MAX_IMAGES]
+
+
+def _entry_paths(deck_hash, slide_number):
+    entry_dir = VISION_CACHE_DIR / deck_hash / VISION_PROFILE
+    return entry_dir / f"slide-{slide_number:02d}.jpg", entry_dir / f"slide-{slide_number:02d}.b64"
+
+
+def _write_entry(source_image_path, deck_hash, slide_number):
+    jpeg_path, b64_path = _entry_paths(deck_hash, slide_number)
+    jpeg_path.parent.mkdir(parents=True, exist_ok=True)
+    with Image.open(source_image_path) as img:
+        img = img.convert("RGB")
+        img.thumbnail((VISION_IMAGE_MAX_SIDE, VISION_IMAGE_MAX_SIDE), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    jpeg_bytes = buffer.getvalue()
+    for path, data in ((jpeg_path, jpeg_bytes), (b64_path, base64.b64encode(jpeg_bytes))):
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def _fill_missing(pptx_filepath, deck_hash, slide_numbers, source_images=None):
+    """Creates cache entries for slides from existing renders, rendering only what is missing."""
+    prepared = deck_store.get_prepared_deck(pptx_filepath, require_images=True)
+    sources = dict(source_images or {})
+    if prepared:
+        for image_path in deck_store.get_slide_image_paths(prepared):
+            sources.setdefault(ppt_processor.slide_number_from_image_path(image_path), image_path)
+    to_render = [slide for slide in slide_numbers if slide not in sources]
+    render_dir = tempfile.mkdtemp(prefix="vision_render_")
+    try:
+        if to_render:
+            for image_path in ppt_processor.export_slides_to_images(pptx_filepath, render_dir, profile="preview", slides=to_render):
+                sources[ppt_processor.slide_number_from_image_path(image_path)] = image_path
+        for slide_number in slide_numbers:
+            if slide_number in sources:
+                _write_entry(sources[slide_number], deck_hash, slide_number)
+    finally:
+        shutil.rmtree(render_dir, ignore_errors=True)
+    return len(to_render)
+
+
+@tracing.traced("vision_inputs")
+def get_image_inputs(pptx_filepath, slide_numbers, source_images=None):
+    """
+    image_inputs for llm_handler.get_llm_response: one entry per available slide with
+    its cached JPEG path, pre-encoded base64 text, mime type and slide number.
+    source_images ({slide number: path}) are existing renders of this deck to downscale
+    instead of rendering, e.g. an edit session's images of its current version.
+    """
+    if not slide_numbers:
+        return []
+    deck_hash = deck_store.compute_deck_hash(pptx_filepath)
+    if (VISION_CACHE_DIR / deck_hash).is_dir():
+        # Marks the deck's entries as recently used for disk-quota eviction (see storage_gc.py)
+        os.utime(VISION_CACHE_DIR / deck_hash)
+    missing = [slide for slide in slide_numbers if not _entry_paths(deck_hash, slide)[1].exists()]
+    rendered = 0
+    if missing:
+        with _deck_lock(deck_hash):
+            missing = [slide for slide in missing if not _entry_paths(deck_hash, slide)[1].exists()]
+            if missing:
+                rendered = _fill_missing(pptx_filepath, deck_hash, missing, source_images)
+    metrics.VISION_CACHE_REQUESTS.inc(len(slide_numbers) - len(missing), result="hit")
+    metrics.VISION_CACHE_REQUESTS.inc(len(missing), result="miss")
+
+    image_inputs = []
+    for slide_number in slide_numbers:
+        jpeg_path, b64_path = _entry_paths(deck_hash, slide_number)
+        if b64_path.exists():
+            image_inputs.append({
+                "path": str(jpeg_path),
+                "base64": b64_path.read_text(encoding="ascii"),
+                "mime_type": VISION_MIME_TYPE,
+                "slide_number": slide_number,
+            })
+    tracing.set_attributes(slides=len(slide_numbers), cache_misses=len(missing), slides_rendered=rendered,
+                           image_bytes=sum(os.path.getsize(entry["path"]) for entry in image_inputs))
+    return image_inputs
@@ -0,0 +1,113 @@
+# --- visual_metrics.py ---
+import numpy as np
+from PIL import Image
+
+# --- Configuration ---
+PIXEL_DIFF_THRESHOLD = 24        # Per-channel delta (0-255) for a pixel to count as changed
+REGION_BLOCK_SIZE = 16           # Changed regions are found on a grid of blocks this many pixels wide
+REGION_BLOCK_MIN_CHANGED = 0.02  # Fraction of changed pixels for a block to count as changed
+MAX_REPORTED_REGIONS = 5
+NO_CHANGE_MAX_DIFF_RATIO = 0.0005
+NO_CHANGE_MIN_SSIM = 0.998
+SSIM_WINDOW = 8
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+
+def _load_pair(before_img_path, after_img_path):
+    """Loads both images as RGB arrays of the same size."""
+    with Image.open(before_img_path) as before_img, Image.open(after_img_path) as after_img:
+        before_rgb = before_img.convert('RGB')
+        after_rgb = after_img.convert('RGB')
+        if after_rgb.size != before_rgb.size:
+            after_rgb = after_rgb.resize(before_rgb.size, Image.BILINEAR)
+        return np.asarray(before_rgb, dtype=np.int16), np.asarray(after_rgb, dtype=np.int16)
+
+
+def _block_view(arr, block):
+    """Crops a 2D array to a multiple of `block` and reshapes it to (rows, cols, block*block)."""
+    h, w = arr.shape[0] // block * block, arr.shape[1] // block * block
+    cropped = arr[:h, :w]
+    return cropped.reshape(h // block, block, w // block, block).swapaxes(1, 2).reshape(h // block, w // block, -1)
+
+
+def structural_similarity(before_gray, after_gray, window=SSIM_WINDOW):
+    """Mean SSIM over non-overlapping windows of two grayscale float arrays."""
+    if min(before_gray.shape) < window:
+        window = max(1, min(before_gray.shape))
+    x = _block_view(before_gray, window)
+    y = _block_view(after_gray, window)
+    mu_x, mu_y = x.mean(axis=2), y.mean(axis=2)
+    var_x, var_y = x.var(axis=2), y.var(axis=2)
+    cov_xy = ((x - mu_x[..., None]) * (y - mu_y[..., None])).mean(axis=2)
+    ssim_map = ((2 * mu_x * mu_y + _SSIM_C1) * (2 * cov_xy + _SSIM_C2)) / \
+               ((mu_x ** 2 + mu_y ** 2 + _SSIM_C1) * (var_x + var_y + _SSIM_C2))
+    return float(ssim_map.mean())
+
+
+def changed_regions(changed_mask, block=REGION_BLOCK_SIZE, max_regions=MAX_REPORTED_REGIONS):
+    """
+    Groups changed pixels into bounding boxes [x0, y0, x1, y1] (pixel coordinates,
+    exclusive end), largest first. Works on a coarse block grid so it stays cheap.
+    """
+    pad_h = -changed_mask.shape[0] % block
+    pad_w = -changed_mask.shape[1] % block
+    padded = np.pad(changed_mask, ((0, pad_h), (0, pad_w)))
+    block_grid = _block_view(padded, block).mean(axis=2) >= REGION_BLOCK_MIN_CHANGED
+
+    visited = np.zeros_like(block_grid, dtype=bool)
+    rows, cols = block_grid.shape
+    regions = []
+    for start_r, start_c in zip(*np.nonzero(block_grid)):
+        if visited[start_r, start_c]:
+            continue
+        stack = [(start_r, start_c)]
+        visited[start_r, start_c] = True
+        r0 = r1 = start_r
+        c0 = c1 = start_c
+        size = 0
+        while stack:
+            r, c = stack.pop()
+            size += 1
+            r0, r1, c0, c1 = min(r0, r), max(r1, r), min(c0, c), max(c1, c)
+            for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if 0 <= nr < rows and 0 <= nc < cols and block_grid[nr, nc] and not visited[nr, nc]:
+                    visited[nr, nc] = True
+                    stack.append((nr, nc))
+        box = [int(c0 * block), int(r0 * block),
+               int(min((c1 + 1) * block, changed_mask.shape[1])), int(min((r1 + 1) * block, changed_mask.shape[0]))]
+        regions.append((size, box))
+
+    regions.sort(key=lambda item: item[0], reverse=True)
+    return [box for _, box in regions[:max_regions]]
+
+
+def compute_visual_metrics(before_img_path, after_img_path):
+    """
+    Compares two slide renders. Returns pixel_diff_ratio (share of changed pixels),
+    mean_abs_diff (0-1), ssim, changed_regions, image_size and no_visual_change.
+    """
+    before_rgb, after_rgb = _load_pair(before_img_path, after_img_path)
+    pixel_delta = np.abs(before_rgb - after_rgb).max(axis=2)
+    changed_mask = pixel_delta > PIXEL_DIFF_THRESHOLD
+
+    gray_weights = np.array([0.299, 0.587, 0.114])
+    ssim = structural_similarity(before_rgb @ gray_weights, after_rgb @ gray_weights)
+    pixel_diff_ratio = float(changed_mask.mean())
+
+    return {
+        "pixel_diff_ratio": round(pixel_diff_ratio, 6),
+        "mean_abs_diff": round(float(pixel_delta.mean()) / 255, 6),
+        "ssim": round(ssim, 6),
+        "changed_regions": changed_regions(changed_mask) if changed_mask.any() else [],
+        "image_size": [int(before_rgb.shape[1]), int(before_rgb.shape[0])],
+        "no_visual_change": pixel_diff_ratio <= NO_CHANGE_MAX_DIFF_RATIO and ssim >= NO_CHANGE_MIN_SSIM,
+    }
+
+
+def union_region(regions):
+    """Bounding box covering all regions, or None."""
+    if not regions:
+        return None
+    return [min(r[0] for r in regions), min(r[1] for r in regions),
+            max(r[2] for r in regions), max(r[3] for r in regions)]
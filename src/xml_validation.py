@@ -0,0 +1,359 @@
+# --- xml_validation.py ---
+"""
+Validates LLM-modified package parts before they are repacked into a .pptx, so
+broken XML is caught in milliseconds instead of by a LibreOffice conversion that
+times out or renders garbage.
+
+Checks, per part:
+    - well-formedness and namespace declarations (undeclared prefixes fail to parse)
+    - the root element matches the original part
+    - relationship ids (r:id, r:embed, r:link, ...) exist in the part's .rels
+    - a schema subset for slide-like parts: cSld/spTree structure, shape property
+      elements, unique shape ids, txBody/paragraph/run child order
+
+mc:AlternateContent holds the same shapes (with the same ids) in mc:Choice and
+mc:Fallback; only the Choice is checked. Issues the original part already has
+are not reported: an edit is only held to the standard of the deck it came from.
+
+Parts that fail can be handed to a repair callback (see llm_handler.repair_xml_part)
+and are dropped if they still fail afterwards.
+
+    python xml_validation.py check   # validate built-in slides with known outcomes
+"""
+import os
+import re
+import argparse
+import tempfile
+import posixpath
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
+import metrics
+import tracing
+
+# --- Configuration ---
+MAX_REPAIR_ATTEMPTS = 1
+MAX_ISSUES_PER_PART = 20
+REPAIR_WORKERS = 4
+
+NS_P = "http://schemas.openxmlformats.org/presentationml/2006/main"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+NS_R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_RELS = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_MC = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+
+SLIDE_LIKE_ROOTS = {f"{{{NS_P}}}{name}" for name in ("sld", "sldLayout", "sldMaster", "notes", "notesMaster", "handoutMaster")}
+
+# Shape element -> its required non-visual properties child (must come first)
+SHAPE_NV_PROPS = {
+    f"{{{NS_P}}}sp": f"{{{NS_P}}}nvSpPr",
+    f"{{{NS_P}}}pic": f"{{{NS_P}}}nvPicPr",
+    f"{{{NS_P}}}graphicFrame": f"{{{NS_P}}}nvGraphicFramePr",
+    f"{{{NS_P}}}grpSp": f"{{{NS_P}}}nvGrpSpPr",
+    f"{{{NS_P}}}cxnSp": f"{{{NS_P}}}nvCxnSpPr",
+}
+# Shape element -> required visual properties child
+SHAPE_PROPS = {
+    f"{{{NS_P}}}sp": f"{{{NS_P}}}spPr",
+    f"{{{NS_P}}}pic": f"{{{NS_P}}}spPr",
+    f"{{{NS_P}}}graphicFrame": f"{{{NS_P}}}xfrm",
+    f"{{{NS_P}}}grpSp": f"{{{NS_P}}}grpSpPr",
+    f"{{{NS_P}}}cxnSp": f"{{{NS_P}}}spPr",
+}
+TX_BODIES = {f"{{{NS_P}}}txBody", f"{{{NS_A}}}txBody"}
+
+_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+
+
+def _short(tag):
+    """'{namespace}name' -> 'prefix:name' for the namespaces used in messages."""
+    if not isinstance(tag, str) or not tag.startswith("{"):
+        return str(tag)
+    namespace, name = tag[1:].split("}", 1)
+    prefix = {NS_P: "p", NS_A: "a", NS_R: "r"}.get(namespace)
+    return f"{prefix}:{name}" if prefix else name
+
+
+def _where(element):
+    return f"line {element.sourceline}" if element.sourceline else "unknown line"
+
+
+def _issue_kind(issue):
+    """An issue without its line numbers, to match it with the same issue in the original part."""
+    return re.sub(r"\b(?:line \d+|unknown line)\b", "line", issue)
+
+
+def rels_part_name(part_name):
+    """ppt/slides/slide1.xml -> ppt/slides/_rels/slide1.xml.rels"""
+    directory, filename = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", f"{filename}.rels")
+
+
+def parse_xml(xml_text):
+    """Parses part content (str or bytes). Raises etree.XMLSyntaxError."""
+    if isinstance(xml_text, str):
+        xml_text = xml_text.encode("utf-8")
+    return etree.fromstring(xml_text, _PARSER)
+
+
+def _read_original_part(original_xml_dir, part_name):
+    if not original_xml_dir:
+        return None
+    path = os.path.join(original_xml_dir, part_name)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def relationship_ids(rels_xml):
+    """Set of relationship Ids declared in a .rels document (str/bytes/None)."""
+    if rels_xml is None:
+        return None
+    try:
+        root = parse_xml(rels_xml)
+    except etree.XMLSyntaxError:
+        return None
+    return {rel.get("Id") for rel in root.iter(f"{{{NS_PKG_RELS}}}Relationship")}
+
+
+def _check_relationship_ids(root, rel_ids):
+    issues = []
+    for element in root.iter():
+        if not isinstance(element.tag, str):
+            continue
+        for attr_name, value in element.attrib.items():
+            if attr_name.startswith(f"{{{NS_R}}}") and value and value not in rel_ids:
+                issues.append(f"{_where(element)}: {_short(element.tag)} references {_short(attr_name)}=\"{value}\", "
+                              f"which is not defined in the part's .rels (available: {', '.join(sorted(rel_ids)) or 'none'})")
+    return issues
+
+
+def _check_text_body(tx_body):
+    issues = []
+    children = [child for child in tx_body if isinstance(child.tag, str)]
+    if not children or children[0].tag != f"{{{NS_A}}}bodyPr":
+        issues.append(f"{_where(tx_body)}: {_short(tx_body.tag)} must start with a:bodyPr")
+    if not any(child.tag == f"{{{NS_A}}}p" for child in children):
+        issues.append(f"{_where(tx_body)}: {_short(tx_body.tag)} must contain at least one a:p")
+    for paragraph in tx_body.iterchildren(f"{{{NS_A}}}p"):
+        p_children = [child for child in paragraph if isinstance(child.tag, str)]
+        for index, child in enumerate(p_children):
+            if child.tag == f"{{{NS_A}}}pPr" and index != 0:
+                issues.append(f"{_where(child)}: a:pPr must be the first child of a:p")
+            if child.tag == f"{{{NS_A}}}endParaRPr" and index != len(p_children) - 1:
+                issues.append(f"{_where(child)}: a:endParaRPr must be the last child of a:p")
+        for run in paragraph.iterchildren(f"{{{NS_A}}}r"):
+            run_children = [child.tag for child in run if isinstance(child.tag, str)]
+            if run_children.count(f"{{{NS_A}}}t") != 1:
+                issues.append(f"{_where(run)}: a:r must contain exactly one a:t")
+            if f"{{{NS_A}}}rPr" in run_children and run_children[0] != f"{{{NS_A}}}rPr":
+                issues.append(f"{_where(run)}: a:rPr must be the first child of a:r")
+    return issues
+
+
+def _iter_shape_tree(element):
+    """element and its descendants, leaving out mc:Fallback (a copy of the mc:Choice shapes)."""
+    yield element
+    for child in element:
+        if child.tag != f"{{{NS_MC}}}Fallback":
+            yield from _iter_shape_tree(child)
+
+
+def _check_slide_schema(root):
+    issues = []
+    common_slide_data = root.findall(f"{{{NS_P}}}cSld")
+    if len(common_slide_data) != 1:
+        return [f"{_short(root.tag)} must contain exactly one p:cSld (found {len(common_slide_data)})"]
+    shape_trees = common_slide_data[0].findall(f"{{{NS_P}}}spTree")
+    if len(shape_trees) != 1:
+        return [f"{_where(common_slide_data[0])}: p:cSld must contain exactly one p:spTree (found {len(shape_trees)})"]
+
+    seen_shape_ids = {}
+    for element in _iter_shape_tree(shape_trees[0]):
+        tag = element.tag
+        if tag in SHAPE_NV_PROPS:
+            children = [child for child in element if isinstance(child.tag, str)]
+            if not children or children[0].tag != SHAPE_NV_PROPS[tag]:
+                issues.append(f"{_where(element)}: {_short(tag)} must start with {_short(SHAPE_NV_PROPS[tag])}")
+            if not any(child.tag == SHAPE_PROPS[tag] for child in children):
+                issues.append(f"{_where(element)}: {_short(tag)} is missing {_short(SHAPE_PROPS[tag])}")
+        elif tag == f"{{{NS_P}}}cNvPr":
+            shape_id = element.get("id")
+            if shape_id is None or not shape_id.isdigit():
+                issues.append(f"{_where(element)}: p:cNvPr needs a numeric id (got {shape_id!r})")
+            elif shape_id in seen_shape_ids:
+                issues.append(f"{_where(element)}: shape id {shape_id} is already used on line {seen_shape_ids[shape_id]}")
+            else:
+                seen_shape_ids[shape_id] = element.sourceline
+        elif tag in TX_BODIES:
+            issues.extend(_check_text_body(element))
+    return issues
+
+
+def _structure_issues(part_name, root, rel_ids):
+    """Relationship and schema issues of a parsed part (rel_ids None: not checked)."""
+    if part_name.endswith(".rels"):
+        if root.tag != f"{{{NS_PKG_RELS}}}Relationships":
+            return [f"root element of a .rels part must be Relationships in namespace {NS_PKG_RELS}"]
+        rel_id_list = [rel.get("Id") for rel in root]
+        duplicates = sorted({rel_id for rel_id in rel_id_list if rel_id_list.count(rel_id) > 1})
+        return [f"duplicate relationship ids: {', '.join(duplicates)}"] if duplicates else []
+    issues = []
+    if rel_ids is not None:
+        issues.extend(_check_relationship_ids(root, rel_ids))
+    if root.tag in SLIDE_LIKE_ROOTS:
+        issues.extend(_check_slide_schema(root))
+    return issues
+
+
+def validate_part(part_name, xml_text, original_xml_dir=None, rels_override=None):
+    """
+    Validates one modified part. Returns a list of issue strings (empty when valid).
+    The original part and its .rels are read from original_xml_dir (the extracted
+    XML folder); rels_override replaces the .rels content when it was modified too.
+    Issues the original part (checked against its original .rels) already has are
+    left out.
+    """
+    try:
+        root = parse_xml(xml_text)
+    except etree.XMLSyntaxError as e:
+        return [f"not well-formed XML: {e}"]
+    except ValueError as e:
+        return [f"unparseable XML: {e}"]
+
+    issues = []
+    original_xml = _read_original_part(original_xml_dir, part_name)
+    original_root = None
+    if original_xml is not None:
+        try:
+            original_root = parse_xml(original_xml)
+        except (etree.XMLSyntaxError, ValueError):
+            original_root = None
+        original_root_tag = original_root.tag if original_root is not None else None
+        if original_root_tag and root.tag != original_root_tag:
+            issues.append(f"root element is {_short(root.tag)} but the original part has {_short(original_root_tag)} "
+                          f"(wrong or missing namespace declaration?)")
+
+    original_rels_xml = None if part_name.endswith(".rels") else _read_original_part(original_xml_dir, rels_part_name(part_name))
+    rels_xml = rels_override if rels_override is not None else original_rels_xml
+    new_issues = _structure_issues(part_name, root, relationship_ids(rels_xml))
+    if original_root is not None and new_issues:
+        # Each issue of the original excuses one issue of the same kind in the edit
+        known = Counter(_issue_kind(issue)
+                        for issue in _structure_issues(part_name, original_root, relationship_ids(original_rels_xml)))
+        for issue in new_issues:
+            if known[_issue_kind(issue)] > 0:
+                known[_issue_kind(issue)] -= 1
+            else:
+                issues.append(issue)
+    else:
+        issues.extend(new_issues)
+    return issues[:MAX_ISSUES_PER_PART]
+
+
+def validate_parts(modified_xml_map, original_xml_dir=None):
+    """Validates every part of a modification map. Returns {part_name: issues} for failing parts."""
+    failures = {}
+    for part_name, xml_text in modified_xml_map.items():
+        rels_override = modified_xml_map.get(rels_part_name(part_name))
+        issues = validate_part(part_name, xml_text, original_xml_dir, rels_override)
+        if issues:
+            failures[part_name] = issues
+    return failures
+
+
+def validate_and_repair(modified_xml_map, original_xml_dir=None, repair_func=None, max_repair_attempts=MAX_REPAIR_ATTEMPTS):
+    """
+    Validates all parts and asks repair_func(part_name, xml_text, issues) -> new xml text
+    (or None) to fix failing ones, up to max_repair_attempts times per part.
+    Returns (valid_map, rejected {part_name: issues}, repaired [part_name]).
+    """
+    valid_map = dict(modified_xml_map)
+    failures = validate_parts(valid_map, original_xml_dir)
+    repaired = []
+    for attempt in range(max_repair_attempts if repair_func else 0):
+        if not failures:
+            break
+
+        def _repair(item):
+            part_name, issues = item
+            with tracing.span("xml_repair", part=part_name, attempt=attempt + 1, issue_count=len(issues)):
+                return part_name, repair_func(part_name, valid_map[part_name], issues)
+
+        with ThreadPoolExecutor(max_workers=min(REPAIR_WORKERS, len(failures))) as executor:
+            repair_results = list(executor.map(tracing.wrap_context(_repair), failures.items()))
+
+        for part_name, new_xml in repair_results:
+            if new_xml:
+                valid_map[part_name] = new_xml
+        still_failing = validate_parts({name: valid_map[name] for name in failures}, original_xml_dir)
+        for part_name in failures:
+            if part_name not in still_failing:
+                repaired.append(part_name)
+        failures = still_failing
+
+    for part_name, issues in failures.items():
+        print(f"Dropping modified part {part_name}: failed validation ({'; '.join(issues[:3])})")
+        del valid_map[part_name]
+
+    for part_name in modified_xml_map:
+        result = "rejected" if part_name in failures else "repaired" if part_name in repaired else "valid"
+        metrics.XML_PARTS_VALIDATED.inc(result=result)
+    tracing.set_attributes(parts_checked=len(modified_xml_map), parts_repaired=len(repaired), parts_rejected=len(failures))
+    return valid_map, failures, repaired
+
+
+# --- Self-check ---
+
+_CHECK_SLIDE = f"""<p:sld xmlns:p="{NS_P}" xmlns:a="{NS_A}" xmlns:r="{NS_R}" xmlns:mc="{NS_MC}"
+    xmlns:p14="http://schemas.microsoft.com/office/powerpoint/2010/main"><p:cSld><p:spTree>
+<p:nvGrpSpPr><p:cNvPr id="1" name=""/><p:cNvGrpSpPr/><p:nvPr/></p:nvGrpSpPr><p:grpSpPr/>
+<p:sp><p:nvSpPr><p:cNvPr id="2" name="Title"/><p:cNvSpPr/><p:nvPr/></p:nvSpPr><p:spPr/>
+<p:txBody><a:bodyPr/><a:p><a:r><a:rPr lang="en-US"/><a:t>{{title}}</a:t></a:r></a:p></p:txBody></p:sp>
+<mc:AlternateContent mc:Ignorable="p14"><mc:Choice Requires="p14">
+<p:sp><p:nvSpPr><p:cNvPr id="3" name="Equation"/><p:cNvSpPr/><p:nvPr/></p:nvSpPr><p:spPr/></p:sp>
+</mc:Choice><mc:Fallback>
+<p:sp><p:nvSpPr><p:cNvPr id="3" name="Equation"/><p:cNvSpPr/><p:nvPr/></p:nvSpPr><p:spPr/></p:sp>
+</mc:Fallback></mc:AlternateContent>{{extra}}
+</p:spTree></p:cSld></p:sld>"""
+_CHECK_DUPLICATE_SHAPE = '<p:sp><p:nvSpPr><p:cNvPr id="2" name="Copy"/><p:cNvSpPr/><p:nvPr/></p:nvSpPr><p:spPr/></p:sp>'
+
+
+def self_check():
+    """Validates built-in slides with known outcomes. Returns the descriptions of failed cases."""
+    part_name = "ppt/slides/slide1.xml"
+    cases = [
+        # (description, original slide or None, edited slide, expects issues)
+        ("AlternateContent slide (same shape in mc:Choice and mc:Fallback) is valid",
+         None, _CHECK_SLIDE.format(title="Edited", extra=""), False),
+        ("a duplicate shape id outside mc:Fallback is reported",
+         None, _CHECK_SLIDE.format(title="Edited", extra=_CHECK_DUPLICATE_SHAPE), True),
+        ("an issue the original part already has is not reported",
+         _CHECK_SLIDE.format(title="Original", extra=_CHECK_DUPLICATE_SHAPE),
+         _CHECK_SLIDE.format(title="Edited", extra=_CHECK_DUPLICATE_SHAPE), False),
+        ("an issue added by the edit is still reported",
+         _CHECK_SLIDE.format(title="Original", extra=_CHECK_DUPLICATE_SHAPE),
+         _CHECK_SLIDE.format(title="Edited", extra=_CHECK_DUPLICATE_SHAPE * 2), True),
+    ]
+    failed = []
+    for description, original_xml, edited_xml, expects_issues in cases:
+        with tempfile.TemporaryDirectory() as original_xml_dir:
+            if original_xml is not None:
+                os.makedirs(os.path.join(original_xml_dir, posixpath.dirname(part_name)))
+                with open(os.path.join(original_xml_dir, part_name), "w", encoding="utf-8") as f:
+                    f.write(original_xml)
+            issues = validate_part(part_name, edited_xml, original_xml_dir)
+        ok = bool(issues) == expects_issues
+        print(f"{'ok  ' if ok else 'FAIL'} {description}" + ("" if ok else f": {issues}"))
+        if not ok:
+            failed.append(description)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validation of LLM-modified package parts.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("check", help="Validate built-in slides with known outcomes.")
+    args = parser.parse_args()
+    raise SystemExit(1 if self_check() else 0)